@@ -0,0 +1,63 @@
+import asyncio
+import functools
+import time
+from astrbot.api import logger
+
+
+class AdminJobRunner:
+    """
+    批量管理任务执行器
+
+    - 任务函数在工作线程中运行（使用独立的数据库连接），不阻塞事件循环
+    - 任务通过 progress 回调汇报进度，进度经队列流式返回给事件循环，最后一条为任务总结
+    - 同一时间只允许运行一个任务
+    """
+
+    def __init__(self, service, progress_interval: float = 5.0):
+        self.service = service
+        self.progress_interval = progress_interval  # 两条进度消息之间的最短间隔（秒），避免刷屏
+        self.running: str | None = None
+
+    async def run(self, name: str, job, **kwargs):
+        """
+        执行任务并逐条产出进度消息。
+        job 需接受 progress 关键字参数，返回值（总结）作为最后一条消息产出。
+        """
+        if self.running:
+            yield f"任务【{self.running}】正在执行中，请稍后再试。"
+            return
+
+        self.running = name
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[str] = asyncio.Queue()
+
+        def progress(message: str):
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+        try:
+            # 在事件循环线程中写回并清空玩家缓存，任务期间所有玩家绕过缓存
+            with self.service.bulk_job():
+                future = loop.run_in_executor(None, functools.partial(job, progress=progress, **kwargs))
+                last_sent = time.monotonic()
+                pending = None  # 尚未发出的最新进度
+                while True:
+                    getter = asyncio.ensure_future(queue.get())
+                    await asyncio.wait({getter, future}, return_when=asyncio.FIRST_COMPLETED)
+                    if not getter.done():
+                        getter.cancel()
+                        if queue.empty():
+                            break
+                        continue
+                    pending = getter.result()
+                    if time.monotonic() - last_sent >= self.progress_interval:
+                        yield pending
+                        pending, last_sent = None, time.monotonic()
+
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    logger.error(f"管理任务【{name}】执行失败: {e}")
+                    summary = f"任务【{name}】执行失败：{e}"
+            yield summary
+        finally:
+            self.running = None
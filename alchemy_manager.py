@@ -1,11 +1,17 @@
 # astrbot_plugin_xiuxian/alchemy_manager.py
 
+import math
 import random
+from collections import Counter, OrderedDict
+from .alchemy_planner import plan_crafts
 from .item_manager import Items
 from .config import XiuConfig, USERRANK
 from astrbot.api import logger
 import json
 
+# 可炼丹药查询结果的缓存条数（按药材持有量缓存）
+POSSIBLE_RECIPES_CACHE_SIZE = 1024
+
 class AlchemyManager:
     """炼丹管理器，负责处理炼丹的核心逻辑"""
 
@@ -15,7 +21,30 @@ class AlchemyManager:
         self.service = service
         self.all_recipes_with_key = self.items_manager.get_data_by_item_type(['合成丹药'])
         self.all_recipes = list(self.all_recipes_with_key.values())
+        # 丹方名称 -> 丹药ID（丹方可能与其他类型的物品重名，因此不直接使用物品目录的名称索引）
+        self.recipe_id_by_name = {}
+        for pill_id, recipe in self.all_recipes_with_key.items():
+            self.recipe_id_by_name.setdefault(recipe['name'], pill_id)
+        self._build_recipe_index()
+        self._herb_specs = {}  # 药材ID -> ((药力类型, 药力), ...)，首次用到时从物品目录读取
+        self._possible_recipes_cache = OrderedDict()  # 药材持有量 -> 可炼丹药
 
+    def _build_recipe_index(self):
+        """
+        整理各丹方的药力需求，并建立 药力类型 -> 丹方ID 的倒排索引。
+        只有玩家持有丹方所需的全部药力类型时，该丹方才需要进一步计算。
+        """
+        self.recipe_formulas = {}  # 丹方ID -> {药力类型: 所需药力}
+        recipes_by_type = {}
+        for pill_id, recipe in self.all_recipes_with_key.items():
+            formula = {str(k): v for k, v in recipe.get("elixir_config", {}).items()}
+            if not formula:  # 丹方不需要材料，不参与推演
+                continue
+            self.recipe_formulas[pill_id] = formula
+            for herb_type in formula:
+                recipes_by_type.setdefault(herb_type, []).append(pill_id)
+        self.recipes_by_type = {herb_type: tuple(ids) for herb_type, ids in recipes_by_type.items()}
+        self._recipe_order = {pill_id: i for i, pill_id in enumerate(self.all_recipes_with_key)}
 
     def get_all_recipes(self) -> list:
         """获取所有丹方"""
@@ -32,20 +61,33 @@ class AlchemyManager:
         initial_backpack_quantities = self._get_user_backpack_herb_quantities(user_backpack)
         if not initial_backpack_quantities: # 如果没有药材，也直接返回
             return {}
-            
+
+        # 结果只取决于各药材的持有量，持有量相同时直接使用上次的结果
+        cache_key = frozenset(initial_backpack_quantities.items())
+        cached = self._possible_recipes_cache.get(cache_key)
+        if cached is not None:
+            self._possible_recipes_cache.move_to_end(cache_key)
+            return dict(cached)
+
         # 2. 将背包药材按药力类型分类 (这个方法内部会处理药材ID到药力类型的转换)
         user_herbs_by_type = self._get_user_herbs_by_type(user_backpack)
 
-        possible_recipes = {}
-        for pill_id, recipe in self.all_recipes_with_key.items():
-            required_materials_config = recipe.get("elixir_config", {})
-            if not required_materials_config: # 如果丹方不需要材料，跳过
-                continue
+        # 3. 通过倒排索引找出所需药力类型全部持有的丹方
+        matched_types = Counter()
+        for herb_type in user_herbs_by_type:
+            matched_types.update(self.recipes_by_type.get(herb_type, ()))
+        candidates = sorted(
+            (pill_id for pill_id, count in matched_types.items() if count == len(self.recipe_formulas[pill_id])),
+            key=self._recipe_order.__getitem__
+        )
 
-            # 3. 使用与 craft_pill 相同的逻辑来判断是否能凑齐材料
+        possible_recipes = {}
+        for pill_id in candidates:
+            recipe = self.all_recipes_with_key[pill_id]
+            # 4. 使用与 craft_pill 相同的逻辑来判断是否能凑齐材料
             # 注意：这里传递的是 initial_backpack_quantities，因为每次检查丹方都是独立的
             can_craft_this_pill, consumed_materials_for_this_pill = self._find_materials_for_recipe(
-                required_materials_config,
+                self.recipe_formulas[pill_id],
                 user_herbs_by_type,
                 initial_backpack_quantities # 每次都用完整的背包初始量去判断
             )
@@ -64,20 +106,18 @@ class AlchemyManager:
                     "materials_str": "、".join(materials_display_list) if materials_display_list else "无需特定药材",
                     "effect_desc": recipe.get('desc', '效果未知') # 单独提取效果描述，方便后续格式化
                 }
-        
-        return possible_recipes
-    
+
+        self._possible_recipes_cache[cache_key] = possible_recipes
+        if len(self._possible_recipes_cache) > POSSIBLE_RECIPES_CACHE_SIZE:
+            self._possible_recipes_cache.popitem(last=False)
+        return dict(possible_recipes)
+
     def craft_pill(self, user_info, user_backpack: list, user_alchemy_info, recipe_name: str) -> dict:
         """
         【最终正确版】执行炼丹的核心逻辑（完全基于药材类型和药力）。
         """
-        target_recipe = None
-        target_pill_id = None
-        for pill_id, recipe in self.all_recipes_with_key.items():
-            if recipe['name'] == recipe_name:
-                target_recipe = recipe
-                target_pill_id = pill_id
-                break
+        target_pill_id = self.recipe_id_by_name.get(recipe_name)
+        target_recipe = self.all_recipes_with_key.get(target_pill_id)
 
         if not target_recipe:
             return {"success": False, "message": f"未找到名为【{recipe_name}】的丹方。"}
@@ -296,6 +336,94 @@ class AlchemyManager:
 
         return result_data
 
+    def craft_pills(self, user_info, user_backpack: list, user_alchemy_info, recipe_name: str, quantity: int | None = None) -> dict:
+        """
+        批量炼丹：按背包药材规划浪费药力最少的用料，一次炼制 quantity 炉（None 表示炼到材料或修为用完）。
+        返回格式与 craft_pill 相同，另含实际炼制的炉数 crafts。
+        """
+        target_pill_id = self.recipe_id_by_name.get(recipe_name)
+        target_recipe = self.all_recipes_with_key.get(target_pill_id)
+        if not target_recipe:
+            return {"success": False, "message": f"未找到名为【{recipe_name}】的丹方。"}
+        if quantity is not None and quantity <= 0:
+            return {"success": False, "message": "炼制数量必须大于0。"}
+
+        furnace = next((self.items_manager.get_data_by_item_id(item.goods_id)
+                        for item in user_backpack if item.goods_type == '炼丹炉'), None)
+        if not furnace:
+            return {"success": False, "message": "炼丹需要先在背包中拥有一个炼丹炉！"}
+
+        # 修为限制可炼制的炉数
+        exp_cost = target_recipe.get("mix_exp", 0)
+        max_crafts = quantity
+        if exp_cost > 0:
+            affordable = user_info.exp // exp_cost
+            if affordable <= 0:
+                return {"success": False, "message": f"炼丹需要消耗 {exp_cost} 修为，道友的修为不足！"}
+            max_crafts = affordable if max_crafts is None else min(max_crafts, affordable)
+        elif max_crafts is None and not self.recipe_formulas.get(target_pill_id):
+            max_crafts = 1  # 既不耗修为也不耗药材的丹方，“炼到用完”只炼一炉
+
+        plan = plan_crafts(
+            self.recipe_formulas.get(target_pill_id, {}),
+            self._get_user_herbs_by_type(user_backpack),
+            self._get_user_backpack_herb_quantities(user_backpack),
+            max_crafts
+        )
+        if plan.crafts <= 0:
+            return {"success": False, "message": f"药力或药材不满足炼制【{recipe_name}】的要求！"}
+
+        # 与逐炉炼制结果一致：每炉产出相同，达到经验上限前的丹药才计经验
+        product_num = (1 + furnace.get("buff", 0) + user_alchemy_info.fire_level) * plan.crafts
+        alchemy_record = json.loads(user_alchemy_info.alchemy_record)
+        current_craft_count = alchemy_record.get(target_pill_id, {}).get('num', 0)
+        max_exp_craft_count = target_recipe.get("mix_all", 100)
+        exp_gain = 0
+        if current_craft_count < max_exp_craft_count:
+            exp_eligible_num = min(product_num, max_exp_craft_count - current_craft_count)
+            exp_gain = target_recipe.get("mix_exp", 10) * exp_eligible_num
+
+        total_exp_cost = exp_cost * plan.crafts
+        materials_str_list = [f"【{self.items_manager.get_data_by_item_id(mat_id)['name']}】x{num}"
+                              for mat_id, num in plan.materials.items()]
+        message = f"你连开 {plan.crafts} 炉，消耗了{', '.join(materials_str_list) or '无药材'}和{total_exp_cost}点修为...\n"
+        message += f"丹炉中霞光连闪，共炼制出【{recipe_name}】x{product_num}！"
+        if plan.wasted_power > 0:
+            message += f"\n（药力溢出共 {plan.wasted_power} 点）"
+        if quantity is not None and plan.crafts < quantity:
+            message += f"\n材料或修为只够炼制 {plan.crafts} 炉。"
+        if exp_gain > 0:
+            message += f"\n获得炼丹经验 {exp_gain} 点。"
+        else:
+            message += f"\n此丹药已炼制多次，无法再获得经验。"
+
+        return {
+            "success": True,
+            "message": message,
+            "crafts": plan.crafts,
+            "consume": {"exp": total_exp_cost, "materials": plan.materials},
+            "produce": {"item_id": int(target_pill_id), "num": product_num},
+            "exp_gain": exp_gain
+        }
+
+    def _get_herb_specs(self, herb_id) -> tuple:
+        """
+        药材可提供的药力：((药力类型, 药力), ...)。
+        一个药材可能同时可以作为多种类型的辅药或主药，这里我们只考虑它作为“主药”和“辅药”时的类型，
+        原版逻辑中，药引的类型与主药相同，所以我们不单独处理；主药与辅药类型相同时只计一次（按主药药力）。
+        """
+        specs = self._herb_specs.get(herb_id)
+        if specs is None:
+            herb_info = self.items_manager.get_data_by_item_id(herb_id)
+            specs = []
+            for role in ("主药", "辅药"):
+                role_info = herb_info.get(role) if herb_info else None
+                if role_info and all(herb_type != str(role_info['type']) for herb_type, _ in specs):
+                    specs.append((str(role_info['type']), role_info['power']))
+            specs = tuple(specs)
+            self._herb_specs[herb_id] = specs
+        return specs
+
     def _get_user_herbs_by_type(self, user_backpack: list) -> dict:
         """
         将用户背包的药材按类型和药力进行分类
@@ -307,45 +435,14 @@ class AlchemyManager:
 
         for item in user_backpack:
             if item.goods_type == "药材":
-                herb_info = self.items_manager.get_data_by_item_id(item.goods_id)
-                if not herb_info: continue
-
-                # 一个药材可能同时可以作为多种类型的辅药或主药，这里我们只考虑它作为“主药”和“辅药”时的类型
-                # 原版逻辑中，药引的类型与主药相同，所以我们不单独处理
-
-                # 作为主药时的类型
-                if main_herb_info := herb_info.get("主药"):
-                    herb_type = str(main_herb_info['type'])
-                    if herb_type not in herbs_by_type:
-                        herbs_by_type[herb_type] = []
-
-                    herbs_by_type[herb_type].append({
+                for herb_type, power in self._get_herb_specs(item.goods_id):
+                    herbs_by_type.setdefault(herb_type, []).append({
                         "id": item.goods_id,
                         "name": item.goods_name,
-                        "power": main_herb_info['power'],
+                        "power": power,
                         "num": item.goods_num
                     })
 
-                # 作为辅药时的类型
-                if sub_herb_info := herb_info.get("辅药"):
-                    herb_type = str(sub_herb_info['type'])
-                    if herb_type not in herbs_by_type:
-                        herbs_by_type[herb_type] = []
-
-                    # 避免重复添加同一个药材
-                    is_added = False
-                    for existing_herb in herbs_by_type[herb_type]:
-                        if existing_herb['id'] == item.goods_id:
-                            is_added = True
-                            break
-                    if not is_added:
-                         herbs_by_type[herb_type].append({
-                            "id": item.goods_id,
-                            "name": item.goods_name,
-                            "power": sub_herb_info['power'],
-                            "num": item.goods_num
-                        })
-
         # 按power从大到小排序，方便后续优先使用药力高的药材
         for herb_type in herbs_by_type:
             herbs_by_type[herb_type].sort(key=lambda x: x['power'], reverse=True)
@@ -368,40 +465,25 @@ class AlchemyManager:
             if required_type not in user_herbs_by_type:
                 return False, {} # 用户完全没有这种类型的药材，直接失败
 
-            power_gathered_for_this_type = 0
-            # 获取用户拥有的该类型所有药材，它们已经按药力从高到低排好序
-            herbs_of_this_type = user_herbs_by_type[required_type]
-
-            # 优先使用药力高的药材来凑数
-            for herb_spec_for_this_type in herbs_of_this_type:
+            power_still_needed = required_power_needed
+            # 优先使用药力高的药材来凑数（已经按药力从高到低排好序）
+            for herb_spec_for_this_type in user_herbs_by_type[required_type]:
+                if power_still_needed <= 0:
+                    break
                 herb_id = herb_spec_for_this_type['id']
                 herb_power_per_item = herb_spec_for_this_type['power']
-
                 physically_available_count = available_quantities.get(herb_id, 0)
-
-                if physically_available_count == 0:
+                if physically_available_count <= 0 or herb_power_per_item <= 0:
                     continue
 
-                num_of_this_herb_to_use_for_this_type = 0
-                # 如果当前凑齐的药力还不够，并且这种药材还有剩余
-                while (power_gathered_for_this_type < required_power_needed and
-                       num_of_this_herb_to_use_for_this_type < physically_available_count):
-                    power_gathered_for_this_type += herb_power_per_item
-                    num_of_this_herb_to_use_for_this_type += 1
-                    if power_gathered_for_this_type >= required_power_needed:
-                        break
-
-                # 如果使用了这种药材，记录下要消耗的数量
-                if num_of_this_herb_to_use_for_this_type > 0:
-                    materials_to_consume_for_this_recipe[herb_id] = materials_to_consume_for_this_recipe.get(herb_id, 0) + num_of_this_herb_to_use_for_this_type
-                    available_quantities[herb_id] -= num_of_this_herb_to_use_for_this_type
-
-                # 如果当前类型的药力已经凑齐，就跳出循环，去凑下一种类型
-                if power_gathered_for_this_type >= required_power_needed:
-                    break
+                # 直接算出凑齐剩余药力需要的数量，不足时全部用上
+                num_to_use = min(physically_available_count, math.ceil(power_still_needed / herb_power_per_item))
+                power_still_needed -= num_to_use * herb_power_per_item
+                materials_to_consume_for_this_recipe[herb_id] = materials_to_consume_for_this_recipe.get(herb_id, 0) + num_to_use
+                available_quantities[herb_id] -= num_to_use
 
             # 如果遍历完所有该类型的药材后，药力依然不够，则说明无法炼制
-            if power_gathered_for_this_type < required_power_needed:
+            if power_still_needed > 0:
                 return False, {}
 
         # 如果所有类型的药力都成功凑齐了
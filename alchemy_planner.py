@@ -0,0 +1,156 @@
+import math
+from collections import namedtuple
+
+# 批量炼丹方案：可炼制次数、消耗的药材 {药材ID: 数量}、浪费的药力（超出丹方需求的部分）
+CraftPlan = namedtuple("CraftPlan", ["crafts", "materials", "wasted_power"])
+
+
+# 计算组合代价时，一个共用药材（还能提供丹方其他类型药力的药材）折合的普通药材数
+SHARED_HERB_COST = 1000
+
+
+def min_waste_cover(required_power: int, herbs: list, quantities: dict, shared: frozenset = frozenset(),
+                    prefer_exclusive: bool = False) -> tuple[dict, int] | None:
+    """
+    在剩余药材中选出药力总和不少于 required_power 且超出部分最少的组合（有界背包）。
+    药力相同的组合中优先少用共用药材，其次药材数量最少。
+    prefer_exclusive 为 True 时改为优先少用共用药材，其次才是浪费最少，把共用药材留给其他类型。
+
+    :param herbs: [(药材ID, 单个药力), ...]
+    :param quantities: {药材ID: 剩余数量}
+    :param shared: 共用药材的ID
+    :return: ({药材ID: 使用数量}, 浪费的药力)，凑不齐返回 None
+    """
+    if required_power <= 0:
+        return {}, 0
+
+    # 药力相同且同为（或同不为）共用药材的药材可以互换，合并后一起计算
+    groups = {}  # (药力, 是否共用) -> [药材ID, ...]
+    for herb_id, power in herbs:
+        if quantities.get(herb_id, 0) > 0 and power > 0:
+            groups.setdefault((power, herb_id in shared), []).append(herb_id)
+    if not groups:
+        return None
+
+    # 每组拆成 1、2、4... 个一份的 0/1 物品；同一药力用到 ceil(需求/药力) 个就已足够
+    pieces = []  # (组, 数量, 药力, 代价)
+    for key, herb_ids in groups.items():
+        power, is_shared = key
+        remaining = min(sum(quantities[herb_id] for herb_id in herb_ids), math.ceil(required_power / power))
+        chunk = 1
+        while remaining > 0:
+            size = min(chunk, remaining)
+            pieces.append((key, size, size * power, size * (SHARED_HERB_COST if is_shared else 1)))
+            remaining -= size
+            chunk *= 2
+    max_power = max(power for power, _ in groups)
+
+    # 最优组合去掉任意一个药材后都凑不齐，因此总药力一定小于 需求 + 最大单个药力
+    limit = required_power + max_power - 1
+    inf = float("inf")
+    min_cost = [inf] * (limit + 1)  # 恰好凑出该药力的最小代价
+    min_cost[0] = 0
+    taken = []  # taken[i][s]: 第 i 组是否参与了凑出药力 s 的最优组合
+    for _, _, piece_power, piece_cost in pieces:
+        row = bytearray(limit + 1)
+        for s in range(limit, piece_power - 1, -1):
+            candidate = min_cost[s - piece_power] + piece_cost
+            if candidate < min_cost[s]:
+                min_cost[s] = candidate
+                row[s] = 1
+        taken.append(row)
+
+    reachable = [s for s in range(required_power, limit + 1) if min_cost[s] != inf]
+    if not reachable:
+        return None
+    if prefer_exclusive:
+        best = min(reachable, key=lambda s: (min_cost[s] // SHARED_HERB_COST, s, min_cost[s]))
+    else:
+        best = reachable[0]
+
+    group_used = {}
+    s = best
+    for i in range(len(pieces) - 1, -1, -1):
+        if taken[i][s]:
+            key, size, piece_power, _ = pieces[i]
+            group_used[key] = group_used.get(key, 0) + size
+            s -= piece_power
+
+    # 把每组的用量按顺序分摊到组内药材上
+    used = {}
+    for key, count in group_used.items():
+        for herb_id in groups[key]:
+            num = min(count, quantities[herb_id])
+            if num > 0:
+                used[herb_id] = num
+                count -= num
+            if count == 0:
+                break
+    return used, best - required_power
+
+
+def plan_crafts(required_formula: dict, herbs_by_type: dict, quantities: dict, max_crafts: int | None = None) -> CraftPlan:
+    """
+    规划同一丹方的批量炼制，炉数尽量多，其次浪费的药力尽量少。
+
+    一种药材可能同时能提供丹方中两种类型的药力，只按浪费最少选料会把它提前用掉，
+    使其他类型凑不齐；因此分别按“浪费最少”和“保留共用药材”两种策略规划，取较好的方案。
+
+    :param required_formula: 丹方药力需求 {药力类型: 所需药力}
+    :param herbs_by_type: {药力类型: [{"id": 药材ID, "power": 药力, ...}, ...]}
+    :param quantities: {药材ID: 持有数量}
+    :param max_crafts: 最多炼制的炉数，None 表示炼到材料用完
+    """
+    herbs_of_type = {
+        herb_type: [(herb['id'], herb['power']) for herb in herbs_by_type.get(herb_type, ())]
+        for herb_type in required_formula
+    }
+    type_count = {}
+    for herbs in herbs_of_type.values():
+        for herb_id in {herb_id for herb_id, _ in herbs}:
+            type_count[herb_id] = type_count.get(herb_id, 0) + 1
+    shared = frozenset(herb_id for herb_id, count in type_count.items() if count > 1)
+
+    plans = [_plan_greedy(required_formula, herbs_of_type, quantities, max_crafts, shared, False)]
+    if shared:
+        plans.append(_plan_greedy(required_formula, herbs_of_type, quantities, max_crafts, shared, True))
+    return min(plans, key=lambda plan: (-plan.crafts, plan.wasted_power))
+
+
+def _plan_greedy(required_formula: dict, herbs_of_type: dict, quantities: dict, max_crafts: int | None,
+                 shared: frozenset, prefer_exclusive: bool) -> CraftPlan:
+    """
+    逐炉规划：每一炉对每种药力类型各求一次最优组合，
+    同一组合能重复使用时按剩余数量一次算出可重复的炉数，药材变化后再重新求解。
+    """
+    remaining = dict(quantities)
+    materials = {}
+    crafts = wasted = 0
+    while max_crafts is None or crafts < max_crafts:
+        # 求出一炉的用料（各类型依次从剩余药材中扣除，同一药材不会被两种类型重复使用）
+        trial = dict(remaining)
+        batch = {}
+        batch_waste = 0
+        for herb_type, required_power in required_formula.items():
+            cover = min_waste_cover(required_power, herbs_of_type[herb_type], trial, shared, prefer_exclusive)
+            if cover is None:
+                return CraftPlan(crafts, materials, wasted)
+            used, waste = cover
+            for herb_id, num in used.items():
+                trial[herb_id] -= num
+                batch[herb_id] = batch.get(herb_id, 0) + num
+            batch_waste += waste
+
+        repeat = min((remaining[herb_id] // num for herb_id, num in batch.items()), default=None)
+        if repeat is None:  # 丹方不需要任何药力
+            repeat = 1 if max_crafts is None else max_crafts - crafts
+        if max_crafts is not None:
+            repeat = min(repeat, max_crafts - crafts)
+        for herb_id, num in batch.items():
+            remaining[herb_id] -= num * repeat
+            materials[herb_id] = materials.get(herb_id, 0) + num * repeat
+        crafts += repeat
+        wasted += batch_waste * repeat
+        if not batch and max_crafts is None:
+            break
+    return CraftPlan(crafts, materials, wasted)
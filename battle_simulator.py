@@ -0,0 +1,256 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+from .item_manager import Items
+from .pvp_manager import PvPManager, PlayerBattleInternalState
+
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，缺失时全部战斗都走逐场模拟
+    np = None
+
+# 每个任务模拟的场数；分块固定，结果只取决于种子，与进程数无关
+CHUNK_SIZE = 2000
+
+# 构建战斗属性时 BuffInfo 中可以指定的装备/功法字段
+LOADOUT_FIELDS = ("main_buff", "sec_buff", "sub_buff", "faqi_buff", "fabao_weapon", "armor_buff", "atk_buff", "blessed_spot")
+
+
+def build_profile(stats_engine, name: str, level: str, exp: int = 0, root_type: str | None = None, **loadout) -> dict:
+    """
+    不经数据库构建一个满血满蓝的战斗属性字典（与 get_user_real_info 的结构一致），
+    用于按境界 × 装备组合做平衡测试。loadout 为 LOADOUT_FIELDS 中的物品ID。
+    """
+    unknown = set(loadout) - set(LOADOUT_FIELDS)
+    if unknown:
+        raise ValueError(f"未知的装备字段: {', '.join(sorted(unknown))}")
+    user_info = SimpleNamespace(level=level, exp=exp, root_type=root_type, atkpractice=0, reincarnation_buff=0.0)
+    buff_info = SimpleNamespace(id=0, user_id=name, **{field: loadout.get(field, 0) for field in LOADOUT_FIELDS})
+    stats = stats_engine.compute(user_info, buff_info)
+    return {
+        "user_id": name, "user_name": name, "level": level, "exp": exp,
+        "hp": stats.max_hp, "mp": stats.max_mp, "max_hp": stats.max_hp, "max_mp": stats.max_mp,
+        "atk": stats.atk, "crit_rate": stats.crit_rate, "crit_damage": stats.crit_damage,
+        "defense_rate": stats.defense_rate, "power": stats.power, "buff_info": buff_info,
+    }
+
+
+def build_profiles(stats_engine, levels: list[str], loadouts: dict[str, dict], exp: int = 0) -> dict[str, dict]:
+    """境界 × 装备组合，返回 {"境界/组合名": 战斗属性}"""
+    return {
+        f"{level}/{loadout_name}": build_profile(stats_engine, f"{level}/{loadout_name}", level, exp, **loadout)
+        for level in levels for loadout_name, loadout in loadouts.items()
+    }
+
+
+def load_user_profile(service, user_id: str, full_health: bool = True) -> dict | None:
+    """从数据库读取真实玩家的战斗属性，full_health 为 True 时按满血满蓝计算"""
+    profile = service.get_user_real_info(user_id)
+    if profile and full_health:
+        profile = dict(profile, hp=profile["max_hp"], mp=profile["max_mp"])
+    return profile
+
+
+def _is_skill_less(profile: dict, items_manager) -> bool:
+    """双方都没有神通和辅修功法时，战斗只有普通攻击，可以走向量化路径"""
+    state = PlayerBattleInternalState(profile, items_manager)
+    return state.active_skill_data is None and state.sub_buff_data is None
+
+
+def _new_partial() -> dict:
+    return {
+        "fights": 0, "wins": [0, 0], "draws": 0, "kos": 0,
+        "rounds_to_kill": [], "damage": ([], []), "casts": [0, 0], "failed_casts": [0, 0],
+    }
+
+
+def _merge(total: dict, partial: dict):
+    total["fights"] += partial["fights"]
+    total["draws"] += partial["draws"]
+    total["kos"] += partial["kos"]
+    total["rounds_to_kill"].extend(partial["rounds_to_kill"])
+    for side in (0, 1):
+        total["wins"][side] += partial["wins"][side]
+        total["damage"][side].extend(partial["damage"][side])
+        total["casts"][side] += partial["casts"][side]
+        total["failed_casts"][side] += partial["failed_casts"][side]
+
+
+def _simulate_chunk_kernel(p1: dict, p2: dict, seed, start: int, count: int, max_rounds: int, items_manager) -> dict:
+    """用 PvPManager 逐场模拟，从事件日志中统计伤害和神通使用"""
+    partial = _new_partial()
+    side_of = {"p1": 0, "p2": 1}
+    saved_state = random.getstate()
+    random.seed(f"{seed}:{start}")
+    try:
+        for _ in range(count):
+            result = PvPManager.simulate_player_vs_player_fight(p1, p2, max_rounds, items_manager=items_manager)
+            rounds = 0
+            actor = 0
+            damage = [0, 0]
+            for event in result["battle_round_details_log"].events:
+                name = event[0]
+                if name == "round":
+                    rounds += 1
+                elif name == "turn":
+                    actor = side_of[event[1]]
+                elif name == "attack":
+                    damage[actor] += event[4]
+                elif name == "skill_hit":
+                    damage[actor] += event[1]
+                elif name == "dot":
+                    damage[1 - side_of[event[1]]] += event[2]
+                elif name == "skill_cast":
+                    partial["casts"][actor] += 1
+                elif name == "skill_failed":
+                    partial["failed_casts"][actor] += 1
+
+            partial["fights"] += 1
+            if result["winner"] is None:
+                partial["draws"] += 1
+            else:
+                partial["wins"][side_of[result["winner"]]] += 1
+            if result["p1_hp_final"] <= 0 or result["p2_hp_final"] <= 0:
+                partial["kos"] += 1
+                partial["rounds_to_kill"].append(rounds)
+            partial["damage"][0].append(damage[0])
+            partial["damage"][1].append(damage[1])
+    finally:
+        random.setstate(saved_state)
+    return partial
+
+
+def _simulate_chunk_numpy(p1: dict, p2: dict, seed, start: int, count: int, max_rounds: int) -> dict:
+    """
+    只有普通攻击的战斗：一次生成 count × max_rounds 的随机数矩阵，
+    按 _calculate_damage 的公式算出每次出手的伤害，再用累计和找出第一次击倒的回合。
+    """
+    generator = np.random.default_rng(random.Random(f"{seed}:{start}").getrandbits(64))
+    first_is_p1 = p1["power"] >= p2["power"]
+    p1_acts = (np.arange(max_rounds) % 2 == 0) == first_is_p1  # 每回合由谁出手
+
+    def column(key, p1_value=None, p2_value=None):
+        return np.where(p1_acts, p1[key] if p1_value is None else p1_value, p2[key] if p2_value is None else p2_value)
+
+    atk = column("atk")
+    crit_rate = column("crit_rate", min(1.0, p1.get("crit_rate", 0.05)), min(1.0, p2.get("crit_rate", 0.05)))
+    crit_damage = column("crit_damage", p1.get("crit_damage", 0.5), p2.get("crit_damage", 0.5))
+    # 出手方对面的减伤率
+    defense = np.where(p1_acts, min(0.9, max(0, p2["defense_rate"])), min(0.9, max(0, p1["defense_rate"])))
+
+    base = np.trunc(atk * generator.uniform(0.9, 1.1, (count, max_rounds)))
+    crits = generator.random((count, max_rounds)) < crit_rate
+    base = np.where(crits, np.trunc(base * (1 + crit_damage + 0.5)), base)
+    damage = np.maximum(1, np.trunc(base * (1 - defense)))
+
+    dealt_by_p1 = np.cumsum(np.where(p1_acts, damage, 0), axis=1)
+    dealt_by_p2 = np.cumsum(np.where(p1_acts, 0, damage), axis=1)
+    knocked_out = (dealt_by_p1 >= p2["hp"]) | (dealt_by_p2 >= p1["hp"])
+    has_ko = knocked_out.any(axis=1)
+    end = np.where(has_ko, knocked_out.argmax(axis=1), max_rounds - 1)
+    rows = np.arange(count)
+    total_p1 = dealt_by_p1[rows, end]
+    total_p2 = dealt_by_p2[rows, end]
+
+    # 击倒时出手方获胜；否则按剩余气血判定
+    ko_by_p1 = has_ko & p1_acts[end]
+    ko_by_p2 = has_ko & ~p1_acts[end]
+    hp1_left = p1["hp"] - total_p2
+    hp2_left = p2["hp"] - total_p1
+    p1_wins = ko_by_p1 | (~has_ko & (hp1_left > hp2_left))
+    p2_wins = ko_by_p2 | (~has_ko & (hp2_left > hp1_left))
+
+    partial = _new_partial()
+    partial["fights"] = count
+    partial["wins"] = [int(p1_wins.sum()), int(p2_wins.sum())]
+    partial["draws"] = count - partial["wins"][0] - partial["wins"][1]
+    partial["kos"] = int(has_ko.sum())
+    partial["rounds_to_kill"] = (end[has_ko] + 1).tolist()
+    partial["damage"] = (total_p1.astype(np.int64).tolist(), total_p2.astype(np.int64).tolist())
+    return partial
+
+
+def _simulate_chunk(p1: dict, p2: dict, seed, start: int, count: int, max_rounds: int, fast: bool,
+                    items_manager=None) -> dict:
+    if fast:
+        return _simulate_chunk_numpy(p1, p2, seed, start, count, max_rounds)
+    return _simulate_chunk_kernel(p1, p2, seed, start, count, max_rounds, items_manager or Items())
+
+
+def _percentiles(values: list, points=(50, 90, 99)) -> dict:
+    if not values:
+        return {"mean": 0.0, **{f"p{point}": 0 for point in points}}
+    ordered = sorted(values)
+    result = {"mean": sum(ordered) / len(ordered)}
+    for point in points:
+        result[f"p{point}"] = ordered[min(len(ordered) - 1, max(0, -(-point * len(ordered) // 100) - 1))]
+    return result
+
+
+def simulate_matchup(p1: dict, p2: dict, n: int = 10000, seed=0, max_rounds: int = 30, workers: int | None = 1,
+                     items_manager=None, use_numpy: bool = True) -> dict:
+    """
+    让两份战斗属性对战 n 场，统计胜率、击倒所需回合、伤害分布和神通使用情况。
+
+    - seed 相同则结果相同，与 workers 无关
+    - workers 为 1 时在当前进程内模拟；大于 1（或 None 表示 CPU 核数）时使用进程池
+    - 双方都没有神通和辅修功法且安装了 numpy 时走向量化路径
+    """
+    items_manager = items_manager or Items()
+    # 事件日志中用 p1/p2 区分双方
+    p1 = dict(p1, user_id="p1", user_name="p1")
+    p2 = dict(p2, user_id="p2", user_name="p2")
+    fast = (use_numpy and np is not None
+            and _is_skill_less(p1, items_manager) and _is_skill_less(p2, items_manager))
+    chunks = [(start, min(CHUNK_SIZE, n - start)) for start in range(0, n, CHUNK_SIZE)]
+
+    started = time.perf_counter()
+    total = _new_partial()
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(chunks) <= 1:
+        for start, count in chunks:
+            _merge(total, _simulate_chunk(p1, p2, seed, start, count, max_rounds, fast, items_manager))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            futures = [pool.submit(_simulate_chunk, p1, p2, seed, start, count, max_rounds, fast)
+                       for start, count in chunks]
+            for future in futures:
+                _merge(total, future.result())
+    elapsed = time.perf_counter() - started
+
+    fights = total["fights"] or 1
+    return {
+        "fights": total["fights"],
+        "mode": "numpy" if fast else "kernel",
+        "p1_win_rate": total["wins"][0] / fights,
+        "p2_win_rate": total["wins"][1] / fights,
+        "draw_rate": total["draws"] / fights,
+        "ko_rate": total["kos"] / fights,
+        "rounds_to_kill": _percentiles(total["rounds_to_kill"]),
+        "damage": {side: _percentiles(total["damage"][i]) for i, side in enumerate(("p1", "p2"))},
+        "skill_usage": {
+            side: {
+                "casts_per_fight": total["casts"][i] / fights,
+                "failed_casts_per_fight": total["failed_casts"][i] / fights,
+            }
+            for i, side in enumerate(("p1", "p2"))
+        },
+        "elapsed": elapsed,
+        "fights_per_second": total["fights"] / elapsed if elapsed else float("inf"),
+    }
+
+
+def sweep(profiles: dict[str, dict], n: int = 2000, seed=0, max_rounds: int = 30, workers: int | None = None,
+          items_manager=None) -> dict[tuple[str, str], dict]:
+    """
+    对 profiles 中的每一对组合（如 build_profiles 生成的 境界 × 装备）各模拟 n 场，
+    返回 {(甲方名, 乙方名): simulate_matchup 的结果}。
+    """
+    names = list(profiles)
+    return {
+        (a, b): simulate_matchup(profiles[a], profiles[b], n, f"{seed}:{a}:{b}", max_rounds, workers, items_manager)
+        for i, a in enumerate(names) for b in names[i + 1:]
+    }
@@ -0,0 +1,241 @@
+import os
+import random
+import tempfile
+import time
+from collections import namedtuple
+
+# 一次攻击的结算结果：扣减后BOSS剩余血量、实际计入的伤害、是否由本次攻击击杀
+BossHit = namedtuple("BossHit", ["hp", "damage", "killed"])
+
+# 击杀结算：全部奖励在内存中算好，由 XiuxianService.settle_world_boss 在工作线程中一次写入
+# exp_rewards / stone_rewards 为 {user_id: 数量}，item_deltas 为 (user_id, 物品ID, 数量, 物品类型) 列表，
+# ranking 为 (名次, user_id, 伤害, 占比, 修为奖励, 灵石奖励) 列表，killer_summary 为击杀者立即收到的消息行
+BossSettlement = namedtuple(
+    "BossSettlement",
+    ["boss_id", "boss_name", "killer_id", "exp_rewards", "stone_rewards", "item_deltas", "ranking", "killer_summary"]
+)
+
+# 讨伐广播中展示的伤害榜名次数
+SETTLEMENT_RANKING_SIZE = 10
+
+
+def plan_settlement(boss: dict, killer_id: str, final_hit_rewards: dict, participant_drops: list) -> BossSettlement:
+    """
+    在内存中算出一次击杀的全部奖励，不读写数据库：
+    - 伤害奖励池按伤害占比分给伤害账本上的每位玩家
+    - 最后一击的物品归击杀者
+    - 参与奖励（灵石或物品）发给每位攻击者
+    """
+    damage_log = boss.get('damage_log') or {}
+    total_damage = sum(damage_log.values())
+    if total_damage <= 0:  # 防止除以零错误
+        total_damage = 1
+
+    exp_rewards, stone_rewards = {}, {}
+    ranking = []
+    sorted_damagers = sorted(damage_log.items(), key=lambda item: item[1], reverse=True)
+    for rank, (user_id, damage) in enumerate(sorted_damagers, 1):
+        share = damage / total_damage
+        exp = int(final_hit_rewards["exp"] * share)
+        stone = int(final_hit_rewards["stone"] * share)
+        if exp > 0:
+            exp_rewards[user_id] = exp
+        if stone > 0:
+            stone_rewards[user_id] = stone
+        ranking.append((rank, user_id, damage, share, exp, stone))
+
+    killer_summary = []
+    for entry in ranking:
+        if entry[1] == killer_id:
+            rank, _, damage, share, exp, stone = entry
+            reward_parts = [f"修为+{exp}"] * (exp > 0) + [f"灵石+{stone}"] * (stone > 0)
+            killer_summary.append(
+                f"道友伤害排名第{rank}名，造成 {damage} 伤害 (占比: {share:.2%})\n"
+                f"  奖励: {', '.join(reward_parts) if reward_parts else '无'}"
+            )
+            break
+
+    item_deltas = []
+    for item_reward in final_hit_rewards["items"]:
+        item_deltas.append((killer_id, item_reward['id'], item_reward['quantity'], item_reward['type']))
+        killer_summary.append(f"最后一击奇遇：获得【{item_reward['name']}】x{item_reward['quantity']}")
+
+    attackers = boss.get('attackers') or ({killer_id} if killer_id else set())
+    for user_id in attackers:
+        for drop in participant_drops:
+            if drop['type'] == "灵石":
+                stone_rewards[user_id] = stone_rewards.get(user_id, 0) + drop['quantity']
+            else:
+                item_deltas.append((user_id, drop['id'], drop['quantity'], drop['type']))
+    if participant_drops and killer_id in attackers:
+        drop_parts = [
+            f"灵石+{drop['quantity']}" if drop['type'] == "灵石" else f"【{drop['name']}】x{drop['quantity']}"
+            for drop in participant_drops
+        ]
+        killer_summary.append(f"参与奖励: {', '.join(drop_parts)}")
+
+    return BossSettlement(
+        boss['id'], boss['name'], killer_id, exp_rewards, stone_rewards, item_deltas, ranking, killer_summary
+    )
+
+
+def format_settlement_broadcast(settlement: BossSettlement, names: dict[str, str]) -> str:
+    """结算完成后的讨伐广播：击杀者与伤害贡献榜前 SETTLEMENT_RANKING_SIZE 名"""
+    killer_name = names.get(settlement.killer_id, settlement.killer_id)
+    lines = [
+        f"🎉 世界BOSS【{settlement.boss_name}】已被道友【{killer_name}】成功讨伐！🎉",
+        "感谢各位道友的英勇奋战！奖励已发放给最后一击者及全部参与者。",
+        "\n--- 伤害贡献榜 ---",
+    ]
+    shown = 0
+    for rank, user_id, damage, share, exp, stone in settlement.ranking:
+        if user_id not in names:
+            continue
+        reward_parts = [f"修为+{exp}"] * (exp > 0) + [f"灵石+{stone}"] * (stone > 0)
+        lines.append(
+            f"第{rank}名:【{names[user_id]}】造成 {damage} 伤害 (占比: {share:.2%})\n"
+            f"  奖励: {', '.join(reward_parts) if reward_parts else '无'}"
+        )
+        shown += 1
+        if shown >= SETTLEMENT_RANKING_SIZE:
+            break
+    if len(settlement.ranking) > shown:
+        lines.append(f"……共 {len(settlement.ranking)} 位道友参与讨伐")
+    return "\n".join(lines)
+
+
+class WorldBossState:
+    """
+    世界BOSS状态
+
+    - 血量以数据库为准：每次攻击原子地执行 current_hp = MAX(0, current_hp - 伤害)，
+      并发的攻击不会互相覆盖
+    - 每位攻击者的累计伤害写入 world_boss_damage 伤害账本，重启后由 load 重建内存视图
+    - 扣减只对血量仍大于 0 的BOSS生效，因此只有把血量扣到 0 的那一次攻击得到 killed=True，
+      击杀结算恰好执行一次
+    - 被击杀的BOSS行保留到结算写入完成，结算中途重启时由 load_unsettled 找回并补做
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def load(self) -> dict | None:
+        """从数据库重建当前BOSS的内存视图（战斗属性 + damage_log + attackers），没有BOSS时返回 None"""
+        boss = self.service.get_active_boss()
+        if boss:
+            boss['damage_log'] = self.service.get_boss_damage_ledger(boss['id'])
+            boss['attackers'] = set(boss['damage_log'])
+        return boss
+
+    def load_unsettled(self) -> list[dict]:
+        """已被击杀但尚未完成结算的BOSS（含伤害账本和击杀者）"""
+        bosses = self.service.get_killed_bosses()
+        for boss in bosses:
+            boss['damage_log'] = self.service.get_boss_damage_ledger(boss['id'])
+            boss['attackers'] = set(boss['damage_log'])
+        return bosses
+
+    def record_hit(self, boss: dict, user_id: str, damage: int) -> BossHit | None:
+        """
+        原子扣减BOSS血量并记入伤害账本，同步更新内存视图。
+        应与玩家状态、奖励的写入在同一个工作单元内调用；BOSS已被击杀或不存在时返回 None。
+        """
+        applied = self.service.apply_boss_damage(boss['id'], max(0, damage), user_id)
+        if applied is None:
+            return None
+        hp, dealt = applied
+        self.service.record_boss_damage(boss['id'], user_id, dealt)
+
+        boss['hp'] = hp
+        damage_log = boss.setdefault('damage_log', {})
+        damage_log[user_id] = damage_log.get(user_id, 0) + dealt
+        boss.setdefault('attackers', set()).add(user_id)
+        return BossHit(hp, dealt, hp == 0)
+
+    def plan_kill(self, boss: dict, killer_id: str) -> BossSettlement:
+        """按BOSS境界抽取掉落并算出本次击杀的全部奖励"""
+        final_hit_rewards, participant_drops = self.service.get_boss_drop(
+            {"jj": boss['jj'], "exp": boss.get('exp', 1000), "stone": boss.get('stone', 1000)}
+        )
+        return plan_settlement(boss, killer_id, final_hit_rewards, participant_drops)
+
+
+def _legacy_settlement(service, boss: dict, killer_id: str, final_hit_rewards: dict, participant_drops: list):
+    """原先在事件循环中逐人执行的结算方式，仅供 benchmark 对比"""
+    with service.transaction():
+        damage_log = boss['damage_log']
+        total_damage = sum(damage_log.values()) or 1
+        for user_id, damage in sorted(damage_log.items(), key=lambda item: item[1], reverse=True):
+            if not service.get_user_message(user_id):
+                continue
+            share = damage / total_damage
+            exp, stone = int(final_hit_rewards["exp"] * share), int(final_hit_rewards["stone"] * share)
+            if exp > 0:
+                service.update_exp(user_id, exp)
+            if stone > 0:
+                service.update_ls(user_id, stone, 1)
+        item_deltas = []
+        for user_id in boss['attackers']:
+            for drop in participant_drops:
+                if drop['type'] == "灵石":
+                    service.update_ls(user_id, drop['quantity'], 1)
+                else:
+                    item_deltas.append((user_id, drop['id'], drop['quantity'], drop['type']))
+        if item_deltas:
+            service.apply_item_deltas(item_deltas)
+
+
+def benchmark(participants: int = 500, seed: int = 0, participant_drops: list | None = None) -> dict:
+    """
+    在临时数据库上对比世界BOSS击杀结算的耗时（毫秒）：
+    - legacy_ms：原先在事件循环中逐人读写的结算
+    - plan_ms：新流程中击杀者等待的部分（内存中算出全部奖励）
+    - settle_ms：新流程在工作线程中一次事务写入的耗时
+    participant_drops 默认只有灵石，可传入物品掉落一并测试批量写入背包。
+    """
+    from .service import XiuxianService
+
+    rng = random.Random(seed)
+    participant_drops = participant_drops or [{"id": 0, "name": "灵石", "type": "灵石", "quantity": 500}]
+    final_hit_rewards = {"exp": 10 ** 7, "stone": 10 ** 6, "items": []}
+    user_ids = [f"bench_{i}" for i in range(participants)]
+    result = {"participants": participants}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        service = XiuxianService(os.path.join(tmp_dir, "bench.db"))
+        try:
+            service.conn.executemany(
+                "INSERT INTO user_xiuxian (user_id, user_name, level, exp, stone, hp, mp) VALUES (?, ?, '江湖好手', 0, 0, 100, 100)",
+                [(user_id, f"道友{i}") for i, user_id in enumerate(user_ids)]
+            )
+            service.conn.commit()
+
+            def spawn_and_kill() -> dict:
+                boss_id = service.spawn_new_boss({
+                    "name": "基准BOSS", "jj": "江湖好手", "hp": 1, "max_hp": 1, "exp": 0, "stone": 0, "atk": 1
+                })
+                service.conn.executemany(
+                    "INSERT INTO world_boss_damage (boss_id, user_id, damage, hits) VALUES (?, ?, ?, 1)",
+                    [(boss_id, user_id, rng.randint(1, 10 ** 6)) for user_id in user_ids]
+                )
+                service.apply_boss_damage(boss_id, 1, user_ids[0])
+                return WorldBossState(service).load_unsettled()[0]
+
+            boss = spawn_and_kill()
+            start = time.perf_counter()
+            _legacy_settlement(service, boss, user_ids[0], final_hit_rewards, participant_drops)
+            result["legacy_ms"] = (time.perf_counter() - start) * 1000
+            service.delete_boss(boss['id'])
+
+            boss = spawn_and_kill()
+            start = time.perf_counter()
+            settlement = plan_settlement(boss, user_ids[0], final_hit_rewards, participant_drops)
+            result["plan_ms"] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            with service.bypass_player_cache(user_ids):
+                names = service.settle_world_boss(settlement)
+            result["settle_ms"] = (time.perf_counter() - start) * 1000
+            result["ranked"] = len(names or {})
+        finally:
+            service.close()
+    return result
@@ -1,5 +1,8 @@
 import yaml
 from pathlib import Path
+from types import MappingProxyType
+from astrbot.api import logger
+from .data_manager import jsondata
 
 # 定义数据文件所在的根目录
 DATABASE = Path() / "data" / "xiuxian"
@@ -7,8 +10,30 @@ DATABASE = Path() / "data" / "xiuxian"
 class XiuConfig:
     """
     集中管理插件的所有静态配置
+
+    进程内单例：config.yaml 只在首次构造或调用 reload() 时读取，
+    同时预先计算境界索引、下一境界、境界rank等查找表。
     """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(XiuConfig, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
     def __init__(self):
+        if self._initialized:
+            return
+        self._load()
+        self._initialized = True
+
+    def reload(self):
+        """重新读取 config.yaml 并重建境界查找表"""
+        self._load()
+        logger.info(f"修仙配置已重新加载，共 {len(self.level)} 个境界。")
+
+    def _load(self):
         # 从 YAML 文件加载配置
         config_yaml_path = DATABASE / "config.yaml"
         try:
@@ -54,6 +79,7 @@ class XiuConfig:
 
         self.atk_practice_buff_per_level = config_data.get('atk_practice_buff_per_level', 0.04) # 每级攻击修炼提升4%攻击
         self.blessed_spot_exp_rate_per_level = config_data.get('blessed_spot_exp_rate_per_level', 0.1) # 洞天福地每级修炼速度加成
+        self.temp_buff_persist = config_data.get('temp_buff_persist', True) # 临时Buff是否持久化到数据库（重启后保留）
 
         # 突破死劫配置
         self.death_calamity_config = {
@@ -257,6 +283,12 @@ class XiuConfig:
                     {"amount_range": [1001, 2500], "weight": 30},
                     {"amount_range": [2501, 5000], "weight": 10}
                 ],
+                "pity": { # 累计保底：连续未获得主要物品时逐步提高概率，计数按玩家和卡池分别保存
+                    "enabled": True,
+                    "soft_pity_start": 40, # 从第40抽起概率逐抽提高
+                    "soft_pity_step": 0.06, # 每抽提高的概率
+                    "hard_pity": 60 # 第60抽必定获得
+                },
                 "ten_pull_guarantee": {
                     "enabled": True,
                     "guaranteed_item_type": "shengtong", # 保底类型为神通
@@ -277,6 +309,12 @@ class XiuConfig:
                     {"amount_range": [1001, 2500], "weight": 30},
                     {"amount_range": [2501, 5000], "weight": 10}
                 ],
+                "pity": { # 累计保底：连续未获得主要物品时逐步提高概率，计数按玩家和卡池分别保存
+                    "enabled": True,
+                    "soft_pity_start": 40, # 从第40抽起概率逐抽提高
+                    "soft_pity_step": 0.06, # 每抽提高的概率
+                    "hard_pity": 60 # 第60抽必定获得
+                },
                 "ten_pull_guarantee": {
                     "enabled": True,
                     "guaranteed_item_type": "faqi",  # 保底类型为法器
@@ -302,6 +340,12 @@ class XiuConfig:
                     {"amount_range": [1001, 2500], "weight": 30},
                     {"amount_range": [2501, 5000], "weight": 10}
                 ],
+                "pity": { # 累计保底：连续未获得主要物品时逐步提高概率，计数按玩家和卡池分别保存
+                    "enabled": True,
+                    "soft_pity_start": 40, # 从第40抽起概率逐抽提高
+                    "soft_pity_step": 0.06, # 每抽提高的概率
+                    "hard_pity": 60 # 第60抽必定获得
+                },
                 "ten_pull_guarantee": {
                     "enabled": True,
                     "guaranteed_item_type": "fangju",  # 保底类型为防具
@@ -325,6 +369,12 @@ class XiuConfig:
                     {"amount_range": [1501, 3000], "weight": 30},
                     {"amount_range": [3001, 6000], "weight": 10}
                 ],
+                "pity": { # 累计保底：连续未获得主要物品时逐步提高概率，计数按玩家和卡池分别保存
+                    "enabled": True,
+                    "soft_pity_start": 40, # 从第40抽起概率逐抽提高
+                    "soft_pity_step": 0.06, # 每抽提高的概率
+                    "hard_pity": 60 # 第60抽必定获得
+                },
                 "ten_pull_guarantee": {
                     "enabled": True,
                     "guaranteed_item_type": "gongfa",  # 保底类型为主修功法
@@ -594,6 +644,55 @@ class XiuConfig:
                 ]
             }
         }
+
+        self._build_level_index()
+
+    def _build_level_index(self):
+        """根据境界列表构建 境界->索引 / 境界->下一境界 / 境界->rank 查找表"""
+        self.level_index = {name: i for i, name in enumerate(self.level)}
+        self.next_level_map = {
+            name: (self.level[i + 1] if i + 1 < len(self.level) else None)
+            for i, name in enumerate(self.level)
+        }
+        self.level_rank = {name: USERRANK.get(name, 99) for name in self.level}
+        # 合并后的境界数据行依赖 境界.json，在其重新加载后惰性重建
+        self._level_rows = {}
+        self._level_rows_source = None
+
+    def get_level_index(self, level: str) -> int | None:
+        """获取境界在境界列表中的位置，不存在时返回 None"""
+        return self.level_index.get(level)
+
+    def get_next_level(self, level: str) -> str | None:
+        """获取下一境界名称，已是最高境界或境界不存在时返回 None"""
+        return self.next_level_map.get(level)
+
+    def get_level_rank(self, level: str) -> int:
+        """获取境界rank值（数字越小境界越高），未知境界返回 99"""
+        return self.level_rank.get(level, 99)
+
+    def get_level_row(self, level: str):
+        """
+        获取合并后的境界数据行：境界.json 中的配置 + 索引/rank/下一境界。
+        返回只读视图，境界不存在时返回 None
+        """
+        level_data = jsondata.level_data()
+        if level_data is not self._level_rows_source:
+            rows = {}
+            for name, i in self.level_index.items():
+                row = dict(level_data.get(name, {}))
+                row.update({
+                    "name": name,
+                    "index": i,
+                    "rank": self.level_rank[name],
+                    "next_level": self.next_level_map[name],
+                })
+                rows[name] = MappingProxyType(row)
+            self._level_rows = rows
+            self._level_rows_source = level_data
+        return self._level_rows.get(level)
+
+
 SKILL_RANK_VALUE = {
     "人阶下品": 50,
     "人阶上品": 45, # 假设人阶上品比下品高5个rank点
@@ -0,0 +1,190 @@
+import math
+import threading
+import time
+from datetime import datetime
+from astrbot.api import logger
+
+# user_cd 表中 type=3 存放的是灵庄存款而不是冷却时间，不由本模块管理
+BANK_SAVINGS_TYPE = 3
+
+
+class CooldownManager:
+    """
+    冷却时间管理器
+
+    - 所有未过期的冷却以 (user_id, type) -> (开始时间字符串, 到期时间戳) 常驻内存，查询只需一次字典查找
+    - 哈希时间轮负责回收过期冷却：按到期时间落入对应槽位，tick 时只检查经过的槽位
+    - 修改先记入待写队列，由 flush 分批写回 user_cd 表；启动时从表中重建
+    """
+
+    def __init__(self, wheel_slots: int = 3600, slot_seconds: int = 1, batch_size: int = 64):
+        self.wheel_slots = wheel_slots
+        self.slot_seconds = slot_seconds
+        self.batch_size = batch_size
+        self.lock = threading.RLock()
+        self._entries: dict[tuple[str, int], tuple[str, int]] = {}
+        self._wheel: list[set[tuple[str, int]]] = [set() for _ in range(wheel_slots)]
+        self._current_tick = self._tick_of(time.time())
+        self._pending: dict[tuple[str, int], tuple[str, int] | None] = {}  # None 表示删除
+        self._deleted_deadlines: dict[tuple[str, int], int] = {}  # 待删除冷却被删除前的到期时间
+
+    def _tick_of(self, timestamp: float) -> int:
+        return int(timestamp // self.slot_seconds)
+
+    def _schedule(self, key: tuple[str, int], deadline: int):
+        self._wheel[self._tick_of(deadline) % self.wheel_slots].add(key)
+
+    @staticmethod
+    def _to_row(key: tuple[str, int], entry: tuple[str, int]) -> tuple:
+        """转换为 user_cd 表的行 (user_id, type, create_time, scheduled_time)"""
+        return key[0], key[1], entry[0], str(datetime.fromtimestamp(entry[1]))
+
+    # ---------- 加载 ----------
+    def load(self, rows):
+        """由 user_cd 表的行 (user_id, type, create_time, scheduled_time) 重建，过期和无法解析的记录会被忽略"""
+        now = time.time()
+        with self.lock:
+            self._entries.clear()
+            for slot in self._wheel:
+                slot.clear()
+            self._pending.clear()
+            self._deleted_deadlines.clear()
+            self._current_tick = self._tick_of(now)
+            for user_id, cd_type, create_time, scheduled_time in rows:
+                if cd_type == BANK_SAVINGS_TYPE or not scheduled_time:
+                    continue
+                try:
+                    deadline = math.ceil(datetime.fromisoformat(scheduled_time).timestamp())
+                except (ValueError, TypeError):
+                    logger.warning(f"用户 {user_id} 的CD类型 {cd_type} 时间格式无效: {scheduled_time}")
+                    continue
+                if deadline > now:
+                    key = (user_id, cd_type)
+                    self._entries[key] = (create_time, deadline)
+                    self._schedule(key, deadline)
+            return len(self._entries)
+
+    def merge(self, rows) -> int:
+        """
+        把 user_cd 表的行合并进内存（不丢弃内存中的冷却和待写记录）：
+        同一冷却以到期较晚者为准，表中较晚或内存中没有的冷却被采用，返回采用的条数
+        """
+        now = time.time()
+        merged = 0
+        with self.lock:
+            for user_id, cd_type, create_time, scheduled_time in rows:
+                if cd_type == BANK_SAVINGS_TYPE or not scheduled_time:
+                    continue
+                try:
+                    deadline = math.ceil(datetime.fromisoformat(scheduled_time).timestamp())
+                except (ValueError, TypeError):
+                    continue
+                key = (user_id, cd_type)
+                entry = self._entries.get(key)
+                if deadline <= now or (entry is not None and entry[1] >= deadline):
+                    continue
+                self._entries[key] = (create_time, deadline)
+                self._schedule(key, deadline)
+                self._pending.pop(key, None)  # 表中已是该值
+                self._deleted_deadlines.pop(key, None)
+                merged += 1
+        return merged
+
+    # ---------- 查询 ----------
+    def get(self, user_id: str, cd_type: int) -> tuple | None:
+        """返回未过期冷却对应的 user_cd 行，无冷却返回 None"""
+        key = (user_id, cd_type)
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                return None
+            return self._to_row(key, entry)
+
+    def remaining(self, user_id: str, cd_type: int) -> int:
+        """剩余冷却秒数，0 表示无冷却"""
+        entry = self._entries.get((user_id, cd_type))
+        if entry is None:
+            return 0
+        return max(int(entry[1] - time.time()), 0)
+
+    # ---------- 修改 ----------
+    def set(self, user_id: str, cd_type: int, duration_seconds: float, create_time: str | None = None):
+        now = datetime.now()
+        deadline = math.ceil(now.timestamp() + duration_seconds)
+        key = (user_id, cd_type)
+        entry = (create_time or str(now), deadline)
+        with self.lock:
+            self._entries[key] = entry
+            self._schedule(key, deadline)
+            self._pending[key] = entry
+            self._deleted_deadlines.pop(key, None)
+
+    def delete(self, user_id: str, cd_type: int):
+        key = (user_id, cd_type)
+        with self.lock:
+            entry = self._entries.pop(key, None)
+            self._pending[key] = None
+            self._deleted_deadlines[key] = entry[1] if entry else math.ceil(time.time())
+
+    def forget_user(self, user_id: str):
+        """丢弃某个玩家的全部冷却及其待写记录（数据库中的行已由调用方删除）"""
+        with self.lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+            for key in [key for key in self._pending if key[0] == user_id]:
+                del self._pending[key]
+                self._deleted_deadlines.pop(key, None)
+
+    # ---------- 时间轮 ----------
+    def tick(self) -> int:
+        """推进时间轮，回收已过期的冷却并记入待删除队列，返回回收的数量"""
+        now = time.time()
+        target_tick = self._tick_of(now)
+        expired = 0
+        with self.lock:
+            # 超过一整圈时每个槽位只需检查一次
+            start_tick = max(self._current_tick + 1, target_tick - self.wheel_slots + 1)
+            for tick in range(start_tick, target_tick + 1):
+                index = tick % self.wheel_slots
+                slot = self._wheel[index]
+                for key in list(slot):
+                    entry = self._entries.get(key)
+                    if entry is None or self._tick_of(entry[1]) % self.wheel_slots != index:
+                        slot.discard(key)  # 已删除或已被重新设置到其他槽位
+                    elif entry[1] <= now:
+                        slot.discard(key)
+                        del self._entries[key]
+                        self._pending[key] = None
+                        self._deleted_deadlines[key] = entry[1]
+                        expired += 1
+                    # 否则是若干圈之后才到期的长冷却，留在槽位中
+            self._current_tick = target_tick
+        return expired
+
+    # ---------- 写回 ----------
+    def needs_flush(self) -> bool:
+        return len(self._pending) >= self.batch_size
+
+    def take_pending(self) -> tuple[list[tuple], list[tuple]]:
+        """
+        取出全部待写记录，返回 (需写入的 user_cd 行, 需删除的 (user_id, type, 删除前的到期时间))
+        """
+        with self.lock:
+            pending, self._pending = self._pending, {}
+            deleted_deadlines, self._deleted_deadlines = self._deleted_deadlines, {}
+        upserts = [self._to_row(key, entry) for key, entry in pending.items() if entry is not None]
+        now = math.ceil(time.time())
+        deletes = [
+            (key[0], key[1], str(datetime.fromtimestamp(deleted_deadlines.get(key, now))))
+            for key, entry in pending.items() if entry is None
+        ]
+        return upserts, deletes
+
+    def discard_pending(self):
+        with self.lock:
+            self._pending.clear()
+            self._deleted_deadlines.clear()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {"active": len(self._entries), "pending": len(self._pending)}
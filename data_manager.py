@@ -1,16 +1,56 @@
 from pathlib import Path
+from types import MappingProxyType
 import json
+import os
+import threading
+import time
 from astrbot.api import logger
 
 # 定义数据文件所在的根目录
 DATABASE = Path() / "data" / "xiuxian"
 
+# 同一个文件两次检查 mtime/size 之间的最小间隔（秒）
+DEFAULT_CHECK_INTERVAL = 5.0
+
+
+def _freeze(obj):
+    """将 json.load 得到的数据递归转换为只读结构: dict -> MappingProxyType, list -> tuple"""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj):
+    """将只读结构还原为普通的 dict/list，供需要修改或序列化的调用方使用"""
+    if isinstance(obj, MappingProxyType):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, tuple):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+class _CachedJsonFile:
+    """单个JSON文件的缓存条目"""
+    __slots__ = ("data", "mtime", "size", "checked_at")
+
+    def __init__(self, data, mtime, size, checked_at):
+        self.data = data
+        self.mtime = mtime
+        self.size = size
+        self.checked_at = checked_at
+
+
 class DataManager:
     """
     处理JSON数据，加载游戏核心规则
+
+    每个文件只解析一次并冻结为只读结构，所有调用方共享同一份视图。
+    文件的 mtime/size 发生变化时才会重新加载，且同一文件最多每 check_interval 秒检查一次。
     """
 
-    def __init__(self):
+    def __init__(self, check_interval: float = DEFAULT_CHECK_INTERVAL):
         """定义所有数据文件的路径"""
         self.root_jsonpath = DATABASE / "灵根.json"
         self.level_rate_jsonpath = DATABASE / "突破概率.json"
@@ -18,6 +58,11 @@ class DataManager:
         self.sect_json_path = DATABASE / "宗门玩法配置.json"
         self.physique_jsonpath = DATABASE / "炼体境界.json"
 
+        self.check_interval = check_interval
+        self._cache: dict[Path, _CachedJsonFile] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "reloads": 0}
+
     def _read_json_file(self, file_path):
         """通用JSON文件读取方法"""
         try:
@@ -29,25 +74,70 @@ class DataManager:
             print(f"错误: 未找到数据文件 {file_path}")
             return {}
 
+    @staticmethod
+    def _stat_file(file_path):
+        """返回 (mtime_ns, size)，文件不存在时返回 (None, None)"""
+        try:
+            st = os.stat(file_path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None, None
+
+    def _load(self, file_path):
+        """带缓存的读取：命中缓存直接返回共享的只读视图"""
+        now = time.monotonic()
+        entry = self._cache.get(file_path)
+        if entry is not None and now - entry.checked_at < self.check_interval:
+            self.stats["hits"] += 1
+            return entry.data
+
+        with self._lock:
+            entry = self._cache.get(file_path)
+            mtime, size = self._stat_file(file_path)
+            if entry is not None and entry.mtime == mtime and entry.size == size:
+                entry.checked_at = now
+                self.stats["hits"] += 1
+                return entry.data
+
+            data = _freeze(self._read_json_file(file_path))
+            self._cache[file_path] = _CachedJsonFile(data, mtime, size, now)
+            self.stats["misses"] += 1
+            if entry is not None:
+                self.stats["reloads"] += 1
+                logger.info(f"数据文件 {file_path} 已变更，重新加载。")
+            return data
+
+    def reload(self, file_path=None):
+        """丢弃缓存，下次访问时强制重新读取。file_path 为 None 时清空全部"""
+        with self._lock:
+            if file_path is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(Path(file_path), None)
+
+    def get_cache_stats(self) -> dict:
+        """获取缓存命中/未命中/重载次数"""
+        return {**self.stats, "cached_files": len(self._cache)}
+
     def level_data(self):
         """获取境界数据"""
-        return self._read_json_file(self.level_jsonpath)
+        return self._load(self.level_jsonpath)
 
     def sect_config_data(self):
         """获取宗门玩法配置"""
-        return self._read_json_file(self.sect_json_path)
+        return self._load(self.sect_json_path)
 
     def root_data(self):
         """获取灵根数据"""
-        return self._read_json_file(self.root_jsonpath)
+        return self._load(self.root_jsonpath)
 
     def level_rate_data(self):
         """获取境界突破概率"""
-        return self._read_json_file(self.level_rate_jsonpath)
-        
+        return self._load(self.level_rate_jsonpath)
+
     def physique_data(self):
         """获取炼体境界数据"""
-        return self._read_json_file(self.physique_jsonpath)
+        return self._load(self.physique_jsonpath)
     # ==================================
 # === 在 data_manager.py 的 DataManager 类中追加 ===
 # ==================================
@@ -55,7 +145,7 @@ class DataManager:
     def get_shop_data(self) -> dict:
         """获取坊市商品数据"""
         shop_path = DATABASE / "goods.json"
-        return self._read_json_file(shop_path)
+        return self._load(shop_path)
     # ==================================
 # === 在 data_manager.py 的 DataManager 类中追加 ===
 # ==================================
@@ -63,17 +153,17 @@ class DataManager:
     def get_bounty_data(self) -> dict:
         """获取悬赏令数据"""
         bounty_path = DATABASE / "悬赏令.json"
-        return self._read_json_file(bounty_path)
+        return self._load(bounty_path)
 
     def get_rift_data(self) -> dict:
         """获取秘境数据"""
         rift_path = DATABASE / "rift.json"
-        return self._read_json_file(rift_path)
+        return self._load(rift_path)
 
     def get_goods_data(self) -> dict:
         """获取坊市基础商品数据"""
         goods_path = DATABASE / "goods.json"
-        return self._read_json_file(goods_path)
+        return self._load(goods_path)
 
 
 # 创建一个全局实例，方便其他文件直接导入使用
@@ -0,0 +1,157 @@
+import sqlite3
+from datetime import datetime
+from astrbot.api import logger
+
+# 用于对比迁移前后查询计划的典型查询 (名称 -> (SQL, 参数))
+PLAN_PROBE_QUERIES = {
+    "查询用户信息": ("SELECT * FROM user_xiuxian WHERE user_id=?", ("0",)),
+    "查询用户Buff": ("SELECT * FROM BuffInfo WHERE user_id=?", ("0",)),
+    "查询背包物品": ("SELECT * FROM back WHERE user_id=? AND goods_name=?", ("0", "")),
+    "背包物品增减": ("SELECT goods_num FROM back WHERE user_id=? AND goods_id=?", ("0", 0)),
+    "查询用户CD": ("SELECT * FROM user_cd WHERE user_id = ? AND type = ?", ("0", 0)),
+    "宗门人数": ("SELECT count(*) FROM user_xiuxian WHERE sect_id=?", (0,)),
+    "用户抵押列表": (
+        "SELECT mortgage_id FROM user_mortgage WHERE user_id = ? AND status = 'active' ORDER BY due_time ASC",
+        ("0",),
+    ),
+    "过期抵押扫描": (
+        "SELECT mortgage_id FROM user_mortgage WHERE status = 'active' AND due_time < ?",
+        ("",),
+    ),
+}
+
+
+def _explain(cur: sqlite3.Cursor, sql: str, params: tuple) -> str:
+    """返回一条查询的 EXPLAIN QUERY PLAN 结果（多行合并为一行）"""
+    try:
+        cur.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return " | ".join(row[-1] for row in cur.fetchall())
+    except sqlite3.OperationalError as e:
+        return f"无法分析: {e}"
+
+
+def collect_query_plans(conn: sqlite3.Connection) -> dict[str, str]:
+    """收集所有典型查询当前的查询计划"""
+    cur = conn.cursor()
+    return {name: _explain(cur, sql, params) for name, (sql, params) in PLAN_PROBE_QUERIES.items()}
+
+
+def _dedupe_by_user_id(cur: sqlite3.Cursor, table: str) -> int:
+    """
+    清理同一 user_id 的重复行，只保留 id 最小的一行（即原查询 fetchone 实际读到的那行）。
+    被删除的行会先备份到 <table>_dedup_backup 表中，返回删除的行数。
+    """
+    backup_table = f"{table}_dedup_backup"
+    duplicate_filter = (
+        f'user_id IS NOT NULL AND id NOT IN '
+        f'(SELECT MIN(id) FROM "{table}" WHERE user_id IS NOT NULL GROUP BY user_id)'
+    )
+    cur.execute(f'SELECT count(*) FROM "{table}" WHERE {duplicate_filter}')
+    duplicate_count = cur.fetchone()[0]
+    if not duplicate_count:
+        return 0
+
+    cur.execute(f'CREATE TABLE IF NOT EXISTS "{backup_table}" AS SELECT * FROM "{table}" WHERE 0')
+    cur.execute(f'INSERT INTO "{backup_table}" SELECT * FROM "{table}" WHERE {duplicate_filter}')
+    cur.execute(f'DELETE FROM "{table}" WHERE {duplicate_filter}')
+    logger.warning(f"表 {table} 中发现 {duplicate_count} 条重复 user_id 记录，已备份至 {backup_table} 后删除。")
+    return duplicate_count
+
+
+def _migration_1_add_indexes(cur: sqlite3.Cursor):
+    """为高频查询添加索引，并为每个用户唯一的表加上唯一约束"""
+    _dedupe_by_user_id(cur, "user_xiuxian")
+    _dedupe_by_user_id(cur, "BuffInfo")
+
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS "idx_user_xiuxian_user_id" ON "user_xiuxian" ("user_id")')
+    cur.execute('CREATE INDEX IF NOT EXISTS "idx_user_xiuxian_sect_id" ON "user_xiuxian" ("sect_id")')
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS "idx_buffinfo_user_id" ON "BuffInfo" ("user_id")')
+    cur.execute('CREATE INDEX IF NOT EXISTS "idx_back_user_goods_name" ON "back" ("user_id", "goods_name")')
+    cur.execute('CREATE INDEX IF NOT EXISTS "idx_back_user_goods_id" ON "back" ("user_id", "goods_id")')
+    cur.execute('CREATE INDEX IF NOT EXISTS "idx_market_user_id" ON "market" ("user_id")')
+    cur.execute('CREATE INDEX IF NOT EXISTS "idx_mortgage_status_due" ON "user_mortgage" ("status", "due_time")')
+    cur.execute('CREATE INDEX IF NOT EXISTS "idx_mortgage_user_status" ON "user_mortgage" ("user_id", "status", "due_time")')
+
+
+def _migration_2_unique_backpack_key(cur: sqlite3.Cursor):
+    """背包以 (user_id, goods_id) 唯一，重复的物品行合并数量后删除（删除前备份到 back_dedup_backup）"""
+    duplicate_filter = "rowid NOT IN (SELECT MIN(rowid) FROM back GROUP BY user_id, goods_id)"
+    cur.execute(f"SELECT count(*) FROM back WHERE {duplicate_filter}")
+    duplicate_count = cur.fetchone()[0]
+    if duplicate_count:
+        cur.execute('CREATE TABLE IF NOT EXISTS "back_dedup_backup" AS SELECT * FROM "back" WHERE 0')
+        cur.execute(f'INSERT INTO "back_dedup_backup" SELECT * FROM "back" WHERE {duplicate_filter}')
+        # 数量类字段累加到保留的那一行
+        cur.execute("""
+            UPDATE back SET
+                goods_num = (SELECT SUM(COALESCE(b.goods_num, 0)) FROM back b WHERE b.user_id = back.user_id AND b.goods_id = back.goods_id),
+                day_num = (SELECT SUM(COALESCE(b.day_num, 0)) FROM back b WHERE b.user_id = back.user_id AND b.goods_id = back.goods_id),
+                all_num = (SELECT SUM(COALESCE(b.all_num, 0)) FROM back b WHERE b.user_id = back.user_id AND b.goods_id = back.goods_id),
+                bind_num = (SELECT SUM(COALESCE(b.bind_num, 0)) FROM back b WHERE b.user_id = back.user_id AND b.goods_id = back.goods_id)
+            WHERE rowid IN (
+                SELECT MIN(rowid) FROM back GROUP BY user_id, goods_id HAVING count(*) > 1
+            )
+        """)
+        cur.execute(f"DELETE FROM back WHERE {duplicate_filter}")
+        logger.warning(f"背包中发现 {duplicate_count} 条重复物品记录，已合并数量并备份至 back_dedup_backup。")
+
+    cur.execute('DROP INDEX IF EXISTS "idx_back_user_goods_id"')
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS "idx_back_user_goods_unique" ON "back" ("user_id", "goods_id")')
+
+
+# 版本号 -> (说明, 迁移函数)，版本号必须递增，已发布的迁移不要修改
+MIGRATIONS = [
+    (1, "为常用查询添加索引并清理重复用户数据", _migration_1_add_indexes),
+    (2, "背包物品以 (user_id, goods_id) 唯一", _migration_2_unique_backpack_key),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """读取数据库当前的结构版本，未迁移过的数据库为 0"""
+    cur = conn.cursor()
+    cur.execute(
+        'CREATE TABLE IF NOT EXISTS "schema_version" ('
+        '"version" INTEGER NOT NULL PRIMARY KEY, "description" TEXT, "applied_at" TEXT)'
+    )
+    conn.commit()
+    cur.execute("SELECT MAX(version) FROM schema_version")
+    return cur.fetchone()[0] or 0
+
+
+def run_migrations(conn: sqlite3.Connection) -> list[str]:
+    """
+    依次执行所有未应用的迁移，每个迁移在单独的事务中完成，失败时回滚并抛出异常。
+    返回迁移报告（包括迁移前后的查询计划），无待执行迁移时返回空列表。
+    """
+    current_version = get_schema_version(conn)
+    pending = [m for m in MIGRATIONS if m[0] > current_version]
+    if not pending:
+        return []
+
+    report = [f"数据库结构版本: {current_version} -> {pending[-1][0]}"]
+    plans_before = collect_query_plans(conn)
+
+    cur = conn.cursor()
+    for version, description, migrate in pending:
+        try:
+            if not conn.in_transaction:
+                cur.execute("BEGIN")
+            migrate(cur)
+            cur.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat())
+            )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"数据库迁移 v{version}（{description}）失败，已回滚: {e}")
+            raise
+        report.append(f"已应用迁移 v{version}: {description}")
+
+    plans_after = collect_query_plans(conn)
+    for name, before in plans_before.items():
+        report.append(f"[{name}]\n  迁移前: {before}\n  迁移后: {plans_after.get(name)}")
+
+    for line in report:
+        logger.info(line)
+    return report
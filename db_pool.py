@@ -0,0 +1,113 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from astrbot.api import logger
+
+# 写连接与只读连接共用的 PRAGMA 配置
+DEFAULT_PRAGMAS = {
+    "synchronous": "NORMAL",   # WAL 模式下 NORMAL 足够安全，且比 FULL 少一次 fsync
+    "cache_size": -16000,      # 负数单位为 KiB，约 16MB 页缓存
+    "mmap_size": 134217728,    # 128MB 内存映射读
+    "busy_timeout": 5000,      # 遇到锁时最多等待 5 秒
+    "temp_store": "MEMORY",
+}
+
+
+class ConnectionManager:
+    """
+    SQLite 连接管理器
+
+    - 数据库切换为 WAL 模式，读写互不阻塞
+    - 一个写连接（writer），所有写入都通过它完成
+    - 一组只读连接池，供排行榜、面板、背包等只读查询并发使用
+    """
+
+    def __init__(self, db_path, pool_size: int = 4, pragmas: dict | None = None):
+        self.db_path = str(db_path)
+        self.pool_size = pool_size
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        # 写连接在多个线程间共享（如钓鱼模块），需要串行化完整事务时持有此锁
+        self.write_lock = threading.RLock()
+
+        self.writer = sqlite3.connect(self.db_path, check_same_thread=False)
+        journal_mode = self.writer.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        self._apply_pragmas(self.writer)
+        if str(journal_mode).lower() != "wal":
+            logger.warning(f"数据库未能切换到 WAL 模式（当前: {journal_mode}），只读连接池将被禁用。")
+            self.pool_size = 0
+
+        self._readers = queue.Queue()
+        self._all_readers = []
+        for _ in range(self.pool_size):
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self._apply_pragmas(conn)
+            conn.execute("PRAGMA query_only=ON")
+            self._readers.put(conn)
+            self._all_readers.append(conn)
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "acquires": 0,           # 从连接池借出只读连接的次数
+            "writer_fallbacks": 0,   # 写连接存在未提交事务时，直接使用写连接读取的次数
+            "total_wait": 0.0,       # 等待空闲只读连接的累计时间（秒）
+            "max_wait": 0.0,
+        }
+
+    def _apply_pragmas(self, conn: sqlite3.Connection):
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+
+    @contextmanager
+    def read(self):
+        """
+        借出一个只读连接，用完自动归还。
+        如果写连接上有未提交的事务，为保证能读到自己刚写入的数据，直接使用写连接。
+        """
+        if not self.pool_size or self.writer.in_transaction:
+            with self._stats_lock:
+                self.stats["writer_fallbacks"] += 1
+            yield self.writer
+            return
+
+        start = time.perf_counter()
+        conn = self._readers.get()
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.stats["acquires"] += 1
+            self.stats["total_wait"] += waited
+            self.stats["max_wait"] = max(self.stats["max_wait"], waited)
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def worker_connection(self):
+        """
+        为后台工作线程单独打开一个读写连接，用完自动关闭。
+        与主写连接之间的写入依靠 busy_timeout 串行化，工作线程应使用短事务分批提交。
+        """
+        conn = sqlite3.connect(self.db_path)
+        self._apply_pragmas(conn)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get_metrics(self) -> dict:
+        """获取连接池指标：池大小、空闲连接数、借出次数及等待时间"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        acquires = stats["acquires"]
+        stats["avg_wait"] = stats["total_wait"] / acquires if acquires else 0.0
+        stats["pool_size"] = self.pool_size
+        stats["idle"] = self._readers.qsize()
+        return stats
+
+    def close(self):
+        for conn in self._all_readers:
+            conn.close()
+        self._all_readers.clear()
+        self.writer.close()
@@ -939,7 +939,9 @@ class FishingDB:
         """【新】更新修仙数据库的灵石数量"""
         mode = 1 if amount >= 0 else 2
         try:
-            self.xiuxian_service.update_ls(user_id, abs(amount), mode)
+            # 经由工作单元写入：钓鱼的后台线程会等待事件循环中正在进行的工作单元结束，不会混入其事务
+            with self.xiuxian_service.transaction():
+                self.xiuxian_service.update_ls(user_id, abs(amount), mode)
             return True
         except Exception as e:
             logger.error(f"跨系统更新灵石失败: {e}")
@@ -2455,6 +2457,89 @@ class FishingDB:
             logger.error(f"记录抽卡结果失败: {e}")
             return False
 
+    def apply_gacha_rewards(self, user_id: str, gacha_pool_id: int, rewards: List[Dict], before_commit=None) -> bool:
+        """
+        在一个事务中发放一批抽卡奖励并写入抽卡记录。
+
+        Args:
+            user_id: 用户ID
+            gacha_pool_id: 抽卡池ID
+            rewards: 奖励列表，每项包含 type, id, name, quantity, rarity
+            before_commit: 提交前调用的回调（如结算灵石），参数为因已拥有而未发放的称号奖励列表，
+                返回 False 或抛出异常时整批回滚
+
+        Returns:
+            bool: 是否发放成功。已拥有的称号不会重复发放，也不写入抽卡记录，该奖励被标记 duplicate=True
+        """
+        conn = self._get_connection()
+        try:
+            with conn:
+                cursor = conn.cursor()
+                new_rod_instance_id = None
+                bait_totals: Dict[int, int] = {}
+                premium_total = 0
+                duplicates = []
+                for reward in rewards:
+                    item_type, item_id, quantity = reward['type'], reward['id'], reward['quantity']
+                    if item_type == 'rod':
+                        cursor.execute("""
+                            INSERT INTO user_rods (user_id, rod_id, current_durability)
+                            VALUES (?, ?, ?)
+                        """, (user_id, item_id, None))
+                        new_rod_instance_id = new_rod_instance_id or cursor.lastrowid
+                    elif item_type == 'accessory':
+                        cursor.execute("""
+                            INSERT INTO user_accessories (user_id, accessory_id)
+                            VALUES (?, ?)
+                        """, (user_id, item_id))
+                    elif item_type == 'bait':
+                        bait_totals[item_id] = bait_totals.get(item_id, 0) + quantity
+                    elif item_type == 'titles':
+                        cursor.execute("""
+                            INSERT OR IGNORE INTO user_titles (user_id, title_id)
+                            VALUES (?, ?)
+                        """, (user_id, item_id))
+                        if not cursor.rowcount:
+                            # 已拥有（或本批中已抽到）该称号
+                            reward['duplicate'] = True
+                            duplicates.append(reward)
+                    elif item_type == 'premium_currency':
+                        premium_total += item_id * quantity
+
+                if bait_totals:
+                    cursor.executemany("""
+                        INSERT INTO user_bait_inventory (user_id, bait_id, quantity)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT(user_id, bait_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                    """, [(user_id, bait_id, quantity) for bait_id, quantity in bait_totals.items()])
+                if premium_total:
+                    cursor.execute("""
+                        UPDATE users SET premium_currency = premium_currency + ? WHERE user_id = ?
+                    """, (premium_total, user_id))
+                if new_rod_instance_id is not None:
+                    # 如果用户没有装备鱼竿，则装备本批中的第一根新鱼竿
+                    cursor.execute("""
+                        UPDATE users SET equipped_rod_instance_id = ?
+                        WHERE user_id = ? AND (equipped_rod_instance_id IS NULL OR equipped_rod_instance_id = 0)
+                    """, (new_rod_instance_id, user_id))
+                    if cursor.rowcount:
+                        cursor.execute("UPDATE user_rods SET is_equipped = 1 WHERE rod_instance_id = ?", (new_rod_instance_id,))
+
+                cursor.executemany("""
+                    INSERT INTO gacha_records (
+                        user_id, gacha_pool_id, item_type, item_id,
+                        item_name, quantity, rarity
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, [(user_id, gacha_pool_id, reward['type'], reward['id'], reward['name'],
+                       reward['quantity'], reward['rarity']) for reward in rewards if not reward.get('duplicate')])
+
+                if before_commit is not None and before_commit(duplicates) is False:
+                    raise sqlite3.Error("提交前的结算失败")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"批量发放抽卡奖励失败: {e}")
+            return False
+
     def get_user_gacha_records(self, user_id: str, limit: int = 10) -> List[Dict]:
         """
         获取用户的抽卡记录
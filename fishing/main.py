@@ -962,6 +962,11 @@ _____ _     _     _
                                     message += f"  🔮 特殊效果: {details.get('other_bonus_description')}\n"
 
                     message += "\n"
+
+                refunded = result.get("refunded", [])
+                if refunded:
+                    titles = "、".join(f"【{item.get('name', '未知称号')}】" for item in refunded)
+                    message += f"♻️ 已拥有的称号 {titles} 未重复发放，已退还 {result.get('refund_coins', 0)} 金币\n"
                 yield event.plain_result(message)
             else:
                 original_message = result.get("message", "十连抽卡失败！")
@@ -13,6 +13,7 @@ from . import pk_skill_handler
 from . import pk_config
 from . import pve_config
 from ..service import XiuxianService as MainXiuxianService
+from ..sampler import AliasSampler, SamplerCache
 
 def get_coins_name():
     """获取金币名称"""
@@ -27,6 +28,17 @@ def get_utc4_now():
 def get_utc4_today():
     return get_utc4_now().date()
 
+# 擦弹奖励倍数区间 (下限, 上限, 权重)
+WIPE_BOMB_RANGES = (
+    (0.0, 0.5, 35),    # 0.0-0.5倍，权重35
+    (0.5, 1.0, 25),    # 0.5-1.0倍，权重25
+    (1.0, 2.0, 20),    # 1.0-2.0倍，权重20
+    (2.0, 3.0, 10),    # 2.0-3.0倍，权重10
+    (3.0, 5.0, 7),     # 3.0-5.0倍，权重7
+    (5.0, 8.0, 2),     # 5.0-8.0倍，权重2
+    (8.0, 10.0, 1),    # 8.0-10.0倍，权重1
+)
+
 class _BattleSimulator:
     def __init__(self, service, attacker, defender, prize_pool):
         self.service = service # 允许访问DB等
@@ -477,6 +489,7 @@ class FishingService:
         self.achievement_check_running = False
         self.today = get_utc4_today()
         self.chest_id = None # 用于缓存宝箱的ID
+        self.samplers = SamplerCache() # 稀有度、鱼、抽卡池等权重表的抽样器
         self.pve_handler = PVEHandler(self)
         
         # 设置日志记录器
@@ -743,16 +756,11 @@ class FishingService:
                 for r in rarity_probs:
                     rarity_probs[r] = max(0.001, rarity_probs[r])
             
-            # 基于概率分布选择稀有度
-            rarity_roll = random.random()
-            cumulative_prob = 0
-            selected_rarity = 1  # 默认为1
-            
-            for rarity, prob in sorted(rarity_probs.items()):
-                cumulative_prob += prob
-                if rarity_roll <= cumulative_prob:
-                    selected_rarity = rarity
-                    break
+            # 基于概率分布选择稀有度（概率之和不足1时剩余部分默认为1）
+            rarity_table = tuple(sorted(rarity_probs.items()))
+            selected_rarity = self.samplers.get(
+                ("rarity", rarity_table), lambda: AliasSampler.from_probabilities(dict(rarity_table), default=1)
+            ).sample()
 
             # <<< 核心修改：黄金罗盘的“转化”逻辑 >>>
             force_get_chest = False
@@ -796,27 +804,13 @@ class FishingService:
                         fish = dict(cursor.fetchone())
                     else:
                         # 在同稀有度内，基于价值反比来选择鱼（价值越高，概率越低）
-                        # 计算所有鱼的总价值倒数
-                        total_inverse_value = sum(1.0 / (f['base_value'] or 1) for f in fishes)
-                        
-                        # 为每条鱼分配概率
-                        fish_probs = []
-                        for f in fishes:
+                        fish_rows = tuple(tuple(f) for f in fishes)
+                        fish_sampler = self.samplers.get(
+                            ("fish", fish_rows),
                             # 避免除以零
-                            inv_value = 1.0 / (f['base_value'] or 1)
-                            prob = inv_value / total_inverse_value
-                            fish_probs.append((dict(f), prob))
-                        
-                        # 基于概率选择鱼
-                        fish_roll = random.random()
-                        cum_prob = 0
-                        fish = fish_probs[0][0]  # 默认选第一条
-                        
-                        for f, prob in fish_probs:
-                            cum_prob += prob
-                            if fish_roll <= cum_prob:
-                                fish = f
-                                break
+                            lambda: AliasSampler([dict(f) for f in fishes], [1.0 / (f['base_value'] or 1) for f in fishes])
+                        )
+                        fish = dict(fish_sampler.sample())  # 复制一份，抽样表中的数据保持不变
             
             # 考虑减少垃圾鱼的概率（如果选中了垃圾鱼且有垃圾减免）
             is_garbage = fish['rarity'] == 1 and fish['base_value'] <= 2  # 简单判断是否为垃圾
@@ -1217,53 +1211,52 @@ class FishingService:
         }
         
     def multi_gacha(self, user_id: str, pool_id: int, count: int = 10) -> Dict:
-        """执行十连抽卡"""
-        # 获取抽卡池信息
-        pool_info = self.db.get_gacha_pool_info(pool_id)
-        if not pool_info:
-            return {"success": False, "message": "抽卡池不存在"}
-
-        # 检查用户金币是否足够
-        cost = pool_info.get('cost_coins', 0) * count
-        user_coins = self.db.get_user_coins(user_id)
-        if user_coins < cost:
-            return {"success": False, "message": f"金币不足，需要 {cost} 金币"}
+        """执行十连抽卡（一次抽样、一次扣费、一个事务发放）"""
+        result = self._perform_batch_gacha(user_id, pool_id, count)
+        if not result.get("success"):
+            return result
 
-        # 执行多次抽卡
-        results = []
+        results = result["items"]
         rewards_by_rarity = {}
-
-        for _ in range(count):
-            result = self._perform_single_gacha(user_id, pool_id)
-            if not result.get("success"):
-                # 如果抽卡失败，退还金币
-                self.db.update_user_coins(user_id, cost)
-                return result
-
-            item = result.get("item", {})
-            results.append(item)
-
+        for item in results:
             # 按稀有度分组
-            rarity = item.get("rarity", 1)
-            if rarity not in rewards_by_rarity:
-                rewards_by_rarity[rarity] = []
-            rewards_by_rarity[rarity].append(item)
+            rewards_by_rarity.setdefault(item.get("rarity", 1), []).append(item)
 
         return {
             "success": True,
             "results": results,
-            "rewards_by_rarity": rewards_by_rarity
+            "rewards_by_rarity": rewards_by_rarity,
+            "refunded": result["refunded"],
+            "refund_coins": result["refund_coins"]
         }
-    
+
     def _perform_single_gacha(self, user_id: str, pool_id: int) -> Dict:
         """执行单次抽卡"""
+        result = self._perform_batch_gacha(user_id, pool_id, 1)
+        if not result.get("success"):
+            return result
+        if result["refunded"]:
+            # 与原先一致：抽到已拥有的称号视为发放失败并退还费用
+            title = result["refunded"][0]
+            return {"success": False, "message": f"已拥有称号【{title['name']}】，已退还 {result['refund_coins']} 金币"}
+        return {"success": True, "item": result["items"][0]}
+
+    def _perform_batch_gacha(self, user_id: str, pool_id: int, count: int) -> Dict:
+        """
+        执行 count 次抽卡：卡池只查询一次、金币只检查一次，
+        抽样一次批量完成，物品、抽卡记录和金币结算在同一个事务中提交，任一步失败整批取消。
+        抽到已拥有的称号不重复发放，按单抽价格退还（返回的 refunded / refund_coins）。
+
+        金币存放在修仙数据库，与钓鱼数据库无法在一个事务中提交：金币在钓鱼事务提交前结算，
+        钓鱼事务随后提交失败时再把金币退回，属于尽力而为的补偿，两次写入之间进程退出仍可能不一致。
+        """
         # 获取抽卡池信息
         pool_info = self.db.get_gacha_pool_info(pool_id)
         if not pool_info:
             return {"success": False, "message": "抽卡池不存在"}
 
         # 检查用户金币是否足够
-        cost = pool_info.get('cost_coins', 0)
+        cost = pool_info.get('cost_coins', 0) * count
         user_coins = self.db.get_user_coins(user_id)
         if user_coins < cost:
             return {"success": False, "message": f"金币不足，需要 {cost} 金币"}
@@ -1278,88 +1271,69 @@ class FishingService:
         if total_weight <= 0:
             return {"success": False, "message": "抽卡池配置错误"}
 
-        # 随机抽取物品
-        rand = random.uniform(0, total_weight)
-        current_weight = 0
-        selected_item = None
-
-        # 将物品随机打乱
-        items = random.sample(items, len(items))
-
-        for item in items:
-            current_weight += item['weight']
-            if rand <= current_weight:
-                selected_item = item
-                break
-
-        if not selected_item:
-            return {"success": False, "message": "抽卡失败"}
-        # 扣除金币
-        if not self.db.update_user_coins(user_id, -cost):
-            return {"success": False, "message": "扣除金币失败"}
-
-        # 根据物品类型处理奖励
-        item_type = selected_item['item_type']
-        item_id = selected_item['item_id']
-        quantity = selected_item.get('quantity', 1)
-
-        # 获取物品详细信息
-        item_info = None
-        if item_type == 'rod':
-            item_info = self.db.get_rod_info(item_id)
-        elif item_type == 'accessory':
-            item_info = self.db.get_accessory_info(item_id)
-        elif item_type == 'bait':
-            item_info = self.db.get_bait_info(item_id)
-        elif item_type == 'coins':
-            item_info = {'name': '金币', 'rarity': 1}
+        # 随机抽取物品（卡池内容不变时复用同一张抽样表）
+        pool_rows = tuple(tuple(item.values()) for item in items)
+        sampler = self.samplers.get(("gacha", pool_id, pool_rows), lambda: AliasSampler.from_weighted(items))
+        selected_items = sampler.sample_many(count)
+
+        # 获取物品详细信息（同一物品只查询一次）
+        info_cache = {}
+        rewards = []
+        coins_gained = 0
+        for selected_item in selected_items:
+            item_type = selected_item['item_type']
+            item_id = selected_item['item_id']
+            quantity = selected_item.get('quantity', 1)
+            key = (item_type, item_id)
+            if key not in info_cache:
+                item_info = None
+                if item_type == 'rod':
+                    item_info = self.db.get_rod_info(item_id)
+                elif item_type == 'accessory':
+                    item_info = self.db.get_accessory_info(item_id)
+                elif item_type == 'bait':
+                    item_info = self.db.get_bait_info(item_id)
+                elif item_type == 'coins':
+                    item_info = {'name': '金币', 'rarity': 1}
+                info_cache[key] = item_info
+            item_info = info_cache[key]
+            if not item_info:
+                return {"success": False, "message": "获取物品信息失败"}
+            if item_type == 'coins':
+                coins_gained += quantity
+            rewards.append({
+                "type": item_type,
+                "id": item_id,
+                "name": item_info.get('name', '未知物品'),
+                "quantity": quantity,
+                "rarity": item_info.get('rarity', 1)
+            })
 
+        # 发放奖励并记录抽卡结果，提交前结算金币（扣除费用、加上抽到的金币、退还重复称号的费用）
+        unit_cost = pool_info.get('cost_coins', 0)
+        settled = {"coins": 0}
 
-        if not item_info:
-            return {"success": False, "message": "获取物品信息失败"}
-
-        # 发放奖励
-        success = False
-        if item_type == 'rod':
-            success = self.db.add_rod_to_inventory(user_id, item_id)
-        elif item_type == 'accessory':
-            success = self.db.add_accessory_to_inventory(user_id, item_id)
-        elif item_type == 'bait':
-            success = self.db.add_bait_to_inventory(user_id, item_id, quantity)
-        elif item_type == 'coins':
-            success = self.db.update_user_coins(user_id, quantity)
-        elif item_type == 'titles':
-            success = self.db.add_title_to_user(user_id, item_id)
-        elif item_type == 'premium_currency':
-            success = self.db.update_user_currency(user_id, 0, item_id * quantity)
+        def settle(duplicates):
+            net_coins = coins_gained - cost + unit_cost * len(duplicates)
+            if net_coins and not self.db.update_user_coins(user_id, net_coins):
+                return False
+            settled["coins"] = net_coins
+            return True
 
-        if not success:
-            # 如果发放失败，退还金币
-            self.db.update_user_coins(user_id, cost)
+        if not self.db.apply_gacha_rewards(user_id, pool_id, rewards, before_commit=settle):
+            if settled["coins"]:
+                # 金币已结算但钓鱼事务未能提交，退回本次结算
+                self.db.update_user_coins(user_id, -settled["coins"])
             return {"success": False, "message": "发放奖励失败"}
 
-        # 记录抽卡结果
-        self.db.record_gacha_result(
-            user_id=user_id,
-            gacha_pool_id=pool_id,
-            item_type=item_type,
-            item_id=item_id,
-            item_name=item_info.get('name', '未知物品'),
-            quantity=quantity,
-            rarity=item_info.get('rarity', 1)
-        )
-
+        refunded = [reward for reward in rewards if reward.get('duplicate')]
         return {
             "success": True,
-            "item": {
-                "type": item_type,
-                "id": item_id,
-                "name": item_info.get('name', '未知物品'),
-                "quantity": quantity,
-                "rarity": item_info.get('rarity', 1)
-            }
+            "items": [reward for reward in rewards if not reward.get('duplicate')],
+            "refunded": refunded,
+            "refund_coins": unit_cost * len(refunded)
         }
-    
+
     def gacha(self, user_id: str, pool_id: int) -> Dict:
         """进行一次抽奖"""
         error = self._check_registered_or_return(user_id)
@@ -1732,31 +1706,12 @@ class FishingService:
         self.db.update_user_coins(user_id, -contribution_amount)
         
         # 使用加权随机算法生成奖励倍数（0-10倍，保留1位小数）
-        # 定义倍数区间和对应的权重
-        ranges = [
-            (0.0, 0.5, 35),    # 0.0-0.5倍，权重35
-            (0.5, 1.0, 25),    # 0.5-1.0倍，权重25
-            (1.0, 2.0, 20),    # 1.0-2.0倍，权重20
-            (2.0, 3.0, 10),    # 2.0-3.0倍，权重10
-            (3.0, 5.0, 7),     # 3.0-5.0倍，权重7
-            (5.0, 8.0, 2),     # 5.0-8.0倍，权重2
-            (8.0, 10.0, 1),    # 8.0-10.0倍，权重1
-        ]
-        
-        # 计算总权重
-        total_weight = sum(weight for _, _, weight in ranges)
-        
         # 随机选择一个区间
-        random_value = random.random() * total_weight
-        current_weight = 0
-        selected_range = ranges[0]  # 默认第一个区间
-        
-        for range_min, range_max, weight in ranges:
-            current_weight += weight
-            if random_value <= current_weight:
-                selected_range = (range_min, range_max, weight)
-                break
-                
+        selected_range = self.samplers.get(
+            "wipe_bomb", lambda: AliasSampler(WIPE_BOMB_RANGES, [weight for _, _, weight in WIPE_BOMB_RANGES]),
+            source=WIPE_BOMB_RANGES
+        ).sample()
+
         # 在选中的区间内随机生成倍数值
         range_min, range_max, _ = selected_range
         reward_multiplier = round(random.uniform(range_min, range_max), 1)
@@ -3134,7 +3089,8 @@ class FishingService:
         """【新】通过修仙主服务更新灵石数量"""
         mode = 1 if amount >= 0 else 2
         try:
-            self.main_service.update_ls(user_id, abs(amount), mode)
+            with self.main_service.transaction():
+                self.main_service.update_ls(user_id, abs(amount), mode)
             return True
         except Exception as e:
             logger.error(f"跨系统更新灵石失败 for {user_id}: {e}")
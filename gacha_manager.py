@@ -1,16 +1,35 @@
 # astrbot_plugin_xiuxian/gacha_manager.py
 
 import random
+import time
+from collections import Counter, namedtuple
 from astrbot.api import logger
 from .item_manager import Items # 用于获取神通的详细信息
 from .config import XiuConfig # 用于获取卡池配置
 from .service import XiuxianService # 用于扣除灵石、添加物品等
+from .sampler import AliasSampler, SamplerCache
+from .gacha_pity import PoolPity, pity_rule_from_config
+
+# 一批抽取的结果：奖励列表、十连保底次数、抽取后的保底计数（未启用保底为 None）、软/硬保底命中次数
+GachaBatch = namedtuple("GachaBatch", ["rewards", "guarantees", "pity_counter", "soft_pity_hits", "hard_pity_hits"])
+
+# (卡池ID, 主要物品类型) -> Items 中对应的预处理物品池属性名（神通池按类型细分，单独处理）
+MAIN_ITEM_POOLS = {
+    ("shenbing_baoku", "faqi"): "prepared_faqi_pool",
+    ("wanggu_gongfa_ge", "gongfa"): "prepared_gongfa_pool",
+    ("xuanjia_baodian", "fangju"): "prepared_fangju_pool",
+}
+
 
 class GachaManager:
     def __init__(self, service: XiuxianService, items_manager: Items, xiu_config: XiuConfig):
         self.service = service
         self.items_manager = items_manager # Items 实例
         self.xiu_config = xiu_config       # XiuConfig 实例
+        self.samplers = SamplerCache()     # 各卡池的抽样表，启动时预先建立
+        self._guarantee_pools = {}         # (卡池ID, 保底类型, 最低稀有度) -> 保底物品列表
+        self.pity_engines: dict[str, PoolPity] = {}  # 卡池ID -> 保底状态机
+        self._prepare_pools()
         # self.all_shengtongs = self.items_manager.get_data_by_item_type(['神通'])
         # self.all_faqi = self.items_manager.get_data_by_item_type(['法器'])
         # self.all_fangju = self.items_manager.get_data_by_item_type(['防具'])
@@ -93,30 +112,101 @@ class GachaManager:
     #     return prepared
 
 
-    def _weighted_random_choice(self, items_with_weights: list) -> dict | None:
+    def _prepare_pools(self):
+        """启动时预先筛选各卡池的保底物品池、建立抽样表，并为配置了保底的卡池建立保底状态机"""
+        for pool_id, pool_config in self.xiu_config.gacha_pools_config.items():
+            main_item_type = pool_config['ten_pull_guarantee']['guaranteed_item_type']
+            self._pool_sampler(("lingshi", pool_id), pool_config['lingshi_rewards'])
+            self._rate_sampler(("category", pool_id), pool_config['item_categories_rate'])
+            guarantee_key = self._guarantee_key(pool_config, pool_id)
+            self._pool_sampler(("guarantee",) + guarantee_key, self._guarantee_pool(*guarantee_key))
+
+            rule = pity_rule_from_config(pool_config)
+            if rule is None:
+                continue
+            self.pity_engines[pool_id] = PoolPity(
+                main_category=main_item_type,
+                base_rate=pool_config['item_categories_rate'].get(main_item_type, 0.0),
+                rule=rule,
+                draw_main=lambda rng, c=pool_config, p=pool_id, t=main_item_type: self._main_reward(
+                    t, self._draw_main_items(c, p, t, 1, rng)[0]),
+                draw_guaranteed=lambda rng, c=pool_config, p=pool_id: self._draw_guaranteed_item(c, p, rng),
+            )
+
+    @staticmethod
+    def _main_reward(category: str, entry: dict | None) -> dict | None:
+        """把物品池中的条目转换为奖励字典"""
+        if not entry:
+            return None
+        return {
+            "category": category,
+            "id": entry['id'],
+            "name": entry['name'],
+            "data": entry['data']
+        }
+
+    @staticmethod
+    def _guarantee_key(pool_config: dict, pool_id: str) -> tuple:
+        guarantee_config = pool_config['ten_pull_guarantee']
+        min_rank_or_level_for_guarantee = guarantee_config.get('guaranteed_min_rank_value', 99)  # 默认一个很高的值
+        return pool_id, guarantee_config['guaranteed_item_type'], min_rank_or_level_for_guarantee
+
+    def _draw_guaranteed_item(self, pool_config: dict, pool_id: str, rng=None) -> dict | None:
+        """从卡池的保底物品池中抽取一个主要物品，池为空返回 None"""
+        guarantee_key = self._guarantee_key(pool_config, pool_id)
+        sampler = self._pool_sampler(("guarantee",) + guarantee_key, self._guarantee_pool(*guarantee_key))
+        return self._main_reward(guarantee_key[1], sampler.sample(rng) if sampler else None)
+
+    def _pool_sampler(self, table_key, items_with_weights: list) -> AliasSampler | None:
         """
-        根据权重随机选择一个物品。
+        获取按权重抽取物品的抽样表（别名法，每张表只建一次，列表对象更换后自动重建）。
+        :param table_key: 抽样表的缓存键
         :param items_with_weights: 列表，每个元素是字典，必须包含 "weight" 键和物品信息。
                                    例如: [{"id": "1", "name": "A", "weight": 10}, {"id": "2", "name": "B", "weight": 1}]
-        :return: 选中的物品字典，或 None (如果列表为空或总权重为0)
+        :return: 抽样表，或 None (如果列表为空或总权重为0)
         """
+        return self.samplers.get(table_key, lambda: self._build_sampler(items_with_weights), source=items_with_weights)
+
+    @staticmethod
+    def _build_sampler(items_with_weights: list) -> AliasSampler | None:
         if not items_with_weights:
             return None
-
         total_weight = sum(item['weight'] for item in items_with_weights)
-        if total_weight <= 0:
-            # 如果所有物品权重都是0，则均等概率选择一个
-            if all(item['weight'] == 0 for item in items_with_weights):
-                return random.choice(items_with_weights)
-            return None # 或者抛出错误
-
-        rand_val = random.uniform(0, total_weight)
-        cumulative_weight = 0
-        for item in items_with_weights:
-            cumulative_weight += item['weight']
-            if rand_val <= cumulative_weight:
-                return item
-        return items_with_weights[-1] # 理论上不会执行到这里，除非浮点数精度问题
+        if total_weight <= 0 and not all(item['weight'] == 0 for item in items_with_weights):
+            return None
+        # 所有物品权重都是0时，AliasSampler 按均等概率选择
+        return AliasSampler.from_weighted(items_with_weights)
+
+    def _rate_sampler(self, table_key, rates: dict) -> AliasSampler:
+        """按 {结果: 概率} 抽取的抽样表，概率之和不足 1 时剩余部分抽中 None"""
+        return self.samplers.get(table_key, lambda: AliasSampler.from_probabilities(rates), source=rates)
+
+    def _guarantee_pool(self, pool_id: str, guaranteed_item_type: str, min_rank_or_level: int) -> list:
+        """十连保底可选的物品列表（物品池加载后不再变化，筛选结果按卡池缓存，保底抽样表因此也只建一次）"""
+        key = (pool_id, guaranteed_item_type, min_rank_or_level)
+        pool = self._guarantee_pools.get(key)
+        if pool is None:
+            pool = self._guarantee_pools[key] = self._filter_guarantee_pool(*key)
+        return pool
+
+    def _filter_guarantee_pool(self, pool_id: str, guaranteed_item_type: str, min_rank_or_level: int) -> list:
+        if pool_id == "wanfa_baojian" and guaranteed_item_type == "shengtong":
+            # 神通的保底是任意神通，不按稀有度筛选（或按需调整）
+            pool = []
+            for st_type_list in self.items_manager.prepared_shengtongs_pool_by_type.values():
+                pool.extend(st_type_list)
+            return pool
+        if pool_id == "shenbing_baoku" and guaranteed_item_type == "faqi":
+            # 法器保底，筛选 rank <= guaranteed_min_rank_value
+            return [item for item in self.items_manager.prepared_faqi_pool if item['rank'] <= min_rank_or_level]
+        if pool_id == "wanggu_gongfa_ge" and guaranteed_item_type == "gongfa":  # 新增功法保底
+            # 功法保底，筛选 origin_level <= guaranteed_min_rank_value
+            return [item for item in self.items_manager.prepared_gongfa_pool if item['origin_level'] <= min_rank_or_level]
+        if pool_id == "xuanjia_baodian" and guaranteed_item_type == "fangju":  # 新增防具保底
+            # 防具保底，筛选 rank <= guaranteed_min_rank_value
+            return [item for item in self.items_manager.prepared_fangju_pool if item['rank'] <= min_rank_or_level]
+        # --- 在这里为后续的功法池、防具池添加分支 ---
+        return []
 
 
     # def _prepare_faqi_pool(self) -> list:
@@ -162,110 +252,152 @@ class GachaManager:
         :param pool_id: 当前卡池的ID (e.g., "wanfa_baojian", "shenbing_baoku")
         :return: 抽到的物品信息字典，包含 "category", "id", "name", "data" (原始物品数据)
         """
-        category_rates = pool_config['item_categories_rate']
-        rand_category = random.random()
-        cumulative_rate = 0
-        chosen_category = None
-        for category, rate in category_rates.items():
-            cumulative_rate += rate
-            if rand_category <= cumulative_rate:
-                chosen_category = category
-                break
+        return self._draw_batch(pool_config, pool_id, 1)[0]
 
+    def _draw_batch(self, pool_config: dict, pool_id: str, n: int, rng: random.Random | None = None) -> list[dict]:
+        """
+        批量执行 n 次单抽（不含保底），每一层（大类、神通类型、物品、灵石档位）各用一次批量抽样完成。
+        返回的每个元素与 _draw_single_item 相同。
+        """
+        rng = rng or random
+        categories = self._rate_sampler(("category", pool_id), pool_config['item_categories_rate']).sample_many(n, rng)
         main_item_type_for_pool = pool_config['ten_pull_guarantee']['guaranteed_item_type']
-        item_to_return = None
-
-        if chosen_category == main_item_type_for_pool:
-            if pool_id == "wanfa_baojian" and main_item_type_for_pool == "shengtong":
-                shengtong_type_rates = pool_config['shengtong_type_rate']
-                rand_st_type = random.random()
-                cumulative_st_rate = 0
-                chosen_st_type_key = None
-                for st_type_key, rate in shengtong_type_rates.items():
-                    cumulative_st_rate += rate
-                    if rand_st_type <= cumulative_st_rate:
-                        chosen_st_type_key = st_type_key
-                        break
-                if chosen_st_type_key and self.items_manager.prepared_shengtongs_pool_by_type.get(chosen_st_type_key):
-                    shengtong_pool_for_type = self.items_manager.prepared_shengtongs_pool_by_type[chosen_st_type_key]
-                    if shengtong_pool_for_type:
-                        chosen_shengtong = self._weighted_random_choice(shengtong_pool_for_type)
-                        if chosen_shengtong:
-                            item_to_return = {
-                                "category": "shengtong",  # 确保 category 与 main_item_type_for_pool 一致
-                                "id": chosen_shengtong['id'],
-                                "name": chosen_shengtong['name'],
-                                "data": chosen_shengtong['data']
-                            }
-                if not item_to_return:  # 如果神通抽取失败
-                    logger.warning(f"无法从神通池 {chosen_st_type_key} 中抽取神通，降级为灵石。")
-                    chosen_category = "lingshi"  # 强制降级
-
-            elif pool_id == "shenbing_baoku" and main_item_type_for_pool == "faqi":  # 新增法器池逻辑
-                if self.items_manager.prepared_faqi_pool:
-                    chosen_faqi = self._weighted_random_choice(self.items_manager.prepared_faqi_pool)
-                    if chosen_faqi:
-                        item_to_return = {
-                            "category": "faqi",  # 确保 category 与 main_item_type_for_pool 一致
-                            "id": chosen_faqi['id'],
-                            "name": chosen_faqi['name'],
-                            "data": chosen_faqi['data']
-                        }
-                if not item_to_return:  # 如果法器抽取失败
-                    logger.warning(f"无法从法器池中抽取法器，降级为灵石。")
-                    chosen_category = "lingshi"  # 强制降级
-            elif pool_id == "wanggu_gongfa_ge" and main_item_type_for_pool == "gongfa": # 新增功法池逻辑
-                if self.items_manager.prepared_gongfa_pool:
-                    chosen_gongfa = self._weighted_random_choice(self.items_manager.prepared_gongfa_pool)
-                    if chosen_gongfa:
-                        item_to_return = {
-                            "category": "gongfa", # 确保 category 与 main_item_type_for_pool 一致
-                            "id": chosen_gongfa['id'],
-                            "name": chosen_gongfa['name'],
-                            "data": chosen_gongfa['data']
-                        }
-                if not item_to_return: # 如果功法抽取失败
-                    logger.warning(f"无法从功法池中抽取功法，降级为灵石。")
-                    chosen_category = "lingshi" # 强制降级
-            elif pool_id == "xuanjia_baodian" and main_item_type_for_pool == "fangju":  # 新增防具池逻辑
-                if self.items_manager.prepared_fangju_pool:
-                    chosen_fangju = self._weighted_random_choice(self.items_manager.prepared_fangju_pool)
-                    if chosen_fangju:
-                        item_to_return = {
-                            "category": "fangju",  # 确保 category 与 main_item_type_for_pool 一致
-                            "id": chosen_fangju['id'],
-                            "name": chosen_fangju['name'],
-                            "data": chosen_fangju['data']
-                        }
-                if not item_to_return:  # 如果防具抽取失败
-                    logger.warning(f"无法从防具池中抽取防具，降级为灵石。")
-                    chosen_category = "lingshi"  # 强制降级
-
-            # --- 在这里为后续的功法池、防具池添加 elif ---
-
-            if item_to_return:
-                return item_to_return
+        results: list[dict | None] = [None] * n
+
+        main_slots = [i for i, category in enumerate(categories) if category == main_item_type_for_pool]
+        if main_slots:
+            chosen_entries = self._draw_main_items(pool_config, pool_id, main_item_type_for_pool, len(main_slots), rng)
+            for i, entry in zip(main_slots, chosen_entries):
+                if entry:
+                    # 确保 category 与 main_item_type_for_pool 一致
+                    results[i] = self._main_reward(main_item_type_for_pool, entry)
+                else:
+                    categories[i] = "lingshi"  # 主要物品抽取失败，强制降级为灵石
 
         # 如果抽中的是灵石，或者主要物品抽取失败后降级为灵石
-        if chosen_category == "lingshi":
+        lingshi_slots = [i for i, category in enumerate(categories) if category == "lingshi" and results[i] is None]
+        if lingshi_slots:
             lingshi_reward_pool = pool_config['lingshi_rewards']
-            chosen_lingshi_tier = self._weighted_random_choice(lingshi_reward_pool)
-            if chosen_lingshi_tier:
-                amount = random.randint(chosen_lingshi_tier['amount_range'][0], chosen_lingshi_tier['amount_range'][1])
-                return {
-                    "category": "lingshi",
-                    "id": "lingshi_reward",
-                    "name": f"{amount}灵石",
-                    "data": {"amount": amount}
-                }
+            sampler = self._pool_sampler(("lingshi", pool_id), lingshi_reward_pool)
+            if sampler:
+                for i, tier in zip(lingshi_slots, sampler.sample_many(len(lingshi_slots), rng)):
+                    amount = rng.randint(tier['amount_range'][0], tier['amount_range'][1])
+                    results[i] = {
+                        "category": "lingshi",
+                        "id": "lingshi_reward",
+                        "name": f"{amount}灵石",
+                        "data": {"amount": amount}
+                    }
 
         # 最终的降级/默认情况
-        logger.error(f"卡池 {pool_id} 抽奖逻辑出现意外或多次降级，返回默认最低灵石奖励。")
-        min_lingshi_amount = pool_config['lingshi_rewards'][0]['amount_range'][0]  # 取配置中最低档灵石的最小值
-        return {
-            "category": "lingshi", "id": "lingshi_reward", "name": f"{min_lingshi_amount}灵石",
-            "data": {"amount": min_lingshi_amount}
-        }
+        if any(result is None for result in results):
+            logger.error(f"卡池 {pool_id} 抽奖逻辑出现意外或多次降级，返回默认最低灵石奖励。")
+            min_lingshi_amount = pool_config['lingshi_rewards'][0]['amount_range'][0]  # 取配置中最低档灵石的最小值
+            for i, result in enumerate(results):
+                if result is None:
+                    results[i] = {
+                        "category": "lingshi", "id": "lingshi_reward", "name": f"{min_lingshi_amount}灵石",
+                        "data": {"amount": min_lingshi_amount}
+                    }
+        return results
+
+    def _draw_main_items(self, pool_config: dict, pool_id: str, main_item_type: str, k: int, rng) -> list:
+        """为抽中卡池主要类型的 k 个位置批量抽取物品，无法抽取的位置为 None"""
+        if pool_id == "wanfa_baojian" and main_item_type == "shengtong":
+            st_types = self._rate_sampler(("shengtong_type", pool_id), pool_config['shengtong_type_rate']).sample_many(k, rng)
+            chosen = [None] * k
+            slots_by_type = {}
+            for slot, st_type_key in enumerate(st_types):
+                slots_by_type.setdefault(st_type_key, []).append(slot)
+            for st_type_key, slots in slots_by_type.items():
+                shengtong_pool_for_type = self.items_manager.prepared_shengtongs_pool_by_type.get(st_type_key) if st_type_key else None
+                sampler = self._pool_sampler(("shengtong", st_type_key), shengtong_pool_for_type) if shengtong_pool_for_type else None
+                if not sampler:  # 如果神通抽取失败
+                    logger.warning(f"无法从神通池 {st_type_key} 中抽取神通，降级为灵石。")
+                    continue
+                for slot, entry in zip(slots, sampler.sample_many(len(slots), rng)):
+                    chosen[slot] = entry
+            return chosen
+
+        pool_attr = MAIN_ITEM_POOLS.get((pool_id, main_item_type))
+        # --- 在 MAIN_ITEM_POOLS 中为后续的卡池添加对应关系 ---
+        prepared_pool = getattr(self.items_manager, pool_attr) if pool_attr else None
+        sampler = self._pool_sampler(main_item_type, prepared_pool) if prepared_pool else None
+        if not sampler:
+            logger.warning(f"无法从 {main_item_type} 池中抽取物品，降级为灵石。")
+            return [None] * k
+        return sampler.sample_many(k, rng)
+
+    def _apply_ten_pull_guarantee(self, rewards_list: list, pool_config: dict, pool_id: str, rng=None, user_id: str = "") -> bool:
+        """
+        对一组十连结果应用保底（原地替换），返回是否触发并完成了保底替换。
+        """
+        guarantee_config = pool_config['ten_pull_guarantee']
+        guaranteed_item_type_for_this_pool = guarantee_config['guaranteed_item_type']
+        if not guarantee_config['enabled'] or any(
+                item['category'] == guaranteed_item_type_for_this_pool for item in rewards_list):
+            return False
+
+        if user_id:
+            logger.info(
+                f"用户 {user_id} 在卡池 {pool_id} 十连抽未获得类型为 {guaranteed_item_type_for_this_pool} 的物品，触发保底。")
+
+        replacement_candidate_index = -1
+        min_value_for_replacement = float('inf')
+        for i, reward_item in enumerate(rewards_list):
+            if reward_item['category'] in guarantee_config['replacement_priority']:
+                current_value = reward_item['data'].get('amount', float('inf')) if reward_item[
+                                                                                       'category'] == 'lingshi' else float(
+                    'inf')
+                if current_value < min_value_for_replacement:
+                    min_value_for_replacement = current_value
+                    replacement_candidate_index = i
+
+        if replacement_candidate_index == -1:
+            logger.warning(f"十连保底触发，但找不到合适的非 {guaranteed_item_type_for_this_pool} 奖励进行替换。")
+            return False
+
+        guaranteed_item_to_add = self._draw_guaranteed_item(pool_config, pool_id, rng)
+        if not guaranteed_item_to_add:
+            logger.error(f"保底触发，但 {guaranteed_item_type_for_this_pool} 池为空或不满足保底稀有度！")
+            return False
+
+        if user_id:
+            logger.info(
+                f"保底替换：将第 {replacement_candidate_index + 1} 个奖励替换为 {guaranteed_item_type_for_this_pool}【{guaranteed_item_to_add['name']}】")
+        rewards_list[replacement_candidate_index] = guaranteed_item_to_add
+        return True
+
+    def draw_batch(self, pool_id: str, n: int, ten_pull: bool = False, rng: random.Random | None = None,
+                   user_id: str = "", pity_counter: int | None = None) -> GachaBatch:
+        """
+        批量抽取 n 次，不涉及灵石和背包。
+        pity_counter 为抽取前的保底计数，卡池启用了保底时按顺序应用软/硬保底；
+        ten_pull 为 True 时再按每 10 抽一组应用十连保底（n 须为 10 的倍数）。
+        """
+        pool_config = self.xiu_config.gacha_pools_config[pool_id]
+        rewards_list = self._draw_batch(pool_config, pool_id, n, rng)
+        pity_engine = self.pity_engines.get(pool_id)
+        soft_hits = hard_hits = 0
+        if pity_engine is not None:
+            pity_result = pity_engine.apply(rewards_list, pity_counter or 0, rng or random)
+            soft_hits, hard_hits = pity_result.soft_pity_hits, pity_result.hard_pity_hits
+
+        guarantees = 0
+        if ten_pull:
+            for start in range(0, n, 10):
+                group = rewards_list[start:start + 10]
+                if self._apply_ten_pull_guarantee(group, pool_config, pool_id, rng, user_id):
+                    rewards_list[start:start + 10] = group
+                    guarantees += 1
+
+        new_counter = None
+        if pity_engine is not None:
+            # 十连保底可能在后面补上主要物品，计数以最后一个主要物品的位置为准
+            main_category = pity_engine.main_category
+            last_main = next((i for i in range(n - 1, -1, -1) if rewards_list[i]['category'] == main_category), None)
+            new_counter = (pity_counter or 0) + n if last_main is None else n - 1 - last_main
+        return GachaBatch(rewards_list, guarantees, new_counter, soft_hits, hard_hits)
 
     def perform_gacha(self, user_id: str, pool_id: str, is_ten_pull: bool = False) -> dict:
         pool_config = self.xiu_config.gacha_pools_config.get(pool_id)
@@ -277,105 +409,100 @@ class GachaManager:
         if not user_info or user_info.stone < cost:
             return {"success": False, "message": f"灵石不足！本次抽取需要 {cost} 灵石。"}
 
-        self.service.update_ls(user_id, cost, 2)
-
         num_pulls = 10 if is_ten_pull else 1
-        rewards_list = []
-        # 修改：shengtong_obtained_in_ten_pull -> obtained_guaranteed_type_in_ten_pull
-        obtained_guaranteed_type_in_ten_pull = False
+        pity_counter = self.service.get_gacha_pity(user_id, pool_id).pity_counter
+        batch = self.draw_batch(pool_id, num_pulls, ten_pull=is_ten_pull, user_id=user_id, pity_counter=pity_counter)
+        rewards_list, guarantees = batch.rewards, batch.guarantees
         guaranteed_item_type_for_this_pool = pool_config['ten_pull_guarantee']['guaranteed_item_type']
 
-        for _ in range(num_pulls):
-            item = self._draw_single_item(pool_config, pool_id)  # 传递 pool_id
-            rewards_list.append(item)
-            if item['category'] == guaranteed_item_type_for_this_pool:  # 检查是否抽到了该池的保底类型
-                obtained_guaranteed_type_in_ten_pull = True
-
-        # 处理十连保底
-        if is_ten_pull and pool_config['ten_pull_guarantee']['enabled'] and not obtained_guaranteed_type_in_ten_pull:
-            logger.info(
-                f"用户 {user_id} 在卡池 {pool_id} 十连抽未获得类型为 {guaranteed_item_type_for_this_pool} 的物品，触发保底。")
-
-            replacement_candidate_index = -1
-            min_value_for_replacement = float('inf')
-            for i, reward_item in enumerate(rewards_list):
-                if reward_item['category'] in pool_config['ten_pull_guarantee']['replacement_priority']:
-                    current_value = reward_item['data'].get('amount', float('inf')) if reward_item[
-                                                                                           'category'] == 'lingshi' else float(
-                        'inf')
-                    if current_value < min_value_for_replacement:
-                        min_value_for_replacement = current_value
-                        replacement_candidate_index = i
-
-            if replacement_candidate_index != -1:
-                guaranteed_item_pool_for_selection = []
-                min_rank_or_level_for_guarantee = pool_config['ten_pull_guarantee'].get('guaranteed_min_rank_value',
-                                                                                        99)  # 默认一个很高的值
-
-                if pool_id == "wanfa_baojian" and guaranteed_item_type_for_this_pool == "shengtong":
-                    # 神通的保底是任意神通，不按稀有度筛选（或按需调整）
-                    for st_type_list in self.items_manager.prepared_shengtongs_pool_by_type.values():
-                        guaranteed_item_pool_for_selection.extend(st_type_list)
-                elif pool_id == "shenbing_baoku" and guaranteed_item_type_for_this_pool == "faqi":
-                    # 法器保底，筛选 rank <= guaranteed_min_rank_value
-                    guaranteed_item_pool_for_selection = [
-                        item for item in self.items_manager.prepared_faqi_pool if item['rank'] <= min_rank_or_level_for_guarantee
-                    ]
-                elif pool_id == "wanggu_gongfa_ge" and guaranteed_item_type_for_this_pool == "gongfa":  # 新增功法保底
-                    # 功法保底，筛选 origin_level <= guaranteed_min_rank_value
-                    guaranteed_item_pool_for_selection = [
-                        item for item in self.items_manager.prepared_gongfa_pool if
-                        item['origin_level'] <= min_rank_or_level_for_guarantee
-                    ]
-                elif pool_id == "xuanjia_baodian" and guaranteed_item_type_for_this_pool == "fangju": # 新增防具保底
-                    # 防具保底，筛选 rank <= guaranteed_min_rank_value
-                    guaranteed_item_pool_for_selection = [
-                        item for item in self.items_manager.prepared_fangju_pool if
-                        item['rank'] <= min_rank_or_level_for_guarantee
-                    ]
-                # --- 在这里为后续的功法池、防具池添加 elif ---
-
-                if guaranteed_item_pool_for_selection:
-                    chosen_guaranteed_item_info = self._weighted_random_choice(guaranteed_item_pool_for_selection)
-                    if chosen_guaranteed_item_info:
-                        guaranteed_item_to_add = {
-                            "category": guaranteed_item_type_for_this_pool,
-                            "id": chosen_guaranteed_item_info['id'],
-                            "name": chosen_guaranteed_item_info['name'],
-                            "data": chosen_guaranteed_item_info['data']
-                        }
-                        logger.info(
-                            f"保底替换：将第 {replacement_candidate_index + 1} 个奖励替换为 {guaranteed_item_type_for_this_pool}【{guaranteed_item_to_add['name']}】")
-                        rewards_list[replacement_candidate_index] = guaranteed_item_to_add
-                    else:
-                        logger.error(f"保底触发，但无法从 {guaranteed_item_type_for_this_pool} 池中抽取保底物品！")
-                else:
-                    logger.error(f"保底触发，但 {guaranteed_item_type_for_this_pool} 池为空或不满足保底稀有度！")
-            else:
-                logger.warning(f"十连保底触发，但找不到合适的非 {guaranteed_item_type_for_this_pool} 奖励进行替换。")
-
-        # 发放奖励
+        # 扣除灵石、发放灵石和物品作为一个整体提交（物品合并为一次批量写入）
         final_rewards_summary = []
+        reward_items = []
+        lingshi_total = 0
         for reward_item in rewards_list:
             final_rewards_summary.append(reward_item['name'])
             if reward_item['category'] in ["shengtong", "faqi", "gongfa", "fangju"]:  # 扩展到法器
                 item_data = reward_item['data']
                 actual_item_type = item_data.get('item_type', '未知')  # "神通" 或 "法器"
-                self.service.add_item(user_id, int(reward_item['id']), actual_item_type, 1)
+                reward_items.append((int(reward_item['id']), 1, actual_item_type))
             elif reward_item['category'] == "lingshi":
-                self.service.update_ls(user_id, reward_item['data']['amount'], 1)
+                lingshi_total += reward_item['data']['amount']
+        try:
+            with self.service.transaction():
+                self.service.update_ls(user_id, cost, 2)
+                if lingshi_total:
+                    self.service.update_ls(user_id, lingshi_total, 1)
+                if reward_items:
+                    self.service.add_items(user_id, reward_items)
+                if batch.pity_counter is not None:
+                    self.service.record_gacha_pity(user_id, pool_id, batch.pity_counter, num_pulls,
+                                                   batch.soft_pity_hits, batch.hard_pity_hits, guarantees)
+        except Exception as e:
+            logger.error(f"用户 {user_id} 在卡池 {pool_id} 抽取后发放奖励失败，已回滚: {e}")
+            return {"success": False, "message": "发放奖励时出错，本次抽取已取消，灵石未扣除。"}
 
         pull_type_msg = "十连铸造" if is_ten_pull and pool_id == "xuanjia_baodian" else "十连参悟" if is_ten_pull and pool_id == "wanggu_gongfa_ge" else "十连寻访" if is_ten_pull else "铸造" if pool_id == "xuanjia_baodian" else "参悟" if pool_id == "wanggu_gongfa_ge" else "寻访"
         message = f"恭喜道友进行{pull_type_msg}，从【{pool_config.get('name', '神秘宝库')}】中获得：\n" + "\n".join(
             [f"- {name}" for name in final_rewards_summary])
 
         # 调整保底提示的触发条件
-        if is_ten_pull and pool_config['ten_pull_guarantee'][
-            'enabled'] and not obtained_guaranteed_type_in_ten_pull and replacement_candidate_index != -1:
+        if guarantees:
             message += f"\n(十连保底已触发，获得{guaranteed_item_type_for_this_pool}!)"
+        if batch.hard_pity_hits:
+            message += f"\n(累计保底已触发，获得{guaranteed_item_type_for_this_pool}!)"
 
         return {"success": True, "message": message, "rewards": rewards_list}
 
+    def simulate(self, pool_id: str, n: int = 1_000_000, ten_pull: bool = False, seed: int | None = None,
+                 chunk_size: int = 100_000) -> dict:
+        """
+        离线模拟抽取 n 次（不扣灵石、不写数据库），统计经验分布，供策划核对概率。
+        卡池启用了累计保底时，保底计数在各批之间延续，与单个玩家连续抽取一致。
+        ten_pull 为 True 时按十连计算并应用保底，n 会向上取整为 10 的倍数。
+        """
+        pool_config = self.xiu_config.gacha_pools_config[pool_id]
+        rng = random.Random(seed)
+        if ten_pull:
+            n = -(-n // 10) * 10
+            chunk_size = max(chunk_size // 10, 1) * 10
+
+        category_counts = Counter()
+        item_counts = Counter()
+        lingshi_total = 0
+        guarantees = soft_pity_hits = hard_pity_hits = 0
+        pity_counter = 0
+        start = time.perf_counter()
+        drawn = 0
+        while drawn < n:
+            batch_size = min(chunk_size, n - drawn)
+            batch = self.draw_batch(pool_id, batch_size, ten_pull=ten_pull, rng=rng, pity_counter=pity_counter)
+            guarantees += batch.guarantees
+            soft_pity_hits += batch.soft_pity_hits
+            hard_pity_hits += batch.hard_pity_hits
+            pity_counter = batch.pity_counter or 0
+            for reward in batch.rewards:
+                category_counts[reward['category']] += 1
+                if reward['category'] == "lingshi":
+                    lingshi_total += reward['data']['amount']
+                else:
+                    item_counts[reward['name']] += 1
+            drawn += batch_size
+        elapsed = time.perf_counter() - start
+
+        return {
+            "pool_id": pool_id,
+            "draws": n,
+            "ten_pull": ten_pull,
+            "configured_category_rates": dict(pool_config['item_categories_rate']),
+            "category_rates": {category: count / n for category, count in category_counts.most_common()},
+            "item_rates": {name: count / n for name, count in item_counts.most_common()},
+            "guarantees": guarantees,
+            "soft_pity_hits": soft_pity_hits,
+            "hard_pity_hits": hard_pity_hits,
+            "avg_lingshi_per_draw": lingshi_total / n if n else 0.0,
+            "elapsed": elapsed,
+        }
+
     # def _prepare_gongfa_pool(self) -> list:
     #     """
     #     加载并预处理主修功法数据，为每个功法计算抽奖权重。
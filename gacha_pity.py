@@ -0,0 +1,77 @@
+from collections import namedtuple
+
+# 卡池保底规则：第 soft_pity_start 抽起主要物品概率每抽提高 soft_pity_step，第 hard_pity 抽必出
+PityRule = namedtuple("PityRule", ["soft_pity_start", "soft_pity_step", "hard_pity"])
+PityResult = namedtuple("PityResult", ["pity_counter", "soft_pity_hits", "hard_pity_hits"])
+
+
+def pity_rule_from_config(pool_config: dict) -> PityRule | None:
+    """从卡池配置读取保底规则，未配置或未启用返回 None"""
+    pity_config = pool_config.get('pity')
+    if not pity_config or not pity_config.get('enabled', True):
+        return None
+    hard_pity = int(pity_config['hard_pity'])
+    return PityRule(
+        soft_pity_start=int(pity_config.get('soft_pity_start', hard_pity)),
+        soft_pity_step=float(pity_config.get('soft_pity_step', 0.0)),
+        hard_pity=hard_pity,
+    )
+
+
+class PoolPity:
+    """
+    单个卡池的保底状态机
+
+    - 计数器为"距上次获得主要物品已经过的抽数"，抽中主要物品归零
+    - 软保底：第 n 抽的主要物品概率提高为 base + step * (n - soft_pity_start + 1)
+      实现方式是对未抽中主要物品的结果按预先算好的转化概率改判，使总概率恰好等于目标概率
+    - 硬保底：第 hard_pity 抽若仍未抽中，直接从保底物品池中抽取
+    - 各计数值对应的转化概率在建立时一次算好，每抽只需一次查表和至多一次抽样
+    """
+
+    def __init__(self, main_category: str, base_rate: float, rule: PityRule, draw_main, draw_guaranteed):
+        """
+        :param main_category: 卡池主要物品类型（与奖励中的 category 一致）
+        :param base_rate: 单抽获得主要物品的基础概率
+        :param draw_main: 函数 (rng) -> 奖励，按常规概率抽一个主要物品，失败返回 None
+        :param draw_guaranteed: 函数 (rng) -> 奖励，从保底物品池抽一个主要物品，失败返回 None
+        """
+        self.main_category = main_category
+        self.base_rate = base_rate
+        self.rule = rule
+        self.draw_main = draw_main
+        self.draw_guaranteed = draw_guaranteed
+        self.conversion = [self._conversion_rate(counter) for counter in range(rule.hard_pity)]
+
+    def _conversion_rate(self, counter: int) -> float:
+        """计数为 counter 时，本抽未抽中主要物品的结果被改判为主要物品的概率"""
+        pull_number = counter + 1
+        if pull_number >= self.rule.hard_pity:
+            return 1.0
+        if pull_number < self.rule.soft_pity_start or self.base_rate >= 1.0:
+            return 0.0
+        target = min(self.base_rate + self.rule.soft_pity_step * (pull_number - self.rule.soft_pity_start + 1), 1.0)
+        return (target - self.base_rate) / (1.0 - self.base_rate)
+
+    def apply(self, rewards_list: list, counter: int, rng) -> PityResult:
+        """按抽取顺序对奖励列表应用软/硬保底（原地替换），返回新的计数和命中次数"""
+        soft_hits = hard_hits = 0
+        last_index = len(self.conversion) - 1
+        for i, reward in enumerate(rewards_list):
+            if reward['category'] == self.main_category:
+                counter = 0
+                continue
+            conversion = self.conversion[min(counter, last_index)]
+            if conversion and rng.random() < conversion:
+                is_hard = counter + 1 >= self.rule.hard_pity
+                replacement = self.draw_guaranteed(rng) if is_hard else self.draw_main(rng)
+                if replacement:
+                    rewards_list[i] = replacement
+                    counter = 0
+                    if is_hard:
+                        hard_hits += 1
+                    else:
+                        soft_hits += 1
+                    continue
+            counter += 1
+        return PityResult(counter, soft_hits, hard_hits)
@@ -1,8 +1,13 @@
+import bisect
 import json
 import os
+import sys
+import tracemalloc
 from pathlib import Path
+from types import MappingProxyType
 from typing import List
 from astrbot.api import logger
+from .item_records import make_item_record
 
 # 定义数据文件所在的根目录
 DATABASE = Path() / "data" / "xiuxian"
@@ -11,6 +16,68 @@ WEAPON_PATH = DATABASE / "装备"
 ELIXIR_PATH = DATABASE / "丹药"
 XIULIAN_ITEM_PATH = DATABASE / "修炼物品"
 
+# 所有需要加载的数据源及其类型
+DATA_SOURCES = {
+    "防具": WEAPON_PATH / "防具.json",
+    "法器": WEAPON_PATH / "法器.json",
+    "功法": SKILL_PATH / "主功法.json",
+    "辅修功法": SKILL_PATH / "辅修功法.json",
+    "神通": SKILL_PATH / "神通.json",
+    "丹药": ELIXIR_PATH / "丹药.json",
+    "商店丹药": ELIXIR_PATH / "商店丹药.json",
+    "药材": ELIXIR_PATH / "药材.json",
+    "合成丹药": ELIXIR_PATH / "炼丹丹药.json",
+    "炼丹炉": ELIXIR_PATH / "炼丹炉.json",
+    "聚灵旗": XIULIAN_ITEM_PATH / "聚灵旗.json",
+}
+
+# 物品数据中可选的别名字段（字符串或字符串列表），别名与正式名称一样可用于按名查找
+ALIAS_FIELDS = ("alias", "别名")
+
+
+def _normalize_item_data(data: dict, item_type: str) -> dict:
+    """在原始JSON数据上补充加载时需要的字段（会修改传入的字典）"""
+    # 兼容原版功法/神通JSON中的 'level' 和 'rank' 字段混淆
+    if item_type in ['功法', '神通', '辅修功法']:
+        # 在这里交换 'rank' 和 'level' 的值
+        data['origin_level'] = data.get('level', 1)
+        data['rank'], data['level'] = data.get('level', "未知"), data.get('rank', "未知品阶")
+        data['type'] = '技能'
+    data['item_type'] = item_type
+    return data
+
+
+class NameTrie:
+    """
+    物品名称的后缀字典树，用于按名称片段查找物品
+
+    - 每个名称的所有后缀都插入树中，因此任意子串都能沿树走到对应节点
+    - 每个节点直接保存经过它的物品ID，查找耗时只与查询串长度和结果数量有关
+    """
+
+    def __init__(self):
+        self._root = {}
+        self._ids_key = None  # 节点中保存物品ID列表的键，不会与任何字符冲突
+
+    def insert(self, name: str, item_id: str):
+        for start in range(len(name)):
+            node = self._root
+            for ch in name[start:]:
+                node = node.setdefault(ch, {})
+                ids = node.setdefault(self._ids_key, [])
+                if not ids or ids[-1] != item_id:
+                    ids.append(item_id)
+
+    def search(self, fragment: str) -> list[str]:
+        """返回名称中包含 fragment 的物品ID（按插入顺序）"""
+        node = self._root
+        for ch in fragment:
+            node = node.get(ch)
+            if node is None:
+                return []
+        return node.get(self._ids_key, [])
+
+
 class Items:
     """
     一个用于加载和管理所有游戏物品、功法、装备等数据的单例类。
@@ -29,6 +96,7 @@ class Items:
             
         self.items = {}
         self._load_all_items()
+        self._build_indexes()  # 先建立二级索引，后续的抽奖池预处理会用到
         self.prepared_faqi_pool = []
         self.total_weight_faqi = 700
         self.prepared_gongfa_pool = []
@@ -181,22 +249,7 @@ class Items:
 
     def _load_all_items(self):
         """加载所有数据文件并整合"""
-        # 定义所有需要加载的数据源及其类型
-        data_sources = {
-            "防具": WEAPON_PATH / "防具.json",
-            "法器": WEAPON_PATH / "法器.json",
-            "功法": SKILL_PATH / "主功法.json",
-            "辅修功法": SKILL_PATH / "辅修功法.json",
-            "神通": SKILL_PATH / "神通.json",
-            "丹药": ELIXIR_PATH / "丹药.json",
-            "商店丹药": ELIXIR_PATH / "商店丹药.json",
-            "药材": ELIXIR_PATH / "药材.json",
-            "合成丹药": ELIXIR_PATH / "炼丹丹药.json",
-            "炼丹炉": ELIXIR_PATH / "炼丹炉.json",
-            "聚灵旗": XIULIAN_ITEM_PATH / "聚灵旗.json",
-        }
-
-        for item_type, path in data_sources.items():
+        for item_type, path in DATA_SOURCES.items():
             try:
                 data = self._read_json_file(path)
                 self._process_and_set_item_data(data, item_type)
@@ -213,17 +266,46 @@ class Items:
             return json.load(f)
 
     def _process_and_set_item_data(self, data_dict: dict, item_type: str):
-        """处理原始数据并存入 self.items"""
+        """处理原始数据，转换为只读的物品记录后存入 self.items"""
         for k, v in data_dict.items():
-            # 兼容原版功法/神通JSON中的 'level' 和 'rank' 字段混淆
-            if item_type in ['功法', '神通', '辅修功法']:
-                # 在这里交换 'rank' 和 'level' 的值
-                v['origin_level'] = v.get('level', 1)
-                v['rank'], v['level'] = v.get('level', "未知"), v.get('rank', "未知品阶")
-                v['type'] = '技能'
-            
-            self.items[k] = v
-            self.items[k]['item_type'] = item_type
+            self.items[sys.intern(k)] = make_item_record(_normalize_item_data(v, item_type), item_type)
+
+    def _build_indexes(self):
+        """
+        加载完成后一次性建立物品目录的二级索引（建立后只读）：
+        类型 -> ID、名称/别名 -> ID、各类型按 rank 排序的列表、按价格排好序的商店丹药列表，以及名称字典树
+        """
+        ids_by_type = {}
+        id_by_name = {}
+        rank_lists = {}
+        self.name_trie = NameTrie()
+
+        for item_id, data in self.items.items():
+            item_type = data.get('item_type')
+            ids_by_type.setdefault(item_type, []).append(item_id)
+
+            name = str(data.get('name', '')).strip()
+            names = [name] if name else []
+            for field in ALIAS_FIELDS:
+                aliases = data.get(field)
+                if isinstance(aliases, str):
+                    aliases = [aliases]
+                names.extend(str(alias).strip() for alias in aliases or [] if str(alias).strip())
+            for entry in names:
+                # 重名时保留先加载的物品，与原先线性查找的结果一致
+                id_by_name.setdefault(entry, item_id)
+                self.name_trie.insert(entry, item_id)
+
+            try:
+                rank_lists.setdefault(item_type, []).append((int(data.get('rank')), item_id))
+            except (ValueError, TypeError):
+                pass
+
+        self._ids_by_type = MappingProxyType({k: tuple(v) for k, v in ids_by_type.items()})
+        self._id_by_name = MappingProxyType(id_by_name)
+        self._ranks_by_type = MappingProxyType({k: tuple(sorted(v)) for k, v in rank_lists.items()})
+        self._shop_dan_yao_items = tuple(self._build_shop_dan_yao_items())
+        logger.info(f"物品目录索引建立完成：{len(self.items)} 个物品，{len(id_by_name)} 个名称/别名，{len(ids_by_type)} 种类型。")
 
     def get_data_by_item_id(self, item_id: int):
         """通过物品ID获取其详细信息"""
@@ -231,38 +313,117 @@ class Items:
 
     def get_data_by_item_type(self, item_types: List[str]) -> dict:
         """根据一个或多个物品类型获取所有匹配的物品"""
-        temp_dict = {}
-        for k, v in self.items.items():
-            if v.get('item_type') in item_types:
-                temp_dict[k] = v
-        return temp_dict
-    
+        return {k: self.items[k] for item_type in item_types for k in self._ids_by_type.get(item_type, ())}
+
+    def get_ids_by_item_type(self, item_type: str) -> tuple:
+        """获取某一类型的全部物品ID"""
+        return self._ids_by_type.get(item_type, ())
+
+    def get_item_id_by_name(self, name: str) -> str | None:
+        """通过物品全名或别名精确查找物品ID，找不到返回 None"""
+        return self._id_by_name.get(name.strip())
+
+    def get_data_by_item_name(self, name: str) -> tuple[str, dict] | tuple[None, None]:
+        """通过物品全名或别名精确查找，返回 (物品ID, 物品数据)"""
+        item_id = self.get_item_id_by_name(name)
+        if item_id is None:
+            return None, None
+        return item_id, self.items[item_id]
+
+    def search_items_by_name(self, fragment: str, limit: int | None = None) -> list[tuple[str, dict]]:
+        """
+        按名称片段模糊查找，返回 [(物品ID, 物品数据)]
+        完全匹配排在最前，其次是以片段开头的名称，再其次按名称长度排序
+        """
+        fragment = fragment.strip()
+        if not fragment:
+            return []
+        item_ids = self.name_trie.search(fragment)
+
+        def sort_key(item_id):
+            name = self.items[item_id].get('name', '')
+            return name != fragment, not name.startswith(fragment), len(name)
+
+        matched = sorted(dict.fromkeys(item_ids), key=sort_key)
+        if limit is not None:
+            matched = matched[:limit]
+        return [(item_id, self.items[item_id]) for item_id in matched]
+
+    def get_items_by_rank(self, item_type: str, min_rank: int | None = None, max_rank: int | None = None) -> list[tuple[int, str]]:
+        """获取某一类型中 rank 位于 [min_rank, max_rank] 的物品，返回按 rank 升序的 (rank, 物品ID) 列表"""
+        ranked = self._ranks_by_type.get(item_type, ())
+        lo = 0 if min_rank is None else bisect.bisect_left(ranked, (min_rank, ""))
+        hi = len(ranked) if max_rank is None else bisect.bisect_left(ranked, (max_rank + 1, ""))
+        return list(ranked[lo:hi])
+
     def get_all_items(self) -> dict:
         """获取所有物品的数据"""
         return self.items
 
-        # --- 新增一个专门获取商店丹药的方法 (可选，但更清晰) ---
-    def get_shop_dan_yao_items(self) -> list:
-        """获取所有标记为 '商店丹药' 类型的物品，并进行格式化和排序"""
-        shop_items_raw = self.get_data_by_item_type(["商店丹药"])
+    def _build_shop_dan_yao_items(self) -> list:
+        """整理所有标记为 '商店丹药' 类型且在售的物品，按价格排序"""
         shop_items_list = []
-        if shop_items_raw:
-            for item_id, item_info in shop_items_raw.items():
-                if item_info.get("status", 0) == 1: # 只处理 status 为 1 的
-                    shop_items_list.append({
-                        "id": item_id,
-                        "name": item_info.get("name", "未知丹药"),
-                        "price": item_info.get("price", 999999),
-                        "desc": item_info.get("desc", "效果未知"),
-                        "require_level": item_info.get("境界", "无要求"),
-                        "item_type_from_data": item_info.get("type", "丹药"), # 从JSON中读取的type
-                        "item_type_internal": item_info.get("item_type"), # Manager赋予的类型，应该是"商店丹药"
-                        "raw_info": item_info
-                    })
-            # 按照境界要求（品阶数字小的在前）和价格排序
-            # 需要 USERRANK 字典，这里暂时不导入，实际应从config获取或传入
-            # from .config import USERRANK # 假设可以这样导入
-            # shop_items_list.sort(key=lambda x: (USERRANK.get(x["require_level"], 99), x["price"]))
-            # 简化排序：
-            shop_items_list.sort(key=lambda x: x["price"])
+        for item_id in self._ids_by_type.get("商店丹药", ()):
+            item_info = self.items[item_id]
+            if item_info.get("status", 0) == 1: # 只处理 status 为 1 的
+                shop_items_list.append(MappingProxyType({
+                    "id": item_id,
+                    "name": item_info.get("name", "未知丹药"),
+                    "price": item_info.get("price", 999999),
+                    "desc": item_info.get("desc", "效果未知"),
+                    "require_level": item_info.get("境界", "无要求"),
+                    "item_type_from_data": item_info.get("type", "丹药"), # 从JSON中读取的type
+                    "item_type_internal": item_info.get("item_type"), # Manager赋予的类型，应该是"商店丹药"
+                    "raw_info": item_info
+                }))
+        # 简化排序：按价格（价格相同保持加载顺序）
+        shop_items_list.sort(key=lambda x: x["price"])
         return shop_items_list
+
+    def get_shop_dan_yao_items(self) -> list:
+        """获取所有在售的商店丹药（加载时已按价格排好序）"""
+        return list(self._shop_dan_yao_items)
+
+
+def benchmark_memory(sources: dict | None = None) -> dict:
+    """
+    对比物品目录以原始字典保存与以只读记录保存的内存占用（tracemalloc 统计，单位字节）。
+    sources 为 {物品类型: JSON文本}，默认读取 DATA_SOURCES 中的数据文件。
+    """
+    if sources is None:
+        sources = {}
+        for item_type, path in DATA_SOURCES.items():
+            if path.exists():
+                sources[item_type] = path.read_text(encoding="UTF-8")
+
+    def measure(build) -> tuple[int, int]:
+        tracemalloc.start()
+        try:
+            catalog = build()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        return size, len(catalog)
+
+    def build_dicts():
+        catalog = {}
+        for item_type, text in sources.items():
+            for k, v in json.loads(text).items():
+                catalog[k] = _normalize_item_data(v, item_type)
+        return catalog
+
+    def build_records():
+        catalog = {}
+        for item_type, text in sources.items():
+            for k, v in json.loads(text).items():
+                catalog[sys.intern(k)] = make_item_record(_normalize_item_data(v, item_type), item_type)
+        return catalog
+
+    dict_bytes, item_count = measure(build_dicts)
+    record_bytes, _ = measure(build_records)
+    return {
+        "items": item_count,
+        "dict_bytes": dict_bytes,
+        "record_bytes": record_bytes,
+        "saved_ratio": 1 - record_bytes / dict_bytes if dict_bytes else 0.0,
+    }
@@ -0,0 +1,154 @@
+import sys
+from collections.abc import Mapping
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class ItemRecord(Mapping):
+    """
+    物品目录中的只读物品记录
+
+    - 常用字段存放在 __slots__ 中，不再为每个物品保存一份带重复键名的字典
+    - 字符串字段全部驻留（sys.intern），同名的类型、品阶等只保留一份
+    - 未声明的字段放入 _extra，保证任何 JSON 字段都不会丢失
+    - 实现 Mapping 接口（get / [] / in / keys / items），原先按字典使用物品数据的代码无需修改
+    - 记录创建后不可修改；需要附加字段时请先 to_dict() 复制一份
+    """
+
+    __slots__ = ("_extra", "name", "type", "item_type", "desc", "rank", "level")
+
+    _fields: tuple[str, ...] = ()
+    _field_set: frozenset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = []
+        for klass in reversed(cls.__mro__):
+            for name in klass.__dict__.get("__slots__", ()):
+                if name != "_extra" and name not in fields:
+                    fields.append(name)
+        cls._fields = tuple(fields)
+        cls._field_set = frozenset(fields)
+
+    def __init__(self, data: dict):
+        extra = None
+        for key, value in data.items():
+            if key in self._field_set:
+                object.__setattr__(self, key, _intern(value))
+            else:
+                if extra is None:
+                    extra = {}
+                extra[_intern(key)] = _intern(value)
+        object.__setattr__(self, "_extra", extra)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"物品记录为只读，无法修改字段 {key}")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"物品记录为只读，无法删除字段 {key}")
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self._field_set:
+            return getattr(self, key, default)
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __contains__(self, key):
+        if key in self._field_set:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key in self._fields:
+            if hasattr(self, key):
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self) -> dict:
+        """复制为普通字典（嵌套的字典值仍与记录共享）"""
+        return dict(self.items())
+
+    copy = to_dict
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+ItemRecord._fields = tuple(name for name in ItemRecord.__slots__ if name != "_extra")
+ItemRecord._field_set = frozenset(ItemRecord._fields)
+
+
+class EquipmentRecord(ItemRecord):
+    """法器、防具"""
+    __slots__ = ("atk_buff", "def_buff", "crit_buff", "critatk", "hp_buff", "mp_buff", "zw")
+
+
+class GongfaRecord(ItemRecord):
+    """主修功法、辅修功法"""
+    __slots__ = ("origin_level", "hpbuff", "mpbuff", "atkbuff", "ratebuff", "crit_buff", "def_buff",
+                 "critatk", "dan_buff", "dan_exp", "reap_buff", "exp_buff", "two_buff", "number",
+                 "clo_exp", "clo_rs", "random_buff", "ew", "buff_type", "buff")
+
+
+class ShengtongRecord(ItemRecord):
+    """神通"""
+    __slots__ = ("origin_level", "skill_type", "hpcost", "mpcost", "turncost", "atkvalue", "atkvalue2",
+                 "rate", "buffvalue", "bufftype", "buff_type", "success")
+
+
+class ElixirRecord(ItemRecord):
+    """丹药、商店丹药、合成丹药"""
+    __slots__ = ("buff_type", "buff", "price", "selling", "realm", "status", "all_num", "day_num",
+                 "mix_exp", "mix_all", "elixir_config", "境界")
+
+
+class HerbRecord(ItemRecord):
+    """药材"""
+    __slots__ = ("主药", "药引", "辅药")
+
+
+class FurnaceRecord(ItemRecord):
+    """炼丹炉"""
+    __slots__ = ("buff",)
+
+
+class CultivationItemRecord(ItemRecord):
+    """聚灵旗等修炼物品"""
+    __slots__ = ("修炼速度", "药材速度")
+
+
+# 物品类型 -> 记录类，未列出的类型使用 ItemRecord
+RECORD_CLASSES = {
+    "法器": EquipmentRecord,
+    "防具": EquipmentRecord,
+    "功法": GongfaRecord,
+    "辅修功法": GongfaRecord,
+    "神通": ShengtongRecord,
+    "丹药": ElixirRecord,
+    "商店丹药": ElixirRecord,
+    "合成丹药": ElixirRecord,
+    "药材": HerbRecord,
+    "炼丹炉": FurnaceRecord,
+    "聚灵旗": CultivationItemRecord,
+}
+
+
+def make_item_record(data: dict, item_type: str) -> ItemRecord:
+    return RECORD_CLASSES.get(item_type, ItemRecord)(data)
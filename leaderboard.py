@@ -0,0 +1,347 @@
+import random
+import sqlite3
+import threading
+import time
+from astrbot.api import logger
+
+# 支持排行的字段
+RANKING_COLUMNS = ("exp", "stone", "power")
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels: int):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels  # 到同层下一个节点之间跨过的位置数
+
+
+class IndexableSkiplist:
+    """
+    可索引跳表（顺序统计结构）
+
+    按 key 升序保存，插入、删除、按 key 求位置、按位置取 key 的期望复杂度均为 O(log n)。
+    """
+    MAX_LEVELS = 24  # 约可容纳 1600 万个元素
+
+    def __init__(self):
+        self.size = 0
+        self._nil = _Node(None, 0)
+        self.head = _Node(None, self.MAX_LEVELS)
+        self.head.next = [self._nil] * self.MAX_LEVELS
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVELS and random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key):
+        nil = self._nil
+        chain = [None] * self.MAX_LEVELS
+        steps_at_level = [0] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not nil and node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._random_level()
+        new_node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        nil = self._nil
+        chain = [None] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not nil and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is nil or target.key != key:
+            raise KeyError(key)
+
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, key) -> int:
+        """返回 key 的位置（从 0 开始），不存在时抛出 KeyError"""
+        nil = self._nil
+        node, position = self.head, 0
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not nil and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is nil or target.key != key:
+            raise KeyError(key)
+        return position
+
+    def _node_at(self, index: int) -> _Node:
+        node, remaining = self.head, index + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._nil and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index: int):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return self._node_at(index).key
+
+    def slice(self, start: int, stop: int) -> list:
+        """取位置 [start, stop) 之间的 key"""
+        start, stop = max(start, 0), min(stop, self.size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        keys = []
+        for _ in range(stop - start):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+    @classmethod
+    def from_sorted(cls, keys: list) -> "IndexableSkiplist":
+        """由已排序的 key 列表 O(n) 批量构建"""
+        skiplist = cls()
+        last_node = [skiplist.head] * cls.MAX_LEVELS
+        last_position = [-1] * cls.MAX_LEVELS
+        for position, key in enumerate(keys):
+            node = _Node(key, skiplist._random_level())
+            for level in range(len(node.next)):
+                prev = last_node[level]
+                prev.next[level] = node
+                prev.width[level] = position - last_position[level]
+                last_node[level], last_position[level] = node, position
+        size = len(keys)
+        for level in range(cls.MAX_LEVELS):
+            last_node[level].next[level] = skiplist._nil
+            last_node[level].width[level] = size - last_position[level]
+        skiplist.size = size
+        return skiplist
+
+
+class Leaderboard:
+    """单个排行榜：记录每个用户的数值，并按 (数值降序, user_id) 维护顺序"""
+
+    def __init__(self, column: str):
+        self.column = column
+        self.values: dict[str, int] = {}
+        self._order = IndexableSkiplist()
+
+    @staticmethod
+    def _key(user_id: str, value) -> tuple:
+        return (-(value or 0), user_id)
+
+    def load(self, pairs):
+        """以 (user_id, 数值) 全量重建"""
+        self.values = {user_id: value or 0 for user_id, value in pairs}
+        self._order = IndexableSkiplist.from_sorted(
+            sorted(self._key(user_id, value) for user_id, value in self.values.items())
+        )
+
+    def set(self, user_id: str, value):
+        value = value or 0
+        old = self.values.get(user_id)
+        if old == value:
+            return
+        if old is not None:
+            self._order.remove(self._key(user_id, old))
+        self.values[user_id] = value
+        self._order.insert(self._key(user_id, value))
+
+    def add(self, user_id: str, delta) -> bool:
+        """在已知数值上累加，用户不在榜上时返回 False"""
+        old = self.values.get(user_id)
+        if old is None:
+            return False
+        self.set(user_id, old + delta)
+        return True
+
+    def remove(self, user_id: str):
+        old = self.values.pop(user_id, None)
+        if old is not None:
+            self._order.remove(self._key(user_id, old))
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def rank(self, user_id: str) -> int | None:
+        """用户名次（从 1 开始），不在榜上返回 None"""
+        value = self.values.get(user_id)
+        if value is None:
+            return None
+        return self._order.index(self._key(user_id, value)) + 1
+
+    def range(self, start_rank: int, stop_rank: int) -> list[tuple[int, str, int]]:
+        """取名次 [start_rank, stop_rank] 之间的 (名次, user_id, 数值)"""
+        start_rank = max(start_rank, 1)
+        keys = self._order.slice(start_rank - 1, stop_rank)
+        return [(start_rank + i, user_id, -neg_value) for i, (neg_value, user_id) in enumerate(keys)]
+
+
+class LeaderboardManager:
+    """
+    修为/灵石/战力排行榜管理器
+
+    - 首次查询时从数据库全量加载，之后由服务层在写入时增量更新
+    - 无法得知新值的写入（直接 SQL 修改）通过 touch 标记，查询前批量重读这些玩家
+    - 事务回滚、批量任务等场景调用 invalidate，下次查询时全量重建
+    - 每隔 resync_interval 秒全量重建一次，兜底修正未经服务层的写入
+    """
+
+    def __init__(self, db, resync_interval: float = 600.0):
+        self.db = db
+        self.resync_interval = resync_interval
+        self.lock = threading.RLock()
+        self.boards = {column: Leaderboard(column) for column in RANKING_COLUMNS}
+        self._loaded_at: float | None = None
+        self._touched: set[str] = set()
+
+    def invalidate(self):
+        with self.lock:
+            self._loaded_at = None
+            self._touched.clear()
+
+    def touch(self, user_id: str):
+        with self.lock:
+            if self._loaded_at is not None:
+                self._touched.add(user_id)
+
+    def add(self, user_id: str, column: str, delta):
+        with self.lock:
+            if self._loaded_at is not None and not self.boards[column].add(user_id, delta):
+                self._touched.add(user_id)
+
+    def set(self, user_id: str, column: str, value):
+        with self.lock:
+            if self._loaded_at is not None:
+                self.boards[column].set(user_id, value)
+
+    def rebuild(self):
+        """从数据库全量重建所有排行榜"""
+        start = time.perf_counter()
+        with self.db.read() as conn:
+            rows = conn.execute(f"SELECT user_id, {', '.join(RANKING_COLUMNS)} FROM user_xiuxian").fetchall()
+        with self.lock:
+            for i, column in enumerate(RANKING_COLUMNS, start=1):
+                self.boards[column].load((row[0], row[i]) for row in rows)
+            self._loaded_at = time.monotonic()
+            self._touched.clear()
+        logger.debug(f"排行榜已重建，共 {len(rows)} 名用户，耗时 {time.perf_counter() - start:.3f}s")
+
+    def _refresh_touched(self):
+        touched = list(self._touched)
+        self._touched.clear()
+        rows = {}
+        with self.db.read() as conn:
+            for start in range(0, len(touched), 500):
+                chunk = touched[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for row in conn.execute(
+                    f"SELECT user_id, {', '.join(RANKING_COLUMNS)} FROM user_xiuxian WHERE user_id IN ({placeholders})",
+                    chunk
+                ):
+                    rows[row[0]] = row
+        for user_id in touched:
+            row = rows.get(user_id)
+            for i, column in enumerate(RANKING_COLUMNS, start=1):
+                if row is None:
+                    self.boards[column].remove(user_id)
+                else:
+                    self.boards[column].set(user_id, row[i])
+
+    def ensure_fresh(self):
+        """查询前调用：按需全量重建或重读被标记的玩家"""
+        with self.lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.resync_interval:
+                self.rebuild()
+            elif self._touched:
+                self._refresh_touched()
+
+    def top(self, column: str, limit: int = 10) -> list[tuple[int, str, int]]:
+        with self.lock:
+            self.ensure_fresh()
+            return self.boards[column].range(1, limit)
+
+    def rank(self, column: str, user_id: str) -> tuple[int, int, int] | None:
+        """返回 (名次, 数值, 上榜总人数)，用户不存在时返回 None"""
+        with self.lock:
+            self.ensure_fresh()
+            board = self.boards[column]
+            rank = board.rank(user_id)
+            if rank is None:
+                return None
+            return rank, board.values[user_id], len(board)
+
+    def around(self, column: str, user_id: str, radius: int = 2) -> list[tuple[int, str, int]]:
+        """返回用户前后各 radius 名的 (名次, user_id, 数值)"""
+        with self.lock:
+            self.ensure_fresh()
+            board = self.boards[column]
+            rank = board.rank(user_id)
+            if rank is None:
+                return []
+            return board.range(rank - radius, rank + radius)
+
+
+def benchmark(user_count: int = 100000, queries: int = 1000, seed: int = 0) -> dict:
+    """
+    对比排行榜结构与原 SQL 查询的耗时（内存数据库，不触碰线上数据）。
+    返回各项操作的平均耗时（毫秒）。
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE user_xiuxian (user_id TEXT, exp INTEGER, stone INTEGER, power INTEGER)")
+    conn.executemany(
+        "INSERT INTO user_xiuxian VALUES (?, ?, ?, ?)",
+        ((f"u{i}", rng.randint(0, 10 ** 8), rng.randint(0, 10 ** 7), rng.randint(0, 10 ** 6)) for i in range(user_count))
+    )
+    sample = [f"u{rng.randrange(user_count)}" for _ in range(queries)]
+
+    def timed(func, repeat=queries) -> float:
+        start = time.perf_counter()
+        for i in range(repeat):
+            func(i)
+        return (time.perf_counter() - start) / repeat * 1000
+
+    result = {"users": user_count}
+    result["sql_top10_ms"] = timed(
+        lambda i: conn.execute("SELECT user_id, exp FROM user_xiuxian ORDER BY exp DESC LIMIT 10").fetchall(), 20)
+    result["sql_rank_ms"] = timed(lambda i: conn.execute(
+        "SELECT count(*) FROM user_xiuxian WHERE exp > (SELECT exp FROM user_xiuxian WHERE user_id = ?)",
+        (sample[i],)).fetchone(), 20)
+
+    board = Leaderboard("exp")
+    start = time.perf_counter()
+    board.load(conn.execute("SELECT user_id, exp FROM user_xiuxian"))
+    result["board_build_ms"] = (time.perf_counter() - start) * 1000
+    result["board_top10_ms"] = timed(lambda i: board.range(1, 10))
+    result["board_rank_ms"] = timed(lambda i: board.rank(sample[i]))
+    result["board_around_ms"] = timed(lambda i: board.range(board.rank(sample[i]) - 2, board.rank(sample[i]) + 2))
+    result["board_update_ms"] = timed(lambda i: board.add(sample[i], rng.randint(-1000, 1000)))
+    conn.close()
+    return result
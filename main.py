@@ -1,3 +1,4 @@
+import asyncio
 import os
 from datetime import datetime, timedelta
 import re
@@ -22,8 +23,10 @@ from .rift_manager import RiftManager
 from .fishing.service import FishingService
 from .fishing import enhancement_config
 from .fishing.draw import draw_fishing_ranking
-from .pvp_manager import PvPManager
+from .pvp_manager import PvPManager, BattleReplay
+from .boss_state import WorldBossState, BossSettlement, format_settlement_broadcast
 from .gacha_manager import GachaManager
+from .admin_jobs import AdminJobRunner
 
 def get_coins_name():
     """获取金币名称"""
@@ -60,11 +63,12 @@ class XiuxianPlugin(Star):
         self.user_bounties = {}
         self.group_boss = {}
         self.world_boss = None
+        self.boss_state = WorldBossState(self.XiuXianService)
+        self._background_tasks: set[asyncio.Task] = set() # 持有后台任务的引用，防止任务未完成就被回收
         self.refreshnum = {}
         self.market_goods = {}
         self.auction_data = None
         self.MANUAL_ADMIN_WXIDS = ["qq--666666", "another_admin_wxid"]
-        self.last_battle_details_log = {}
 
         fishing_db_path = os.path.join(self.data_dir, "fish.db")
         self.FishingService = FishingService(fishing_db_path, self.XiuXianService)
@@ -76,15 +80,22 @@ class XiuxianPlugin(Star):
         self.scheduler = XianScheduler(self.context, self.XiuXianService, self)
         # GachaManager 需要 XiuXianService, Items (通过 XiuXianService.items 获取), 和 XiuConfig 实例
         self.gacha_manager = GachaManager(self.XiuXianService, self.XiuXianService.items, self.xiu_config)
+        # 批量修复等管理任务在工作线程中执行
+        self.admin_jobs = AdminJobRunner(self.XiuXianService)
 
     async def initialize(self):
         logger.info("修仙插件加载成功！")
         # v-- 加载全局BOSS，而非分群BOSS --v
-        self.world_boss = self.XiuXianService.get_active_boss()
+        self.world_boss = self.boss_state.load()
         if self.world_boss:
-            logger.info(f"成功从数据库加载世界BOSS【{self.world_boss['name']}】。")
+            logger.info(f"成功从数据库加载世界BOSS【{self.world_boss['name']}】，已有 {len(self.world_boss['attackers'])} 位道友参与讨伐。")
         else:
             logger.info("数据库中无活跃的世界BOSS。")
+        # 上次运行时已被击杀、但奖励尚未写入的BOSS，补做结算
+        for killed_boss in self.boss_state.load_unsettled():
+            logger.info(f"世界BOSS【{killed_boss['name']}】的击杀结算未完成，正在补做。")
+            settlement = self.boss_state.plan_kill(killed_boss, killed_boss['killed_by'])
+            self._spawn_background(self._settle_world_boss(settlement))
         # v-- 从数据库加载活跃的群组到内存 --v
         self.groups = self.XiuXianService.get_all_active_groups()
         logger.info(f"成功从数据库加载 {len(self.groups)} 个活跃群组。")
@@ -92,6 +103,21 @@ class XiuxianPlugin(Star):
 
         self.scheduler.start()
 
+    def _spawn_background(self, coro) -> asyncio.Task:
+        """在后台运行协程，任务结束前一直持有其引用"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def terminate(self):
+        """插件停用时等待后台结算完成，再写回玩家缓存和冷却中尚未落库的修改"""
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        flushed = self.XiuXianService.flush_player_cache()
+        flushed_cooldowns = self.XiuXianService.flush_cooldowns()
+        logger.info(f"修仙插件已停用，写回 {flushed} 条玩家缓存记录、{flushed_cooldowns} 条冷却记录。")
+
     async def _update_active_groups(self, event: AstrMessageEvent):
         """动态更新互动过的群聊列表，并存入数据库"""
         session_id = event.unified_msg_origin
@@ -101,13 +127,13 @@ class XiuxianPlugin(Star):
                 self.XiuXianService.add_active_group(session_id) # 添加到数据库
                 logger.info(f"已将新群聊 {session_id} 添加到推送列表并持久化。")
 
-    async def _store_last_battle_details(self, user_id: str, detailed_log: list):
-        """存储指定用户的最近一次战斗详细日志"""
-        if not detailed_log: # 如果没有详细日志，就不存储
-            if user_id in self.last_battle_details_log:
-                del self.last_battle_details_log[user_id] # 清除旧的，如果有的话
-            return
-        self.last_battle_details_log[user_id] = detailed_log
+    async def _store_last_battle_details(self, user_ids, battle_replay: BattleReplay | None):
+        """
+        存储参战玩家最近一次战斗的回放信息（种子与双方属性快照），
+        查看战斗详情时重新模拟生成详细日志，不在内存中保留日志文本。
+        """
+        if battle_replay:
+            self.XiuXianService.save_battle_replay(user_ids, battle_replay)
 
     @filter.command("我要修仙")
     @command_lock
@@ -395,16 +421,13 @@ class XiuxianPlugin(Star):
         #        return
         
         # ... (获取下一境界和所需修为的逻辑保持不变)
-        all_levels = self.xiu_config.level
-        if user_info.level == all_levels[-1]:
+        next_level = self.xiu_config.get_next_level(user_info.level)
+        if next_level is None:
              msg = f"道友已是当前世界的巅峰，无法再突破！"
              async for r in self._send_response(event, msg): yield r
              return
 
-        current_level_index = all_levels.index(user_info.level)
-        next_level = all_levels[current_level_index + 1]
-        level_data = jsondata.level_data()
-        required_exp = level_data.get(next_level, {}).get("power")
+        required_exp = (self.xiu_config.get_level_row(next_level) or {}).get("power")
         if not required_exp or user_info.exp < required_exp:
             msg = f"道友的修为不足以冲击【{next_level}】！\n所需修为: {required_exp} (还需 {required_exp - user_info.exp})"
             async for r in self._send_response(event, msg): yield r
@@ -1032,8 +1055,6 @@ class XiuxianPlugin(Star):
 
         current_world_boss_data = self.world_boss
         boss_hp_before = current_world_boss_data['hp']
-        # 记录攻击者
-        current_world_boss_data.setdefault('attackers', set()).add(user_id)
 
        # 获取玩家和BOSS的完整战斗属性
         player_real_info = self.XiuXianService.get_user_real_info(user_id)
@@ -1048,136 +1069,80 @@ class XiuxianPlugin(Star):
 
         # 执行战斗模拟 (玩家 vs BOSS)
         # 注意：simulate_player_vs_player_fight 的参数顺序是 p1_info, p2_info
-        battle_result = PvPManager.simulate_player_vs_player_fight(player_real_info, boss_combat_info)
-        # --- 存储详细战斗日志 ---
-        if battle_result.get("battle_round_details_log"):
-            # 为双方都存储同一份详细日志
-            await self._store_last_battle_details(user_id, battle_result["battle_round_details_log"])
+        battle_result = PvPManager.recorded_fight(player_real_info, boss_combat_info)
+        # --- 存储战斗回放 ---
+        await self._store_last_battle_details(user_id, battle_result.get("battle_replay"))
         # --- 结束存储 ---
         
         msg_lines = battle_result['log'] # 获取战斗日志
         boss_hp_after = battle_result['p2_hp_final']
         damage_this_round = boss_hp_before - boss_hp_after
 
-        # 更新玩家实际HP (BOSS战是真实伤害)
-        # battle_result['p1_hp_final'] 是玩家战斗后的模拟HP
-        self.XiuXianService.update_hp_to_value(user_id, battle_result['p1_hp_final'])
-        self.XiuXianService.update_mp_to_value(user_id, battle_result['p1_mp_final'])
-
-        # 更新BOSS实际HP (数据库和内存)
-        boss_new_hp = battle_result['p2_hp_final'] # p2 是BOSS
-        self.XiuXianService.update_boss_hp(current_world_boss_data['id'], boss_new_hp)
-        current_world_boss_data['hp'] = boss_new_hp # 更新内存中的BOSS血量
-
-        # 记录伤害日志 (确保'damage_log'字典存在)
-        current_world_boss_data.setdefault('damage_log', {})
-        current_world_boss_data['damage_log'][user_id] = current_world_boss_data['damage_log'].get(user_id, 0) + damage_this_round
-        msg_lines.append(f"道友对世界BOSS造成伤害：{damage_this_round}点")
+        settlement = None
+        # 本次攻击的所有写入（HP、BOSS血量、伤害账本、CD）合并为一次提交
+        with self.XiuXianService.transaction():
+            # 更新玩家实际HP (BOSS战是真实伤害)
+            # battle_result['p1_hp_final'] 是玩家战斗后的模拟HP
+            self.XiuXianService.update_hp_to_value(user_id, battle_result['p1_hp_final'])
+            self.XiuXianService.update_mp_to_value(user_id, battle_result['p1_mp_final'])
 
-        # 设置玩家CD
-        self.XiuXianService.set_user_cd(user_id, boss_cd_duration, boss_cd_type)
+            # 原子扣减BOSS血量并记入伤害账本（数据库和内存）
+            boss_hit = self.boss_state.record_hit(current_world_boss_data, user_id, damage_this_round)
 
-        # 检查战斗结果
-        if battle_result['winner'] == player_real_info['user_id']: # 玩家击败了BOSS
-            msg_lines.append(f"\n🎉🎉🎉 恭喜道友【{player_real_info['user_name']}】神威盖世，成功击败了世界BOSS【{boss_combat_info['name']}】！ 🎉🎉🎉")
+            # 设置玩家CD
+            self.XiuXianService.set_user_cd(user_id, boss_cd_duration, boss_cd_type)
 
+            # 检查战斗结果：是否击杀以数据库中的血量为准，只有扣到 0 的那次攻击进行结算
+            if boss_hit is None: # 战斗期间BOSS已被其他道友击杀
+                msg_lines.append(f"\n⌛ 道友出手之时，【{boss_combat_info['name']}】已被其他道友讨伐，此战未能计入伤害。")
+                self.world_boss = None
 
-            total_exp_reward_pool = boss_combat_info.get('exp', 1000)
-            total_stone_reward_pool = boss_combat_info.get('stone', 1000)
-            final_hit_rewards, participant_drops = self.XiuXianService.get_boss_drop(
-                {"jj": boss_combat_info['jj'], "exp": total_exp_reward_pool, "stone": total_stone_reward_pool}
-            )
+            elif boss_hit.killed: # 玩家击败了BOSS
+                msg_lines.append(f"道友对世界BOSS造成伤害：{boss_hit.damage}点")
+                msg_lines.append(f"\n🎉🎉🎉 恭喜道友【{player_real_info['user_name']}】神威盖世，成功击败了世界BOSS【{boss_combat_info['name']}】！ 🎉🎉🎉")
 
-            damage_log = current_world_boss_data.get('damage_log', {})
-            # 1. 计算总伤害
-            total_damage_dealt = sum(damage_log.values())
-            if total_damage_dealt <= 0:  # 防止除以零错误
-                total_damage_dealt = 1
-
-            # 2. 构建伤害贡献榜和分发奖励
-            reward_details_lines = ["\n--- 伤害贡献榜 ---"]
-            sorted_damagers = sorted(damage_log.items(), key=lambda item: item[1], reverse=True)
-
-            for rank, (damager_id, damage_dealt) in enumerate(sorted_damagers, 1):
-                damager_info = self.XiuXianService.get_user_message(damager_id)
-                if not damager_info: continue
-
-                damage_percentage = damage_dealt / total_damage_dealt
-
-                # 计算并分发奖励
-                exp_reward = int(final_hit_rewards["exp"] * damage_percentage)
-                stone_reward = int(final_hit_rewards["stone"] * damage_percentage)
-
-                reward_str_parts = []
-                if exp_reward > 0:
-                    self.XiuXianService.update_exp(damager_id, exp_reward)
-                    reward_str_parts.append(f"修为+{exp_reward}")
-                if stone_reward > 0:
-                    self.XiuXianService.update_ls(damager_id, stone_reward, 1)
-                    reward_str_parts.append(f"灵石+{stone_reward}")
-
-                # 格式化榜单消息
-                reward_details_lines.append(
-                    f"第{rank}名:【{damager_info.user_name}】造成 {damage_dealt} 伤害 (占比: {damage_percentage:.2%})\n"
-                    f"  奖励: {', '.join(reward_str_parts) if reward_str_parts else '无'}"
-                )
+                # 奖励先在内存中全部算好，击杀者立即收到自己的结算；写入在本次提交后交给工作线程
+                settlement = self.boss_state.plan_kill(current_world_boss_data, user_id)
+                msg_lines.extend(settlement.killer_summary)
+                msg_lines.append("\n伤害贡献榜及全体道友的奖励正在发放，完成后将广播通知。")
+                self.world_boss = None # 清理插件实例中的BOSS缓存
 
-            msg_lines.extend(reward_details_lines)
-
-            #
-            # # a. 处理最后一击奖励 (当前攻击者即为最后一击者)
-            # if final_hit_rewards["exp"] > 0:
-            #     self.XiuXianService.update_exp(user_id, final_hit_rewards["exp"])
-            #     msg_lines.append(f"最后一击额外奖励：修为+{final_hit_rewards['exp']}")
-            # if final_hit_rewards["stone"] > 0:
-            #     self.XiuXianService.update_ls(user_id, final_hit_rewards["stone"], 1)
-            #     msg_lines.append(f"最后一击额外奖励：灵石+{final_hit_rewards['stone']}")
-            for item_reward in final_hit_rewards["items"]:
-                self.XiuXianService.add_item(user_id, item_reward['id'], item_reward['type'], item_reward['quantity'])
-                msg_lines.append(f"最后一击奇遇：获得【{item_reward['name']}】x{item_reward['quantity']}")
-
-            # b. 处理所有参与者的奖励
-            attackers = current_world_boss_data.get('attackers', {user_id})
-            if participant_drops and attackers:
-                msg_lines.append("\n--- 所有参与战斗的道友均获得了以下战利品 ---")
-                for attacker_player_id in attackers:
-                    player_drop_details = []
-                    for drop in participant_drops:
-                        is_for_current_player = (attacker_player_id == user_id)
-
-                        if drop['type'] == "灵石":
-                            self.XiuXianService.update_ls(attacker_player_id, drop['quantity'], 1)
-                            if is_for_current_player: player_drop_details.append(f"灵石+{drop['quantity']}")
-                        else:
-                            self.XiuXianService.add_item(attacker_player_id, drop['id'], drop['type'], drop['quantity'])
-                            if is_for_current_player: player_drop_details.append(f"【{drop['name']}】x{drop['quantity']}")
-
-                    if is_for_current_player and player_drop_details:
-                        msg_lines.append(f"参与奖励: {', '.join(player_drop_details)}")
-                    elif not is_for_current_player: # 对其他攻击者可以简单记录日志
-                         logger.info(f"BOSS战参与者 {attacker_player_id} 获得奖励: {', '.join(player_drop_details)}")
-
-              # 构造简单的广播消息
-            broadcast_final_message = (
-                f"🎉 世界BOSS【{boss_combat_info['name']}】已被道友【{player_real_info['user_name']}】成功讨伐！🎉\n"
-                "感谢各位道友的英勇奋战！详细奖励已发放给最后一击者及贡献者。"
-            )
-            await self.scheduler._broadcast_to_groups(broadcast_final_message, "世界BOSS已被讨伐")
-            # 清理BOSS
-            self.XiuXianService.delete_boss(current_world_boss_data['id'])
-            self.world_boss = None # 清理插件实例中的BOSS缓存
+            elif battle_result['winner'] == boss_combat_info['user_id']: # 玩家被BOSS击败
+                msg_lines.append(f"道友对世界BOSS造成伤害：{boss_hit.damage}点")
+                msg_lines.append(f"\n💨 可惜，道友不敌【{boss_combat_info['name']}】，重伤败退！请勤加修炼再来挑战！")
+                # 玩家HP已在上面更新为0或1
 
-        elif battle_result['winner'] == boss_combat_info['user_id']: # 玩家被BOSS击败
-            msg_lines.append(f"\n💨 可惜，道友不敌【{boss_combat_info['name']}】，重伤败退！请勤加修炼再来挑战！")
-            # 玩家HP已在上面更新为0或1
+            else: # 平局或达到最大回合
+                msg_lines.append(f"道友对世界BOSS造成伤害：{boss_hit.damage}点")
+                msg_lines.append(f"\n⚔️ 道友与【{boss_combat_info['name']}】鏖战许久，未分胜负，只能暂作休整。")
 
-        elif battle_result['winner'] is None: # 平局或达到最大回合
-            msg_lines.append(f"\n⚔️ 道友与【{boss_combat_info['name']}】鏖战许久，未分胜负，只能暂作休整。")
+        if settlement:
+            self._spawn_background(self._settle_world_boss(settlement))
 
         final_msg = "\n".join(msg_lines)
         async for r in self._send_response(event, final_msg, "BOSS战报"):
             yield r
 
+    async def _settle_world_boss(self, settlement: BossSettlement):
+        """在工作线程中一次性写入世界BOSS的击杀奖励，完成后广播伤害贡献榜"""
+        participants = (
+            set(settlement.exp_rewards) | set(settlement.stone_rewards) | {delta[0] for delta in settlement.item_deltas}
+        )
+        try:
+            # 工作线程直接修改这些玩家，期间他们绕过缓存
+            with self.XiuXianService.bypass_player_cache(participants):
+                names = await asyncio.get_running_loop().run_in_executor(
+                    None, self.XiuXianService.settle_world_boss, settlement
+                )
+        except Exception as e:
+            logger.error(f"世界BOSS【{settlement.boss_name}】击杀结算失败，将在重启后重试: {e}", exc_info=True)
+            return
+        if names is None:
+            logger.warning(f"世界BOSS【{settlement.boss_name}】已结算过，跳过重复结算。")
+            return
+        logger.info(f"世界BOSS【{settlement.boss_name}】击杀结算完成，共 {len(participants)} 位道友获得奖励。")
+        await self.scheduler._broadcast_to_groups(format_settlement_broadcast(settlement, names), "世界BOSS已被讨伐")
+
     @filter.command("悬赏帮助")
     @command_lock
     async def bounty_help_cmd(self, event: AstrMessageEvent):
@@ -1337,45 +1302,47 @@ class XiuxianPlugin(Star):
             async for r in self._send_response(event, msg): yield r
             return
 
-        # --- 战斗类任务（全自动模拟） ---
-        if bounty_type in ["捉妖", "暗杀"]:
-            user_real_info = self.XiuXianService.get_user_real_info(user_id)
-            monster_info = {
-                "name": bounty.get('monster_name', '未知妖兽'),
-                "hp": bounty.get('monster_hp'), # 现在可以正确获取
-                "atk": bounty.get('monster_atk') # 现在可以正确获取
-            }
-
-            battle_result = PvPManager.simulate_full_bounty_fight(user_real_info, monster_info)
+        # 结算奖励与清理任务合并为一次提交
+        with self.XiuXianService.transaction():
+            # --- 战斗类任务（全自动模拟） ---
+            if bounty_type in ["捉妖", "暗杀"]:
+                user_real_info = self.XiuXianService.get_user_real_info(user_id)
+                monster_info = {
+                    "name": bounty.get('monster_name', '未知妖兽'),
+                    "hp": bounty.get('monster_hp'), # 现在可以正确获取
+                    "atk": bounty.get('monster_atk') # 现在可以正确获取
+                }
 
-            if battle_result['success']:
-                reward = self.XiuXianService.get_bounty_reward(work_info)
-                self.XiuXianService.update_exp(user_id, reward['exp'])
-                self.XiuXianService.update_ls(user_id, reward['stone'], 1)
-                battle_result['log'].append(f"获得奖励：修为 +{reward['exp']}，灵石 +{reward['stone']}！")
+                battle_result = PvPManager.simulate_full_bounty_fight(user_real_info, monster_info)
 
-            self.XiuXianService.abandon_bounty(user_id)
-            msg = "\n".join(battle_result['log'])
-
-        # --- 概率成功类任务 ---
-        elif bounty_type == "采药":
-            success_rate = work_info.get("rate", 100)
-            if random.randint(0, 100) <= success_rate:
-                reward = work_info.get("succeed_thank", 0)
-                self.XiuXianService.update_ls(user_id, reward, 1)
-                msg = f"{random.choice(work_info.get('succeed', ['任务成功！']))}\n你获得了 {reward} 灵石！"
-            else:
-                penalty = work_info.get("fail_thank", 0)
-                self.XiuXianService.update_ls(user_id, penalty, 1)
-                msg = f"{random.choice(work_info.get('fail', ['任务失败...']))}\n但你聊以慰藉地拿到了 {penalty} 灵石作为补偿。"
+                if battle_result['success']:
+                    reward = self.XiuXianService.get_bounty_reward(work_info)
+                    self.XiuXianService.update_exp(user_id, reward['exp'])
+                    self.XiuXianService.update_ls(user_id, reward['stone'], 1)
+                    battle_result['log'].append(f"获得奖励：修为 +{reward['exp']}，灵石 +{reward['stone']}！")
+
+                self.XiuXianService.abandon_bounty(user_id)
+                msg = "\n".join(battle_result['log'])
+
+            # --- 概率成功类任务 ---
+            elif bounty_type == "采药":
+                success_rate = work_info.get("rate", 100)
+                if random.randint(0, 100) <= success_rate:
+                    reward = work_info.get("succeed_thank", 0)
+                    self.XiuXianService.update_ls(user_id, reward, 1)
+                    msg = f"{random.choice(work_info.get('succeed', ['任务成功！']))}\n你获得了 {reward} 灵石！"
+                else:
+                    penalty = work_info.get("fail_thank", 0)
+                    self.XiuXianService.update_ls(user_id, penalty, 1)
+                    msg = f"{random.choice(work_info.get('fail', ['任务失败...']))}\n但你聊以慰藉地拿到了 {penalty} 灵石作为补偿。"
 
-            self.XiuXianService.abandon_bounty(user_id)
+                self.XiuXianService.abandon_bounty(user_id)
 
-        else:
-            msg = "此类型的悬赏任务暂未支持完成方式，请联系管理员。"
+            else:
+                msg = "此类型的悬赏任务暂未支持完成方式，请联系管理员。"
 
 
-        self.XiuXianService.refresh_user_base_attributes(user_id)
+            self.XiuXianService.refresh_user_base_attributes(user_id)
 
         async for r in self._send_response(event, msg):
             yield r
@@ -1435,78 +1402,79 @@ class XiuxianPlugin(Star):
             async for r in self._send_response(event, msg): yield r
             return
 
-        self.XiuXianService.update_ls(user_id, self.xiu_config.rift_cost, 2)
-        # 注意：我们不再将秘境存入数据库，因为是即时探索
-        self.XiuXianService.set_user_rift_cd(user_id)
-
-        # --- 4. 开始自动探索循环 ---
-        rift_map = new_rift_template['map']
-        total_floors = new_rift_template['total_floors']
-        current_floor_num = 1
-        exploration_log = [f"=== 秘境【{new_rift_template['name']}】探索记录 ==="]
-
-        while current_floor_num <= total_floors:
-            # 获取当前玩家信息，因为HP可能会在战斗中变化
-            current_user_info = self.XiuXianService.get_user_message(user_id)
-            if not current_user_info or current_user_info.hp <= 0:
-                exploration_log.append(f"\n在第 {current_floor_num-1} 层后，你因伤势过重，被迫退出了秘境。")
-                break # 玩家死亡，结束探索
-
-            event_data = rift_map[current_floor_num - 1]
-            log_entry = [f"\n--- 第 {event_data['floor']} 层 ---", event_data['desc']]
-            event_type = event_data['event_type']
-
-            if event_type == 'reward':
-                reward_info = event_data.get('reward', {'exp': 10, 'stone': 10})
-                exp, stone = reward_info['exp'], reward_info['stone']
-                self.XiuXianService.update_exp(user_id, exp)
-                self.XiuXianService.update_ls(user_id, stone, 1)
-                log_entry.append(f"获得奖励：修为+{exp}，灵石+{stone}！")
-
-            elif event_type == 'punish':
-                punish_info = self.rift_manager.rift_event_data[event_data['event_name']]['punish']
-                hp_lost = random.randint(*punish_info['hp'])
-                self.XiuXianService.update_hp(user_id, hp_lost, 2)
-                user_info_after_punish = self.XiuXianService.get_user_message(user_id)
-                log_entry.append(f"道友因此损失了 {hp_lost} 点生命！当前生命：{user_info_after_punish.hp}")
-                if user_info_after_punish.hp <= 0:
-                    log_entry.append("你身受重伤，探索被迫中止！")
-                    exploration_log.extend(log_entry)
-                    break
-
-            elif event_type == 'combat':
-                monster = event_data['monster']
-                user_real_info = self.XiuXianService.get_user_real_info(user_id)
-                battle_result = PvPManager.simulate_full_bounty_fight(user_real_info, monster)
+        # 整次探索（扣费、CD、每层奖励与伤害）合并为一次提交
+        with self.XiuXianService.transaction():
+            self.XiuXianService.update_ls(user_id, self.xiu_config.rift_cost, 2)
+            # 注意：我们不再将秘境存入数据库，因为是即时探索
+            self.XiuXianService.set_user_rift_cd(user_id)
 
-                log_entry.extend(battle_result['log']) # 添加战斗日志
+            # --- 4. 开始自动探索循环 ---
+            rift_map = new_rift_template['map']
+            total_floors = new_rift_template['total_floors']
+            current_floor_num = 1
+            exploration_log = [f"=== 秘境【{new_rift_template['name']}】探索记录 ==="]
 
-                player_hp_after_fight = battle_result.get("player_hp", 0)
-                # 直接设置玩家战斗后的HP
-                self.XiuXianService.conn.cursor().execute("UPDATE user_xiuxian SET hp = ? WHERE user_id = ?", (player_hp_after_fight, user_id))
-                self.XiuXianService.conn.commit()
+            while current_floor_num <= total_floors:
+                # 获取当前玩家信息，因为HP可能会在战斗中变化
+                current_user_info = self.XiuXianService.get_user_message(user_id)
+                if not current_user_info or current_user_info.hp <= 0:
+                    exploration_log.append(f"\n在第 {current_floor_num-1} 层后，你因伤势过重，被迫退出了秘境。")
+                    break # 玩家死亡，结束探索
 
-                if battle_result['success']:
+                event_data = rift_map[current_floor_num - 1]
+                log_entry = [f"\n--- 第 {event_data['floor']} 层 ---", event_data['desc']]
+                event_type = event_data['event_type']
+
+                if event_type == 'reward':
                     reward_info = event_data.get('reward', {'exp': 10, 'stone': 10})
                     exp, stone = reward_info['exp'], reward_info['stone']
                     self.XiuXianService.update_exp(user_id, exp)
                     self.XiuXianService.update_ls(user_id, stone, 1)
-                    log_entry.append(f"战斗胜利！获得奖励：修为+{exp}，灵石+{stone}！")
-                else:
-                    log_entry.append("你被击败了，探索被迫中止！")
-                    exploration_log.extend(log_entry)
-                    break
+                    log_entry.append(f"获得奖励：修为+{exp}，灵石+{stone}！")
+
+                elif event_type == 'punish':
+                    punish_info = self.rift_manager.rift_event_data[event_data['event_name']]['punish']
+                    hp_lost = random.randint(*punish_info['hp'])
+                    self.XiuXianService.update_hp(user_id, hp_lost, 2)
+                    user_info_after_punish = self.XiuXianService.get_user_message(user_id)
+                    log_entry.append(f"道友因此损失了 {hp_lost} 点生命！当前生命：{user_info_after_punish.hp}")
+                    if user_info_after_punish.hp <= 0:
+                        log_entry.append("你身受重伤，探索被迫中止！")
+                        exploration_log.extend(log_entry)
+                        break
+
+                elif event_type == 'combat':
+                    monster = event_data['monster']
+                    user_real_info = self.XiuXianService.get_user_real_info(user_id)
+                    battle_result = PvPManager.simulate_full_bounty_fight(user_real_info, monster)
+
+                    log_entry.extend(battle_result['log']) # 添加战斗日志
+
+                    player_hp_after_fight = battle_result.get("player_hp", 0)
+                    # 直接设置玩家战斗后的HP
+                    self.XiuXianService.update_hp_to_value(user_id, player_hp_after_fight)
+
+                    if battle_result['success']:
+                        reward_info = event_data.get('reward', {'exp': 10, 'stone': 10})
+                        exp, stone = reward_info['exp'], reward_info['stone']
+                        self.XiuXianService.update_exp(user_id, exp)
+                        self.XiuXianService.update_ls(user_id, stone, 1)
+                        log_entry.append(f"战斗胜利！获得奖励：修为+{exp}，灵石+{stone}！")
+                    else:
+                        log_entry.append("你被击败了，探索被迫中止！")
+                        exploration_log.extend(log_entry)
+                        break
 
-            exploration_log.extend(log_entry)
-            current_floor_num += 1
+                exploration_log.extend(log_entry)
+                current_floor_num += 1
 
-        # --- 5. 探索结束，发送总结报告 ---
-        if current_floor_num > total_floors:
-            exploration_log.append(f"\n恭喜道友，成功探索完【{new_rift_template['name']}】的所有 {total_floors} 层！")
+            # --- 5. 探索结束，发送总结报告 ---
+            if current_floor_num > total_floors:
+                exploration_log.append(f"\n恭喜道友，成功探索完【{new_rift_template['name']}】的所有 {total_floors} 层！")
 
-        # 刷新最终属性
-        self.XiuXianService.refresh_user_base_attributes(user_id)
-        self.XiuXianService.update_power2(user_id)
+            # 刷新最终属性
+            self.XiuXianService.refresh_user_base_attributes(user_id)
+            self.XiuXianService.update_power2(user_id)
 
 
         msg = "\n".join(exploration_log)
@@ -1655,6 +1623,7 @@ class XiuxianPlugin(Star):
 炼丹帮助信息:
 指令：
 1、炼丹 [丹药名称]：根据丹方尝试炼制指定丹药。
+   炼丹 [丹药名称] [炉数/全部]：批量炼制，自动选择浪费药力最少的药材组合。
 2、查看丹方：查看所有已知的丹药配方。
 3、可炼丹药：检测背包药材，列出当前可炼制的丹药。
 4、灵田收取、灵田结算：收取你洞天福地中的药材。
@@ -1766,49 +1735,69 @@ class XiuxianPlugin(Star):
         args = event.message_str.split()
         recipe_name = args[1] if len(args) >= 2 else ""
         if not recipe_name:
-            msg = "请输入要炼制的丹药名称，如：炼丹 筑基丹"
+            msg = "请输入要炼制的丹药名称，如：炼丹 筑基丹\n批量炼制：炼丹 筑基丹 10，或 炼丹 筑基丹 全部（炼到材料用完）"
             async for r in self._send_response(event, msg): yield r
             return
 
+        # 第三个参数为炉数，“全部”/max 表示炼到材料或修为用完
+        batch_quantity = None
+        is_batch = len(args) >= 3
+        if is_batch and args[2].lower() not in ("全部", "max"):
+            if not args[2].isdigit() or int(args[2]) <= 0:
+                msg = "炼制数量必须是正整数，或使用“全部”炼到材料用完。"
+                async for r in self._send_response(event, msg): yield r
+                return
+            batch_quantity = int(args[2])
+
         user_backpack = self.XiuXianService.get_user_back_msg(user_id)
         user_alchemy_info = self.XiuXianService.get_user_alchemy_info(user_id)
         
         # 将 service 实例传递给 manager
         self.alchemy_manager.service = self.XiuXianService
-        result = self.alchemy_manager.craft_pill(user_info, user_backpack, user_alchemy_info, recipe_name)
-        
-        # 处理消耗
-        if result.get("consume"):
-            self.XiuXianService.update_j_exp(user_id, result['consume']['exp'])
-            for mat_id, num in result['consume']['materials'].items():
-                mat_info = self.XiuXianService.items.get_data_by_item_id(int(mat_id))
-                self.XiuXianService.remove_item(user_id, mat_info['name'], num)
-        
-        # 处理产出和经验
-        if result['success'] and result.get('produce'):
-            produce_info = result['produce']
-            item_full_info = self.XiuXianService.items.get_data_by_item_id(produce_info['item_id'])
-            self.XiuXianService.add_item(user_id, produce_info['item_id'], item_full_info.get('item_type', '丹药'), produce_info['num'])
-
-            if result.get('exp_gain', 0) > 0:
-                current_alchemy_info = self.XiuXianService.get_user_alchemy_info(user_id)
-                new_exp = current_alchemy_info.alchemy_exp + result['exp_gain']
-                
-                alchemy_record = json.loads(current_alchemy_info.alchemy_record)
-                pill_id_str = str(produce_info['item_id'])
-                if pill_id_str not in alchemy_record:
-                    alchemy_record[pill_id_str] = {'num': 0, 'name': recipe_name}
-                alchemy_record[pill_id_str]['num'] += produce_info['num']
-
-                updated_info = current_alchemy_info._replace(
-                    alchemy_exp=new_exp,
-                    alchemy_record=json.dumps(alchemy_record, ensure_ascii=False)
-                )
-                self.XiuXianService.update_user_alchemy_info(user_id, updated_info)
+        if is_batch:
+            result = self.alchemy_manager.craft_pills(user_info, user_backpack, user_alchemy_info, recipe_name, batch_quantity)
+        else:
+            result = self.alchemy_manager.craft_pill(user_info, user_backpack, user_alchemy_info, recipe_name)
+
+        if result['success']:
+            try:
+                # 扣除修为和药材、发放丹药、记录炼丹经验作为一个整体提交
+                with self.XiuXianService.transaction():
+                    self._apply_alchemy_result(user_id, recipe_name, result)
+            except ValueError:
+                result = {"success": False, "message": "背包中的药材已发生变化，请重新炼制。"}
         
         async for r in self._send_response(event, result['message']):
             yield r
 
+    def _apply_alchemy_result(self, user_id: str, recipe_name: str, result: dict):
+        """扣除炼丹消耗并发放产出、更新炼丹记录，药材不足时抛出 ValueError"""
+        service = self.XiuXianService
+        produce_info = result['produce']
+        item_full_info = service.items.get_data_by_item_id(produce_info['item_id'])
+
+        service.update_j_exp(user_id, result['consume']['exp'])
+        deltas = [(user_id, int(mat_id), -num) for mat_id, num in result['consume']['materials'].items()]
+        deltas.append((user_id, produce_info['item_id'], produce_info['num'], item_full_info.get('item_type', '丹药')))
+        if service.apply_item_deltas(deltas) is None:
+            raise ValueError("药材数量不足")
+
+        if result.get('exp_gain', 0) > 0:
+            current_alchemy_info = service.get_user_alchemy_info(user_id)
+            new_exp = current_alchemy_info.alchemy_exp + result['exp_gain']
+
+            alchemy_record = json.loads(current_alchemy_info.alchemy_record)
+            pill_id_str = str(produce_info['item_id'])
+            if pill_id_str not in alchemy_record:
+                alchemy_record[pill_id_str] = {'num': 0, 'name': recipe_name}
+            alchemy_record[pill_id_str]['num'] += produce_info['num']
+
+            updated_info = current_alchemy_info._replace(
+                alchemy_exp=new_exp,
+                alchemy_record=json.dumps(alchemy_record, ensure_ascii=False)
+            )
+            service.update_user_alchemy_info(user_id, updated_info)
+
 
     @filter.command("灵田收取", alias={"灵田结算"})
     @command_lock
@@ -1857,7 +1846,7 @@ class XiuxianPlugin(Star):
             num_to_get = (1 + alchemy_info.collection_level) * batches
 
             # 随机获取药材
-            herb_id_list = list(self.XiuXianService.items.get_data_by_item_type(['药材']).keys())
+            herb_id_list = list(self.XiuXianService.items.get_ids_by_item_type('药材'))
             if not herb_id_list:
                 msg = "错误：药材库为空，无法收取！"
                 async for r in self._send_response(event, msg): yield r
@@ -2247,12 +2236,11 @@ class XiuxianPlugin(Star):
             return
 
         # 执行战斗模拟
-        battle_result = PvPManager.simulate_player_vs_player_fight(user_real_info_p1, user_real_info_p2)
+        battle_result = PvPManager.recorded_fight(user_real_info_p1, user_real_info_p2)
 
-        # --- 存储详细战斗日志 ---
-        if battle_result.get("battle_round_details_log"):
-            # 为双方都存储同一份详细日志
-            await self._store_last_battle_details(user_id, battle_result["battle_round_details_log"])
+        # --- 存储战斗回放 ---
+        # 为双方都存储同一份回放
+        await self._store_last_battle_details((user_id, target_user_id), battle_result.get("battle_replay"))
         # --- 结束存储 ---
 
         # 设置切磋CD
@@ -2388,18 +2376,22 @@ class XiuxianPlugin(Star):
 
         title = ""
         data = []
+        column = ""
 
         if rank_type == "修为":
             title = "修仙界修为排行榜"
             data = self.XiuXianService.get_exp_ranking()
+            column = "exp"
 
         elif rank_type == "灵石":
             title = "修仙界财富排行榜"
             data = self.XiuXianService.get_stone_ranking()
+            column = "stone"
 
         elif rank_type == "战力":
             title = "修仙界战力排行榜"
             data = self.XiuXianService.get_power_ranking()
+            column = "power"
 
         else:
             msg = "请输入想查看的排行榜类型，例如：排行榜 修为 | 灵石 | 战力"
@@ -2413,6 +2405,10 @@ class XiuxianPlugin(Star):
             for i, item in enumerate(data):
                 user_name, level, value = item
                 msg_lines.append(f"No.{i+1} {user_name} ({level}) - {value}")
+            # 附上发送者自己的名次
+            my_rank = self.XiuXianService.get_user_ranking(event.get_sender_id(), column)
+            if my_rank:
+                msg_lines.append(f"\n道友当前位列第 {my_rank['rank']} 名（共 {my_rank['total']} 人），{rank_type} {my_rank['value']}")
             msg = "\n".join(msg_lines)
 
         yield event.chain_result([Comp.Image.fromFileSystem(str(await get_msg_pic(await pic_msg_format(msg, event), title, 30)))])
@@ -2487,6 +2483,7 @@ class XiuxianPlugin(Star):
 
         # 执行战斗模拟
         battle_result = PvPManager.execute_robbery_fight(user_real_info_attacker, user_real_info_defender)
+        await self._store_last_battle_details((user_id, target_user_id), battle_result.get("battle_replay"))
 
         # 战斗结算
         # 1. 更新双方实际HP (抢劫会真实扣血)
@@ -2725,26 +2722,13 @@ class XiuxianPlugin(Star):
             async for r in self._send_response(event, msg): yield r
             return
 
-        # 执行批量回滚操作
-        log_messages = self.XiuXianService.rollback_high_exp_users()
-
-        # 将日志通过转发消息发送出来，避免刷屏
-        # 平台适配：如果平台不支持转发，需要用其他方式发送长消息
-            #from astrbot.api.message_components import Forward
-            #forward_node_list = []
-            #for log_msg in log_messages:
-            #    forward_node_list.append(
-            #        Comp.ForwardNode(
-            #            bot_id=self.context.self_id,
-            #            user_id=self.context.self_id,
-            #            user_name="数据修复日志",
-            #            content=MessageChain(log_msg)
-            #        )
-            #    )
-            #yield event.chain_result([Forward(forward_node_list)])
-        full_log = "\n\n".join(log_messages)
-        async for r in self._send_response(event, full_log, "数据修复报告"):
-            yield r
+        # 在工作线程中执行批量回滚，带“预演”参数时只统计不修改
+        dry_run = "预演" in event.message_str.split()[1:]
+        async for progress in self.admin_jobs.run(
+            "修复秘境异常数据", self.XiuXianService.rollback_high_exp_users, dry_run=dry_run
+        ):
+            async for r in self._send_response(event, progress, "数据修复报告"):
+                yield r
 
     @filter.command("修复用户数据")
     async def admin_fix_data_cmd(self, event: AstrMessageEvent):
@@ -2755,6 +2739,7 @@ class XiuxianPlugin(Star):
             return
 
         target_id = await self._get_at_user_id(event)
+        dry_run = "预演" in event.message_str.split()[1:]
 
         if target_id:
             # --- 修复单个用户 ---
@@ -2767,12 +2752,96 @@ class XiuxianPlugin(Star):
             async for r in self._send_response(event, log, "单用户数据修复报告"):
                 yield r
         else:
-            # --- 修复所有用户 ---
-            log_messages = self.XiuXianService.fix_all_users_data()
-            full_log = "\n\n".join(log_messages)
+            # --- 修复所有用户（工作线程中执行，进度流式返回） ---
+            async for progress in self.admin_jobs.run(
+                "全服数据修复", self.XiuXianService.fix_all_users_data, dry_run=dry_run
+            ):
+                async for r in self._send_response(event, progress, "全服数据修复报告"):
+                    yield r
 
-            async for r in self._send_response(event, full_log, "全服数据修复报告"):
-                yield r
+    @filter.command("重算全服战力")
+    async def admin_recompute_power_cmd(self, event: AstrMessageEvent):
+        # 权限检查
+        if event.get_sender_id() not in self.MANUAL_ADMIN_WXIDS:
+            msg = "汝非天选之人，无权执此法旨！"
+            async for r in self._send_response(event, msg): yield r
+            return
+
+        result = self.XiuXianService.recompute_all_power()
+        msg = (
+            f"全服战力重算完成！\n"
+            f"共计算 {result['users']} 名用户，其中 {result['updated']} 人战力发生变化。\n"
+            f"耗时 {result['elapsed']:.2f} 秒，约 {result['users_per_second']:.0f} 人/秒。"
+        )
+        async for r in self._send_response(event, msg, "战力重算"): yield r
+
+    @filter.command("重载修仙配置")
+    async def admin_reload_config_cmd(self, event: AstrMessageEvent):
+        # 权限检查
+        if event.get_sender_id() not in self.MANUAL_ADMIN_WXIDS:
+            msg = "汝非天选之人，无权执此法旨！"
+            async for r in self._send_response(event, msg): yield r
+            return
+
+        # 丢弃所有JSON缓存，并重新读取 config.yaml（所有模块共享同一个配置实例）
+        jsondata.reload()
+        self.xiu_config.reload()
+
+        msg = f"修仙配置已重新加载，当前共 {len(self.xiu_config.level)} 个境界。"
+        async for r in self._send_response(event, msg): yield r
+
+    @filter.command("修仙数据库状态")
+    async def admin_db_status_cmd(self, event: AstrMessageEvent):
+        # 权限检查
+        if event.get_sender_id() not in self.MANUAL_ADMIN_WXIDS:
+            msg = "汝非天选之人，无权执此法旨！"
+            async for r in self._send_response(event, msg): yield r
+            return
+
+        pool = self.XiuXianService.db.get_metrics()
+        cache = jsondata.get_cache_stats()
+        player = self.XiuXianService.player_cache.get_stats()
+        engine = self.XiuXianService.stats_engine.get_cache_stats()
+        cooldowns = self.XiuXianService.cooldowns.get_stats()
+        temp_buffs = self.XiuXianService.temp_buffs.get_stats()
+        msg = (
+            f"只读连接池: {pool['idle']}/{pool['pool_size']} 空闲\n"
+            f"借出次数: {pool['acquires']}，写连接代读: {pool['writer_fallbacks']}\n"
+            f"平均等待: {pool['avg_wait'] * 1000:.2f}ms，最长等待: {pool['max_wait'] * 1000:.2f}ms\n"
+            f"数据文件缓存: 命中 {cache['hits']} / 未命中 {cache['misses']} / 重载 {cache['reloads']}\n"
+            f"玩家缓存: 命中率 {player['hit_rate']:.1%}，缓存 {player['cached_users']} 人，待写回 {player['dirty_users']} 人\n"
+            f"写回: {player['flushes']} 次 / {player['flushed_rows']} 行，平均 {player['avg_flush_time'] * 1000:.2f}ms，"
+            f"最长 {player['max_flush_time'] * 1000:.2f}ms\n"
+            f"属性引擎: 命中率 {engine['hit_rate']:.1%}，缓存 {engine['cached']} 条\n"
+            f"冷却: 生效 {cooldowns['active']} 条，待写回 {cooldowns['pending']} 条\n"
+            f"临时Buff: 生效 {temp_buffs['live']} 个，近一分钟过期 {temp_buffs['expired_per_minute']} 个"
+        )
+        async for r in self._send_response(event, msg, "数据库状态"): yield r
+
+    @filter.command("抽卡保底查询")
+    async def admin_gacha_pity_cmd(self, event: AstrMessageEvent):
+        # 权限检查
+        if event.get_sender_id() not in self.MANUAL_ADMIN_WXIDS:
+            msg = "汝非天选之人，无权执此法旨！"
+            async for r in self._send_response(event, msg): yield r
+            return
+
+        # @某人时只查询该玩家，否则列出最近的记录
+        target_id = await self._get_at_user_id(event)
+        records = self.XiuXianService.get_gacha_pity_records(target_id)
+        if not records:
+            async for r in self._send_response(event, "暂无抽卡保底记录。", "抽卡保底"): yield r
+            return
+
+        lines = []
+        for record in records[:20]:
+            pool_config = self.xiu_config.gacha_pools_config.get(record.pool_id, {})
+            lines.append(
+                f"{record.user_id}【{pool_config.get('name', record.pool_id)}】"
+                f"当前计数 {record.pity_counter}，累计 {record.total_pulls} 抽，"
+                f"软保底 {record.soft_pity_hits} 次，硬保底 {record.hard_pity_hits} 次，十连保底 {record.guarantee_hits} 次"
+            )
+        async for r in self._send_response(event, "\n".join(lines), "抽卡保底"): yield r
 
     @filter.command("手动刷新世界boss")
     async def admin_refresh_boss_cmd(self, event: AstrMessageEvent):
@@ -5011,14 +5080,7 @@ class XiuxianPlugin(Star):
         logger.info(f"后台发放解析（严格版）：目标用户ID: {target_user_id}, 物品名称: '{item_name}', 数量: {quantity}")
 
         # 3. 后续的物品查找、类型检查、发放逻辑 (与之前版本一致)
-        item_data = None
-        item_id_found = None
-        # get_all_items() 返回的是 { item_id_str: item_data_dict, ... }
-        for item_id_str_key, data_val in self.XiuXianService.items.get_all_items().items():
-            if data_val.get('name') == item_name:
-                item_data = data_val
-                item_id_found = item_id_str_key
-                break
+        item_id_found, item_data = self.XiuXianService.items.get_data_by_item_name(item_name)
 
         if not item_data:
             msg = f"❌ 未在物品库中找到名为【{item_name}】的物品。"
@@ -5057,25 +5119,20 @@ class XiuxianPlugin(Star):
 
         item_name_to_query = args[1].strip()
 
-        # 从 Items 实例获取所有物品数据
-        all_items_data = self.XiuXianService.items.get_all_items()
-
-        found_item_data = None
-        # 精确匹配物品名称
-        for item_id, data in all_items_data.items():
-            if data.get('name') == item_name_to_query:
-                found_item_data = data
-                # 为 found_item_data 补充 item_id，因为 format_item_details 可能需要
-                found_item_data['_id_for_display'] = item_id
-                break
+        # 精确匹配物品名称（或别名）
+        item_id, found_item_data = self.XiuXianService.items.get_data_by_item_name(item_name_to_query)
+        if found_item_data:
+            # 物品记录只读，复制后补充 item_id，因为 format_item_details 可能需要
+            found_item_data = found_item_data.to_dict()
+            found_item_data['_id_for_display'] = item_id
 
         if not found_item_data:
-            # 如果精确匹配失败，可以尝试模糊匹配 (可选)
+            # 如果精确匹配失败，按名称片段模糊匹配
             possible_matches = []
-            for item_id, data in all_items_data.items():
-                if item_name_to_query in data.get('name', ''):
-                    data['_id_for_display'] = item_id
-                    possible_matches.append(data)
+            for item_id, data in self.XiuXianService.items.search_items_by_name(item_name_to_query):
+                data = data.to_dict()
+                data['_id_for_display'] = item_id
+                possible_matches.append(data)
 
             if not possible_matches:
                 msg = f"未能找到名为【{item_name_to_query}】的物品。"
@@ -5210,7 +5267,12 @@ class XiuxianPlugin(Star):
             processing_msg = "正在沟通天地，演算天机..." if not is_ten_pull else "大法力运转，十方天机尽在掌握..."
             async for r_wait in self._send_response(event, processing_msg, "请稍候"): yield r_wait
 
-            result = self.gacha_manager.perform_gacha(user_id, pool_id, is_ten_pull)
+            # 扣费、发放奖励、刷新属性合并为一次提交，出错时整体回滚
+            with self.XiuXianService.transaction():
+                result = self.gacha_manager.perform_gacha(user_id, pool_id, is_ten_pull)
+                if result["success"]:
+                    self.XiuXianService.refresh_user_base_attributes(user_id)
+                    self.XiuXianService.update_power2(user_id)
         except Exception as e:
             logger.error(f"卡池 {pool_id} 抽奖时发生严重错误: {e}", exc_info=True)
             async for r in self._send_response(event,
@@ -5219,9 +5281,6 @@ class XiuxianPlugin(Star):
 
         title_prefix = "十连结果" if is_ten_pull else "抽奖结果"
         if result["success"]:
-            self.XiuXianService.refresh_user_base_attributes(user_id)
-            self.XiuXianService.update_power2(user_id)
-
             response_message = result["message"]
             if is_ten_pull and result.get("rewards"):
                 formatted_rewards = []
@@ -5431,9 +5490,11 @@ class XiuxianPlugin(Star):
             async for r in self._send_response(event, msg_check): yield r
             return
 
-        detailed_log = self.last_battle_details_log.get(user_id)
+        # 由记录的种子和属性快照重新模拟，得到与当时完全相同的详细日志
+        battle_replay = self.XiuXianService.get_battle_replay(user_id)
+        replay_result = PvPManager.replay_fight(battle_replay) if battle_replay else None
 
-        if not detailed_log:
+        if not replay_result:
             msg = "道友近期未曾酣战，或战报已随风而逝。"
         else:
             # 可以在日志开头加上一些提示信息
@@ -5442,7 +5503,7 @@ class XiuxianPlugin(Star):
                 "（仅保留最近一场，且回合数过多可能无法完全显示）",
                 "----------------------------------"
             ]
-            msg_lines = log_header + detailed_log
+            msg_lines = log_header + replay_result["battle_round_details_log"].format()
             msg = "\n".join(msg_lines)
 
         message = await pic_msg_format(msg, event)
@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import OrderedDict
+from astrbot.api import logger
+
+
+class _PlayerEntry:
+    """单个玩家的缓存条目：行快照 + 尚未写回数据库的修改"""
+    __slots__ = ("row", "loaded_at", "deltas", "values")
+
+    def __init__(self, row, loaded_at):
+        self.row = row
+        self.loaded_at = loaded_at
+        self.deltas = {}   # 累加型字段: 列名 -> 增量 (灵石、修为)
+        self.values = {}   # 覆盖型字段: 列名 -> 最新值 (HP、MP、战力)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.deltas or self.values)
+
+
+class PlayerStateCache:
+    """
+    玩家状态缓存（LRU + TTL，写回式）
+
+    - user_xiuxian 行和 BuffInfo 行按 user_id 缓存
+    - 高频修改（灵石、修为、HP、MP、战力）只修改缓存并标记为脏，由 flush 统一写回
+    - 累加型字段以增量形式写回 (stone = stone + ?)，与其他直接执行的增量 SQL 可以交换顺序
+    - 脏条目不会因 TTL 或容量被淘汰，只能由 flush 写回后才会被淘汰
+    """
+
+    def __init__(self, capacity: int = 2048, ttl: float = 300.0, max_dirty: int = 256):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_dirty = max_dirty
+        self.lock = threading.RLock()
+        self._users: OrderedDict[str, _PlayerEntry] = OrderedDict()
+        self._buffs: OrderedDict[str, tuple] = OrderedDict()  # user_id -> (BuffInfo, loaded_at)
+        self._dirty: set[str] = set()
+        self.stats = {
+            "hits": 0, "misses": 0, "evictions": 0,
+            "flushes": 0, "flushed_rows": 0, "flush_time": 0.0, "max_flush_time": 0.0,
+        }
+
+    # ---------- 读取 ----------
+    def get_user(self, user_id: str):
+        """返回缓存的 UserDate（已包含未写回的修改），未命中返回 None"""
+        with self.lock:
+            entry = self._users.get(user_id)
+            if entry is None or (not entry.dirty and time.monotonic() - entry.loaded_at > self.ttl):
+                self.stats["misses"] += 1
+                return None
+            self._users.move_to_end(user_id)
+            self.stats["hits"] += 1
+            return entry.row
+
+    def get_buff(self, user_id: str):
+        """返回缓存的 BuffInfo，未命中返回 None"""
+        with self.lock:
+            cached = self._buffs.get(user_id)
+            if cached is None or time.monotonic() - cached[1] > self.ttl:
+                self.stats["misses"] += 1
+                return None
+            self._buffs.move_to_end(user_id)
+            self.stats["hits"] += 1
+            return cached[0]
+
+    # ---------- 写入缓存 ----------
+    def put_user(self, user_id: str, row):
+        with self.lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry.dirty:
+                return  # 存在未写回的修改时，以缓存为准
+            self._users[user_id] = _PlayerEntry(row, time.monotonic())
+            self._users.move_to_end(user_id)
+            self._evict()
+
+    def put_buff(self, user_id: str, row):
+        with self.lock:
+            self._buffs[user_id] = (row, time.monotonic())
+            self._buffs.move_to_end(user_id)
+            while len(self._buffs) > self.capacity:
+                self._buffs.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def add(self, user_id: str, column: str, delta: int) -> bool:
+        """累加一个字段并标记为脏；玩家不在缓存中时返回 False，由调用方直接写库"""
+        with self.lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return False
+            entry.row = entry.row._replace(**{column: (getattr(entry.row, column) or 0) + delta})
+            entry.deltas[column] = entry.deltas.get(column, 0) + delta
+            self._dirty.add(user_id)
+            return True
+
+    def set(self, user_id: str, column: str, value) -> bool:
+        """覆盖一个字段并标记为脏；玩家不在缓存中时返回 False，由调用方直接写库"""
+        with self.lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return False
+            entry.row = entry.row._replace(**{column: value})
+            entry.values[column] = value
+            self._dirty.add(user_id)
+            return True
+
+    def needs_flush(self) -> bool:
+        return len(self._dirty) >= self.max_dirty
+
+    # ---------- 写回与失效 ----------
+    def _write_entry(self, conn, user_id: str, entry: _PlayerEntry):
+        assignments, params = [], []
+        for column, delta in entry.deltas.items():
+            assignments.append(f"{column} = {column} + ?")
+            params.append(delta)
+        for column, value in entry.values.items():
+            assignments.append(f"{column} = ?")
+            params.append(value)
+        params.append(user_id)
+        conn.execute(f"UPDATE user_xiuxian SET {', '.join(assignments)} WHERE user_id = ?", params)
+        entry.deltas.clear()
+        entry.values.clear()
+
+    def flush(self, conn, user_id: str | None = None) -> int:
+        """把脏条目写回数据库（不提交，由调用方决定提交时机），返回写回的行数"""
+        with self.lock:
+            targets = [user_id] if user_id is not None else list(self._dirty)
+            targets = [uid for uid in targets if uid in self._dirty]
+            if not targets:
+                return 0
+            start = time.perf_counter()
+            for uid in targets:
+                self._write_entry(conn, uid, self._users[uid])
+                self._dirty.discard(uid)
+            elapsed = time.perf_counter() - start
+            self.stats["flushes"] += 1
+            self.stats["flushed_rows"] += len(targets)
+            self.stats["flush_time"] += elapsed
+            self.stats["max_flush_time"] = max(self.stats["max_flush_time"], elapsed)
+            return len(targets)
+
+    def invalidate(self, user_id: str):
+        """丢弃某个玩家的缓存（调用前应已 flush，否则未写回的修改会丢失）"""
+        with self.lock:
+            if user_id in self._dirty:
+                logger.warning(f"玩家 {user_id} 的缓存在写回前被丢弃。")
+                self._dirty.discard(user_id)
+            self._users.pop(user_id, None)
+            self._buffs.pop(user_id, None)
+
+    def discard(self, user_ids):
+        """丢弃指定玩家的缓存及未写回的修改（随事务回滚一同作废，不再告警）"""
+        with self.lock:
+            for user_id in user_ids:
+                self._dirty.discard(user_id)
+                self._users.pop(user_id, None)
+                self._buffs.pop(user_id, None)
+
+    def clear(self):
+        """清空全部缓存（包括未写回的修改）"""
+        with self.lock:
+            self._users.clear()
+            self._buffs.clear()
+            self._dirty.clear()
+
+    def _evict(self):
+        """按 LRU 顺序淘汰干净的条目，脏条目保留到下次 flush"""
+        overflow = len(self._users) - self.capacity
+        if overflow <= 0:
+            return
+        for user_id in [uid for uid, entry in self._users.items() if not entry.dirty][:overflow]:
+            self._users.pop(user_id)
+            self.stats["evictions"] += 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+            stats["avg_flush_time"] = stats["flush_time"] / stats["flushes"] if stats["flushes"] else 0.0
+            stats["cached_users"] = len(self._users)
+            stats["dirty_users"] = len(self._dirty)
+            return stats
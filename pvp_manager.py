@@ -1,29 +1,166 @@
+import copy
 import random
+import time
+from collections import namedtuple
+from types import SimpleNamespace
 from astrbot.api import logger
 
 #from .service import XiuxianService
 from .item_manager import Items
 from .config import USERRANK, SKILL_RANK_VALUE, MP_COST_REDUCTION_MAP
 
+# 战斗详细日志的事件模板：事件记录为 (事件名, 参数...) 元组，查看战斗详情时才格式化
+BATTLE_EVENT_TEMPLATES = {
+    "round": "-----------------回合 {0} -----------------",
+    "dot": "🩸【{0}】受到持续伤害效果，损失了 {1} 点气血。剩余HP: {2}",
+    "turn": "轮到【{0}】行动...",
+    "sealed": "【{0}】被封印了，本回合无法行动！(剩余 {1} 回合)",
+    "skill_cast": "✨【{0}】准备施展神通【{1}】！",
+    "skill_hit": "  💥 神通造成 {0} 点伤害！{1}",
+    "skill_total": "  总计对【{0}】造成 {1} 点神通伤害！",
+    "dot_applied": "  【{0}】受到了【{1}】效果，将在接下来 {2} 回合持续受到伤害！",
+    "buff_unknown": "  【{0}】具有未知的bufftype: {1}",
+    "seal": "  【{0}】被【{1}】封印了神通，持续 {2} 回合！",
+    "seal_failed": "  【{0}】对【{1}】的封印失败了！",
+    "skill_failed": "【{0}】施展神通【{1}】失败了！",
+    "attack_choice": "【{0}】选择了普通攻击...",
+    "attack": "💥【{0}】的普通攻击，{1}对【{2}】造成了 {3} 点伤害！",
+    "remaining_hp": "🩸【{0}】剩余气血: {1}",
+    "leech_hp": "🩸【{0}】效果发动，{1} 吸取了 {2} 点气血！",
+    "leech_mp": "🩸【{0}】效果发动，{1} 吸取了 {2} 点真元！",
+    "poison": "☠️【{0}】效果触发！【{1}】身中剧毒，将在接下来 {2} 回合持续受到伤害！",
+    "regen_hp": "✨【{0}】效果发动，{1} 回复了 {2} 点气血！",
+    "regen_mp": "✨【{0}】效果发动，{1} 回复了 {2} 点真元！",
+}
+
+# 神通 bufftype -> (战斗内部的Buff类型, 效果描述模板)
+SKILL_BUFF_TYPES = {
+    1: ("atk_rate", "攻击力变化 {:+.0f}%"),  # +号显示正负
+    "1": ("atk_rate", "攻击力变化 {:+.0f}%"),
+    2: ("def_rate", "减伤率变化 {:+.0f}%"),  # 减伤率 (对应防御率)
+    "2": ("def_rate", "减伤率变化 {:+.0f}%"),
+    # --- 补充其他 bufftype ---
+    "crit_rate_add": ("crit_rate_add", "暴击率变化 {:+.1f}%"),  # 假设神通数据中这样定义
+    "crit_dmg_add": ("crit_dmg_add", "暴击伤害变化 {:+.1f}%"),
+    # ...可以继续添加其他类型的buff...
+}
+BUFF_DESC_TEMPLATES = {internal_type: template for internal_type, template in SKILL_BUFF_TYPES.values()}
+
+CRIT_TEXT = "✨暴击！"
+
+# MP_COST_REDUCTION_MAP 的境界差阈值，从大到小
+MP_COST_THRESHOLDS = tuple(sorted(MP_COST_REDUCTION_MAP, reverse=True))
+
+# 战斗内核版本：改动战斗流程或随机数的取用顺序时递增，旧版本的战斗记录不再回放
+BATTLE_ENGINE_VERSION = 1
+
+# 战斗内核读取的属性，回放记录只保存这些字段
+SNAPSHOT_FIELDS = (
+    "user_id", "user_name", "level", "exp", "power", "hp", "mp", "max_hp", "max_mp",
+    "atk", "crit_rate", "crit_damage", "defense_rate",
+)
+
+# 可回放的战斗记录：随机数种子、双方开战时的属性快照、最大回合数、战斗内核版本
+BattleReplay = namedtuple("BattleReplay", ["seed", "p1", "p2", "max_rounds", "engine_version"])
+
+
+def snapshot_combatant(info: dict, items_manager) -> dict:
+    """
+    记录一方开战时的属性快照（可直接序列化为 JSON）。
+    神通和辅修功法的数据一并保存（复制为普通字典，物品记录本身不能被 json 序列化），
+    物品数据之后被修改也能原样回放。
+    """
+    snapshot = {field: info[field] for field in SNAPSHOT_FIELDS if field in info}
+    buff_info = info.get('buff_info')
+    snapshot["buffs"] = {}
+    for field in ("sec_buff", "sub_buff"):
+        item_id = getattr(buff_info, field, 0) if buff_info else 0
+        snapshot[field] = item_id
+        if item_id:
+            item_data = items_manager.get_data_by_item_id(item_id)
+            snapshot["buffs"][str(item_id)] = copy.deepcopy(dict(item_data)) if item_data else None
+    return snapshot
+
+
+class _SnapshotItems:
+    """回放时代替 Items，只提供快照中保存的神通和辅修功法数据"""
+
+    __slots__ = ("data",)
+
+    def __init__(self, *snapshots: dict):
+        self.data = {}
+        for snapshot in snapshots:
+            self.data.update(snapshot.get("buffs", {}))
+
+    def get_data_by_item_id(self, item_id):
+        return self.data.get(str(item_id))
+
+
+def _combatant_from_snapshot(snapshot: dict) -> dict:
+    info = {field: snapshot[field] for field in SNAPSHOT_FIELDS if field in snapshot}
+    info["buff_info"] = SimpleNamespace(sec_buff=snapshot.get("sec_buff", 0), sub_buff=snapshot.get("sub_buff", 0))
+    return info
+
+
+class BattleLog:
+    """
+    战斗详细日志
+
+    - 战斗中只追加 (事件名, 参数...) 元组，不拼接字符串
+    - 查看【战斗详情】时由 format() 按 BATTLE_EVENT_TEMPLATES 生成文本
+    """
+
+    __slots__ = ("events", "append")
+
+    def __init__(self):
+        self.events = []
+        self.append = self.events.append
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.format())
+
+    @staticmethod
+    def format_event(event: tuple) -> str:
+        name = event[0]
+        if name == "skill_cost":
+            hp_cost, mp_cost = event[1], event[2]
+            cost_log_parts = []
+            if hp_cost > 0: cost_log_parts.append(f"消耗气血 {hp_cost}")
+            if mp_cost > 0: cost_log_parts.append(f"消耗真元 {mp_cost}")
+            return f"({', '.join(cost_log_parts)})"
+        if name == "buff":
+            target_name, skill_name, buff_type, buff_value, buff_duration = event[1:]
+            buff_desc = BUFF_DESC_TEMPLATES[buff_type].format(buff_value * 100)
+            return f"  【{target_name}】受【{skill_name}】影响，{buff_desc}，持续 {buff_duration} 回合！"
+        return BATTLE_EVENT_TEMPLATES[name].format(*event[1:])
+
+    def format(self) -> list[str]:
+        return [self.format_event(event) for event in self.events]
+
+
 class PvPManager:
     """处理玩家之间战斗的核心逻辑"""
 
     @staticmethod
     def _calculate_damage(attacker_atk: int, defender_defense_rate: float,
-                          attacker_crit_rate: float, attacker_crit_damage: float) -> tuple[int, bool]:
+                          attacker_crit_rate: float, attacker_crit_damage: float, rng=random) -> tuple[int, bool]:
         """
         计算单次攻击的最终伤害。
+        :param rng: 随机数来源，默认使用全局 random，回放战斗时传入按种子建立的 random.Random
         :return: (伤害值, 是否暴击)
         """
         base_damage = attacker_atk
         is_crit = False
 
         # 攻击浮动 (例如 +/- 10%)
-        damage_float_rate = random.uniform(0.9, 1.1)
+        damage_float_rate = rng.uniform(0.9, 1.1)
         base_damage = int(base_damage * damage_float_rate)
 
         # 计算暴击
-        if random.random() < attacker_crit_rate:
+        if rng.random() < attacker_crit_rate:
             is_crit = True
             # 暴击伤害 = 基础伤害 * (1 + 暴击伤害加成)
             # 例如，基础暴击伤害是150%，则 attacker_crit_damage 是 0.5
@@ -36,11 +173,20 @@ class PvPManager:
         return max(1, final_damage), is_crit # 至少造成1点伤害
 
     @staticmethod
-    def simulate_player_vs_player_fight(p1_info_dict: dict, p2_info_dict: dict, max_rounds: int = 30) -> dict:
-        items_manager = Items()
+    def simulate_player_vs_player_fight(p1_info_dict: dict, p2_info_dict: dict, max_rounds: int = 30,
+                                        items_manager: Items | None = None, rng=None) -> dict:
+        """
+        模拟两名玩家（或玩家与BOSS）的战斗。
+        返回的 battle_round_details_log 为 BattleLog，查看战斗详情时再格式化为文本。
+        所有随机数都取自 rng（默认全局 random），因此同一个种子和同样的输入得到完全相同的战斗。
+        """
+        items_manager = items_manager or Items()
+        calculate_damage = PvPManager._calculate_damage
+        rng = rng or random
 
         p1_state = PlayerBattleInternalState(p1_info_dict, items_manager)
         p2_state = PlayerBattleInternalState(p2_info_dict, items_manager)
+        both_states = (p1_state, p2_state)
 
         battle_log = [
             f"⚔️ 一场惊心动魄的对决在【{p1_state.user_name}】与【{p2_state.user_name}】之间展开！",
@@ -48,28 +194,24 @@ class PvPManager:
             f"【{p2_state.user_name}】:\n ❤️{p2_state.hp}/{p2_state.base_hp}\n 💙{p2_state.mp}/{p2_state.base_mp}\n ⚔️{p2_state.base_atk}",
             "----------------------------------"
         ]
-        battle_round_details_log = []
+        battle_round_details_log = BattleLog()
+        log = battle_round_details_log.append
 
         turn_p1 = p1_state.power >= p2_state.power # 假设 power 是一个初始战斗力用于决定先手
 
         for round_num in range(1, max_rounds + 1):
-            battle_round_details_log.append(f"-----------------回合 {round_num} -----------------")
+            log(("round", round_num))
 
             p1_state.tick_cooldowns_and_effects()
             p2_state.tick_cooldowns_and_effects()
 
-            # 应用DoT伤害 (双方)
-            for player_s_dot in [p1_state, p2_state]:
-                dot_damage_this_round = 0
-                active_dots_after_tick = []
-                for dot_effect in player_s_dot.active_dot_effects:
-                    dot_damage_this_round += dot_effect['damage_per_turn']
-                    # 效果在 tick_cooldowns_and_effects 中减少回合，这里只结算伤害
+            # 应用DoT伤害 (双方)，每回合伤害在添加/到期时已经累计好
+            for player_s_dot in both_states:
+                dot_damage_this_round = player_s_dot.dot_damage_per_turn
                 if dot_damage_this_round > 0:
                     player_s_dot.hp -= dot_damage_this_round
-                    battle_round_details_log.append(f"🩸【{player_s_dot.user_name}】受到持续伤害效果，损失了 {dot_damage_this_round} 点气血。剩余HP: {max(0, player_s_dot.hp)}")
+                    log(("dot", player_s_dot.user_name, dot_damage_this_round, max(0, player_s_dot.hp)))
                     if player_s_dot.hp <= 0: break
-                if player_s_dot.hp <= 0: break 
             if p1_state.hp <= 0 or p2_state.hp <= 0: break # 一方因DoT死亡
 
             # --- 轮流行动 ---
@@ -78,26 +220,24 @@ class PvPManager:
             else:
                 attacker, defender = p2_state, p1_state
             
-            battle_round_details_log.append(f"轮到【{attacker.user_name}】行动...")
-            
+            log(("turn", attacker.user_name))
+
+            turn_damage = 0 # 本次行动造成的直接伤害（用于吸血）
             if attacker.is_sealed > 0:
-                battle_round_details_log.append(f"【{attacker.user_name}】被封印了，本回合无法行动！(剩余 {attacker.is_sealed} 回合)")
+                log(("sealed", attacker.user_name, attacker.is_sealed))
             else:
                 # === 玩家行动决策：使用神通还是普攻 ===
                 used_skill_this_turn = False
                 if attacker.can_use_skill():
-                    skill_cast_rate = attacker.active_skill_data.get('rate', 100) / 100.0
-                    if random.random() <= skill_cast_rate:
+                    skill_data = attacker.active_skill_data
+                    if rng.random() <= attacker.skill_cast_rate:
                         used_skill_this_turn = True
-                        skill_data = attacker.active_skill_data
-                        battle_round_details_log.append(f"✨【{attacker.user_name}】准备施展神通【{skill_data['name']}】！")
+                        log(("skill_cast", attacker.user_name, skill_data['name']))
 
                         hp_cost = attacker.apply_hp_cost_for_skill()
                         mp_cost = attacker.apply_mp_cost_for_skill()
-                        cost_log_parts = []
-                        if hp_cost > 0: cost_log_parts.append(f"消耗气血 {hp_cost}")
-                        if mp_cost > 0: cost_log_parts.append(f"消耗真元 {mp_cost}")
-                        if cost_log_parts: battle_round_details_log.append(f"({', '.join(cost_log_parts)})")
+                        if hp_cost > 0 or mp_cost > 0:
+                            log(("skill_cost", hp_cost, mp_cost))
                         
                         # 按照您的要求，turncost 既是持续也是冷却
                         attacker.skill_cooldown = skill_data.get('turncost', 0)  + 1
@@ -107,17 +247,18 @@ class PvPManager:
                         if skill_type == 1: #直接伤害/多段伤害
                             total_skill_damage = 0
                             for hit_multiplier in skill_data.get('atkvalue', [1.0]):
-                                damage_this_hit, was_crit_skill = PvPManager._calculate_damage(
+                                damage_this_hit, was_crit_skill = calculate_damage(
                                     int(attacker.get_current_atk() * hit_multiplier), # 使用当前计算的攻击力
                                     defender.get_current_defense_rate(),
                                     attacker.get_current_crit_rate(),
-                                    attacker.get_current_crit_damage()
+                                    attacker.get_current_crit_damage(),
+                                    rng
                                 )
-                                crit_text_skill = "✨暴击！" if was_crit_skill else ""
-                                battle_round_details_log.append(f"  💥 神通造成 {damage_this_hit} 点伤害！{crit_text_skill}")
+                                log(("skill_hit", damage_this_hit, CRIT_TEXT if was_crit_skill else ""))
                                 defender.hp -= damage_this_hit
                                 total_skill_damage += damage_this_hit
-                            battle_round_details_log.append(f"  总计对【{defender.user_name}】造成 {total_skill_damage} 点神通伤害！")
+                            log(("skill_total", defender.user_name, total_skill_damage))
+                            turn_damage = total_skill_damage
 
                         elif skill_type == 2: # 持续性伤害 (DoT)
                             dot_damage_multiplier = skill_data.get('atkvalue', 0.0)
@@ -125,7 +266,7 @@ class PvPManager:
                             damage_per_turn = int(attacker.get_current_atk() * dot_damage_multiplier)
                             if damage_per_turn > 0 and dot_duration > 0:
                                 defender.add_dot_effect(skill_data['name'], damage_per_turn, dot_duration, attacker.user_id)
-                                battle_round_details_log.append(f"  【{defender.user_name}】受到了【{skill_data['name']}】效果，将在接下来 {dot_duration} 回合持续受到伤害！")
+                                log(("dot_applied", defender.user_name, skill_data['name'], dot_duration))
                                 used_skill_this_turn = False
                         
                         elif skill_type == 3: # Buff/Debuff
@@ -135,119 +276,82 @@ class PvPManager:
                             buff_type_from_skill_json = skill_data.get('bufftype') # 原版是字符串 "1", "2"
                             buff_value = skill_data.get('buffvalue', 0.0) # 这个值本身就是小数倍率
                             buff_duration = skill_data.get('turncost', 0)
-                            
-                            buff_applied_type_internal = None # 用于 active_buff_effects 的type
-                            buff_desc_for_log = ""
                             is_debuff_flag = target_is_opponent # 简单认为给对方上的就是debuff
 
-                            if buff_type_from_skill_json == 1 or buff_type_from_skill_json == "1": # 攻击力
-                                buff_applied_type_internal = "atk_rate"
-                                buff_desc_for_log = f"攻击力变化 {buff_value*100:+.0f}%" # +号显示正负
-                            elif buff_type_from_skill_json == 2 or buff_type_from_skill_json == "2": # 减伤率 (对应防御率)
-                                buff_applied_type_internal = "def_rate"
-                                buff_desc_for_log = f"减伤率变化 {buff_value*100:+.0f}%"
-                            # --- 补充其他 bufftype ---
-                            elif buff_type_from_skill_json == "crit_rate_add": # 假设神通数据中这样定义
-                                buff_applied_type_internal = "crit_rate_add"
-                                buff_desc_for_log = f"暴击率变化 {buff_value*100:+.1f}%"
-                            elif buff_type_from_skill_json == "crit_dmg_add":
-                                buff_applied_type_internal = "crit_dmg_add"
-                                buff_desc_for_log = f"暴击伤害变化 {buff_value*100:+.1f}%"
-                            # ...可以继续添加其他类型的buff...
-                            else:
-                                battle_round_details_log.append(f"  【{skill_data['name']}】具有未知的bufftype: {buff_type_from_skill_json}")
-
-                            if buff_applied_type_internal and buff_duration > 0:
+                            buff_type_entry = SKILL_BUFF_TYPES.get(buff_type_from_skill_json)
+                            if buff_type_entry is None:
+                                log(("buff_unknown", skill_data['name'], buff_type_from_skill_json))
+                            elif buff_duration > 0:
+                                buff_applied_type_internal = buff_type_entry[0]
                                 target_player_state.add_buff_effect(
                                     skill_data['name'], buff_applied_type_internal,
                                     buff_value, buff_duration, attacker.user_id, is_debuff_flag
                                 )
-                                battle_round_details_log.append(f"  【{target_player_state.user_name}】受【{skill_data['name']}】影响，{buff_desc_for_log}，持续 {buff_duration} 回合！")
+                                log(("buff", target_player_state.user_name, skill_data['name'],
+                                     buff_applied_type_internal, buff_value, buff_duration))
                             used_skill_this_turn = False
 
                         elif skill_type == 4: # 封印
                             seal_success_rate = skill_data.get('success', 100) / 100.0
                             seal_duration = skill_data.get('turncost', 0)
-                            if random.random() <= seal_success_rate:
+                            if rng.random() <= seal_success_rate:
                                 defender.is_sealed = max(defender.is_sealed, seal_duration)
-                                battle_round_details_log.append(f"  【{defender.user_name}】被【{skill_data['name']}】封印了神通，持续 {seal_duration} 回合！")
+                                log(("seal", defender.user_name, skill_data['name'], seal_duration))
                             else:
-                                battle_round_details_log.append(f"  【{skill_data['name']}】对【{defender.user_name}】的封印失败了！")
+                                log(("seal_failed", skill_data['name'], defender.user_name))
                         
                     else: # 神通发动失败 (概率)
-                        battle_round_details_log.append(f"【{attacker.user_name}】施展神通【{attacker.active_skill_data['name']}】失败了！")
-                        used_skill_this_turn = False 
+                        log(("skill_failed", attacker.user_name, skill_data['name']))
                 
                 # === 如果没有使用技能，或者技能判定失败，则进行普通攻击 ===
                 if not used_skill_this_turn:
-                    battle_round_details_log.append(f"【{attacker.user_name}】选择了普通攻击...")
-                    damage_dealt, was_crit = PvPManager._calculate_damage(
+                    log(("attack_choice", attacker.user_name))
+                    damage_dealt, was_crit = calculate_damage(
                         attacker.get_current_atk(), # 使用动态计算的攻击力
                         defender.get_current_defense_rate(), # 使用动态计算的防御率
                         attacker.get_current_crit_rate(),
-                        attacker.get_current_crit_damage()
-                    )
-                    crit_text = "✨暴击！" if was_crit else ""
-                    battle_round_details_log.append(
-                        f"💥【{attacker.user_name}】的普通攻击，{crit_text}对【{defender.user_name}】造成了 {damage_dealt} 点伤害！"
+                        attacker.get_current_crit_damage(),
+                        rng
                     )
+                    log(("attack", attacker.user_name, CRIT_TEXT if was_crit else "", defender.user_name, damage_dealt))
                     defender.hp -= damage_dealt
+                    turn_damage = damage_dealt
             
-            battle_round_details_log.append(f"🩸【{defender.user_name}】剩余气血: {max(0, defender.hp)}")
+            log(("remaining_hp", defender.user_name, max(0, defender.hp)))
 
             # --- 攻击后辅修功法效果 (如吸血) ---
-            attacker_buff_info_obj = attacker.buff_info
-            if attacker_buff_info_obj and getattr(attacker_buff_info_obj, 'sub_buff', 0) != 0:
-                sub_buff_data_attacker = items_manager.get_data_by_item_id(attacker_buff_info_obj.sub_buff)
-                if sub_buff_data_attacker and sub_buff_data_attacker.get("buff_type") == "6": # 吸血
-                    leech_percent = float(sub_buff_data_attacker.get("buff", "0")) / 100.0
-                    # 吸血量基于实际造成的伤害 (需要确定是神通伤害还是普攻伤害，或两者都有)
-                    # 简单起见，我们假设它作用于本回合造成的所有直接伤害
-                    # 如果 used_skill_this_turn 且 skill_type == 1, 伤害是 total_skill_damage
-                    # 否则是 damage_dealt (如果是普攻)
-                    damage_source_for_leech = 0
-                    if used_skill_this_turn and skill_type == 1:
-                         damage_source_for_leech = total_skill_damage # total_skill_damage 在上面 skill_type 1 处定义
-                    elif not used_skill_this_turn:
-                         damage_source_for_leech = damage_dealt # damage_dealt 在上面普攻处定义
-                    
-                    leech_amount = int(damage_source_for_leech * leech_percent)
-                    if leech_amount > 0:
-                        original_attacker_hp = attacker.hp
-                        attacker.hp = min(attacker.base_hp, attacker.hp + leech_amount) # 注意这里用 base_hp 作为上限
-                        healed_by_leech = attacker.hp - original_attacker_hp
-                        if healed_by_leech > 0:
-                           battle_round_details_log.append(f"🩸【{sub_buff_data_attacker['name']}】效果发动，{attacker.user_name} 吸取了 {healed_by_leech} 点气血！")
-                elif sub_buff_data_attacker and sub_buff_data_attacker.get("buff_type") == "7":  # 吸血
-                    leech_percent = float(sub_buff_data_attacker.get("buff", "0")) / 100.0
-                    damage_source_for_leech = 0
-                    if used_skill_this_turn and skill_type == 1:
-                        damage_source_for_leech = total_skill_damage  # total_skill_damage 在上面 skill_type 1 处定义
-                    elif not used_skill_this_turn:
-                        damage_source_for_leech = damage_dealt  # damage_dealt 在上面普攻处定义
-
-                    leech_amount = int(damage_source_for_leech * leech_percent)
-                    if leech_amount > 0:
-                        original_attacker_mp = attacker.mp
-                        attacker.mp = min(attacker.base_mp, attacker.mp + leech_amount)  # 注意这里用 base_hp 作为上限
-                        healed_by_leech = attacker.mp - original_attacker_mp
-                        if healed_by_leech > 0:
-                            battle_round_details_log.append(
-                                f"🩸【{sub_buff_data_attacker['name']}】效果发动，{attacker.user_name} 吸取了 {healed_by_leech} 点真元！")
-                elif sub_buff_data_attacker and sub_buff_data_attacker.get("buff_type") == "8": # 对敌中毒效果
-                    # 假设 "buff" 字段存储的是每回合中毒伤害占攻击者当前攻击力的百分比
-                    # 并且辅修功法JSON中应有 "poison_duration" 和 "poison_chance" 字段
-                    poison_damage_percent_of_atk = float(sub_buff_data_attacker.get("buff", "0")) / 100.0
-                    poison_duration = int(sub_buff_data_attacker.get("poison_duration", 3)) # 默认持续3回合
-                    poison_chance = float(sub_buff_data_attacker.get("poison_chance", 0.5)) # 默认30%概率
-
-                    if random.random() < poison_chance:
-                        # 中毒伤害基于攻击者当前的攻击力
-                        damage_per_turn_for_poison = int(defender.hp * poison_damage_percent_of_atk)
-                        if damage_per_turn_for_poison > 0 and poison_duration > 0:
-                            # 使用辅修功法的名称作为DoT效果的名称
-                            defender.add_dot_effect(sub_buff_data_attacker['name'], damage_per_turn_for_poison, poison_duration, attacker.user_id)
-                            battle_round_details_log.append(f"☠️【{sub_buff_data_attacker['name']}】效果触发！【{defender.user_name}】身中剧毒，将在接下来 {poison_duration} 回合持续受到伤害！")
+            sub_buff_data_attacker = attacker.sub_buff_data
+            sub_buff_type = attacker.sub_buff_type
+            if sub_buff_type == "6": # 吸血
+                # 吸血量基于本次行动实际造成的直接伤害（神通伤害或普攻伤害）
+                leech_amount = int(turn_damage * attacker.sub_buff_rate)
+                if leech_amount > 0:
+                    original_attacker_hp = attacker.hp
+                    attacker.hp = min(attacker.base_hp, attacker.hp + leech_amount) # 注意这里用 base_hp 作为上限
+                    healed_by_leech = attacker.hp - original_attacker_hp
+                    if healed_by_leech > 0:
+                        log(("leech_hp", sub_buff_data_attacker['name'], attacker.user_name, healed_by_leech))
+            elif sub_buff_type == "7":  # 吸取真元
+                leech_amount = int(turn_damage * attacker.sub_buff_rate)
+                if leech_amount > 0:
+                    original_attacker_mp = attacker.mp
+                    attacker.mp = min(attacker.base_mp, attacker.mp + leech_amount)  # 注意这里用 base_mp 作为上限
+                    healed_by_leech = attacker.mp - original_attacker_mp
+                    if healed_by_leech > 0:
+                        log(("leech_mp", sub_buff_data_attacker['name'], attacker.user_name, healed_by_leech))
+            elif sub_buff_type == "8": # 对敌中毒效果
+                # 假设 "buff" 字段存储的是每回合中毒伤害占攻击者当前攻击力的百分比
+                # 并且辅修功法JSON中应有 "poison_duration" 和 "poison_chance" 字段
+                poison_duration = int(sub_buff_data_attacker.get("poison_duration", 3)) # 默认持续3回合
+                poison_chance = float(sub_buff_data_attacker.get("poison_chance", 0.5)) # 默认30%概率
+
+                if rng.random() < poison_chance:
+                    # 中毒伤害基于攻击者当前的攻击力
+                    damage_per_turn_for_poison = int(defender.hp * attacker.sub_buff_rate)
+                    if damage_per_turn_for_poison > 0 and poison_duration > 0:
+                        # 使用辅修功法的名称作为DoT效果的名称
+                        defender.add_dot_effect(sub_buff_data_attacker['name'], damage_per_turn_for_poison, poison_duration, attacker.user_id)
+                        log(("poison", sub_buff_data_attacker['name'], defender.user_name, poison_duration))
 
             # 检查防御方是否阵亡
             if defender.hp <= 0:
@@ -273,27 +377,11 @@ class PvPManager:
                 turn_p1 = True # 下一轮该 P1 先手判断
             # 如果一方死亡，则上面已经 return
 
-            # --- 大回合结束，结算双方的辅修功法（如回血回蓝） ---
-            # 注意：这里应该在双方都行动完毕后，或者至少在回合数增加前
-            # 当前逻辑是每个玩家行动后，会有一个turn_p1切换，所以下一个循环开始时attacker/defender会变
-            # 我们需要确保双方的回合结束效果都被触发
-            
-            if not turn_p1: # 刚刚是P1攻击，现在轮到P2，所以是P1的回合结束
-                effects_log_attacker = PvPManager._apply_end_of_round_sub_buff_effects(attacker, items_manager) # attacker此时是p1_state
-                if effects_log_attacker: battle_round_details_log.extend(effects_log_attacker)
-            else: # 刚刚是P2攻击，现在轮到P1，所以是P2的回合结束
-                effects_log_defender = PvPManager._apply_end_of_round_sub_buff_effects(attacker, items_manager) # attacker此时是p2_state
-                if effects_log_defender: battle_round_details_log.extend(effects_log_defender)
-            # (上面的逻辑有些绕，改为在回合末尾统一结算双方)
+            # --- 行动方的回合结束效果（如回血回蓝） ---
+            if sub_buff_type == "4" or sub_buff_type == "5":
+                PvPManager._apply_end_of_round_sub_buff_effects(attacker, battle_round_details_log)
 
         # === 循环结束后 ===
-        
-        # 大回合真正结束，结算双方的辅修功法被动回复效果
-        #effects_log_p1 = PvPManager._apply_end_of_round_sub_buff_effects(p1_state, items_manager)
-        #if effects_log_p1: battle_log.extend(effects_log_p1)
-        #
-        #effects_log_p2 = PvPManager._apply_end_of_round_sub_buff_effects(p2_state, items_manager)
-        #if effects_log_p2: battle_log.extend(effects_log_p2)
 
         battle_log.append(f"战斗共计【{round_num}】回合, 回合结束状态：【{p1_state.user_name}】HP:{max(0, p1_state.hp)} MP:{max(0, p1_state.mp)} | 【{p2_state.user_name}】HP:{max(0, p2_state.hp)} MP:{max(0, p2_state.mp)}")
         
@@ -332,6 +420,35 @@ class PvPManager:
         }
 
 
+    @staticmethod
+    def recorded_fight(p1_info_dict: dict, p2_info_dict: dict, max_rounds: int = 30,
+                       items_manager: Items | None = None) -> dict:
+        """
+        执行一场可回放的战斗，结果中额外附带 battle_replay（BattleReplay）。
+        只需保存 battle_replay，查看战斗详情时由 replay_fight 重新生成详细日志。
+        """
+        items_manager = items_manager or Items()
+        seed = random.getrandbits(63)  # 存入 SQLite 的有符号 64 位整数
+        replay = BattleReplay(
+            seed, snapshot_combatant(p1_info_dict, items_manager), snapshot_combatant(p2_info_dict, items_manager),
+            max_rounds, BATTLE_ENGINE_VERSION
+        )
+        battle_result = PvPManager.simulate_player_vs_player_fight(
+            p1_info_dict, p2_info_dict, max_rounds, items_manager, random.Random(seed)
+        )
+        battle_result["battle_replay"] = replay
+        return battle_result
+
+    @staticmethod
+    def replay_fight(replay: BattleReplay) -> dict | None:
+        """按记录的种子和属性快照重新模拟战斗，战斗内核版本已变化时返回 None"""
+        if replay.engine_version != BATTLE_ENGINE_VERSION:
+            return None
+        return PvPManager.simulate_player_vs_player_fight(
+            _combatant_from_snapshot(replay.p1), _combatant_from_snapshot(replay.p2), replay.max_rounds,
+            _SnapshotItems(replay.p1, replay.p2), random.Random(replay.seed)
+        )
+
     #@staticmethod
     #def simulate_full_bounty_fight(player_info: dict, monster_info: dict) -> dict:
     #    """
@@ -378,7 +495,7 @@ class PvPManager:
         """
         【修正版】执行抢劫战斗模拟, 调用核心PVP战斗逻辑
         """
-        battle_result = PvPManager.simulate_player_vs_player_fight(attacker_info, defender_info)
+        battle_result = PvPManager.recorded_fight(attacker_info, defender_info)
 
         final_result = {
             "winner": battle_result["winner"],
@@ -389,7 +506,8 @@ class PvPManager:
             "defender_hp_final": battle_result["p2_hp_final"],
             "attacker_mp_final": battle_result["p1_mp_final"], # 假设 attacker_info 是 p1
             "defender_mp_final": battle_result["p2_mp_final"],
-            "battle_round_details_log": battle_result["battle_round_details_log"]
+            "battle_round_details_log": battle_result["battle_round_details_log"],
+            "battle_replay": battle_result["battle_replay"]
         }
 
         if battle_result["winner"] == attacker_info['user_id']: # 攻击方胜利
@@ -469,60 +587,70 @@ class PvPManager:
         return result
 
     @staticmethod
-    def _apply_end_of_round_sub_buff_effects(player_state, service_items_instance) -> list[str]:
+    def _apply_end_of_round_sub_buff_effects(player_state, battle_log: BattleLog):
         """
-        在回合结束时应用玩家装备的辅修功法的被动效果。
+        在回合结束时应用玩家装备的辅修功法的被动效果（每回合回复气血/真元），事件记入 battle_log。
         :param player_state: 当前玩家的 PlayerBattleInternalState 实例
-        :param service_items_instance: Items 类的实例，用于获取物品信息
-        :return: 包含效果描述的日志列表
         """
-        effect_log = []
-        if not player_state: # 检查 player_state 对象本身是否为 None
-            return effect_log
-
-        buff_info_obj = player_state.buff_info # <<< 修正：直接访问属性
-        if not buff_info_obj: # 检查 buff_info 对象是否为 None
-            return effect_log
-
-        sub_buff_id = getattr(buff_info_obj, 'sub_buff', 0) # 安全获取 sub_buff
-
-        if sub_buff_id == 0:  # 没有装备辅修功法
-            return effect_log
-
-        sub_buff_data = service_items_instance.get_data_by_item_id(sub_buff_id)
-        if not sub_buff_data:
-            logger.warning(f"未能找到ID为 {sub_buff_id} 的辅修功法数据。")
-            return effect_log
+        sub_buff_data = player_state.sub_buff_data
+        if not sub_buff_data:  # 没有装备辅修功法
+            return
 
-        buff_type = sub_buff_data.get("buff_type")
-        buff_value_percent = float(sub_buff_data.get("buff", "0")) / 100.0
+        buff_type = player_state.sub_buff_type
+        buff_value_percent = player_state.sub_buff_rate
 
-        original_hp = player_state.hp # <<< 修正
-        original_mp = player_state.mp # <<< 修正
+        original_hp = player_state.hp
+        original_mp = player_state.mp
 
         if buff_type == "4":  # 每回合气血回复
-            # 注意：max_hp 在 PlayerBattleInternalState 中应该叫 base_hp (战斗开始时的最大血量)
-            # 或者如果 PlayerBattleInternalState 也有一个动态的 max_hp (受buff影响的当前最大血量)，则用那个
-            # 假设我们用 base_hp 作为回复上限和计算基准
-            hp_to_restore = int(player_state.base_hp * buff_value_percent) # <<< 修正
+            # 使用 base_hp（战斗开始时的最大血量）作为回复上限和计算基准
+            hp_to_restore = int(player_state.base_hp * buff_value_percent)
             if hp_to_restore > 0:
-                player_state.hp = min(player_state.base_hp, player_state.hp + hp_to_restore) # <<< 修正
+                player_state.hp = min(player_state.base_hp, player_state.hp + hp_to_restore)
                 healed_amount = player_state.hp - original_hp
                 if healed_amount > 0:
-                    effect_log.append(f"✨【{sub_buff_data['name']}】效果发动，{player_state.user_name} 回复了 {healed_amount} 点气血！")
+                    battle_log.append(("regen_hp", sub_buff_data['name'], player_state.user_name, healed_amount))
 
         elif buff_type == "5":  # 每回合真元回复
-            mp_to_restore = int(player_state.base_mp * buff_value_percent) # <<< 修正
+            mp_to_restore = int(player_state.base_mp * buff_value_percent)
             if mp_to_restore > 0:
-                player_state.mp = min(player_state.base_mp, player_state.mp + mp_to_restore) # <<< 修正
+                player_state.mp = min(player_state.base_mp, player_state.mp + mp_to_restore)
                 restored_mp_amount = player_state.mp - original_mp
                 if restored_mp_amount > 0:
-                    effect_log.append(f"✨【{sub_buff_data['name']}】效果发动，{player_state.user_name} 回复了 {restored_mp_amount} 点真元！")
+                    battle_log.append(("regen_mp", sub_buff_data['name'], player_state.user_name, restored_mp_amount))
 
-        return effect_log
+
+class BattleEffect:
+    """战斗中的持续效果：Buff/Debuff（kind 为 'atk_rate' 等）或持续伤害（kind 为 'dot'，value 为每回合伤害）"""
+
+    __slots__ = ("name", "kind", "value", "remaining_turns", "caster_id", "is_debuff")
+
+    def __init__(self, name: str, kind: str, value, remaining_turns: int, caster_id: str, is_debuff: bool = False):
+        self.name = name
+        self.kind = kind
+        self.value = value
+        self.remaining_turns = remaining_turns
+        self.caster_id = caster_id
+        self.is_debuff = is_debuff
 
 
 class PlayerBattleInternalState:
+    """
+    单场战斗中一方的状态
+
+    - 使用 __slots__，不为每场战斗创建属性字典
+    - Buff 和持续伤害的合计值在添加/到期时增量维护，读取当前攻击、减伤、暴击不再逐个求和
+    - 神通消耗、辅修功法数据等战斗中不变的值在开战时一次算好
+    """
+
+    __slots__ = (
+        "user_id", "user_name", "base_hp", "base_mp", "base_atk", "base_defense_rate", "base_crit_rate",
+        "base_crit_damage", "hp", "mp", "exp", "power", "level", "buff_info", "items_manager", "user_level_rank",
+        "active_skill_id", "active_skill_data", "skill_cast_rate", "skill_mp_cost", "skill_cooldown", "is_sealed",
+        "active_dot_effects", "active_buff_effects", "dot_damage_per_turn", "atk_rate_mod", "def_rate_mod",
+        "crit_rate_add", "crit_dmg_add", "sub_buff_data", "sub_buff_type", "sub_buff_rate",
+    )
+
     def __init__(self, p_info: dict, items_manager):
         self.user_id = p_info['user_id']
         self.user_name = p_info['user_name']
@@ -551,18 +679,35 @@ class PlayerBattleInternalState:
         # 神通相关状态
         self.active_skill_id = getattr(self.buff_info, 'sec_buff', 0) if self.buff_info else 0
         self.active_skill_data = self.items_manager.get_data_by_item_id(self.active_skill_id) if self.active_skill_id != 0 else None
-        logger.info("self.active_skill_data :" + str(self.active_skill_data))
+        self.skill_cast_rate = self.active_skill_data.get('rate', 100) / 100.0 if self.active_skill_data else 0.0
+        self.skill_mp_cost = self._calculate_actual_mp_cost()
         
         self.skill_cooldown = 0 # 当前神通的剩余冷却回合
         self.is_sealed = 0 # 被封印的剩余回合
+
+        # 辅修功法（吸血、回复、中毒等），战斗中不会变化
+        self.sub_buff_data = None
+        self.sub_buff_type = None
+        self.sub_buff_rate = 0.0
+        sub_buff_id = getattr(self.buff_info, 'sub_buff', 0) if self.buff_info else 0
+        if sub_buff_id != 0:
+            self.sub_buff_data = self.items_manager.get_data_by_item_id(sub_buff_id)
+            if self.sub_buff_data:
+                self.sub_buff_type = self.sub_buff_data.get("buff_type")
+                self.sub_buff_rate = float(self.sub_buff_data.get("buff", "0")) / 100.0
+            else:
+                logger.warning(f"未能找到ID为 {sub_buff_id} 的辅修功法数据。")
         
-        # 战斗中的临时效果
-        self.active_dot_effects = [] 
-        # [{'name': str, 'damage_per_turn': int, 'remaining_turns': int, 'caster_id': str}]
-        
-        self.active_buff_effects = [] 
-        # [{'name': str, 'type': str(如'atk_rate', 'def_rate', 'crit_rate_add', 'crit_dmg_add'), 
-        #   'value': float, 'remaining_turns': int, 'caster_id': str, 'is_debuff': bool}]
+        # 战斗中的临时效果 (BattleEffect)
+        self.active_dot_effects = []
+        self.active_buff_effects = []
+
+        # 临时效果的合计值，在添加/到期时增量维护
+        self.dot_damage_per_turn = 0
+        self.atk_rate_mod = 0.0    # 攻击力倍率增量（增益减去减益）
+        self.def_rate_mod = 0.0    # 减伤率增量（增益减去减益）
+        self.crit_rate_add = 0.0
+        self.crit_dmg_add = 0.0
 
     def tick_cooldowns_and_effects(self):
         """每回合开始时调用，减少冷却和持续效果的回合数"""
@@ -572,48 +717,65 @@ class PlayerBattleInternalState:
         if self.is_sealed > 0:
             self.is_sealed -= 1
 
-        next_dots = []
-        for dot in self.active_dot_effects:
-            dot['remaining_turns'] -= 1
-            if dot['remaining_turns'] >= 0:
-                next_dots.append(dot)
-        self.active_dot_effects = next_dots
-        
-        next_buffs = []
-        for buff in self.active_buff_effects:
-            buff['remaining_turns'] -= 1
-            if buff['remaining_turns'] >= 0:
-                next_buffs.append(buff)
-        self.active_buff_effects = next_buffs
+        if self.active_dot_effects:
+            kept = 0
+            for dot in self.active_dot_effects:
+                dot.remaining_turns -= 1
+                if dot.remaining_turns >= 0:
+                    self.active_dot_effects[kept] = dot
+                    kept += 1
+                else:
+                    self.dot_damage_per_turn -= dot.value
+            del self.active_dot_effects[kept:]
+
+        if self.active_buff_effects:
+            kept = 0
+            for buff in self.active_buff_effects:
+                buff.remaining_turns -= 1
+                if buff.remaining_turns >= 0:
+                    self.active_buff_effects[kept] = buff
+                    kept += 1
+                else:
+                    self._accumulate_buff(buff, -1)
+            del self.active_buff_effects[kept:]
+            if not kept:  # 全部到期时清零，避免浮点误差累积
+                self.atk_rate_mod = self.def_rate_mod = self.crit_rate_add = self.crit_dmg_add = 0.0
+
+    def _accumulate_buff(self, buff: BattleEffect, sign: int):
+        """把一个Buff计入（sign=1）或移出（sign=-1）合计值"""
+        value = buff.value * sign
+        kind = buff.kind
+        if kind == 'atk_rate':
+            self.atk_rate_mod += -value if buff.is_debuff else value
+        elif kind == 'def_rate':
+            self.def_rate_mod += -value if buff.is_debuff else value
+        elif kind == 'crit_rate_add':
+            self.crit_rate_add += value
+        elif kind == 'crit_dmg_add':
+            self.crit_dmg_add += value
 
     def get_current_atk(self) -> int:
         """计算应用了Buff后的当前攻击力"""
-        atk_rate_bonus = sum(b['value'] for b in self.active_buff_effects if b['type'] == 'atk_rate' and not b.get('is_debuff'))
-        atk_rate_penalty = sum(b['value'] for b in self.active_buff_effects if b['type'] == 'atk_rate' and b.get('is_debuff'))
         # 可以考虑固定值加成，但原版神通似乎没有
-        return int(self.base_atk * (1 + atk_rate_bonus - atk_rate_penalty))
+        return int(self.base_atk * (1 + self.atk_rate_mod))
 
     def get_current_defense_rate(self) -> float:
         """计算应用了Buff后的当前减伤率"""
-        def_rate_bonus = sum(b['value'] for b in self.active_buff_effects if b['type'] == 'def_rate' and not b.get('is_debuff'))
-        def_rate_penalty = sum(b['value'] for b in self.active_buff_effects if b['type'] == 'def_rate' and b.get('is_debuff'))
-        current_def = self.base_defense_rate + def_rate_bonus - def_rate_penalty
+        current_def = self.base_defense_rate + self.def_rate_mod
         return min(0.9, max(0, current_def)) # 减伤率限制在 0% 到 90%
 
     def get_current_crit_rate(self) -> float:
         """计算应用了Buff后的当前暴击率"""
-        crit_rate_add = sum(b['value'] for b in self.active_buff_effects if b['type'] == 'crit_rate_add')
         # 假设暴击率是直接加算，且不超过100%
-        return min(1.0, self.base_crit_rate + crit_rate_add)
+        return min(1.0, self.base_crit_rate + self.crit_rate_add)
 
     def get_current_crit_damage(self) -> float:
         """计算应用了Buff后的当前暴击伤害加成"""
-        crit_dmg_add = sum(b['value'] for b in self.active_buff_effects if b['type'] == 'crit_dmg_add')
         # 暴击伤害加成也是直接加算
-        return self.base_crit_damage + crit_dmg_add
+        return self.base_crit_damage + self.crit_dmg_add
 
     def _calculate_actual_mp_cost(self) -> int:
-        """计算神通实际MP消耗，考虑境界折减"""
+        """计算神通实际MP消耗，考虑境界折减（战斗中不变，开战时计算一次）"""
         if not self.active_skill_data:
             return 0
 
@@ -633,18 +795,10 @@ class PlayerBattleInternalState:
         level_diff = self.user_level_rank - skill_rank_numeric # 玩家境界rank - 技能品阶rank
                                                               # 同样，正数代表玩家境界远高于技能品阶
 
-        reduction_factor = 1.0 # 默认无折减
-        # 从 MP_COST_REDUCTION_MAP 中查找合适的折减系数
-        # 遍历映射表，找到第一个满足条件的境界差（因为表是按差值从大到小或特定顺序定义的）
-        # 假设 MP_COST_REDUCTION_MAP 的键是从大（高境界差）到小（低境界差）排列
-        # 或者，更通用的方法是找到最接近且不超过 level_diff 的那个键
-
-        # 精确查找或向下取最接近的键
-        applicable_reduction_key = 0 # 默认无差（对应1.0的因子）
-        for diff_threshold in sorted(MP_COST_REDUCTION_MAP.keys(), reverse=True): # 从大到小遍历阈值
-            if level_diff >= diff_threshold:
-                applicable_reduction_key = diff_threshold
-                break
+        # 精确查找或向下取最接近的键（阈值从大到小遍历）
+        applicable_reduction_key = next(
+            (diff_threshold for diff_threshold in MP_COST_THRESHOLDS if level_diff >= diff_threshold), 0
+        )
         reduction_factor = MP_COST_REDUCTION_MAP.get(applicable_reduction_key, 1.0)
 
         actual_mp_cost = int(base_required_mp * reduction_factor)
@@ -652,24 +806,14 @@ class PlayerBattleInternalState:
         min_cost_for_any_skill = max(1, int(self.base_mp * 0.01)) # 例如，最低消耗1点MP或最大MP的1%，取较大者
         actual_mp_cost = max(min_cost_for_any_skill, actual_mp_cost)
 
-        # logger.debug(f"MP消耗计算: 技能 {self.active_skill_data['name']}, 基础消耗百分比 {base_mp_cost_percent*100}%, "
-        #              f"基础MP消耗 {base_required_mp}, 玩家品阶 {self.user_level_rank} ({self.level}), "
-        #              f"技能品阶 {skill_rank_value} ({skill_rank_text}), 境界差 {level_diff}, "
-        #              f"折减系数 {reduction_factor:.2f}, 最终消耗 {actual_mp_cost}")
-
         return actual_mp_cost
 
-    # can_use_skill, apply_mp_cost_for_skill 方法将自动使用新的 _calculate_actual_mp_cost 逻辑，
-    # 无需显式修改这两个方法内部的MP消耗计算部分，因为它们已经调用了 _calculate_actual_mp_cost。
-    # 只需要确保 can_use_skill 中的MP检查是 >= _calculate_actual_mp_cost() 的结果。
     # HP消耗判断逻辑保持不变。
     def can_use_skill(self) -> bool:
         if self.is_sealed > 0: return False
         if not self.active_skill_data: return False
         if self.skill_cooldown > 0: return False
-
-        required_mp = self._calculate_actual_mp_cost()
-        if self.mp < required_mp: return False
+        if self.mp < self.skill_mp_cost: return False
 
         #hp_cost_percent = self.active_skill_data.get('hpcost', 0.0)
         #if hp_cost_percent > 0:
@@ -678,18 +822,12 @@ class PlayerBattleInternalState:
         #         return False
         return True
 
-    def apply_mp_cost_for_skill(self): # 这个方法本身不需要改，因为它调用了已修改的_calculate_actual_mp_cost
+    def apply_mp_cost_for_skill(self):
         if self.active_skill_data:
-            actual_mp_cost = self._calculate_actual_mp_cost()
-            self.mp -= actual_mp_cost
-            return actual_mp_cost
+            self.mp -= self.skill_mp_cost
+            return self.skill_mp_cost
         return 0
 
-        
-        mp_cost_percent = self.active_skill_data.get('mpcost', 0.0)
-        required_mp = int(self.exp * mp_cost_percent) # MP消耗基于修为
-        return self.mp >= required_mp
-
     def apply_hp_cost_for_skill(self):
         if self.active_skill_data:
             hp_cost_percent = self.active_skill_data.get('hpcost', 0.0)
@@ -703,14 +841,57 @@ class PlayerBattleInternalState:
     def add_buff_effect(self, name: str, buff_type_str: str, value: float, duration: int, caster_id: str, is_debuff: bool = False):
         """添加一个Buff/Debuff效果"""
         # 可选：实现Buff叠加/覆盖逻辑，例如同名高级覆盖低级，或同类型取最高等
-        self.active_buff_effects.append({
-            'name': name, 'type': buff_type_str, 'value': value,
-            'remaining_turns': duration, 'caster_id': caster_id, 'is_debuff': is_debuff
-        })
+        buff = BattleEffect(name, buff_type_str, value, duration, caster_id, is_debuff)
+        self.active_buff_effects.append(buff)
+        self._accumulate_buff(buff, 1)
         
     def add_dot_effect(self, name: str, damage_per_turn: int, duration: int, caster_id: str):
         """添加一个持续伤害效果"""
-        self.active_dot_effects.append({
-            'name': name, 'damage_per_turn': damage_per_turn,
-            'remaining_turns': duration, 'caster_id': caster_id
-        })
+        self.active_dot_effects.append(BattleEffect(name, "dot", damage_per_turn, duration, caster_id))
+        self.dot_damage_per_turn += damage_per_turn
+
+
+def _benchmark_player(rng: random.Random, index: int, skill_ids: list, sub_buff_ids: list) -> dict:
+    """生成一个用于基准测试的虚拟玩家"""
+    max_hp = rng.randint(50000, 200000)
+    max_mp = rng.randint(20000, 100000)
+    return {
+        "user_id": f"bench{index}", "user_name": f"道友{index}",
+        "max_hp": max_hp, "hp": max_hp, "max_mp": max_mp, "mp": max_mp,
+        "atk": rng.randint(3000, 12000), "defense_rate": rng.uniform(0.0, 0.5),
+        "crit_rate": rng.uniform(0.05, 0.4), "crit_damage": rng.uniform(0.2, 1.0),
+        "power": rng.randint(1, 10 ** 6), "level": "江湖好手", "exp": 0,
+        "buff_info": SimpleNamespace(
+            sec_buff=rng.choice(skill_ids) if skill_ids else 0,
+            sub_buff=rng.choice(sub_buff_ids) if sub_buff_ids else 0,
+        ),
+    }
+
+
+def benchmark(fights: int = 5000, seed: int = 0, items_manager: Items | None = None) -> dict:
+    """
+    战斗内核微基准：用随机生成的双方（装备物品目录中随机的神通、辅修功法）连续模拟 fights 场战斗。
+    分别统计只模拟、以及模拟后再把详细日志格式化为文本（查看战斗详情）时的每秒场数。
+    """
+    items_manager = items_manager or Items()
+    rng = random.Random(seed)
+    skill_ids = list(items_manager.get_ids_by_item_type('神通'))
+    sub_buff_ids = list(items_manager.get_ids_by_item_type('辅修功法'))
+    pairs = [(_benchmark_player(rng, 2 * i, skill_ids, sub_buff_ids),
+              _benchmark_player(rng, 2 * i + 1, skill_ids, sub_buff_ids)) for i in range(fights)]
+
+    random.seed(seed)
+    start = time.perf_counter()
+    results = [PvPManager.simulate_player_vs_player_fight(p1, p2, items_manager=items_manager) for p1, p2 in pairs]
+    simulate_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lines = sum(len(result["battle_round_details_log"].format()) for result in results)
+    format_elapsed = time.perf_counter() - start
+
+    return {
+        "fights": fights,
+        "fights_per_second": fights / simulate_elapsed if simulate_elapsed else float("inf"),
+        "fights_per_second_with_details": fights / (simulate_elapsed + format_elapsed),
+        "avg_events_per_fight": lines / fights if fights else 0.0,
+    }
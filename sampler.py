@@ -0,0 +1,158 @@
+import random
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，缺失时批量抽样退化为逐个抽样
+    np = None
+
+
+class AliasSampler:
+    """
+    加权随机抽样器（Vose 别名法）
+
+    - 建表 O(n)，之后每次抽样 O(1)，只需一个随机数
+    - 权重可以是整数或小数，无需归一化；全部为 0 时退化为等概率
+    - 抽样时可传入 random.Random 实例，便于用固定种子复现结果
+    """
+
+    __slots__ = ("items", "weights", "total_weight", "_prob", "_alias", "_np_tables", "rng")
+
+    def __init__(self, items: Sequence, weights: Sequence[float], rng: random.Random | None = None):
+        if len(items) != len(weights):
+            raise ValueError("物品数量与权重数量不一致")
+        if not items:
+            raise ValueError("抽样表不能为空")
+        if any(w < 0 for w in weights):
+            raise ValueError("权重不能为负数")
+
+        self.items = list(items)
+        self.weights = list(weights)
+        self.total_weight = sum(self.weights)
+        self.rng = rng or random
+
+        n = len(self.items)
+        if self.total_weight > 0:
+            scaled = [w * n / self.total_weight for w in self.weights]
+        else:
+            scaled = [1.0] * n
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 剩余项由于浮点误差可能略小于 1，按 1 处理
+        self._prob = prob
+        self._alias = alias
+        self._np_tables = None  # numpy 版本的概率表和别名表，首次批量抽样时建立
+
+    @classmethod
+    def from_weighted(cls, entries: Sequence[dict], key: str = "weight", rng: random.Random | None = None) -> "AliasSampler":
+        """由带权重字段的字典列表建表，抽样返回字典本身"""
+        return cls(entries, [entry[key] for entry in entries], rng)
+
+    @classmethod
+    def from_mapping(cls, mapping: dict, rng: random.Random | None = None) -> "AliasSampler":
+        """由 {结果: 权重} 建表"""
+        return cls(list(mapping.keys()), list(mapping.values()), rng)
+
+    @classmethod
+    def from_probabilities(cls, mapping: dict, default=None, rng: random.Random | None = None) -> "AliasSampler":
+        """
+        由 {结果: 概率} 建表，与"取一个 [0,1) 随机数、按顺序累加概率、落入即选中"的旧写法分布一致：
+        累计超过 1 的部分被截断，不足 1 的剩余部分抽中 default
+        """
+        items, weights = [], []
+        cumulative = 0.0
+        for item, p in mapping.items():
+            effective = min(max(p, 0.0), max(1.0 - cumulative, 0.0))
+            cumulative += max(p, 0.0)
+            if effective > 0:
+                items.append(item)
+                weights.append(effective)
+        remainder = 1.0 - sum(weights)
+        if remainder > 1e-9 or not items:
+            if default in items:
+                weights[items.index(default)] += remainder
+            else:
+                items.append(default)
+                weights.append(max(remainder, 0.0))
+        return cls(items, weights, rng)
+
+    def __len__(self):
+        return len(self.items)
+
+    def sample(self, rng: random.Random | None = None):
+        n = len(self._prob)
+        u = (rng or self.rng).random() * n
+        i = min(int(u), n - 1)  # 防止浮点舍入使 u 恰好等于 n
+        return self.items[i] if u - i < self._prob[i] else self.items[self._alias[i]]
+
+    def sample_indices(self, k: int, rng: random.Random | None = None) -> list[int]:
+        """
+        批量抽取 k 次，返回物品下标列表。
+        安装了 numpy 时一次向量化完成（numpy 生成器的种子取自 rng，固定种子仍可复现）。
+        """
+        rng = rng or self.rng
+        n, prob, alias = len(self._prob), self._prob, self._alias
+        if np is not None and k > 1:
+            if self._np_tables is None:
+                self._np_tables = (np.asarray(prob), np.asarray(alias))
+            np_prob, np_alias = self._np_tables
+            generator = np.random.default_rng(rng.getrandbits(64))
+            u = generator.random(k) * n
+            i = np.minimum(u.astype(np.int64), n - 1)
+            return np.where(u - i < np_prob[i], i, np_alias[i]).tolist()
+        result = []
+        for _ in range(k):
+            u = rng.random() * n
+            i = min(int(u), n - 1)
+            result.append(i if u - i < prob[i] else alias[i])
+        return result
+
+    def sample_many(self, k: int, rng: random.Random | None = None) -> list:
+        items = self.items
+        return [items[i] for i in self.sample_indices(k, rng)]
+
+
+class SamplerCache:
+    """
+    抽样表缓存，每张表只建一次
+
+    - key 标识一张表；source 为建表所用的数据对象，传入时若与缓存时不是同一个对象则重建
+    - 对每次从数据库读出的表，可把 (物品, 权重) 元组直接作为 key，内容不变就命中缓存
+    - 超出容量时淘汰最久未用的表
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[object, AliasSampler]] = OrderedDict()
+
+    def get(self, key: Hashable, build: Callable[[], AliasSampler | None], source=None) -> AliasSampler | None:
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is source:
+                self._entries.move_to_end(key)
+                return entry[1]
+        sampler = build()
+        with self.lock:
+            self._entries[key] = (source, sampler)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return sampler
+
+    def invalidate(self, key: Hashable | None = None):
+        with self.lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
@@ -80,7 +80,37 @@ class XianScheduler:
         self.scheduler.add_job(self._daily_check_expired_mortgages_task, "cron", hour=1, minute=0,
                                id="check_expired_mortgages")
 
+        # 定时写回玩家状态缓存中的脏数据
+        self.scheduler.add_job(self._flush_player_cache_task, "interval", seconds=10, id="flush_player_cache")
 
+        # 推进冷却时间轮，分批写回冷却修改
+        self.scheduler.add_job(self._flush_cooldowns_task, "interval", seconds=5, id="flush_cooldowns")
+
+        # 主动回收过期的临时Buff
+        self.scheduler.add_job(self._expire_temp_buffs_task, "interval", seconds=30, id="expire_temp_buffs")
+
+
+
+    async def _flush_player_cache_task(self):
+        """定时写回玩家状态缓存"""
+        try:
+            self.service.flush_player_cache()
+        except Exception as e:
+            logger.error(f"写回玩家状态缓存失败: {e}")
+
+    async def _flush_cooldowns_task(self):
+        """定时回收过期冷却并写回冷却修改"""
+        try:
+            self.service.flush_cooldowns()
+        except Exception as e:
+            logger.error(f"写回冷却记录失败: {e}")
+
+    async def _expire_temp_buffs_task(self):
+        """定时回收过期的临时Buff"""
+        try:
+            self.service.expire_temp_buffs()
+        except Exception as e:
+            logger.error(f"回收过期临时Buff失败: {e}")
 
     async def _market_auto_add_task(self):
         """定时自动上架商品"""
@@ -253,7 +283,8 @@ class XianScheduler:
 
             refreshed_market = {}
             for key in items_for_sale_keys:
-                item_info = goods_data[key]
+                # goods_data 为只读共享数据，复制后再添加库存和价格
+                item_info = dict(goods_data[key])
                 item_info['id'] = key
                 # 为商品添加随机库存和价格浮动
                 item_info['quantity'] = random.randint(1, 10)
@@ -321,7 +352,7 @@ class XianScheduler:
             # 3. 从数据库重新获取一次，确保数据一致性，并作为内存中的当前BOSS
             # 或者，可以直接使用 boss_info_template 并补充数据库ID
             # 为了简单和一致，推荐从数据库获取
-            self.plugin_instance.world_boss = self.service.get_active_boss()
+            self.plugin_instance.world_boss = self.plugin_instance.boss_state.load()
             if not self.plugin_instance.world_boss:
                 logger.error("存入数据库后未能成功获取BOSS信息，请检查 get_active_boss 方法！")
                 return {"success": False, "message": "BOSS数据同步失败。"}
@@ -3,14 +3,28 @@ import json
 import random
 import sqlite3
 from collections import namedtuple
+from collections.abc import Mapping
 import time
 import re
+import threading
+from contextlib import contextmanager
+import functools
 
 from astrbot.api import logger
 
 from .config import XiuConfig, USERRANK
 from .data_manager import jsondata
+from .db_migrations import run_migrations
+from .db_pool import ConnectionManager
+from .player_cache import PlayerStateCache
+from .leaderboard import LeaderboardManager
+from .cooldown_manager import CooldownManager, BANK_SAVINGS_TYPE
+from .temp_buff_store import TempBuffStore
+from .sampler import AliasSampler, SamplerCache
+from .stats_engine import StatsEngine
 from .item_manager import Items
+from .pvp_manager import BattleReplay
+from .boss_state import BossSettlement
 
 # 定义数据模型
 UserDate = namedtuple(
@@ -44,6 +58,71 @@ BackpackItem = namedtuple(
     ["user_id", "goods_id", "goods_name", "goods_type", "goods_num", "create_time", "update_time",
      "remake", "day_num", "all_num", "action_time", "state", "bind_num"]
 )
+GachaPity = namedtuple(
+    "GachaPity",
+    ["user_id", "pool_id", "pity_counter", "total_pulls", "soft_pity_hits", "hard_pity_hits", "guarantee_hits",
+     "updated_at"]
+)
+
+# 批量任务期间写回冷却：任务线程可能已写入更晚到期的冷却（如24小时惩罚CD），同一冷却保留到期较晚者
+COOLDOWN_MERGE_SQL = """
+    INSERT INTO user_cd (user_id, type, create_time, scheduled_time) VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id, type) DO UPDATE SET
+        create_time = excluded.create_time, scheduled_time = excluded.scheduled_time
+    WHERE user_cd.scheduled_time IS NULL OR excluded.scheduled_time > user_cd.scheduled_time
+"""
+
+# 背包物品批量增加：键为 (user_id, goods_id)，已有则累加数量
+BACK_UPSERT_SQL = """
+    INSERT INTO back (user_id, goods_id, goods_name, goods_type, goods_num, create_time, update_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, goods_id) DO UPDATE SET
+        goods_num = goods_num + excluded.goods_num, update_time = excluded.update_time
+"""
+
+def _holds_write_lock(func):
+    """
+    用于工作单元外逐条提交的修改方法：执行期间持有写锁，使执行与提交成为一个整体。
+    写连接由多个线程共享（如钓鱼模块的后台线程），不持锁执行的写入可能落进其他线程正在进行的事务，随之提交或回滚。
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.db.write_lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def _syncs_player_cache(scope: str = "user"):
+    """
+    用于直接以 SQL 读写 user_xiuxian / BuffInfo 的方法：
+    执行前把玩家缓存中尚未写回的修改刷入数据库并丢弃缓存，执行期间相关玩家绕过缓存直接读写数据库。
+    scope: "user" 只处理第一个参数对应的玩家; "all" 处理全部玩家; "read" 只在执行前刷写（只读汇总查询）
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if scope == "read":
+                self._refresh_stale_power()
+                self._flush_player_cache()
+                return func(self, *args, **kwargs)
+
+            if scope == "user":
+                user_id = kwargs.get("user_id", args[0] if args else None)
+                with self.bypass_player_cache((user_id,)):
+                    return func(self, *args, **kwargs)
+
+            with self.db.write_lock:
+                self._flush_player_cache()
+                self.player_cache.clear()
+            self._cache_bypass_all += 1
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self._cache_bypass_all -= 1
+                self.leaderboards.invalidate()
+        return wrapper
+    return decorator
+
 
 class XiuxianService:
     """
@@ -52,19 +131,263 @@ class XiuxianService:
 
     def __init__(self, db_path):
         self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # WAL 模式：一个写连接 + 只读连接池
+        self.db = ConnectionManager(self.db_path)
+        self.conn = self.db.writer
         logger.info("修仙数据库已连接！")
+        self._tx_local = threading.local() # 工作单元的嵌套层数按线程记录，见 _tx_depth
+        self.player_cache = PlayerStateCache()
+        self._tx_open = False # 是否有工作单元正在进行（任一线程）
+        self._tx_touched: set[str] = set() # 工作单元期间缓存被修改或载入过的玩家，回滚时只丢弃这些
+        self._tx_ranked: set[str] = set() # 工作单元期间排行榜被增量修改过的玩家，回滚时只重读这些
+        self._cache_bypass = {} # 正在被直接 SQL 修改的玩家 -> 嵌套层数，期间绕过缓存
+        self._cache_bypass_all = 0
+        self._power_stale: set[str] = set() # 属性输入已变化、战力待重算的玩家
+        self.leaderboards = LeaderboardManager(self.db)
+        self.cooldowns = CooldownManager()
+        self._bulk_jobs = 0 # 正在运行的批量管理任务数，期间写回冷却不覆盖任务写入的更晚到期的冷却
         self._check_and_create_tables()
+        self._load_cooldowns()
         self.items = Items()
         self.xiu_config = XiuConfig()
         self.jsondata = jsondata
-        self.user_temp_buffs = {}
+        self.stats_engine = StatsEngine(self.items, self.xiu_config)
+        self.temp_buffs = TempBuffStore()
+        self._load_temp_buffs()
+        self.samplers = SamplerCache() # 灵根等权重表的抽样器
+
+    @property
+    def _tx_depth(self) -> int:
+        """
+        当前线程所在工作单元的嵌套层数。
+        写连接由多个线程共享（如钓鱼模块的后台线程），层数若在线程间共享，
+        其他线程的写入会误以为处于本线程的工作单元内而跳过提交。
+        """
+        return getattr(self._tx_local, "depth", 0)
+
+    @_tx_depth.setter
+    def _tx_depth(self, value: int):
+        self._tx_local.depth = value
+
+    @contextmanager
+    def transaction(self):
+        """
+        工作单元：块内所有写操作合并为一次提交，发生异常时整体回滚。
+        可以嵌套，内层使用 SAVEPOINT，异常时只回滚内层的修改。
+        整个工作单元期间持有写锁，其他线程的写入须同样经由 transaction() 进入，才会等待本单元结束。
+        注意：块内不要 await，否则其他协程的写入也会混入本事务。
+        """
+        with self.db.write_lock:
+            # 进入前先写回缓存，保证缓存中的脏数据都产生于本工作单元内
+            self._flush_player_cache()
+            self._flush_cooldowns()
+            depth = self._tx_depth
+            self._tx_depth += 1
+            try:
+                if depth == 0:
+                    self._tx_open = True
+                    if self.conn.in_transaction:
+                        self.conn.commit() # 先提交遗留的隐式事务
+                    self.conn.execute("BEGIN")
+                else:
+                    self.conn.execute(f"SAVEPOINT uow_{depth}")
+                try:
+                    yield self
+                    self._flush_player_cache()
+                    self._flush_cooldowns()
+                except BaseException:
+                    if depth == 0:
+                        self.conn.rollback()
+                    else:
+                        self.conn.execute(f"ROLLBACK TO uow_{depth}")
+                        self.conn.execute(f"RELEASE uow_{depth}")
+                    # 本工作单元在缓存中的修改随事务一起作废，其他玩家的缓存不受影响
+                    self.player_cache.discard(self._tx_touched)
+                    # 排行榜只重读本单元修改过的玩家，不整体失效（全量重建需扫描整张表）
+                    for user_id in self._tx_ranked:
+                        self.leaderboards.touch(user_id)
+                    self.cooldowns.discard_pending()
+                    self._load_cooldowns()
+                    raise
+                if depth == 0:
+                    self.conn.commit()
+                else:
+                    self.conn.execute(f"RELEASE uow_{depth}")
+            finally:
+                self._tx_depth -= 1
+                if depth == 0:
+                    self._tx_open = False
+                    self._tx_touched.clear()
+                    self._tx_ranked.clear()
+
+    def _commit(self):
+        """在工作单元内由最外层统一提交，否则立即提交（等待其他线程的工作单元结束，不会提交其半成品）"""
+        if not self._tx_depth:
+            with self.db.write_lock:
+                self.conn.commit()
+
+    def _rollback(self):
+        """
+        在工作单元内交由外层决定是否回滚，否则立即回滚。
+        工作单元外的修改方法都是逐条提交的，回滚只会撤销失败的那一条，排行榜无需失效。
+        """
+        if not self._tx_depth:
+            with self.db.write_lock:
+                self.conn.rollback()
+
+    def _flush_player_cache(self, user_id: str | None = None):
+        """把玩家缓存中的脏数据写回数据库，user_id 为 None 时写回全部"""
+        with self.db.write_lock:
+            if self.player_cache.flush(self.conn, user_id):
+                self._commit()
+
+    def flush_player_cache(self) -> int:
+        """显式写回全部玩家缓存（供定时任务和关闭时调用），返回写回的行数"""
+        with self.db.write_lock:
+            self._refresh_stale_power()
+            flushed = self.player_cache.flush(self.conn)
+            if flushed:
+                self._commit()
+            return flushed
+
+    def _load_cooldowns(self):
+        """从 user_cd 表重建内存中的冷却（会丢弃尚未写回的修改）"""
+        rows = self.conn.execute("SELECT user_id, type, create_time, scheduled_time FROM user_cd").fetchall()
+        count = self.cooldowns.load(rows)
+        logger.debug(f"已加载 {count} 条未过期的冷却记录。")
+
+    def _merge_cooldowns(self):
+        """把 user_cd 表中的冷却合并进内存，不丢弃内存中的冷却（批量任务结束后调用）"""
+        rows = self.conn.execute("SELECT user_id, type, create_time, scheduled_time FROM user_cd").fetchall()
+        count = self.cooldowns.merge(rows)
+        logger.debug(f"已从数据库合并 {count} 条冷却记录。")
+
+    def _flush_cooldowns(self) -> int:
+        """把待写的冷却修改分批写回 user_cd 表，返回写回的条数"""
+        upserts, deletes = self.cooldowns.take_pending()
+        if upserts:
+            self.conn.executemany(
+                COOLDOWN_MERGE_SQL if self._bulk_jobs else
+                "INSERT OR REPLACE INTO user_cd (user_id, type, create_time, scheduled_time) VALUES (?, ?, ?, ?)",
+                upserts
+            )
+        if deletes:
+            if self._bulk_jobs:
+                # 任务把冷却延长到更晚时不删除，稍后由 _merge_cooldowns 合并进内存
+                self.conn.executemany(
+                    "DELETE FROM user_cd WHERE user_id = ? AND type = ? AND scheduled_time <= ?", deletes
+                )
+            else:
+                self.conn.executemany(
+                    "DELETE FROM user_cd WHERE user_id = ? AND type = ?", [(user_id, cd_type) for user_id, cd_type, _ in deletes]
+                )
+        if upserts or deletes:
+            self._commit()
+        return len(upserts) + len(deletes)
+
+    def flush_cooldowns(self) -> int:
+        """推进冷却时间轮并写回待写的修改（供定时任务和关闭时调用），返回写回的条数"""
+        with self.db.write_lock:
+            self.cooldowns.tick()
+            return self._flush_cooldowns()
+
+    @contextmanager
+    def bulk_job(self):
+        """
+        批量管理任务的准备工作（须在事件循环线程中进入）：
+        写回并清空玩家缓存，任务期间所有玩家绕过缓存直接读写数据库。
+        """
+        with self.db.write_lock:
+            self.flush_player_cache()
+            self.flush_cooldowns()
+            self.player_cache.clear()
+        self._cache_bypass_all += 1
+        self._bulk_jobs += 1
+        try:
+            yield
+        finally:
+            self._cache_bypass_all -= 1
+            self._power_stale.clear()
+            self.leaderboards.invalidate()
+            # 批量任务可能直接修改了 user_cd 表：先按到期较晚者写回任务期间的冷却，再把任务写入的冷却合并进内存
+            with self.db.write_lock:
+                self.flush_cooldowns()
+                self._bulk_jobs -= 1
+                self._merge_cooldowns()
+
+    @contextmanager
+    def bypass_player_cache(self, user_ids):
+        """
+        写回并丢弃指定玩家的缓存，块内这些玩家绕过缓存直接读写数据库；
+        也用于工作线程直接修改这些玩家期间（须在事件循环线程中进入）。
+        """
+        user_ids = list(user_ids)
+        with self.db.write_lock:
+            for user_id in user_ids:
+                self._flush_player_cache(user_id)
+                self.player_cache.invalidate(user_id)
+                self._cache_bypass[user_id] = self._cache_bypass.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            for user_id in user_ids:
+                self._cache_bypass[user_id] -= 1
+                if not self._cache_bypass[user_id]:
+                    del self._cache_bypass[user_id]
+                self._power_stale.add(user_id) # 属性输入可能已变化，战力稍后增量重算
+                self.leaderboards.touch(user_id)
+
+    def _rank_add(self, user_id: str, column: str, delta):
+        """增量更新排行榜，并记录工作单元内被修改的玩家"""
+        if self._tx_open:
+            self._tx_ranked.add(user_id)
+        self.leaderboards.add(user_id, column, delta)
+
+    def _rank_set(self, user_id: str, column: str, value):
+        """覆盖排行榜中的数值，并记录工作单元内被修改的玩家"""
+        if self._tx_open:
+            self._tx_ranked.add(user_id)
+        self.leaderboards.set(user_id, column, value)
+
+    def _cache_enabled(self, user_id: str) -> bool:
+        return not self._cache_bypass_all and user_id not in self._cache_bypass
+
+    def _cache_touch(self, user_id: str):
+        """记录工作单元期间缓存被修改或载入的玩家（载入的行可能包含未提交的数据）"""
+        if self._tx_open:
+            self._tx_touched.add(user_id)
+
+    def _cache_add(self, user_id: str, column: str, delta: int) -> bool:
+        """
+        写回式累加字段，玩家未缓存时返回 False。
+        持有写锁修改缓存：其他线程的工作单元进行中时先等待其结束，
+        避免本次修改或触发的写回混入别人的事务。
+        """
+        with self.db.write_lock:
+            if not self._cache_enabled(user_id) or not self.player_cache.add(user_id, column, delta):
+                return False
+            self._cache_touch(user_id)
+            if self.player_cache.needs_flush():
+                self._flush_player_cache()
+            return True
+
+    def _cache_set(self, user_id: str, column: str, value) -> bool:
+        """写回式覆盖字段，玩家未缓存时返回 False（加锁原因同 _cache_add）"""
+        with self.db.write_lock:
+            if not self._cache_enabled(user_id) or not self.player_cache.set(user_id, column, value):
+                return False
+            self._cache_touch(user_id)
+            if self.player_cache.needs_flush():
+                self._flush_player_cache()
+            return True
 
     def get_goods_data(self) -> dict:
         return self.jsondata.get_goods_data()
 
     def close(self):
-        self.conn.close()
+        self.flush_player_cache()
+        self.flush_cooldowns()
+        self.db.close()
         logger.info("修仙数据库已关闭！")
 
     def _check_and_create_tables(self):
@@ -84,6 +407,39 @@ class XiuxianService:
                     "blessed_spot_name" TEXT
                 );
             """,
+            "user_temp_buff": """
+                CREATE TABLE "user_temp_buff" (
+                    "user_id" TEXT NOT NULL,
+                    "buff_key" TEXT NOT NULL,
+                    "value" TEXT,
+                    "expires_at" REAL,
+                    PRIMARY KEY ("user_id", "buff_key")
+                ) WITHOUT ROWID;
+            """,
+            "user_gacha_pity": """
+                CREATE TABLE "user_gacha_pity" (
+                    "user_id" TEXT NOT NULL,
+                    "pool_id" TEXT NOT NULL,
+                    "pity_counter" INTEGER NOT NULL DEFAULT 0,
+                    "total_pulls" INTEGER NOT NULL DEFAULT 0,
+                    "soft_pity_hits" INTEGER NOT NULL DEFAULT 0,
+                    "hard_pity_hits" INTEGER NOT NULL DEFAULT 0,
+                    "guarantee_hits" INTEGER NOT NULL DEFAULT 0,
+                    "updated_at" TEXT,
+                    PRIMARY KEY ("user_id", "pool_id")
+                ) WITHOUT ROWID;
+            """,
+            "user_battle_replay": """
+                CREATE TABLE "user_battle_replay" (
+                    "user_id" TEXT PRIMARY KEY NOT NULL,
+                    "seed" INTEGER NOT NULL,
+                    "p1_snapshot" TEXT NOT NULL,
+                    "p2_snapshot" TEXT NOT NULL,
+                    "max_rounds" INTEGER NOT NULL,
+                    "engine_version" INTEGER NOT NULL,
+                    "created_at" TEXT
+                );
+            """,
             "user_cd": """
                 CREATE TABLE "user_cd" (
                     "user_id" TEXT NOT NULL,
@@ -132,9 +488,21 @@ class XiuxianService:
                     "stone_reward" INTEGER NOT NULL, "atk" INTEGER NOT NULL,
                     "defense_rate" REAL DEFAULT 0.05,
                     "crit_rate" REAL DEFAULT 0.03,
-                    "crit_damage" REAL DEFAULT 0.1 
+                    "crit_damage" REAL DEFAULT 0.1,
+                    "last_hit_damage" INTEGER DEFAULT 0,
+                    "killed_by" TEXT
                 );
             """,
+            "world_boss_damage": """
+                CREATE TABLE "world_boss_damage" (
+                    "boss_id" INTEGER NOT NULL,
+                    "user_id" TEXT NOT NULL,
+                    "damage" INTEGER NOT NULL DEFAULT 0,
+                    "hits" INTEGER NOT NULL DEFAULT 0,
+                    "last_hit_at" TEXT,
+                    PRIMARY KEY ("boss_id", "user_id")
+                ) WITHOUT ROWID;
+            """,
             "active_groups": """
                 CREATE TABLE "active_groups" (
                     "group_id" TEXT NOT NULL PRIMARY KEY
@@ -197,7 +565,9 @@ class XiuxianService:
         boss_columns_to_add = {
             "defense_rate": "REAL DEFAULT 0.05",
             "crit_rate": "REAL DEFAULT 0.03",
-            "crit_damage": "REAL DEFAULT 0.1"
+            "crit_damage": "REAL DEFAULT 0.1",
+            "last_hit_damage": "INTEGER DEFAULT 0",
+            "killed_by": "TEXT"
         }
         c.execute("PRAGMA table_info(world_boss);")
         existing_boss_columns = [column[1] for column in c.fetchall()]
@@ -245,7 +615,10 @@ class XiuxianService:
             c.execute("ALTER TABLE user_bounty ADD COLUMN monster_atk INTEGER;")
             logger.info("成功为 user_bounty 表添加 monster_atk 字段。")
 
-        self.conn.commit()
+        self._commit()
+
+        # 执行版本化的结构迁移（索引、唯一约束等）
+        run_migrations(self.conn)
     # v-- 新增的类方法 --v
     def cal_max_hp(self, user_msg, hp_buff_rate: float) -> int:
         if user_msg.level.startswith("化圣境"):
@@ -268,11 +641,23 @@ class XiuxianService:
     
     def get_user_message(self, user_id: str) -> UserDate | None:
         """根据USER_ID获取原始用户信息"""
-        cur = self.conn.cursor()
-        cur.execute("SELECT * FROM user_xiuxian WHERE user_id=?", (user_id,))
-        result = cur.fetchone()
-        return UserDate(*result) if result else None
-
+        use_cache = self._cache_enabled(user_id)
+        if use_cache:
+            cached = self.player_cache.get_user(user_id)
+            if cached is not None:
+                return cached
+        with self.db.read() as conn:
+            result = conn.execute("SELECT * FROM user_xiuxian WHERE user_id=?", (user_id,)).fetchone()
+        if not result:
+            return None
+        user = UserDate(*result)
+        if use_cache:
+            self._cache_touch(user_id)
+            self.player_cache.put_user(user_id, user)
+        return user
+
+    @_holds_write_lock
+    @_syncs_player_cache()
     def register_user(self, user_id: str, user_name: str) -> dict:
         """注册新用户，返回一个包含结果的字典"""
         if self.get_user_message(user_id):
@@ -302,12 +687,14 @@ class XiuxianService:
             # 初始化 CD 表和 Buff 表
             c.execute("INSERT INTO user_cd (user_id) VALUES (?)", (user_id,))
             c.execute("INSERT INTO BuffInfo (user_id) VALUES (?)", (user_id,))
-            self.conn.commit()
+            self._commit()
             return {"success": True, "message": f"欢迎进入修仙世界，你的灵根为：{root}，类型是：{root_type}，你的战力为：{int(power)}，当前境界：江湖好手"}
         except Exception as e:
             logger.error(f"创建用户失败: {e}")
             return {"success": False, "message": "系统错误，创建角色失败！"}
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def get_sign(self, user_id: str) -> dict:
         """处理用户签到，返回结果字典"""
         user = self.get_user_message(user_id)
@@ -323,67 +710,141 @@ class XiuxianService:
         try:
             c = self.conn.cursor()
             c.execute("UPDATE user_xiuxian SET is_sign=1, stone=stone+?, exp=exp+? WHERE user_id=?", (ls, exp, user_id))
-            self.conn.commit()
+            self._commit()
             self.update_power2(user_id)
             return {'success': True, 'message': f'签到成功，获取{ls}块灵石, 修为增加{exp}！'}
         except Exception as e:
             logger.error(f"签到失败: {e}")
             return {'success': False, 'message': '签到失败，请联系管理员。'}
 
+    @_holds_write_lock
     def update_ls(self, user_id: str, amount: int, mode: int):
         """更新灵石, 1为增加, 2为减少"""
+        if mode in (1, 2):
+            self._rank_add(user_id, "stone", amount if mode == 1 else -amount)
+        if mode in (1, 2) and self._cache_add(user_id, "stone", amount if mode == 1 else -amount):
+            return
         c = self.conn.cursor()
         if mode == 1:
             c.execute("UPDATE user_xiuxian SET stone=stone+? WHERE user_id=?", (amount, user_id))
         elif mode == 2:
             c.execute("UPDATE user_xiuxian SET stone=stone-? WHERE user_id=?", (amount, user_id))
-        self.conn.commit()
+        self._commit()
         
+    @_holds_write_lock
     def update_exp(self, user_id: str, amount: int):
         """增加修为"""
+        self._power_stale.add(user_id)
+        self._rank_add(user_id, "exp", amount)
+        if self._cache_add(user_id, "exp", amount):
+            return
         c = self.conn.cursor()
         c.execute("UPDATE user_xiuxian SET exp=exp+? WHERE user_id=?", (amount, user_id))
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
     def update_j_exp(self, user_id: str, amount: int):
         """减少修为"""
+        self._power_stale.add(user_id)
+        self._rank_add(user_id, "exp", -amount)
+        if self._cache_add(user_id, "exp", -amount):
+            return
         c = self.conn.cursor()
         c.execute("UPDATE user_xiuxian SET exp=exp-? WHERE user_id=?", (amount, user_id))
-        self.conn.commit()
+        self._commit()
 
     def update_user_calculated_power(self, user_id: str):
         """【修正版】获取真实属性并用其计算的战力更新数据库"""
-        real_user_info = self.get_user_real_info(user_id)
-        if real_user_info and 'power' in real_user_info:
-            self._update_user_power_in_db(user_id, real_user_info['power'])
-        else:
-            logger.error(f"update_user_calculated_power: 无法为用户 {user_id} 更新战力，因无法获取其真实信息。")
+        self.update_power2(user_id)
 
     def update_power2(self, user_id: str):
-        """【修正版】获取真实属性并用其计算的战力更新数据库"""
-        real_user_info = self.get_user_real_info(user_id)
-        if real_user_info and 'power' in real_user_info:
-            self._update_user_power_in_db(user_id, real_user_info['power'])
-        else:
+        """【修正版】获取真实属性并用其计算的战力更新数据库（战力未变化时不写库）"""
+        if self._refresh_power(user_id) is None:
             logger.error(f"update_user_calculated_power: 无法为用户 {user_id} 更新战力，因无法获取其真实信息。")
 
+    def _refresh_power(self, user_id: str) -> bool | None:
+        """用属性引擎重算单个玩家的战力，只有变化时才写入；返回是否写入，玩家不存在时返回 None"""
+        self._power_stale.discard(user_id)
+        user_info = self.get_user_message(user_id)
+        buff_info = self.get_user_buff_info(user_id)
+        if not user_info or not buff_info:
+            return None
+        power = self.stats_engine.get(user_info, buff_info).power
+        if power == user_info.power:
+            return False
+        self._update_user_power_in_db(user_id, power)
+        return True
+
+    def _refresh_stale_power(self) -> int:
+        """增量重算所有属性输入已变化的玩家的战力，返回实际写入的人数"""
+        updated = 0
+        while self._power_stale:
+            if self._refresh_power(self._power_stale.pop()):
+                updated += 1
+        return updated
+
+    def _iter_user_stats(self, conn: sqlite3.Connection, chunk_size: int):
+        """分批流式读取玩家及其Buff，经属性引擎计算后逐批产出 [(UserDate, DerivedStats), ...]"""
+        level_data, root_data = self.jsondata.level_data(), self.jsondata.root_data()
+        user_width = len(UserDate._fields)
+        cur = conn.execute("SELECT u.*, b.* FROM user_xiuxian u LEFT JOIN BuffInfo b ON b.user_id = u.user_id")
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return
+            chunk = []
+            for row in rows:
+                user_info = UserDate(*row[:user_width])
+                buff_row = row[user_width:]
+                if buff_row[0] is None:
+                    buff_info = BuffInfo(id=-1, user_id=user_info.user_id, main_buff=0, sec_buff=0, faqi_buff=0,
+                                         fabao_weapon=0, armor_buff=0, atk_buff=0, blessed_spot=0, sub_buff=0)
+                else:
+                    buff_info = BuffInfo(*buff_row)
+                # 批量计算不经过 LRU 缓存，避免冲掉在线玩家的热数据
+                chunk.append((user_info, self.stats_engine.compute(user_info, buff_info, level_data, root_data)))
+            yield chunk
+
+    @_syncs_player_cache("all")
+    def recompute_all_power(self, chunk_size: int = 1000) -> dict:
+        """
+        全服战力批量重算：分批流式读取玩家及其Buff，经属性引擎计算后，
+        每批只用一次 executemany 写回发生变化的战力。
+        """
+        start = time.perf_counter()
+        total = updated = 0
+        with self.db.read() as conn:
+            for chunk in self._iter_user_stats(conn, chunk_size):
+                changes = [(stats.power, user_info.user_id) for user_info, stats in chunk if stats.power != user_info.power]
+                total += len(chunk)
+                if changes:
+                    with self.transaction():
+                        self.conn.executemany("UPDATE user_xiuxian SET power = ? WHERE user_id = ?", changes)
+                    for power, user_id in changes:
+                        self._rank_set(user_id, "power", power)
+                    updated += len(changes)
+        self._power_stale.clear()
+
+        elapsed = time.perf_counter() - start
+        return {
+            "users": total,
+            "updated": updated,
+            "elapsed": elapsed,
+            "users_per_second": total / elapsed if elapsed > 0 else 0.0,
+        }
+
+    @_holds_write_lock
+    @_syncs_player_cache("all")
     def singh_remake(self):
         """重置所有用户签到"""
         c = self.conn.cursor()
         c.execute("UPDATE user_xiuxian SET is_sign=0")
-        self.conn.commit()
+        self._commit()
 
     def _calculated(self, rate: dict) -> str:
-        """根据概率计算，轮盘型"""
-        total_rate = sum(rate.values())
-        rand_num = random.randint(1, total_rate)
-        
-        current_sum = 0
-        for name, value in rate.items():
-            current_sum += value
-            if rand_num <= current_sum:
-                return name
-        return list(rate.keys())[-1]
+        """根据权重随机抽取（别名法，相同的权重表只建一次）"""
+        sampler = self.samplers.get(tuple(rate.items()), lambda: AliasSampler.from_mapping(rate))
+        return sampler.sample()
 
     # ==================================
 # ===== 在 service.py 末尾追加以下代码 =====
@@ -391,15 +852,25 @@ class XiuxianService:
 
     def get_user_buff_info(self, user_id: str) -> BuffInfo | None:
         """获取用户的Buff信息"""
-        cur = self.conn.cursor()
-        cur.execute("SELECT * FROM BuffInfo WHERE user_id=?", (user_id,))
-        result = cur.fetchone()
+        use_cache = self._cache_enabled(user_id)
+        if use_cache:
+            cached = self.player_cache.get_buff(user_id)
+            if cached is not None:
+                return cached
+        with self.db.read() as conn:
+            result = conn.execute("SELECT * FROM BuffInfo WHERE user_id=?", (user_id,)).fetchone()
         if not result:
             return BuffInfo(id=-1, user_id=user_id, main_buff=0, sec_buff=0, 
                             faqi_buff=0, fabao_weapon=0, armor_buff=0, 
                             atk_buff=0, blessed_spot=0, sub_buff=0)
 
-        return BuffInfo(*result) if result and len(result) == len(BuffInfo._fields) else None
+        if len(result) != len(BuffInfo._fields):
+            return None
+        buff_info = BuffInfo(*result)
+        if use_cache:
+            self._cache_touch(user_id)
+            self.player_cache.put_buff(user_id, buff_info)
+        return buff_info
 
     def get_sect_config(self) -> dict:
         """获取宗门配置"""
@@ -417,6 +888,7 @@ class XiuxianService:
         cur.execute("SELECT sect_id, sect_scale, sect_owner FROM sects")
         return cur.fetchall()
 
+    @_holds_write_lock
     def update_sect_materials(self, sect_id, sect_materials, key=1):
         """更新宗门资材"""
         cur = self.conn.cursor()
@@ -424,7 +896,7 @@ class XiuxianService:
             cur.execute("UPDATE sects SET sect_materials = sect_materials + ? WHERE sect_id = ?", (sect_materials, sect_id))
         else:
             cur.execute("UPDATE sects SET sect_materials = sect_materials - ? WHERE sect_id = ?", (sect_materials, sect_id))
-        self.conn.commit()
+        self._commit()
 
     #def create_boss(self) -> dict:
     #    """
@@ -453,29 +925,35 @@ class XiuxianService:
     #        "s_bool": False # 是否被击杀
     #    }
 
+    @_holds_write_lock
     def day_num_reset(self):
         """重置丹药每日使用次数"""
         cur = self.conn.cursor()
         cur.execute("UPDATE back SET day_num = 0 WHERE goods_type = '丹药'")
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
+    @_syncs_player_cache("all")
     def sect_task_reset(self):
         """重置宗门任务次数"""
         cur = self.conn.cursor()
         cur.execute("UPDATE user_xiuxian SET sect_task = 0")
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
+    @_syncs_player_cache("all")
     def sect_elixir_get_num_reset(self):
         """重置宗门丹药每日领取次数"""
         cur = self.conn.cursor()
         cur.execute("UPDATE user_xiuxian SET sect_elixir_get = 0")
-        self.conn.commit()
+        self._commit()
     # ==================================
 # === 在 service.py 末尾追加修炼功能相关方法 ===
 # ==================================
 
     def get_user_cd(self, user_id: str) -> list[UserCd]:
         """获取一个用户所有的CD信息记录，返回一个列表"""
+        self._flush_cooldowns()
         cur = self.conn.cursor()
         cur.execute("SELECT * FROM user_cd WHERE user_id = ?", (user_id,))
         results = cur.fetchall()
@@ -484,10 +962,8 @@ class XiuxianService:
     def start_closing(self, user_id: str, close_time: str) -> None:
         """开始闭关 (type=1)"""
         # 使用一个超长的CD代表状态，并记录开始时间
-        self._set_user_cd(user_id, 1, 999999)
-        cur = self.conn.cursor()
-        cur.execute("UPDATE user_cd SET create_time = ? WHERE user_id = ? and type = 1", (close_time, user_id))
-        self.conn.commit()
+        self.cooldowns.set(user_id, 1, 999999 * 60, create_time=close_time)
+        self._maybe_flush_cooldowns()
 
     def end_closing(self, user_id: str) -> None:
         """结束闭关，通过删除记录实现"""
@@ -499,17 +975,21 @@ class XiuxianService:
         """
         return self._get_user_cd_by_type(user_id, 1)
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def update_level(self, user_id: str, level: str) -> None:
         """更新用户境界"""
         cur = self.conn.cursor()
         cur.execute("UPDATE user_xiuxian SET level = ? WHERE user_id = ?", (level, user_id))
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def update_level_up_cd(self, user_id: str, time: str) -> None:
         """更新突破CD"""
         cur = self.conn.cursor()
         cur.execute("UPDATE user_xiuxian SET level_up_cd = ? WHERE user_id = ?", (time, user_id))
-        self.conn.commit()
+        self._commit()
 
     # ==================================
 # === 在 service.py 末尾追加背包功能相关方法 ===
@@ -517,9 +997,8 @@ class XiuxianService:
 
     def get_user_back_msg(self, user_id: str) -> list[BackpackItem]:
         """获取用户背包内的所有物品"""
-        cur = self.conn.cursor()
-        cur.execute("SELECT * FROM back WHERE user_id=? AND goods_num > 0", (user_id,))
-        items = cur.fetchall()
+        with self.db.read() as conn:
+            items = conn.execute("SELECT * FROM back WHERE user_id=? AND goods_num > 0", (user_id,)).fetchall()
         return [BackpackItem(*item) for item in items]
 
     def get_item_by_name(self, user_id: str, item_name: str) -> BackpackItem | None:
@@ -533,29 +1012,90 @@ class XiuxianService:
 
     def add_item(self, user_id: str, item_id: int, item_type: str, item_num: int = 1):
         """为用户添加物品"""
-        logger.info(user_id + " " + str(item_id) + " " + item_type)
-        item_info = self.items.get_data_by_item_id(item_id)
-        if not item_info:
-            logger.error(f"尝试添加不存在的物品ID: {item_id}")
-            return
-
-        item_name = item_info.get('name')
-
-        # 检查背包中是否已有该物品
-        user_item = self.get_item_by_name(user_id, item_name)
-
-        cur = self.conn.cursor()
-        if user_item:
-            # 已有，更新数量
-            cur.execute("UPDATE back SET goods_num = goods_num + ? WHERE user_id = ? AND goods_name = ?", (item_num, user_id, item_name))
-        else:
-            # 没有，插入新纪录
-            cur.execute(
-                "INSERT INTO back (user_id, goods_id, goods_name, goods_type, goods_num, create_time, update_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (user_id, item_id, item_name, item_type, item_num, str(datetime.now()), str(datetime.now()))
-            )
-        self.conn.commit()
-
+        self.apply_item_deltas([(user_id, item_id, item_num, item_type)])
+
+    def add_items(self, user_id: str, items: list[tuple]) -> dict | None:
+        """为一个用户批量添加物品，items 为 (物品ID, 数量[, 物品类型]) 列表，返回 {物品ID: 变化后的数量}"""
+        result = self.apply_item_deltas((user_id, *item) for item in items)
+        return None if result is None else {item_id: num for (_, item_id), num in result.items()}
+
+    def apply_item_deltas(self, deltas) -> dict | None:
+        """
+        批量增减背包物品，可同时涉及多个用户。增加用一条 UPSERT executemany 完成（键为 (user_id, goods_id)）。
+        :param deltas: (user_id, 物品ID, 数量[, 物品类型]) 的可迭代对象，数量为负表示扣除，同一物品的多条变化会先合并
+        :return: {(user_id, 物品ID): 变化后的数量}；任一物品扣除时数量不足，则不做任何修改并返回 None
+        """
+        merged = self._merge_item_deltas(deltas)
+        now = str(datetime.now())
+        additions = self._item_addition_rows(merged, now)
+        removals = [
+            (quantity, now, user_id, item_id, -quantity)
+            for (user_id, item_id), (quantity, _) in merged.items() if quantity < 0
+        ]
+        if not additions and not removals:
+            return {}
+
+        with self.db.write_lock:
+            # 数量不足是正常结果：持锁先查，直接返回 None，不进入工作单元也不经过回滚
+            if removals:
+                current = self._get_item_quantities([(user_id, item_id) for _, _, user_id, item_id, _ in removals])
+                if any(current[(user_id, item_id)] < needed for _, _, user_id, item_id, needed in removals):
+                    return None
+            try:
+                with self.transaction():
+                    if removals:
+                        # 条件更新作为兜底，正常情况下不会失败
+                        cur = self.conn.executemany(
+                            "UPDATE back SET goods_num = goods_num + ?, update_time = ? WHERE user_id = ? AND goods_id = ? AND goods_num >= ?",
+                            removals
+                        )
+                        if cur.rowcount != len(removals):
+                            raise ValueError("物品数量不足")
+                    if additions:
+                        self.conn.executemany(BACK_UPSERT_SQL, additions)
+                    return self._get_item_quantities(list(merged))
+            except ValueError:
+                return None
+
+    @staticmethod
+    def _merge_item_deltas(deltas) -> dict[tuple[str, int], list]:
+        """合并同一玩家同一物品的多条变化：{(user_id, 物品ID): [数量, 物品类型]}"""
+        merged: dict[tuple[str, int], list] = {}
+        for delta in deltas:
+            key = (delta[0], int(delta[1]))
+            entry = merged.setdefault(key, [0, None])
+            entry[0] += delta[2]
+            if len(delta) > 3 and delta[3]:
+                entry[1] = delta[3]
+        return merged
+
+    def _item_addition_rows(self, merged: dict, now: str) -> list[tuple]:
+        """由合并后的变化生成 BACK_UPSERT_SQL 的参数行（只含增加的物品）"""
+        additions = []
+        for (user_id, item_id), (quantity, item_type) in merged.items():
+            if quantity > 0:
+                item_info = self.items.get_data_by_item_id(item_id)
+                if not item_info:
+                    logger.error(f"尝试添加不存在的物品ID: {item_id}")
+                    continue
+                additions.append((user_id, item_id, item_info.get('name'), item_type or item_info.get('item_type'), quantity, now, now))
+        return additions
+
+    def _get_item_quantities(self, keys: list[tuple[str, int]]) -> dict[tuple[str, int], int]:
+        """批量查询 (user_id, 物品ID) 的当前数量，不存在的记为 0"""
+        quantities = dict.fromkeys(keys, 0)
+        for start in range(0, len(keys), 400):
+            chunk = keys[start:start + 400]
+            params = [value for key in chunk for value in key]
+            rows = self.conn.execute(
+                f"SELECT user_id, goods_id, goods_num FROM back WHERE (user_id, goods_id) IN (VALUES {','.join(['(?, ?)'] * len(chunk))})",
+                params
+            ).fetchall()
+            for user_id, goods_id, goods_num in rows:
+                quantities[(user_id, goods_id)] = goods_num
+        return quantities
+
+    @_holds_write_lock
     def remove_item(self, user_id: str, item_name: str, item_num: int = 1) -> bool:
         """从用户背包移除物品"""
         user_item = self.get_item_by_name(user_id, item_name)
@@ -564,7 +1104,7 @@ class XiuxianService:
 
         cur = self.conn.cursor()
         cur.execute("UPDATE back SET goods_num = goods_num - ? WHERE user_id = ? AND goods_name = ?", (item_num, user_id, item_name))
-        self.conn.commit()
+        self._commit()
         return True
 
     def get_user_real_info(self, user_id: str) -> dict | None:
@@ -582,8 +1122,16 @@ class XiuxianService:
             from .service import BuffInfo
             buff_info = BuffInfo(id=0, user_id=user_id, main_buff=0, sec_buff=0, faqi_buff=0, fabao_weapon=0, armor_buff=0, atk_buff=0, blessed_spot=0, sub_buff=0)
 
-        # 0. 初始化返回的字典结构，确保所有键都存在
-        real_info = {
+        # 派生属性由统计引擎按版本戳缓存，输入不变时不会重复计算
+        stats = self.stats_engine.get(user_info, buff_info)
+
+        # 确保当前血量/蓝量不超过上限
+        hp = min(user_info.hp if user_info.hp is not None else stats.max_hp, stats.max_hp)
+        if hp <= 0 and stats.max_hp > 0: # 如果血量为0但最大血量大于0，则置为1（防止战斗问题）
+            hp = 1
+        mp = min(user_info.mp if user_info.mp is not None else stats.max_mp, stats.max_mp)
+
+        return {
             "user_id": user_info.user_id,
             "user_name": user_info.user_name,
             "level": user_info.level,
@@ -591,144 +1139,66 @@ class XiuxianService:
             "root_type": user_info.root_type,
             "exp": user_info.exp,
             "stone": user_info.stone,
-            "hp": user_info.hp, # 当前HP，后续会被最大HP限制
-            "mp": user_info.mp, # 当前MP，后续会被最大MP限制
-            "max_hp": 0,
-            "max_mp": 0,
-            "atk": 0,
-            "crit_rate": 0.0,       # 暴击率 (百分比，例如 0.05 代表 5%)
-            "crit_damage": 0.0,   # 暴击伤害加成 (百分比，例如 0.5 代表额外50%伤害)
-            "defense_rate": 0.0,  # 减伤率 (百分比，例如 0.1 代表减伤10%)
-            "power": user_info.power, # 战力后续会重新计算
-            "final_exp_rate": 1.0, # 修炼效率
+            "hp": hp,
+            "mp": mp,
+            "max_hp": stats.max_hp,
+            "max_mp": stats.max_mp,
+            "atk": stats.atk,
+            "crit_rate": stats.crit_rate,       # 暴击率 (百分比，例如 0.05 代表 5%)
+            "crit_damage": stats.crit_damage,   # 暴击伤害加成 (百分比，例如 0.5 代表额外50%伤害)
+            "defense_rate": stats.defense_rate, # 减伤率 (百分比，例如 0.1 代表减伤10%)
+            "power": stats.power,               # 基于最终面板重新计算的战力
+            "final_exp_rate": stats.final_exp_rate, # 修炼效率
             "buff_info": buff_info, # 原始buff信息，供其他地方使用
             "atk_practice_level": getattr(user_info, 'atkpractice', 0) # 攻击修炼等级
         }
 
-        # 1. 获取境界基准属性
-        level_config = self.jsondata.level_data().get(user_info.level, {})
-        logger.info(level_config)
-        #base_hp = level_config.get("HP", 50)
-        #base_mp = level_config.get("MP", 100)
-        #base_atk = level_config.get("ATK", 10)
-        base_hp = level_config.get("HP", user_info.exp / 2 if user_info.exp > 0 else 50) # 以修为一半为基础或默认50
-        base_mp = level_config.get("MP", user_info.exp if user_info.exp > 0 else 100)     # 以修为为基础或默认100
-        base_atk = level_config.get("ATK", user_info.exp / 10 if user_info.exp > 0 else 10)   # 以修为十分之一为基础或默认10
-
-        # 2. 初始化百分比增益率和固定增益值
-        hp_buff_rate_total = 0.0
-        mp_buff_rate_total = 0.0
-        atk_buff_rate_total = 0.0
-        crit_rate_buff_total = 0.0      # 初始暴击率
-        crit_damage_buff_total = 0.0  # 初始暴击伤害加成 (例如基础暴击是150%伤害，这里存0.5)
-        defense_rate_total = 0.0      # 初始减伤率
-
-        fixed_atk_buff_total = buff_info.atk_buff if buff_info else 0 # 来自丹药等的永久攻击力
-
-        # 2. 获取功法和装备的增益
-        items_manager = self.items
-
-        # 主修功法
-        main_buff_info = items_manager.get_data_by_item_id(buff_info.main_buff) if buff_info else None
-        if main_buff_info:
-            hp_buff_rate_total += main_buff_info.get("hpbuff", 0)
-            mp_buff_rate_total += main_buff_info.get("mpbuff", 0)
-            atk_buff_rate_total += main_buff_info.get("atkbuff", 0)
-
-        # 辅修功法
-        sub_buff_info = items_manager.get_data_by_item_id(buff_info.sub_buff) if buff_info else None
-        if sub_buff_info:
-            sub_buff_type = sub_buff_info.get("buff_type")
-            sub_buff_value = float(sub_buff_info.get("buff", 0)) / 100 # 原版是存的百分比整数
-            if sub_buff_type == '1': # 攻击力百分比
-                atk_buff_rate_total += sub_buff_value
-            elif sub_buff_type == '2': # 暴击率百分比
-                crit_rate_buff_total += sub_buff_value
-            elif sub_buff_type == '3': # 暴击伤害百分比
-                crit_damage_buff_total += sub_buff_value
-
-         # 武器 (法器)
-        weapon_info = items_manager.get_data_by_item_id(buff_info.fabao_weapon) if buff_info else None # fabao_weapon 对应原版的法器
-        if weapon_info:
-            atk_buff_rate_total += weapon_info.get("atk_buff", 0)
-            crit_rate_buff_total += weapon_info.get("crit_buff", 0)
-
-        # 防具
-        armor_info = items_manager.get_data_by_item_id(buff_info.armor_buff) if buff_info else None
-        if armor_info:
-            defense_rate_total += armor_info.get("def_buff", 0)
-
-        # 攻击修炼
-        # 原版是每级4%攻击力，你的 XiuConfig 中是否有类似配置？
-        # 假设每级 atkpractice 提升 XiuConfig().atk_practice_buff_per_level (例如 0.04)
-        atk_practice_buff_rate = getattr(user_info, 'atkpractice', 0) * self.xiu_config.atk_practice_buff_per_level
-        atk_buff_rate_total += atk_practice_buff_rate
-
-        # 4. 计算最终属性
-        # 最大生命值
-        real_info['max_hp'] = int(base_hp * (1 + hp_buff_rate_total))
-        # 最大真元
-        real_info['max_mp'] = int(base_mp * (1 + mp_buff_rate_total))
-        # 攻击力
-        real_info['atk'] = int(base_atk * (1 + atk_buff_rate_total)) + fixed_atk_buff_total
-
-        # 确保当前血量不超过最大血量
-        real_info['hp'] = min(user_info.hp if user_info.hp is not None else real_info['max_hp'], real_info['max_hp'])
-        if real_info['hp'] <= 0 and real_info['max_hp'] > 0 : # 如果血量为0但最大血量大于0，则置为1（防止战斗问题）
-            real_info['hp'] = 1
-
-        # 确保当前蓝量不超过最大蓝量
-        real_info['mp'] = min(user_info.mp if user_info.mp is not None else real_info['max_mp'], real_info['max_mp'])
-
-        # 其他属性
-        real_info['crit_rate'] = round(crit_rate_buff_total, 4)
-        real_info['crit_damage'] = round(crit_damage_buff_total, 4) # 例如，0.5 表示暴击时造成 100% + 50% = 150% 伤害
-        real_info['defense_rate'] = round(defense_rate_total, 4)
-
-        # 计算修炼效率
-        main_rate_buff = main_buff_info.get("ratebuff", 0) if main_buff_info else 0
-        realm_rate = level_config.get("spend", 1.0)
-        root_rate = self.jsondata.root_data().get(user_info.root_type, {}).get("type_speeds", 1.0)
-
-        reincarnation_buff_rate = user_info.reincarnation_buff if hasattr(user_info, 'reincarnation_buff') else 0.0
-        blessed_spot_rate = getattr(buff_info, 'blessed_spot', 0) # 这个是等级，需要转换成倍率
-        # 假设 blessed_spot 等级1对应 0.1 (10%) 的倍率加成
-        blessed_spot_multiplier = blessed_spot_rate * self.xiu_config.blessed_spot_exp_rate_per_level
-
-        logger.info(str(realm_rate) + " " + str(root_rate) + " " + str(main_rate_buff) + " " + str(reincarnation_buff_rate) + " " + str(blessed_spot_multiplier))
-        real_info['final_exp_rate'] = realm_rate * root_rate * (1 + main_rate_buff + reincarnation_buff_rate + blessed_spot_multiplier)
-        # 6. 更新战力 (复用你的 update_power2 逻辑，但传入的是已计算好的属性)
-        # 战力计算应该在所有属性都确定后再进行，确保它基于的是最终的面板属性
-        # 暂时注释掉，因为你的 update_power2 内部会再次调用 get_user_real_info，可能导致循环或不一致
-        # self.update_power2(user_id) # 或者在这里直接计算并更新 real_info['power']
-
-        # 重新计算战力，基于最终面板
-        # 这些权重可以根据你的游戏平衡性进行调整
-        hp_weight = 0.5  # 每点最大生命值提供 0.5 点战力
-        mp_weight = 0.2  # 每点最大真元提供 0.2 点战力
-        atk_weight = 10    # 每点攻击力提供 10 点战力
-        # 也可以考虑将暴击、爆伤、减伤等属性也纳入战力计算
-
-        calculated_power = int(
-            (real_info['max_hp'] * hp_weight) +
-            (real_info['max_mp'] * mp_weight) +
-            (real_info['atk'] * atk_weight)
-        )
-        real_info['power'] = calculated_power
-
-        return real_info
+    @_syncs_player_cache("read")
+    def get_users_derived_stats(self, user_ids: list[str] | None = None) -> dict:
+        """
+        批量获取玩家的派生属性 (user_id -> DerivedStats)，user_ids 为 None 时计算全部玩家。
+        用两次批量查询代替逐个调用 get_user_real_info。
+        """
+        with self.db.read() as conn:
+            if user_ids is None:
+                user_rows = conn.execute("SELECT * FROM user_xiuxian").fetchall()
+                buff_rows = conn.execute("SELECT * FROM BuffInfo").fetchall()
+            else:
+                user_rows, buff_rows = [], []
+                ids = list(user_ids)
+                for start in range(0, len(ids), 500): # 分批，避免超出 SQLite 参数个数上限
+                    chunk = ids[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    user_rows += conn.execute(f"SELECT * FROM user_xiuxian WHERE user_id IN ({placeholders})", chunk).fetchall()
+                    buff_rows += conn.execute(f"SELECT * FROM BuffInfo WHERE user_id IN ({placeholders})", chunk).fetchall()
+
+        buffs = {row[1]: BuffInfo(*row) for row in buff_rows}
+        pairs = []
+        for row in user_rows:
+            user_info = UserDate(*row)
+            buff_info = buffs.get(user_info.user_id) or BuffInfo(
+                id=-1, user_id=user_info.user_id, main_buff=0, sec_buff=0, faqi_buff=0,
+                fabao_weapon=0, armor_buff=0, atk_buff=0, blessed_spot=0, sub_buff=0)
+            pairs.append((user_info, buff_info))
+        return self.stats_engine.get_many(pairs)
 
     # 你可能需要一个单独的方法来更新数据库中的战力，如果战力是持久化的
+    @_holds_write_lock
     def _update_user_power_in_db(self, user_id: str, power: int):
         """内部方法：仅更新数据库中的用户战力字段"""
+        self._rank_set(user_id, "power", power)
+        if self._cache_set(user_id, "power", power):
+            return
         try:
             c = self.conn.cursor()
             c.execute("UPDATE user_xiuxian SET power=? WHERE user_id=?", (power, user_id))
-            self.conn.commit()
+            self._commit()
         except Exception as e:
             logger.error(f"_update_user_power_in_db: 更新用户 {user_id} 战力失败: {e}")
 
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def equip_item(self, user_id: str, item_id: int) -> dict:
         """为用户穿戴装备"""
         item_info = self.items.get_data_by_item_id(item_id)
@@ -777,12 +1247,14 @@ class XiuxianService:
                 VALUES (?, 0, 0, 0, 0, 0, 0, 0, 0)
                 """, (user_id,)) # faqi_buff 是旧字段名，可能你的表里已经没有了
             cur.execute(f"UPDATE BuffInfo SET {slot_to_update} = ? WHERE user_id = ?", (item_id, user_id))
-        self.conn.commit()
+        self._commit()
 
         # return {"success": True, "message": f"成功穿戴 {item_info['name']}！"}
 
         return {"success": True, "message": f"{unequip_message_part}成功穿戴【{item_info['name']}】！"}
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def unequip_item(self, user_id: str, item_type_str: str) -> dict:
         """为用户卸下装备"""
         if item_type_str not in ["法器", "防具", "武器", "神通", "功法", "辅修功法"]: # 兼容"武器"的叫法
@@ -820,7 +1292,7 @@ class XiuxianService:
 
         cur = self.conn.cursor()
         cur.execute(f"UPDATE BuffInfo SET {slot_name} = 0 WHERE user_id = ?", (user_id,))
-        self.conn.commit()
+        self._commit()
 
         item_info = self.items.get_data_by_item_id(item_to_unequip_id)
         return {"success": True, "message": f"成功卸下 {item_info['name']}！"}
@@ -846,12 +1318,15 @@ class XiuxianService:
         results = cur.fetchall()
         return [SectInfo(*row) for row in results]
 
+    @_syncs_player_cache("read")
     def get_sect_member_count(self, sect_id: int) -> int:
         """获取宗门当前成员人数"""
         cur = self.conn.cursor()
         cur.execute("SELECT count(*) FROM user_xiuxian WHERE sect_id=?", (sect_id,))
         return cur.fetchone()[0]
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def create_sect(self, user_id: str, sect_name: str) -> dict:
         """创建宗门"""
         user_info = self.get_user_message(user_id)
@@ -879,12 +1354,14 @@ class XiuxianService:
             # 更新用户宗门信息
             cur.execute("UPDATE user_xiuxian SET sect_id = ?, sect_position = ? WHERE user_id = ?",
                         (new_sect_id, 4, user_id)) # 4代表宗主
-            self.conn.commit()
+            self._commit()
             return {"success": True, "message": f"恭喜道友成功创建宗门【{sect_name}】，广纳门徒，开创万世基业！"}
         except Exception as e:
             logger.error(f"创建宗门失败: {e}")
             return {"success": False, "message": "系统错误，创建宗门失败！"}
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def join_sect(self, user_id: str, sect_id: int) -> dict:
         """加入宗门"""
         user_info = self.get_user_message(user_id)
@@ -903,12 +1380,14 @@ class XiuxianService:
             cur = self.conn.cursor()
             cur.execute("UPDATE user_xiuxian SET sect_id = ?, sect_position = ? WHERE user_id = ?",
                         (sect_id, 0, user_id)) # 0代表弟子
-            self.conn.commit()
+            self._commit()
             return {"success": True, "message": f"道友成功加入【{sect_info.sect_name}】！"}
         except Exception as e:
             logger.error(f"加入宗门失败: {e}")
             return {"success": False, "message": "系统错误，加入宗门失败！"}
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def leave_sect(self, user_id: str) -> dict:
         """退出宗门"""
         user_info = self.get_user_message(user_id)
@@ -921,47 +1400,16 @@ class XiuxianService:
             cur = self.conn.cursor()
             cur.execute("UPDATE user_xiuxian SET sect_id = 0, sect_position = 0, sect_contribution = 0 WHERE user_id = ?",
                         (user_id,))
-            self.conn.commit()
+            self._commit()
             return {"success": True, "message": "道友已成功退出宗门，从此逍遥于天地之间。"}
         except Exception as e:
             logger.error(f"退出宗门失败: {e}")
             return {"success": False, "message": "系统错误，退出宗门失败！"}
 
 
-    def set_user_cd(self, user_id: str, cd_time_minutes: int, cd_type: int = 2) -> None:
-        """
-        设置用户CD
-        :param user_id: 用户ID
-        :param cd_time_minutes: CD时长（分钟）
-        :param cd_type: 2代表世界BOSS攻击CD
-        """
-        cur = self.conn.cursor()
-        create_time = datetime.now()
-        # scheduled_time 在这里可以理解为CD的结束时间
-        scheduled_time = create_time + timedelta(minutes=cd_time_minutes)
-
-        # 检查user_cd表中是否已有该用户的记录
-        cur.execute("SELECT user_id FROM user_cd WHERE user_id = ?", (user_id,))
-        if cur.fetchone():
-            cur.execute(
-                "UPDATE user_cd SET type = ?, create_time = ?, scheduled_time = ? WHERE user_id = ?",
-                (cd_type, str(create_time), str(scheduled_time), user_id)
-            )
-        else:
-            cur.execute(
-                "INSERT INTO user_cd (user_id, type, create_time, scheduled_time) VALUES (?, ?, ?, ?)",
-                (user_id, cd_type, str(create_time), str(scheduled_time))
-            )
-        self.conn.commit()
-
     def check_user_cd(self, user_id: str) -> int:
         """检查用户BOSS战CD (type=2)，返回剩余秒数"""
-        cd_info = self._get_user_cd_by_type(user_id, 2)
-        if cd_info and cd_info.scheduled_time:
-            end_time = datetime.fromisoformat(cd_info.scheduled_time)
-            if datetime.now() < end_time:
-                return int((end_time - datetime.now()).total_seconds())
-        return 0
+        return self.cooldowns.remaining(user_id, 2)
 
     def get_user_bounty(self, user_id: str) -> dict | None:
         """获取用户当前接取的悬赏任务"""
@@ -975,6 +1423,7 @@ class XiuxianService:
         columns = [desc[0] for desc in cur.description]
         return dict(zip(columns, result))
 
+    @_holds_write_lock
     def accept_bounty(self, user_id: str, bounty: dict) -> None:
         """接取悬赏任务"""
         cur = self.conn.cursor()
@@ -990,14 +1439,16 @@ class XiuxianService:
              bounty.get('item_count'))
         )
         # ^-- 替换结束 --^
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
     def abandon_bounty(self, user_id: str) -> None:
         """放弃/完成悬赏任务"""
         cur = self.conn.cursor()
         cur.execute("DELETE FROM user_bounty WHERE user_id = ?", (user_id,))
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
     def update_bounty_monster_hp(self, user_id: str, damage: int) -> int:
         """
         更新悬赏任务中怪物的HP，并返回剩余HP
@@ -1012,7 +1463,7 @@ class XiuxianService:
         )
         # ^-- 这是本次修正的核心 --^
 
-        self.conn.commit()
+        self._commit()
 
         cur.execute("SELECT monster_hp FROM user_bounty WHERE user_id=?", (user_id,))
         result = cur.fetchone()
@@ -1052,6 +1503,7 @@ class XiuxianService:
         rift_data['rift_map'] = json.loads(rift_data['rift_map']) # 将json字符串转回list
         return rift_data
 
+    @_holds_write_lock
     def create_user_rift(self, user_id: str, rift_data: dict) -> None:
         """为用户创建秘境存档"""
         cur = self.conn.cursor()
@@ -1060,17 +1512,19 @@ class XiuxianService:
             "INSERT INTO user_rift (user_id, rift_name, rift_map) VALUES (?, ?, ?)",
             (user_id, rift_data['name'], rift_map_str)
         )
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
     def delete_user_rift(self, user_id: str) -> None:
         """删除用户的秘境存档"""
         cur = self.conn.cursor()
         cur.execute("DELETE FROM user_rift WHERE user_id=?", (user_id,))
-        self.conn.commit()
+        self._commit()
     # ==================================
 # === 在 service.py 末尾追加秘境进度更新方法 ===
 # ==================================
 
+    @_holds_write_lock
     def update_user_rift(self, user_id: str, new_floor: int, new_map_str: str):
         """更新用户的秘境存档"""
         cur = self.conn.cursor()
@@ -1078,7 +1532,7 @@ class XiuxianService:
             "UPDATE user_rift SET current_floor = ?, rift_map = ? WHERE user_id = ?",
             (new_floor, new_map_str, user_id)
         )
-        self.conn.commit()
+        self._commit()
 
     # ==================================
 # === 在 service.py 末尾追加功法系统相关方法 ===
@@ -1100,12 +1554,14 @@ class XiuxianService:
     #         cur = self.conn.cursor()
     #         # 使用 f-string 来动态构建列名，确保 buff_type 来自受信任的来源（我们自己的代码）
     #         cur.execute(f"UPDATE BuffInfo SET {buff_type} = ? WHERE user_id = ?", (item_id, user_id))
-    #         self.conn.commit()
+    #         self._commit()
     #         return True
     #     except Exception as e:
     #         logger.error(f"更新Buff失败: {e}")
     #         return False
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def remake_user_root(self, user_id: str) -> dict:
         """
         为用户重置灵根
@@ -1136,7 +1592,7 @@ class XiuxianService:
         # 更新数据库
         cur = self.conn.cursor()
         cur.execute("UPDATE user_xiuxian SET root = ?, root_type = ? WHERE user_id = ?", (root, root_type, user_id))
-        self.conn.commit()
+        self._commit()
 
         # 更新战力
         self.update_power2(user_id)
@@ -1147,11 +1603,13 @@ class XiuxianService:
             "message": f"道友重入仙途成功！新的灵根为【{root}】，当前战力已更新为 {int(new_user_info.power)}！"
         }
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def update_user_name(self, user_id: str, new_name: str) -> None:
         """更新用户名"""
         cur = self.conn.cursor()
         cur.execute("UPDATE user_xiuxian SET user_name = ? WHERE user_id = ?", (new_name, user_id))
-        self.conn.commit()
+        self._commit()
 
     # ==================================
 # === 在 service.py 末尾追加PVP与灵庄相关方法 ===
@@ -1168,6 +1626,7 @@ class XiuxianService:
             return {"savings": int(result[0])}
         return {"savings": 0}
 
+    @_holds_write_lock
     def update_bank_savings(self, user_id: str, amount: int) -> None:
         """更新用户灵庄存款"""
         cur = self.conn.cursor()
@@ -1177,59 +1636,80 @@ class XiuxianService:
             cur.execute("UPDATE user_cd SET scheduled_time = ? WHERE user_id = ? AND type=3", (str(amount), user_id))
         else:
             cur.execute("INSERT INTO user_cd (user_id, type, scheduled_time) VALUES (?, 3, ?)", (user_id, str(amount)))
-        self.conn.commit()
+        self._commit()
 
     def get_user_hp(self, user_id: str) -> int:
         """快速获取用户当前HP"""
-        cur = self.conn.cursor()
-        cur.execute("SELECT hp FROM user_xiuxian WHERE user_id=?", (user_id,))
-        result = cur.fetchone()
-        return result[0] if result else 0
+        user_info = self.get_user_message(user_id)
+        return user_info.hp if user_info else 0
 
     # ==================================
 # === 在 service.py 末尾追加排行榜相关方法 ===
 # ==================================
 
+    def _ranking_rows(self, entries: list[tuple[int, str, int]]) -> list[tuple[int, str, str, int]]:
+        """把排行榜条目 (名次, user_id, 数值) 补全为 (名次, 道号, 境界, 数值)"""
+        if not entries:
+            return []
+        user_ids = [user_id for _, user_id, _ in entries]
+        with self.db.read() as conn:
+            names = {
+                row[0]: (row[1], row[2]) for row in conn.execute(
+                    f"SELECT user_id, user_name, level FROM user_xiuxian WHERE user_id IN ({','.join('?' * len(user_ids))})",
+                    user_ids
+                )
+            }
+        return [(rank, *names.get(user_id, (user_id, "")), value) for rank, user_id, value in entries]
+
+    @_syncs_player_cache("read")
     def get_exp_ranking(self, limit: int = 10) -> list:
         """获取修为排行榜"""
-        cur = self.conn.cursor()
-        cur.execute(
-            "SELECT user_name, level, exp FROM user_xiuxian ORDER BY exp DESC LIMIT ?",
-            (limit,)
-        )
-        return cur.fetchall()
+        return [row[1:] for row in self._ranking_rows(self.leaderboards.top("exp", limit))]
 
+    @_syncs_player_cache("read")
     def get_stone_ranking(self, limit: int = 10) -> list:
         """获取灵石排行榜"""
-        cur = self.conn.cursor()
-        cur.execute(
-            "SELECT user_name, level, stone FROM user_xiuxian ORDER BY stone DESC LIMIT ?",
-            (limit,)
-        )
-        return cur.fetchall()
+        return [row[1:] for row in self._ranking_rows(self.leaderboards.top("stone", limit))]
 
+    @_syncs_player_cache("read")
     def get_power_ranking(self, limit: int = 10) -> list:
         """获取战力排行榜"""
-        cur = self.conn.cursor()
-        cur.execute(
-            "SELECT user_name, level, power FROM user_xiuxian ORDER BY power DESC LIMIT ?",
-            (limit,)
-        )
-        return cur.fetchall()
+        return [row[1:] for row in self._ranking_rows(self.leaderboards.top("power", limit))]
+
+    @_syncs_player_cache("read")
+    def get_user_ranking(self, user_id: str, column: str) -> dict | None:
+        """
+        获取用户在某个排行榜上的名次，column 为 exp / stone / power。
+        返回 {"rank": 名次, "value": 数值, "total": 上榜人数}，用户不存在时返回 None
+        """
+        result = self.leaderboards.rank(column, user_id)
+        if result is None:
+            return None
+        rank, value, total = result
+        return {"rank": rank, "value": value, "total": total}
+
+    @_syncs_player_cache("read")
+    def get_ranking_around(self, user_id: str, column: str, radius: int = 2) -> list:
+        """获取用户前后各 radius 名的 (名次, 道号, 境界, 数值)"""
+        return self._ranking_rows(self.leaderboards.around(column, user_id, radius))
     # ==================================
 # === 在 service.py 末尾追加抢劫相关方法 ===
 # ==================================
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def update_wanted_status(self, user_id: str, amount: int):
         """更新通缉状态"""
         cur = self.conn.cursor()
         cur.execute("UPDATE user_xiuxian SET wanted_status = wanted_status + ? WHERE user_id = ?", (amount, user_id))
-        self.conn.commit()
+        self._commit()
 
     # ==================================
 # === 在 service.py 末尾追加数据清理方法 ===
 # ==================================
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def reset_user_sect_info(self, user_id: str):
         """
         重置用户的宗门信息，用于处理数据不一致的情况
@@ -1239,7 +1719,7 @@ class XiuxianService:
             "UPDATE user_xiuxian SET sect_id = 0, sect_position = 0, sect_contribution = 0 WHERE user_id = ?",
             (user_id,)
         )
-        self.conn.commit()
+        self._commit()
     def set_remake_cd(self, user_id: str):
         """
         设置用户重入仙途CD，30分钟
@@ -1254,16 +1734,9 @@ class XiuxianService:
         :return: 剩余秒数
         """
         # 精确查询 type=4 的CD记录
-        cd_info = self._get_user_cd_by_type(user_id, 4)
-        if cd_info and cd_info.scheduled_time:
-            try:
-                end_time = datetime.fromisoformat(cd_info.scheduled_time)
-                if datetime.now() < end_time:
-                    return int((end_time - datetime.now()).total_seconds())
-            except (ValueError, TypeError):
-                return 0 # 时间格式错误，视为无CD
-        return 0
+        return self.cooldowns.remaining(user_id, 4)
 
+    @_holds_write_lock
     def update_hp(self, user_id: str, amount: int, mode: int = 1):
         """
         更新用户HP，并防止超出上限
@@ -1281,12 +1754,17 @@ class XiuxianService:
         if mode == 1: # 增加生命值
             max_hp = user_real_info['max_hp']
             new_hp = min(current_hp + amount, max_hp) # 确保不会超过最大生命值
+            if self._cache_set(user_id, "hp", new_hp):
+                return
             cur.execute("UPDATE user_xiuxian SET hp = ? WHERE user_id = ?", (new_hp, user_id))
         else: # 减少生命值
+            if self._cache_add(user_id, "hp", -amount):
+                return
             cur.execute("UPDATE user_xiuxian SET hp = hp - ? WHERE user_id = ?", (amount, user_id))
 
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
     def update_mp(self, user_id: str, amount: int, mode: int = 1):
         """
         更新用户MP，并防止超出上限
@@ -1304,12 +1782,17 @@ class XiuxianService:
         if mode == 1: # 增加生命值
             max_mp = user_real_info['max_mp']
             new_mp = min(current_mp + amount, max_mp) # 确保不会超过最大生命值
+            if self._cache_set(user_id, "mp", new_mp):
+                return
             cur.execute("UPDATE user_xiuxian SET mp = ? WHERE user_id = ?", (new_mp, user_id))
         else: # 减少生命值
+            if self._cache_add(user_id, "mp", -amount):
+                return
             cur.execute("UPDATE user_xiuxian SET mp = mp - ? WHERE user_id = ?", (amount, user_id))
 
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
     def spawn_new_boss(self, boss_info: dict) -> int | None:
         """
         【最终修正版】在数据库中生成一个全局BOSS，会先清空旧的BOSS。
@@ -1322,8 +1805,9 @@ class XiuxianService:
 
         try:
             cur = self.conn.cursor()
-            # 先清空可能存在的旧BOSS
-            cur.execute("DELETE FROM world_boss")
+            # 先清空可能存在的旧BOSS及其伤害账本（已被击杀、等待结算的BOSS保留）
+            cur.execute("DELETE FROM world_boss WHERE current_hp > 0")
+            cur.execute("DELETE FROM world_boss_damage WHERE boss_id NOT IN (SELECT id FROM world_boss)")
 
             # 插入新的BOSS数据
             cur.execute(
@@ -1346,7 +1830,7 @@ class XiuxianService:
                     boss_info.get('crit_damage', 0.1)
                 )
             )
-            self.conn.commit()
+            self._commit()
             new_boss_id = cur.lastrowid
             logger.info(f"新世界BOSS【{boss_info['name']}】已成功存入数据库，ID: {new_boss_id}")
             return new_boss_id
@@ -1377,7 +1861,7 @@ class XiuxianService:
             SELECT id, boss_name, boss_level, current_hp, total_hp,
                    exp_reward, stone_reward, atk,
                    defense_rate, crit_rate, crit_damage
-            FROM world_boss LIMIT 1
+            FROM world_boss WHERE current_hp > 0 LIMIT 1
         """
         try:
             # 假设 self.conn 是在 __init__ 中初始化的 sqlite3.Connection 对象
@@ -1443,26 +1927,121 @@ class XiuxianService:
 
         return boss_combat_info
 
+    @_holds_write_lock
     def update_boss_hp(self, boss_db_id: int, new_hp: int):
         cur = self.conn.cursor()
         cur.execute("UPDATE world_boss SET current_hp = ? WHERE id = ?", (new_hp, boss_db_id))
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
+    def apply_boss_damage(self, boss_db_id: int, damage: int, user_id: str | None = None) -> tuple[int, int] | None:
+        """
+        原子扣减BOSS血量：current_hp = MAX(0, current_hp - damage)，只对血量仍大于 0 的BOSS生效。
+        血量被扣到 0 时把 user_id 记为击杀者，BOSS行保留到击杀结算完成（见 settle_world_boss）。
+        :return: (扣减后的血量, 实际扣除的血量)，BOSS不存在或已被击杀返回 None
+        """
+        # SET 右侧引用的都是更新前的值，last_hit_damage 即本次实际扣除的血量
+        row = self.conn.execute(
+            """
+            UPDATE world_boss
+            SET current_hp = MAX(0, current_hp - ?), last_hit_damage = MIN(current_hp, ?),
+                killed_by = CASE WHEN current_hp <= ? THEN ? ELSE killed_by END
+            WHERE id = ? AND current_hp > 0
+            RETURNING current_hp, last_hit_damage
+            """,
+            (damage, damage, damage, user_id, boss_db_id)
+        ).fetchone()
+        self._commit()
+        return tuple(row) if row else None
+
+    @_holds_write_lock
+    def record_boss_damage(self, boss_db_id: int, user_id: str, damage: int):
+        """把一次攻击的伤害累加到伤害账本（伤害为 0 也记录为参与者）"""
+        self.conn.execute(
+            """
+            INSERT INTO world_boss_damage (boss_id, user_id, damage, hits, last_hit_at)
+            VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT (boss_id, user_id) DO UPDATE SET
+                damage = damage + excluded.damage,
+                hits = hits + 1,
+                last_hit_at = excluded.last_hit_at
+            """,
+            (boss_db_id, user_id, damage, str(datetime.now()))
+        )
+        self._commit()
+
+    def get_boss_damage_ledger(self, boss_db_id: int) -> dict[str, int]:
+        """读取BOSS的伤害账本 {user_id: 累计伤害}"""
+        rows = self.conn.execute(
+            "SELECT user_id, damage FROM world_boss_damage WHERE boss_id = ?", (boss_db_id,)
+        ).fetchall()
+        return dict(rows)
+
+    def get_killed_bosses(self) -> list[dict]:
+        """已被击杀但尚未完成结算的BOSS（结算完成时BOSS行才被删除），供重启后补做结算"""
+        rows = self.conn.execute(
+            "SELECT id, boss_name, boss_level, exp_reward, stone_reward, killed_by FROM world_boss WHERE current_hp <= 0"
+        ).fetchall()
+        return [
+            {"id": boss_id, "name": name, "jj": level, "exp": exp, "stone": stone, "killed_by": killed_by}
+            for boss_id, name, level, exp, stone, killed_by in rows
+        ]
+
+    def settle_world_boss(self, settlement: BossSettlement) -> dict[str, str] | None:
+        """
+        写入世界BOSS的击杀结算（须在工作线程中调用，使用独立的数据库连接）。
+        删除BOSS行、伤害账本和发放全部修为/灵石/物品在同一个事务中完成，各用一次 executemany；
+        BOSS行已不存在说明已经结算过，此时不做任何修改并返回 None。
+        调用期间应通过 bypass_player_cache 让获奖玩家绕过缓存。
+        :return: 伤害榜上玩家的 {user_id: 道号}，用于生成广播
+        """
+        now = str(datetime.now())
+        additions = self._item_addition_rows(self._merge_item_deltas(settlement.item_deltas), now)
+        with self.db.worker_connection() as conn:
+            with conn:
+                cur = conn.execute("DELETE FROM world_boss WHERE id = ? AND current_hp <= 0", (settlement.boss_id,))
+                if cur.rowcount == 0:
+                    return None
+                conn.execute("DELETE FROM world_boss_damage WHERE boss_id = ?", (settlement.boss_id,))
+                conn.executemany(
+                    "UPDATE user_xiuxian SET exp = exp + ? WHERE user_id = ?",
+                    [(amount, user_id) for user_id, amount in settlement.exp_rewards.items()]
+                )
+                conn.executemany(
+                    "UPDATE user_xiuxian SET stone = stone + ? WHERE user_id = ?",
+                    [(amount, user_id) for user_id, amount in settlement.stone_rewards.items()]
+                )
+                if additions:
+                    conn.executemany(BACK_UPSERT_SQL, additions)
+
+            names = {}
+            ranked_ids = [entry[1] for entry in settlement.ranking]
+            for start in range(0, len(ranked_ids), 500):
+                chunk = ranked_ids[start:start + 500]
+                names.update(conn.execute(
+                    f"SELECT user_id, user_name FROM user_xiuxian WHERE user_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall())
+        return names
+
+    @_holds_write_lock
     def delete_boss(self, boss_db_id: int):
-        """从数据库中删除世界BOSS"""
+        """从数据库中删除世界BOSS及其伤害账本"""
         cur = self.conn.cursor()
         cur.execute("DELETE FROM world_boss WHERE id = ?", (boss_db_id,))
-        self.conn.commit()
+        cur.execute("DELETE FROM world_boss_damage WHERE boss_id = ?", (boss_db_id,))
+        self._commit()
         # ==================================
 # === 在 service.py 末尾追加群组持久化方法 ===
 # ==================================
 
+    @_holds_write_lock
     def add_active_group(self, group_id: str):
         """添加一个活跃的群组到数据库，如果已存在则忽略"""
         cur = self.conn.cursor()
         # 使用 INSERT OR IGNORE 来避免因主键重复而报错
         cur.execute("INSERT OR IGNORE INTO active_groups (group_id) VALUES (?)", (group_id,))
-        self.conn.commit()
+        self._commit()
 
     def get_all_active_groups(self) -> set:
         """从数据库获取所有活跃的群组ID"""
@@ -1472,6 +2051,7 @@ class XiuxianService:
         # 将返回的元组列表转换为集合
         return {row[0] for row in results}
 
+    @_holds_write_lock
     def get_user_alchemy_info(self, user_id: str) -> UserAlchemyInfo:
         """获取用户的炼丹信息，如果不存在则创建并返回默认值"""
         cur = self.conn.cursor()
@@ -1486,11 +2066,12 @@ class XiuxianService:
             # ^-- 更新结束 --^
 
             cur.execute("INSERT INTO user_alchemy_info VALUES (?, ?, ?, ?, ?, ?, ?)", default_record)
-            self.conn.commit()
+            self._commit()
             return UserAlchemyInfo(*default_record)
         else:
             return UserAlchemyInfo(*result)
 
+    @_holds_write_lock
     def update_user_alchemy_info(self, user_id: str, alchemy_info: UserAlchemyInfo):
         """更新用户的炼丹信息"""
         cur = self.conn.cursor()
@@ -1515,24 +2096,28 @@ class XiuxianService:
             )
         )
         # ^-- 更新结束 --^
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def purchase_blessed_spot(self, user_id: str) -> bool:
         """为用户购买洞天福地"""
         try:
             cur = self.conn.cursor()
             cur.execute("UPDATE user_xiuxian SET blessed_spot_flag = 1 WHERE user_id = ?", (user_id,))
-            self.conn.commit()
+            self._commit()
             return True
         except Exception as e:
             logger.error(f"购买洞天福地失败: {e}")
             return False
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def update_blessed_spot_name(self, user_id: str, new_name: str):
         """更新洞天福地名称"""
         cur = self.conn.cursor()
         cur.execute("UPDATE user_xiuxian SET blessed_spot_name = ? WHERE user_id = ?", (new_name, user_id))
-        self.conn.commit()
+        self._commit()
 
     def get_boss_drop(self, boss_info: dict) -> tuple[dict, list]:
         """
@@ -1614,13 +2199,11 @@ class XiuxianService:
         return final_hit_rewards, participant_drops_list
 
 
+    @_syncs_player_cache("read")
     def get_top1_user(self) -> UserDate | None:
         """获取服务器内修为最高的用户信息"""
-        cur = self.conn.cursor()
-        # ORDER BY exp DESC LIMIT 1 可以直接找到修为最高的用户
-        cur.execute("SELECT * FROM user_xiuxian ORDER BY exp DESC LIMIT 1")
-        result = cur.fetchone()
-        return UserDate(*result) if result and len(result) == len(UserDate._fields) else None
+        top = self.leaderboards.top("exp", 1)
+        return self.get_user_message(top[0][1]) if top else None
 
     def create_boss(self) -> dict | None:
         """
@@ -1632,10 +2215,7 @@ class XiuxianService:
             top_user_level = "太乙境圆满"
 
         all_levels = self.xiu_config.level
-        try:
-            now_jinjie_index = all_levels.index(top_user_level)
-        except ValueError:
-            now_jinjie_index = 0
+        now_jinjie_index = self.xiu_config.get_level_index(top_user_level) or 0
 
         #min_jinjie_range = 30
         #start_index = max(0, now_jinjie_index - min_jinjie_range)
@@ -1694,6 +2274,8 @@ class XiuxianService:
             "buff_info": None # BOSS通常不直接使用玩家的BuffInfo系统
         }
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def set_user_buff(self, user_id: str, buff_type: str, value: int, is_additive: bool = False):
         """
         通用方法：为用户设置或增加Buff值
@@ -1721,18 +2303,22 @@ class XiuxianService:
                     """, (user_id,)) # faqi_buff 是旧字段名，可能你的表里已经没有了
 
                 cur.execute(sql, (value, user_id))
-            self.conn.commit()
+            self._commit()
             return True
         except Exception as e:
             logger.error(f"更新Buff失败: {e}")
             return False
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def update_user_level_up_rate(self, user_id: str, rate_add: int):
         """增加用户的突破成功率"""
         cur = self.conn.cursor()
         cur.execute("UPDATE user_xiuxian SET level_up_rate = level_up_rate + ? WHERE user_id = ?", (rate_add, user_id))
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def update_user_blessed_spot_level(self, user_id: str, new_level: int):
         """更新用户的洞天福地等级"""
         cur = self.conn.cursor()
@@ -1741,13 +2327,15 @@ class XiuxianService:
             cur.execute("INSERT INTO BuffInfo (user_id) VALUES (?)", (user_id,))
 
         cur.execute("UPDATE BuffInfo SET blessed_spot = ? WHERE user_id = ?", (new_level, user_id))
-        self.conn.commit()
+        self._commit()
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def reset_user_level_up_rate(self, user_id: str):
         """将用户的额外突破成功率清零"""
         cur = self.conn.cursor()
         cur.execute("UPDATE user_xiuxian SET level_up_rate = 0 WHERE user_id = ?", (user_id,))
-        self.conn.commit()
+        self._commit()
 
     #def update_user_hp_mp_atk(self, user_id: str):
     #    """根据当前修为，重置并更新用户的HP, MP, ATK基础值"""
@@ -1764,9 +2352,10 @@ class XiuxianService:
     #        "UPDATE user_xiuxian SET hp = ?, mp = ?, atk = ? WHERE user_id = ?",
     #        (new_hp, new_mp, new_atk, user_id)
     #    )
-    #    self.conn.commit()
+    #    self._commit()
     
     #    # --- 坊市 Market 相关方法 ---
+    @_holds_write_lock
     def add_market_goods(self, user_id: str, goods_id: int, goods_type: str, price: int) -> bool:
         """上架一件商品到坊市"""
         item_info = self.items.get_data_by_item_id(goods_id)
@@ -1783,7 +2372,7 @@ class XiuxianService:
                 "INSERT INTO market (user_id, goods_id, goods_name, goods_type, price, group_id, user_name) VALUES (?, ?, ?, ?, ?, ?, ?)",
                 (user_id, goods_id, goods_name, goods_type, price, "0", user_name)
             )
-            self.conn.commit()
+            self._commit()
             return True
         except Exception as e:
             logger.error(f"上架商品失败: {e}")
@@ -1803,12 +2392,13 @@ class XiuxianService:
         result = cur.fetchone()
         return MarketGoods(*result) if result else None
 
+    @_holds_write_lock
     def remove_market_goods_by_id(self, market_id: int) -> bool:
         """通过坊市ID下架商品"""
         try:
             cur = self.conn.cursor()
             cur.execute("DELETE FROM market WHERE id = ?", (market_id,))
-            self.conn.commit()
+            self._commit()
             return cur.rowcount > 0 # 检查是否真的有行被删除了
         except Exception as e:
             logger.error(f"下架商品失败: {e}")
@@ -1821,96 +2411,99 @@ class XiuxianService:
 
     def check_user_rift_cd(self, user_id: str) -> int:
         """检查用户秘境探索CD (type=5)，返回剩余秒数"""
-        cd_info = self._get_user_cd_by_type(user_id, 5)
-        if cd_info and cd_info.scheduled_time:
-            end_time = datetime.fromisoformat(cd_info.scheduled_time)
-            if datetime.now() < end_time:
-                return int((end_time - datetime.now()).total_seconds())
-        return 0
+        return self.cooldowns.remaining(user_id, 5)
 
     def _get_user_cd_by_type(self, user_id: str, cd_type: int) -> UserCd | None:
-        """内部方法：通过类型精确获取一个用户的特定CD记录"""
-        cur = self.conn.cursor()
-        cur.execute("SELECT * FROM user_cd WHERE user_id = ? AND type = ?", (user_id, cd_type))
-        result = cur.fetchone()
-        return UserCd(*result) if result else None
+        """内部方法：通过类型精确获取一个用户的特定CD记录（已过期的CD视为不存在）"""
+        if cd_type == BANK_SAVINGS_TYPE:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM user_cd WHERE user_id = ? AND type = ?", (user_id, cd_type))
+            result = cur.fetchone()
+            return UserCd(*result) if result else None
+        row = self.cooldowns.get(user_id, cd_type)
+        return UserCd(*row) if row else None
 
     def _set_user_cd(self, user_id: str, cd_type: int, cd_duration_minutes: int):
-        """内部方法：设置一个特定类型的CD"""
-        create_time = datetime.now()
-        end_time = create_time + timedelta(minutes=cd_duration_minutes)
+        """内部方法：设置一个特定类型的CD（先写内存，分批写回数据库）"""
+        self.cooldowns.set(user_id, cd_type, cd_duration_minutes * 60)
+        self._maybe_flush_cooldowns()
 
-        cur = self.conn.cursor()
-        # 使用 INSERT OR REPLACE，如果存在则更新，不存在则插入
-        cur.execute(
-            "INSERT OR REPLACE INTO user_cd (user_id, type, create_time, scheduled_time) VALUES (?, ?, ?, ?)",
-            (user_id, cd_type, str(create_time), str(end_time))
-        )
-        self.conn.commit()
+    def _maybe_flush_cooldowns(self):
+        """待写的冷却修改攒够一批时写回"""
+        if self.cooldowns.needs_flush():
+            self._flush_cooldowns()
 
-    def set_user_cd(self, user_id: str, cd_time_minutes: int, cd_type: int):
+    def set_user_cd(self, user_id: str, cd_time_minutes: int, cd_type: int = 2):
         """通用CD设置接口，现直接调用内部方法"""
         self._set_user_cd(user_id, cd_type, cd_time_minutes)
 
-    def rollback_high_exp_users(self, exp_threshold: int = 200000, avg_exp_per_rift: int = 2300, avg_stone_per_rift: int = 2500) -> list[str]:
+    def rollback_high_exp_users(self, exp_threshold: int = 200000, avg_exp_per_rift: int = 2300, avg_stone_per_rift: int = 2500,
+                                dry_run: bool = False, chunk_size: int = 1000, progress=None) -> str:
         """
-        批量修复修为异常高的用户数据。
+        批量修复修为异常高的用户数据（按 id 分段执行集合式 SQL，每段一个事务）。
+        须通过 AdminJobRunner 在工作线程中调用，使用独立的数据库连接。
         :param exp_threshold: 触发修复的修为阈值。
         :param avg_exp_per_rift: 估算的单次秘境修为收益。
         :param avg_stone_per_rift: 估算的单次秘境灵石收益。
-        :return: 一个包含每位用户修复详情的字符串列表。
-        """
-        cur = self.conn.cursor()
-
-        # 1. 找出所有修为超过阈值的用户
-        cur.execute("SELECT user_id, user_name, exp, stone FROM user_xiuxian WHERE exp > ?", (exp_threshold,))
-        high_exp_users = cur.fetchall()
-
-        if not high_exp_users:
-            return ["未找到修为超过20万的用户，无需修复。"]
-
-        log_messages = ["--- 开始执行数据修复 ---"]
-
-        for user_data in high_exp_users:
-            user_id, user_name, current_exp, current_stone = user_data
-
-            # 2. 计算超额修为和估算的秘境次数
-            excess_exp = current_exp - exp_threshold
-            estimated_rift_count = excess_exp // avg_exp_per_rift
-
-            if estimated_rift_count <= 0:
-                log_messages.append(f"用户【{user_name}】({user_id})修为虽高，但未达到一次秘境估算收益，跳过。")
-                continue
-
-            # 3. 计算需要扣除的总量
-            exp_to_deduct = estimated_rift_count * avg_exp_per_rift
-            stone_to_deduct = estimated_rift_count * avg_stone_per_rift
-
-            # 4. 执行扣除（带安全检查，防止扣成负数）
-            final_exp_to_deduct = min(exp_to_deduct, current_exp - 100) # 至少保留100修为
-            final_stone_to_deduct = min(stone_to_deduct, current_stone)
-
-            try:
-                self.update_j_exp(user_id, final_exp_to_deduct)
-                self.update_ls(user_id, final_stone_to_deduct, 2)
-
-                # 设置一个惩罚性CD，比如24小时
-                self.set_user_cd(user_id, 24 * 60, 5) # type=5是秘境CD
-
-                log_messages.append(
-                    f"用户【{user_name}】:\n"
-                    f" - 估算超额探索次数: {estimated_rift_count} 次\n"
-                    f" - 已扣除修为: {final_exp_to_deduct}\n"
-                    f" - 已扣除灵石: {final_stone_to_deduct}\n"
-                    f" - 已施加24小时秘境冷却。"
-                )
-            except Exception as e:
-                logger.error(f"为用户 {user_id} 执行回滚时失败: {e}")
-                log_messages.append(f"用户【{user_name}】({user_id}) 修复失败，发生数据库错误。")
-
-        log_messages.append("--- 数据修复执行完毕 ---")
-        return log_messages
+        :param dry_run: 预演模式，只统计受影响的行数，不做任何修改。
+        :param progress: 进度回调，接收一条进度消息。
+        :return: 修复总结。
+        """
+        progress = progress or (lambda message: None)
+        params = {"threshold": exp_threshold, "exp": avg_exp_per_rift, "stone": avg_stone_per_rift}
+        # 估算超额探索次数 >= 1 的用户才需要修复
+        target = "exp - :threshold >= :exp"
+        rifts = "CAST((exp - :threshold) / :exp AS INTEGER)"
+        exp_deduct = f"MIN({rifts} * :exp, exp - 100)"      # 至少保留100修为
+        stone_deduct = f"MIN({rifts} * :stone, stone)"      # 防止扣成负数
+
+        with self.db.worker_connection() as conn:
+            high_count, skipped = conn.execute(
+                f"SELECT count(*), count(*) - SUM({target}) FROM user_xiuxian WHERE exp > :threshold", params
+            ).fetchone()
+            if not high_count:
+                return f"未找到修为超过 {exp_threshold} 的用户，无需修复。"
+
+            min_id, max_id = conn.execute(f"SELECT MIN(id), MAX(id) FROM user_xiuxian WHERE {target}", params).fetchone()
+            users = total_exp = total_stone = 0
+            if min_id is not None:
+                create_time = datetime.now()
+                end_time = create_time + timedelta(hours=24)
+                for low in range(min_id, max_id + 1, chunk_size):
+                    window = {**params, "low": low, "high": low + chunk_size - 1}
+                    where = f"WHERE id BETWEEN :low AND :high AND {target}"
+                    count, exp_sum, stone_sum = conn.execute(
+                        f"SELECT count(*), SUM({exp_deduct}), SUM({stone_deduct}) FROM user_xiuxian {where}", window
+                    ).fetchone()
+                    if not count:
+                        continue
+                    if not dry_run:
+                        with conn:
+                            # 惩罚性24小时秘境CD (type=5)，必须在扣除修为之前写入，否则筛选条件会变化
+                            conn.execute(
+                                "INSERT OR REPLACE INTO user_cd (user_id, type, create_time, scheduled_time) "
+                                f"SELECT user_id, 5, :create_time, :end_time FROM user_xiuxian {where}",
+                                {**window, "create_time": str(create_time), "end_time": str(end_time)}
+                            )
+                            conn.execute(
+                                f"UPDATE user_xiuxian SET exp = exp - {exp_deduct}, stone = stone - {stone_deduct} {where}",
+                                window
+                            )
+                    users += count
+                    total_exp += exp_sum or 0
+                    total_stone += stone_sum or 0
+                    progress(f"已{'统计' if dry_run else '修复'} {users} 名用户...")
+
+        action = "预计" if dry_run else "已"
+        return (
+            f"--- 秘境异常数据{'修复预演' if dry_run else '修复'}完毕 ---\n"
+            f"修为超过 {exp_threshold} 的用户: {high_count} 名（其中 {skipped} 名未达到一次秘境估算收益，跳过）\n"
+            f"{action}修复 {users} 名用户，{action}扣除修为 {total_exp}、灵石 {total_stone}"
+            f"{'' if dry_run else '，并施加24小时秘境冷却'}。"
+        )
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def fix_user_data(self, user_id: str) -> tuple[bool, str]:
         """
         【最终版】修复单个用户的数据，包括基础属性、战力和HP溢出。
@@ -1935,7 +2528,7 @@ class XiuxianService:
             hp_log = f"HP正常 ({user_info_after.hp}/{max_hp})。"
             if user_info_after.hp > max_hp:
                 self.conn.cursor().execute("UPDATE user_xiuxian SET hp = ? WHERE user_id = ?", (max_hp, user_id))
-                self.conn.commit()
+                self._commit()
                 hp_log = f"HP异常({user_info_after.hp}/{max_hp})，已修正为 {max_hp}。"
                 # 再次获取最终信息
                 user_info_after = self.get_user_message(user_id)
@@ -1953,42 +2546,82 @@ class XiuxianService:
             logger.error(f"修复用户 {user_id} 数据时失败: {e}")
             return False, f"用户【{user_info_before.user_name}】修复失败，发生错误。"
 
-    def fix_all_users_data(self) -> list[str]:
-        """
-        【最终正确版】批量修复所有用户的数据，并返回每个用户的详细修复日志列表。
-        """
-        cur = self.conn.cursor()
-        cur.execute("SELECT user_id FROM user_xiuxian")
-        all_user_ids = cur.fetchall()
-
-        if not all_user_ids:
-            return ["数据库中没有任何用户数据。"]
-
-        # 1. 初始化报告列表，并添加一个总览头
-        report_messages = [f"--- 开始执行全服数据修复，总计 {len(all_user_ids)} 名用户 ---"]
-        success_count = 0
-        fail_count = 0
-
-        # 2. 循环为每个用户执行单点修复，并收集详细日志
-        for user_id_tuple in all_user_ids:
-            user_id = user_id_tuple[0]
-            # fix_user_data 会返回 (bool, str)
-            success, log_msg = self.fix_user_data(user_id)
-
-            if success:
-                success_count += 1
-            else:
-                fail_count += 1
-
-            # 将每个用户的详细修复日志添加到报告列表中
-            report_messages.append(log_msg)
-
-        # 3. 在报告的末尾添加一个总结
-        summary = f"--- 修复完成 ---\n成功修复 {success_count} 名用户，失败 {fail_count} 名。"
-        report_messages.append(summary)
-
-        return report_messages
+    def fix_all_users_data(self, dry_run: bool = False, chunk_size: int = 1000, progress=None) -> str:
+        """
+        批量修复所有用户的数据（基础属性、战力、HP溢出），与 fix_user_data 的修复规则一致。
+        基础属性用一条集合式 UPDATE 完成，战力和HP上限经属性引擎分批计算后用 executemany 写回。
+        须通过 AdminJobRunner 在工作线程中调用，使用独立的数据库连接。
+        :param dry_run: 预演模式，只统计受影响的行数，不做任何修改。
+        :param progress: 进度回调，接收一条进度消息。
+        :return: 修复总结。
+        """
+        progress = progress or (lambda message: None)
+        level_rows = [
+            (name, int(config.get("HP", 50)), int(config.get("MP", 100)), int(config.get("ATK", 10)))
+            for name, config in self.jsondata.level_data().items()
+        ]
+
+        with self.db.worker_connection() as conn, self.db.worker_connection() as reader:
+            total_users = conn.execute("SELECT count(*) FROM user_xiuxian").fetchone()[0]
+            if not total_users:
+                return "数据库中没有任何用户数据。"
+
+            # 1. 根据境界刷新基础属性 (HP, MP, ATK)，HP/MP 不超过境界基础值
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS "level_base" (level TEXT PRIMARY KEY, hp INTEGER, mp INTEGER, atk INTEGER)')
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS "fix_base" (id INTEGER PRIMARY KEY, hp INTEGER, mp INTEGER, atk INTEGER)')
+            with conn:
+                conn.execute("DELETE FROM temp.level_base")
+                conn.execute("DELETE FROM temp.fix_base")
+                conn.executemany("INSERT OR REPLACE INTO temp.level_base VALUES (?, ?, ?, ?)", level_rows)
+                conn.execute("""
+                    INSERT INTO temp.fix_base (id, hp, mp, atk)
+                    SELECT id, new_hp, new_mp, new_atk FROM (
+                        SELECT u.id, u.hp, u.mp, u.atk,
+                               CASE WHEN u.hp > 0 THEN MIN(u.hp, COALESCE(lb.hp, 50)) ELSE COALESCE(lb.hp, 50) END AS new_hp,
+                               CASE WHEN u.mp > 0 THEN MIN(u.mp, COALESCE(lb.mp, 100)) ELSE COALESCE(lb.mp, 100) END AS new_mp,
+                               COALESCE(lb.atk, 10) AS new_atk
+                        FROM user_xiuxian u LEFT JOIN temp.level_base lb ON lb.level = u.level
+                    )
+                    WHERE hp IS NOT new_hp OR mp IS NOT new_mp OR atk IS NOT new_atk
+                """)
+                base_fixed = conn.execute("SELECT count(*) FROM temp.fix_base").fetchone()[0]
+                if base_fixed and not dry_run:
+                    conn.execute("""
+                        UPDATE user_xiuxian SET
+                            hp = (SELECT hp FROM temp.fix_base f WHERE f.id = user_xiuxian.id),
+                            mp = (SELECT mp FROM temp.fix_base f WHERE f.id = user_xiuxian.id),
+                            atk = (SELECT atk FROM temp.fix_base f WHERE f.id = user_xiuxian.id)
+                        WHERE id IN (SELECT id FROM temp.fix_base)
+                    """)
+            progress(f"基础属性: {base_fixed} 名用户{'需要' if dry_run else '已'}修正，开始重算战力...")
+
+            # 2. 基于最新境界和装备功法刷新战力，3. HP超过最大生命值时修正
+            # （预演模式下 HP 按修正前的值统计）
+            scanned = power_fixed = hp_fixed = 0
+            for chunk in self._iter_user_stats(reader, chunk_size):
+                changes = []
+                for user_info, stats in chunk:
+                    hp_overflow = user_info.hp is not None and user_info.hp > stats.max_hp
+                    if stats.power != user_info.power or hp_overflow:
+                        changes.append((stats.power, stats.max_hp, user_info.user_id))
+                        power_fixed += stats.power != user_info.power
+                        hp_fixed += hp_overflow
+                if changes and not dry_run:
+                    with conn:
+                        conn.executemany("UPDATE user_xiuxian SET power = ?, hp = MIN(hp, ?) WHERE user_id = ?", changes)
+                scanned += len(chunk)
+                progress(f"已处理 {scanned}/{total_users} 名用户...")
+
+        action = "需要修正" if dry_run else "已修正"
+        return (
+            f"--- 全服数据{'修复预演' if dry_run else '修复'}完成，总计 {total_users} 名用户 ---\n"
+            f"基础属性{action}: {base_fixed} 名\n"
+            f"战力{action}: {power_fixed} 名\n"
+            f"HP溢出{action}: {hp_fixed} 名"
+        )
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def refresh_user_base_attributes(self, user_id: str):
         """
         根据用户当前境界，刷新其基础属性（HP, MP, ATK）。
@@ -2015,26 +2648,22 @@ class XiuxianService:
             "UPDATE user_xiuxian SET hp = ?, mp = ?, atk = ? WHERE user_id = ?",
             (int(final_hp), int(final_mp), int(base_atk), user_id)
         )
-        self.conn.commit()
+        self._commit()
 
     def get_next_level_info(self, current_level: str) -> dict | None:
         """获取下一境界的完整配置信息"""
-        all_levels = self.xiu_config.level
-        if current_level not in all_levels or current_level == all_levels[-1]:
+        next_level_name = self.xiu_config.get_next_level(current_level)
+        if next_level_name is None:
             return None # 已是最高级或当前等级不存在
 
-        current_index = all_levels.index(current_level)
-        next_level_name = all_levels[current_index + 1]
-
         return self.jsondata.level_data().get(next_level_name)
 
     def _delete_user_cd_by_type(self, user_id: str, cd_type: int):
         """
         【新增】内部方法：删除特定类型的CD记录
         """
-        cur = self.conn.cursor()
-        cur.execute("DELETE FROM user_cd WHERE user_id = ? AND type = ?", (user_id, cd_type))
-        self.conn.commit()
+        self.cooldowns.delete(user_id, cd_type)
+        self._maybe_flush_cooldowns()
 
     async def _create_world_boss_task(self):
         """定时生成世界BOSS并写入数据库"""
@@ -2069,6 +2698,7 @@ class XiuxianService:
             msg = f"警报！{self.plugin_instance.world_boss['jj']}境界的【{self.plugin_instance.world_boss['name']}】已降临仙界，请各位道友速去讨伐！"
             await self._broadcast_to_groups(msg, "世界BOSS降临")
 
+    @_holds_write_lock
     def clear_all_bosses(self) -> int:
         """
         清理数据库中所有的世界BOSS记录。
@@ -2078,7 +2708,8 @@ class XiuxianService:
             cur = self.conn.cursor()
             cur.execute("DELETE FROM world_boss")
             deleted_rows = cur.rowcount
-            self.conn.commit()
+            cur.execute("DELETE FROM world_boss_damage")
+            self._commit()
             return deleted_rows
         except Exception as e:
             logger.error(f"清理世界BOSS失败: {e}")
@@ -2090,6 +2721,8 @@ class XiuxianService:
         cur.execute("SELECT user_id FROM user_xiuxian")
         return [row[0] for row in cur.fetchall()]
 
+    @_holds_write_lock
+    @_syncs_player_cache()
     def reset_user_for_reincarnation(self, user_id: str, user_name: str, buff_value: float) -> dict:
         """
         处理用户身死道消和转世的逻辑。
@@ -2139,12 +2772,13 @@ class XiuxianService:
             # c. 清理其他关联表的数据
             cur.execute("DELETE FROM back WHERE user_id = ?", (user_id,))
             cur.execute("DELETE FROM user_cd WHERE user_id = ?", (user_id,))
+            self.cooldowns.forget_user(user_id)
             cur.execute("DELETE FROM BuffInfo WHERE user_id = ?", (user_id,))
             cur.execute("DELETE FROM user_alchemy_info WHERE user_id = ?", (user_id,))
             cur.execute("DELETE FROM user_bounty WHERE user_id = ?", (user_id,))
             cur.execute("DELETE FROM user_rift WHERE user_id = ?", (user_id,))
 
-            self.conn.commit()
+            self._commit()
             return {"success": True, "root": root, "root_type": root_type}
         except Exception as e:
             logger.error(f"重置用户 {user_id} 数据失败: {e}")
@@ -2152,10 +2786,8 @@ class XiuxianService:
 
     def get_market_goods_count(self) -> int:
         """获取全局坊市的商品总数"""
-        with self.conn as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM market")
-            result = cursor.fetchone()
+        with self.db.read() as conn:
+            result = conn.execute("SELECT COUNT(*) FROM market").fetchone()
             return result[0] if result else 75
 
     def check_user_cd_specific_type(self, user_id: str, cd_type: int) -> int:
@@ -2165,17 +2797,9 @@ class XiuxianService:
         :param cd_type: CD类型 (1-闭关, 2-抢劫/BOSS, 4-重入仙途, 5-秘境, 6-切磋, 7-被打劫保护)
         :return: 剩余秒数, 0表示无CD或已结束
         """
-        cd_info = self._get_user_cd_by_type(user_id, cd_type) # _get_user_cd_by_type 已在之前实现
-        if cd_info and cd_info.scheduled_time:
-            try:
-                end_time = datetime.fromisoformat(cd_info.scheduled_time)
-                if datetime.now() < end_time:
-                    return int((end_time - datetime.now()).total_seconds())
-            except (ValueError, TypeError):
-                logger.warning(f"用户 {user_id} 的CD类型 {cd_type} 时间格式无效: {cd_info.scheduled_time}")
-                return 0 # 无效时间视为无CD
-        return 0
+        return self.cooldowns.remaining(user_id, cd_type)
     
+    @_holds_write_lock
     def update_hp_to_value(self, user_id: str, new_hp_value: int):
         """
         直接将用户的HP设置为一个特定的值，会进行上下限校验。
@@ -2190,14 +2814,17 @@ class XiuxianService:
         max_hp = user_real_info['max_hp']
         # 确保HP不低于1（除非最大HP就是0或负数，那就有问题了），也不高于最大HP
         final_hp = max(1 if max_hp > 0 else 0, min(new_hp_value, max_hp))
+        if self._cache_set(user_id, "hp", final_hp):
+            return
 
         try:
             c = self.conn.cursor()
             c.execute("UPDATE user_xiuxian SET hp = ? WHERE user_id = ?", (final_hp, user_id))
-            self.conn.commit()
+            self._commit()
         except Exception as e:
             logger.error(f"update_hp_to_value: 更新用户 {user_id} HP失败: {e}")
 
+    @_holds_write_lock
     def update_mp_to_value(self, user_id: str, new_mp_value: int):
         """
         直接将用户的HP设置为一个特定的值，会进行上下限校验。
@@ -2212,11 +2839,13 @@ class XiuxianService:
         max_mp = user_real_info['max_mp']
         # 确保HP不低于1（除非最大HP就是0或负数，那就有问题了），也不高于最大HP
         final_mp = max(1 if max_mp > 0 else 0, min(new_mp_value, max_mp))
+        if self._cache_set(user_id, "mp", final_mp):
+            return
 
         try:
             c = self.conn.cursor()
             c.execute("UPDATE user_xiuxian SET mp = ? WHERE user_id = ?", (final_mp, user_id))
-            self.conn.commit()
+            self._commit()
         except Exception as e:
             logger.error(f"update_mp_to_value: 更新用户 {user_id} MP失败: {e}")
 
@@ -2248,7 +2877,7 @@ class XiuxianService:
         :param item_data: 从 Items().get_data_by_item_id() 获取到的物品信息字典。
         :return: 格式化后的字符串，如果item_data无效则返回None。
         """
-        if not item_data or not isinstance(item_data, dict):
+        if not item_data or not isinstance(item_data, Mapping):
             return "未能找到该物品的详细信息。"
 
         name = item_data.get('name', '未知物品')
@@ -2387,26 +3016,54 @@ class XiuxianService:
 
         return "\n".join(desc_lines)
 
+    @_holds_write_lock
+    def _load_temp_buffs(self):
+        """从 user_temp_buff 表恢复临时Buff（未开启持久化时跳过）"""
+        if not self.xiu_config.temp_buff_persist:
+            return
+        entries = []
+        for user_id, buff_key, value, expires_at in self.conn.execute(
+            "SELECT user_id, buff_key, value, expires_at FROM user_temp_buff"
+        ):
+            try:
+                entries.append((user_id, buff_key, json.loads(value), expires_at))
+            except (TypeError, ValueError):
+                logger.warning(f"用户 {user_id} 的临时Buff {buff_key} 数据无效，已忽略。")
+        count = self.temp_buffs.load(entries)
+        self.conn.execute("DELETE FROM user_temp_buff WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        self._commit()
+        logger.debug(f"已恢复 {count} 个临时Buff。")
+
+    @_holds_write_lock
+    def _delete_temp_buffs(self, keys: list[tuple[str, str]]):
+        if keys and self.xiu_config.temp_buff_persist:
+            self.conn.executemany("DELETE FROM user_temp_buff WHERE user_id = ? AND buff_key = ?", keys)
+            self._commit()
+
+    @_holds_write_lock
     def set_user_temp_buff(self, user_id: str, buff_key: str, buff_value: any, duration_seconds: int = None):
         """
-        为用户设置一个内存中的临时Buff。
+        为用户设置一个临时Buff（开启持久化时同时写入 user_temp_buff 表，重启后仍然有效）。
         :param user_id: 用户ID
         :param buff_key: Buff的唯一标识符 (例如 "reduce_breakthrough_penalty")
         :param buff_value: Buff的值 (例如 True, 或一个包含更多信息的字典)
         :param duration_seconds: Buff的持续时间（秒）。如果为None，则Buff不会自动过期，需要手动消耗。
         """
-        if user_id not in self.user_temp_buffs:
-            self.user_temp_buffs[user_id] = {}
-
-        expires_at = None
-        if duration_seconds is not None:
-            expires_at = time.time() + duration_seconds
-
-        self.user_temp_buffs[user_id][buff_key] = {
-            "value": buff_value,
-            "expires_at": expires_at
-        }
-        logger.info(f"为用户 {user_id} 设置临时Buff: {buff_key}={buff_value}, 过期时间: {expires_at}")
+        expires_at, evicted = self.temp_buffs.set(user_id, buff_key, buff_value, duration_seconds)
+        logger.debug(f"为用户 {user_id} 设置临时Buff: {buff_key}={buff_value}, 过期时间: {expires_at}")
+        if not self.xiu_config.temp_buff_persist:
+            return
+        try:
+            value = json.dumps(buff_value, ensure_ascii=False)
+        except (TypeError, ValueError):
+            logger.warning(f"临时Buff {buff_key} 的值无法序列化，仅保存在内存中。")
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO user_temp_buff (user_id, buff_key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (user_id, buff_key, value, expires_at)
+        )
+        self._commit()
+        self._delete_temp_buffs(evicted)
 
     def get_user_temp_buff(self, user_id: str, buff_key: str):
         """
@@ -2415,17 +3072,7 @@ class XiuxianService:
         :param buff_key: Buff的唯一标识符
         :return: Buff的值，或者None
         """
-        if user_id in self.user_temp_buffs and buff_key in self.user_temp_buffs[user_id]:
-            buff_data = self.user_temp_buffs[user_id][buff_key]
-            if buff_data["expires_at"] is None or time.time() < buff_data["expires_at"]:
-                return buff_data["value"]
-            else:
-                # Buff已过期，从字典中移除
-                del self.user_temp_buffs[user_id][buff_key]
-                if not self.user_temp_buffs[user_id]: # 如果该用户没有其他buff了，也移除用户条目
-                    del self.user_temp_buffs[user_id]
-                logger.info(f"用户 {user_id} 的临时Buff {buff_key} 已过期并移除。")
-        return None
+        return self.temp_buffs.get(user_id, buff_key)
 
     def consume_user_temp_buff(self, user_id: str, buff_key: str):
         """
@@ -2433,11 +3080,7 @@ class XiuxianService:
         :param user_id: 用户ID
         :param buff_key: Buff的唯一标识符
         """
-        if user_id in self.user_temp_buffs and buff_key in self.user_temp_buffs[user_id]:
-            del self.user_temp_buffs[user_id][buff_key]
-            if not self.user_temp_buffs[user_id]:
-                del self.user_temp_buffs[user_id]
-            logger.info(f"用户 {user_id} 的临时Buff {buff_key} 已被消耗并移除。")
+        self.check_and_consume_temp_buff(user_id, buff_key)
 
     def check_and_consume_temp_buff(self, user_id: str, buff_key: str):
         """
@@ -2446,12 +3089,99 @@ class XiuxianService:
         :param buff_key: Buff的唯一标识符
         :return: Buff的值（如果存在且有效），否则返回None。
         """
-        buff_value = self.get_user_temp_buff(user_id, buff_key)
+        buff_value = self.temp_buffs.consume(user_id, buff_key)
+        self._delete_temp_buffs([(user_id, buff_key)])
         if buff_value is not None:
-            self.consume_user_temp_buff(user_id, buff_key)
-            return buff_value
-        return None
+            logger.debug(f"用户 {user_id} 的临时Buff {buff_key} 已被消耗并移除。")
+        return buff_value
+
+    def expire_temp_buffs(self) -> int:
+        """主动回收已过期的临时Buff（供定时任务调用），返回回收的数量"""
+        with self.db.write_lock:
+            expired = self.temp_buffs.expire()
+            self._delete_temp_buffs(expired)
+            return len(expired)
+
+    def get_gacha_pity(self, user_id: str, pool_id: str) -> GachaPity:
+        """获取玩家在某个卡池的保底计数，从未抽过时各项为 0"""
+        row = self.conn.execute(
+            "SELECT * FROM user_gacha_pity WHERE user_id = ? AND pool_id = ?", (user_id, pool_id)
+        ).fetchone()
+        if row is None:
+            return GachaPity(user_id, pool_id, 0, 0, 0, 0, 0, None)
+        return GachaPity(*row)
+
+    @_holds_write_lock
+    def record_gacha_pity(self, user_id: str, pool_id: str, pity_counter: int, pulls: int,
+                          soft_pity_hits: int = 0, hard_pity_hits: int = 0, guarantee_hits: int = 0):
+        """
+        写入一次抽取后的保底计数，并累加抽数和各类保底命中次数（供审计）。
+        应与扣除灵石、发放奖励在同一个工作单元内调用。
+        """
+        self.conn.execute(
+            """
+            INSERT INTO user_gacha_pity (user_id, pool_id, pity_counter, total_pulls, soft_pity_hits,
+                                         hard_pity_hits, guarantee_hits, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, pool_id) DO UPDATE SET
+                pity_counter = excluded.pity_counter,
+                total_pulls = total_pulls + excluded.total_pulls,
+                soft_pity_hits = soft_pity_hits + excluded.soft_pity_hits,
+                hard_pity_hits = hard_pity_hits + excluded.hard_pity_hits,
+                guarantee_hits = guarantee_hits + excluded.guarantee_hits,
+                updated_at = excluded.updated_at
+            """,
+            (user_id, pool_id, pity_counter, pulls, soft_pity_hits, hard_pity_hits, guarantee_hits,
+             str(datetime.now()))
+        )
+        self._commit()
+
+    def get_gacha_pity_records(self, user_id: str | None = None) -> list[GachaPity]:
+        """列出保底计数记录（可按玩家筛选），供管理员审计"""
+        if user_id:
+            rows = self.conn.execute(
+                "SELECT * FROM user_gacha_pity WHERE user_id = ? ORDER BY pool_id", (user_id,)
+            ).fetchall()
+        else:
+            rows = self.conn.execute(
+                "SELECT * FROM user_gacha_pity ORDER BY updated_at DESC"
+            ).fetchall()
+        return [GachaPity(*row) for row in rows]
+
+    @_holds_write_lock
+    def save_battle_replay(self, user_ids, replay: BattleReplay):
+        """
+        记录玩家最近一场战斗的回放信息（种子与双方属性快照），每人只保留一条。
+        user_ids 可以是单个玩家ID，也可以是参战各方的ID列表。
+        """
+        if isinstance(user_ids, str):
+            user_ids = (user_ids,)
+        p1_snapshot = json.dumps(replay.p1, ensure_ascii=False)
+        p2_snapshot = json.dumps(replay.p2, ensure_ascii=False)
+        now = str(datetime.now())
+        self.conn.executemany(
+            """
+            INSERT OR REPLACE INTO user_battle_replay
+                (user_id, seed, p1_snapshot, p2_snapshot, max_rounds, engine_version, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(user_id, replay.seed, p1_snapshot, p2_snapshot, replay.max_rounds, replay.engine_version, now)
+             for user_id in user_ids]
+        )
+        self._commit()
+
+    def get_battle_replay(self, user_id: str) -> BattleReplay | None:
+        """读取玩家最近一场战斗的回放信息"""
+        row = self.conn.execute(
+            "SELECT seed, p1_snapshot, p2_snapshot, max_rounds, engine_version FROM user_battle_replay WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        seed, p1_snapshot, p2_snapshot, max_rounds, engine_version = row
+        return BattleReplay(seed, json.loads(p1_snapshot), json.loads(p2_snapshot), max_rounds, engine_version)
 
+    @_holds_write_lock
     def update_item_usage_counts(self, user_id: str, goods_id: int, consumed_num: int):
         """
         更新用户背包中特定物品的每日已使用次数和总已使用次数。
@@ -2468,12 +3198,14 @@ class XiuxianService:
                 WHERE user_id = ? AND goods_id = ?
             """, (consumed_num, consumed_num, str(datetime.now()), user_id, goods_id))
 
-            self.conn.commit()
+            self._commit()
             if cur.rowcount == 0: # 这是一个潜在问题，如果物品在消耗后记录就没了，这里可能更新不到
                 logger.warning(f"更新物品使用次数警告：未找到用户 {user_id} 的物品ID {goods_id} 的记录来更新使用次数。可能物品已耗尽。")
         except Exception as e:
             logger.error(f"更新物品 {goods_id} 的使用次数失败 for user {user_id}: {e}")
-            self.conn.rollback()
+            if self._tx_depth:
+                raise # 在工作单元内由外层整体回滚，不能吞掉异常让外层照常提交
+            self._rollback()
 
     def get_item_mortgage_loan_amount(self, item_id_original_str: str, item_data_dict: dict) -> int:
         """
@@ -2611,36 +3343,36 @@ class XiuxianService:
         if loan_amount <= 0:
             return False, f"【{item_name_in_backpack}】价值过低或无法评估，无法抵押。"
 
-        # 4. 从玩家背包移除物品 (假设一次抵押一件)
-        if not self.remove_item(user_id, item_name_in_backpack, 1):
-            return False, f"抵押失败：从背包移除【{item_name_in_backpack}】时出错，可能数量不足。"
-
-        # 5. 记录抵押信息
         mortgage_time = datetime.now()
         due_time = mortgage_time + timedelta(days=due_days)
-        item_data_json_str = json.dumps(item_data_dict, ensure_ascii=False)
+        item_data_json_str = json.dumps(dict(item_data_dict), ensure_ascii=False)
 
         try:
-            cur = self.conn.cursor()
-            cur.execute(
-                """
-                INSERT INTO user_mortgage 
-                (user_id, item_id_original, item_name, item_type, item_data_json, loan_amount, mortgage_time, due_time, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'active')
-                """,
-                (user_id, int(item_id_in_backpack_str), item_name_in_backpack, item_data_dict.get('item_type'),
-                 item_data_json_str, loan_amount, str(mortgage_time), str(due_time))
-            )
-            # 6. 发放贷款给玩家
-            self.update_ls(user_id, loan_amount, 1)  # 1 代表增加
-            self.conn.commit()
+            # 移除物品、记录抵押、发放贷款在同一事务中完成，任一步失败整体回滚
+            with self.transaction():
+                # 4. 从玩家背包移除物品 (假设一次抵押一件)
+                if not self.remove_item(user_id, item_name_in_backpack, 1):
+                    return False, f"抵押失败：从背包移除【{item_name_in_backpack}】时出错，可能数量不足。"
+
+                # 5. 记录抵押信息
+                cur = self.conn.cursor()
+                cur.execute(
+                    """
+                    INSERT INTO user_mortgage 
+                    (user_id, item_id_original, item_name, item_type, item_data_json, loan_amount, mortgage_time, due_time, status)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'active')
+                    """,
+                    (user_id, int(item_id_in_backpack_str), item_name_in_backpack, item_data_dict.get('item_type'),
+                     item_data_json_str, loan_amount, str(mortgage_time), str(due_time))
+                )
+                # 6. 发放贷款给玩家
+                self.update_ls(user_id, loan_amount, 1)  # 1 代表增加
             return True, f"成功将【{item_name_in_backpack}】抵押给银行，获得贷款 {loan_amount} 灵石！请在 {due_days} 天内（{due_time.strftime('%Y-%m-%d %H:%M')}前）赎回。"
         except Exception as e:
             logger.error(f"创建抵押记录失败 for user {user_id}, item {item_name_in_backpack}: {e}")
-            # 尝试回滚背包操作（如果可能且必要）
-            self.add_item(user_id, int(item_id_in_backpack_str), item_data_dict.get('item_type'), 1)
             return False, "抵押过程中发生数据库错误，操作已取消。"
 
+    @_holds_write_lock
     def redeem_mortgage(self, user_id: str, mortgage_id: int) -> tuple[bool, str]:
         """处理赎回操作"""
         user_info = self.get_user_message(user_id)
@@ -2667,7 +3399,7 @@ class XiuxianService:
         if datetime.now() > due_time_obj:
             # 自动处理为逾期并没收
             cur.execute("UPDATE user_mortgage SET status = 'expired' WHERE mortgage_id = ?", (mortgage_id,))
-            self.conn.commit()
+            self._commit()
             return False, f"抵押品【{record_dict['item_name']}】已于 {due_time_obj.strftime('%Y-%m-%d %H:%M')} 到期，已被银行没收。"
 
         # 计算应还金额 (当前无利息，即为贷款金额)
@@ -2677,20 +3409,20 @@ class XiuxianService:
             return False, f"灵石不足！赎回【{record_dict['item_name']}】需要 {amount_to_repay} 灵石。"
 
         try:
-            # 1. 扣除玩家灵石
-            self.update_ls(user_id, amount_to_repay, 2)  # 2 代表减少
-            # 2. 将物品添加回玩家背包
-            # item_data_original = json.loads(record_dict['item_data_json']) # 理论上不需要，因为 item_type 和 item_id_original 足够
-            self.add_item(user_id, record_dict['item_id_original'], record_dict['item_type'], 1)
-            # 3. 更新抵押记录状态
-            cur.execute("UPDATE user_mortgage SET status = 'redeemed' WHERE mortgage_id = ?", (mortgage_id,))
-            self.conn.commit()
+            with self.transaction():
+                # 1. 扣除玩家灵石
+                self.update_ls(user_id, amount_to_repay, 2)  # 2 代表减少
+                # 2. 将物品添加回玩家背包
+                # item_data_original = json.loads(record_dict['item_data_json']) # 理论上不需要，因为 item_type 和 item_id_original 足够
+                self.add_item(user_id, record_dict['item_id_original'], record_dict['item_type'], 1)
+                # 3. 更新抵押记录状态
+                cur.execute("UPDATE user_mortgage SET status = 'redeemed' WHERE mortgage_id = ?", (mortgage_id,))
             return True, f"成功赎回【{record_dict['item_name']}】，花费 {amount_to_repay} 灵石。"
         except Exception as e:
             logger.error(f"赎回抵押品失败 for user {user_id}, mortgage_id {mortgage_id}: {e}")
-            # 此处可能需要更复杂的事务回滚，但暂时简化
-            return False, "赎回过程中发生数据库错误。"
+            return False, "赎回过程中发生数据库错误，操作已取消。"
 
+    @_holds_write_lock
     def check_and_handle_expired_mortgages(self, user_id_filter: str = None):
         """检查并处理所有（或特定用户的）逾期抵押，将其状态更新为 'expired' (没收)"""
         now_str = str(datetime.now())
@@ -2706,7 +3438,7 @@ class XiuxianService:
                 (now_str,)
             )
         expired_count = cur.rowcount
-        self.conn.commit()
+        self._commit()
         if expired_count > 0:
             logger.info(f"处理了 {expired_count} 条逾期抵押记录，已将其标记为 'expired' (没收)。")
         return expired_count
@@ -2753,27 +3485,51 @@ class XiuxianService:
         total_loan_received = 0
         messages = []
 
-        # 注意：在循环中修改背包列表（通过 remove_item）是不安全的。
-        # 更好的做法是先收集所有要抵押的物品信息，然后统一处理。
-        # 但由于 create_mortgage 内部会调用 remove_item，我们需要确保它处理的是单个物品。
-        # 这里我们逐个调用 create_mortgage。
+        # 先为每件物品计算贷款额，再整批扣除物品、写入抵押记录、发放贷款
+        mortgage_time = datetime.now()
+        due_time = mortgage_time + timedelta(days=due_days)
+        removals, mortgage_rows = [], []
         for item_to_mortgage_in_back in items_to_process:
-            # 每次抵押一件，因为 create_mortgage 设计为处理单件
-            for _ in range(item_to_mortgage_in_back.goods_num): # 如果一个物品有多件，分别抵押
-                success, msg = self.create_mortgage(user_id, str(item_to_mortgage_in_back.goods_id), item_to_mortgage_in_back.goods_name, due_days)
+            if not item_to_mortgage_in_back.goods_num or item_to_mortgage_in_back.goods_num <= 0:
+                continue
+            item_data_dict = self.items.get_data_by_item_id(item_to_mortgage_in_back.goods_id)
+            loan_amount = self.get_item_mortgage_loan_amount(str(item_to_mortgage_in_back.goods_id), item_data_dict)
+            if loan_amount <= 0:
+                msg = f"【{item_to_mortgage_in_back.goods_name}】价值过低或无法评估，无法抵押。"
                 messages.append(msg)
-                if success:
-                    successful_mortgages += 1
-                    # 从消息中提取贷款金额 (这是一个不太稳健的做法，最好 create_mortgage 能返回贷款额)
-                    try:
-                        loan_match = re.search(r"获得贷款 (\d+) 灵石", msg)
-                        if loan_match:
-                            total_loan_received += int(loan_match.group(1))
-                    except Exception:
-                        pass # 提取失败就算了
-                else:
-                    # 如果单件抵押失败，可能因为价值过低或背包中实际已无（并发问题？），记录但不中断
-                    logger.warning(f"一键抵押中，物品 {item_to_mortgage_in_back.goods_name} 单件抵押失败: {msg}")
+                logger.warning(f"一键抵押中，物品 {item_to_mortgage_in_back.goods_name} 抵押失败: {msg}")
+                continue
+            item_data_json_str = json.dumps(dict(item_data_dict), ensure_ascii=False)
+            removals.append((user_id, item_to_mortgage_in_back.goods_id, -item_to_mortgage_in_back.goods_num))
+            for _ in range(item_to_mortgage_in_back.goods_num): # 如果一个物品有多件，分别抵押
+                mortgage_rows.append(
+                    (user_id, item_to_mortgage_in_back.goods_id, item_to_mortgage_in_back.goods_name,
+                     item_data_dict.get('item_type'), item_data_json_str, loan_amount, str(mortgage_time), str(due_time))
+                )
+                messages.append(
+                    f"成功将【{item_to_mortgage_in_back.goods_name}】抵押给银行，获得贷款 {loan_amount} 灵石！"
+                    f"请在 {due_days} 天内（{due_time.strftime('%Y-%m-%d %H:%M')}前）赎回。"
+                )
+                successful_mortgages += 1
+                total_loan_received += loan_amount
+
+        if mortgage_rows:
+            try:
+                with self.transaction():
+                    if self.apply_item_deltas(removals) is None:
+                        raise ValueError("背包物品数量已变化")
+                    self.conn.executemany(
+                        """
+                        INSERT INTO user_mortgage 
+                        (user_id, item_id_original, item_name, item_type, item_data_json, loan_amount, mortgage_time, due_time, status)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'active')
+                        """,
+                        mortgage_rows
+                    )
+                    self.update_ls(user_id, total_loan_received, 1)
+            except Exception as e:
+                logger.error(f"一键抵押失败 for user {user_id}: {e}")
+                return 0, 0, ["抵押过程中发生错误，操作已取消。"]
 
         if successful_mortgages > 0:
             summary_msg = f"\n--- 一键抵押总结 ---\n成功抵押 {successful_mortgages} 件物品，共获得贷款 {total_loan_received} 灵石。"
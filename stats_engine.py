@@ -0,0 +1,215 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from astrbot.api import logger
+
+from .data_manager import jsondata
+
+# 派生属性记录：由境界、修为、灵根、功法装备、攻击修炼、转世加成等输入唯一决定
+DerivedStats = namedtuple(
+    "DerivedStats",
+    ["max_hp", "max_mp", "atk", "crit_rate", "crit_damage", "defense_rate", "final_exp_rate", "power"]
+)
+
+# 战力权重
+POWER_HP_WEIGHT = 0.5    # 每点最大生命值提供 0.5 点战力
+POWER_MP_WEIGHT = 0.2    # 每点最大真元提供 0.2 点战力
+POWER_ATK_WEIGHT = 10    # 每点攻击力提供 10 点战力
+
+
+class StatsEngine:
+    """
+    派生属性计算引擎
+
+    以 (境界, 修为, 灵根类型, 各功法/装备ID, 永久攻击, 洞天福地, 攻击修炼, 转世加成) 作为版本戳，
+    只有这些输入发生变化时才重新计算；境界/灵根数据文件重载后缓存自动失效。
+    """
+
+    def __init__(self, items, xiu_config, capacity: int = 4096):
+        self.items = items
+        self.xiu_config = xiu_config
+        self.capacity = capacity
+        self._cache: OrderedDict[tuple, DerivedStats] = OrderedDict()
+        self._lock = threading.Lock()
+        self._data_stamp = None
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def stats_key(user_info, buff_info) -> tuple:
+        """计算派生属性的全部输入，作为缓存的版本戳"""
+        return (
+            user_info.level, user_info.exp, user_info.root_type,
+            buff_info.main_buff, buff_info.sub_buff, buff_info.fabao_weapon, buff_info.armor_buff,
+            buff_info.atk_buff, buff_info.blessed_spot,
+            getattr(user_info, 'atkpractice', 0) or 0,
+            getattr(user_info, 'reincarnation_buff', 0.0) or 0.0,
+        )
+
+    def _check_data_stamp(self, level_data, root_data):
+        """
+        境界/灵根数据被重新加载（对象身份变化）或相关配置变化时清空缓存。
+        保存数据对象本身并用 is 比较：只记 id() 的话，旧对象被回收后新对象可能复用同一地址。
+        """
+        config_stamp = (self.xiu_config.atk_practice_buff_per_level, self.xiu_config.blessed_spot_exp_rate_per_level)
+        stamp = self._data_stamp
+        if stamp is None or stamp[0] is not level_data or stamp[1] is not root_data or stamp[2] != config_stamp:
+            self._cache.clear()
+            self._data_stamp = (level_data, root_data, config_stamp)
+
+    def get(self, user_info, buff_info) -> DerivedStats:
+        """获取派生属性，命中缓存时不做任何计算"""
+        level_data, root_data = jsondata.level_data(), jsondata.root_data()
+        key = self.stats_key(user_info, buff_info)
+        with self._lock:
+            self._check_data_stamp(level_data, root_data)
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return cached
+            self.stats["misses"] += 1
+
+        derived = self.compute(user_info, buff_info, level_data, root_data)
+        with self._lock:
+            # 计算期间数据被重新加载时不写入缓存，避免旧数据算出的结果混入新版本
+            stamp = self._data_stamp
+            if stamp is not None and stamp[0] is level_data and stamp[1] is root_data:
+                self._cache[key] = derived
+                while len(self._cache) > self.capacity:
+                    self._cache.popitem(last=False)
+        return derived
+
+    def get_many(self, pairs) -> dict:
+        """批量计算：pairs 为 (user_info, buff_info) 的可迭代对象，返回 user_id -> DerivedStats"""
+        return {user_info.user_id: self.get(user_info, buff_info) for user_info, buff_info in pairs}
+
+    def compute(self, user_info, buff_info, level_data=None, root_data=None) -> DerivedStats:
+        """不经缓存直接计算派生属性"""
+        level_data = level_data if level_data is not None else jsondata.level_data()
+        root_data = root_data if root_data is not None else jsondata.root_data()
+        exp = user_info.exp or 0
+
+        # 1. 境界基准属性
+        level_config = level_data.get(user_info.level, {})
+        base_hp = level_config.get("HP", exp / 2 if exp > 0 else 50)   # 以修为一半为基础或默认50
+        base_mp = level_config.get("MP", exp if exp > 0 else 100)      # 以修为为基础或默认100
+        base_atk = level_config.get("ATK", exp / 10 if exp > 0 else 10)  # 以修为十分之一为基础或默认10
+
+        # 2. 功法和装备的增益
+        hp_rate = mp_rate = atk_rate = 0.0
+        crit_rate = crit_damage = defense_rate = 0.0
+        get_item = self.items.get_data_by_item_id
+
+        main_buff_info = get_item(buff_info.main_buff)
+        if main_buff_info:
+            hp_rate += main_buff_info.get("hpbuff", 0)
+            mp_rate += main_buff_info.get("mpbuff", 0)
+            atk_rate += main_buff_info.get("atkbuff", 0)
+
+        sub_buff_info = get_item(buff_info.sub_buff)
+        if sub_buff_info:
+            sub_buff_type = sub_buff_info.get("buff_type")
+            sub_buff_value = float(sub_buff_info.get("buff", 0)) / 100  # 原版是存的百分比整数
+            if sub_buff_type == '1':    # 攻击力百分比
+                atk_rate += sub_buff_value
+            elif sub_buff_type == '2':  # 暴击率百分比
+                crit_rate += sub_buff_value
+            elif sub_buff_type == '3':  # 暴击伤害百分比
+                crit_damage += sub_buff_value
+
+        weapon_info = get_item(buff_info.fabao_weapon)
+        if weapon_info:
+            atk_rate += weapon_info.get("atk_buff", 0)
+            crit_rate += weapon_info.get("crit_buff", 0)
+
+        armor_info = get_item(buff_info.armor_buff)
+        if armor_info:
+            defense_rate += armor_info.get("def_buff", 0)
+
+        # 攻击修炼
+        atk_rate += (getattr(user_info, 'atkpractice', 0) or 0) * self.xiu_config.atk_practice_buff_per_level
+
+        # 3. 最终属性
+        max_hp = int(base_hp * (1 + hp_rate))
+        max_mp = int(base_mp * (1 + mp_rate))
+        atk = int(base_atk * (1 + atk_rate)) + (buff_info.atk_buff or 0)
+
+        # 4. 修炼效率
+        main_rate_buff = main_buff_info.get("ratebuff", 0) if main_buff_info else 0
+        realm_rate = level_config.get("spend", 1.0)
+        root_rate = root_data.get(user_info.root_type, {}).get("type_speeds", 1.0)
+        reincarnation_buff_rate = getattr(user_info, 'reincarnation_buff', 0.0) or 0.0
+        blessed_spot_multiplier = (buff_info.blessed_spot or 0) * self.xiu_config.blessed_spot_exp_rate_per_level
+        final_exp_rate = realm_rate * root_rate * (1 + main_rate_buff + reincarnation_buff_rate + blessed_spot_multiplier)
+        logger.debug(f"修炼效率: {realm_rate} {root_rate} {main_rate_buff} {reincarnation_buff_rate} {blessed_spot_multiplier}")
+
+        # 5. 基于最终面板的战力
+        power = int(max_hp * POWER_HP_WEIGHT + max_mp * POWER_MP_WEIGHT + atk * POWER_ATK_WEIGHT)
+
+        return DerivedStats(
+            max_hp=max_hp, max_mp=max_mp, atk=atk,
+            crit_rate=round(crit_rate, 4), crit_damage=round(crit_damage, 4), defense_rate=round(defense_rate, 4),
+            final_exp_rate=final_exp_rate, power=power,
+        )
+
+    def get_cache_stats(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "cached": len(self._cache),
+            }
+
+
+def benchmark(user_count: int = 50000, per_user_sample: int = 2000, seed: int = 0) -> dict:
+    """
+    在临时数据库上测量全服战力重算的吞吐（玩家/秒）：
+    - bulk_users_per_second：recompute_all_power 分批流式读取、批量写回
+    - per_user_users_per_second：原先逐个玩家读取、计算并写回战力的方式（只测 per_user_sample 名玩家）
+    """
+    from .service import XiuxianService
+
+    rng = random.Random(seed)
+    levels = list(jsondata.level_data()) or ["江湖好手"]
+    roots = list(jsondata.root_data()) or [None]
+    result = {"users": user_count}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        service = XiuxianService(os.path.join(tmp_dir, "bench.db"))
+        try:
+            service.conn.executemany(
+                "INSERT INTO user_xiuxian (user_id, user_name, level, root_type, exp, stone, hp, mp, power) "
+                "VALUES (?, ?, ?, ?, ?, 0, 100, 100, 0)",
+                ((f"bench_{i}", f"道友{i}", rng.choice(levels), rng.choice(roots), rng.randint(0, 10 ** 8))
+                 for i in range(user_count))
+            )
+            service.conn.executemany(
+                "INSERT INTO BuffInfo (user_id, atk_buff, blessed_spot) VALUES (?, ?, ?)",
+                ((f"bench_{i}", rng.randint(0, 100), rng.randint(0, 5)) for i in range(0, user_count, 2))
+            )
+            service.conn.commit()
+
+            bulk = service.recompute_all_power()
+            result["bulk_updated"] = bulk["updated"]
+            result["bulk_seconds"] = bulk["elapsed"]
+            result["bulk_users_per_second"] = bulk["users_per_second"]
+
+            sample = [f"bench_{i}" for i in rng.sample(range(user_count), min(per_user_sample, user_count))]
+            service.conn.executemany("UPDATE user_xiuxian SET power = 0 WHERE user_id = ?", [(uid,) for uid in sample])
+            service.conn.commit()
+            # 绕过玩家缓存，与原先一样逐人查询并立即提交
+            with service.bypass_player_cache(sample):
+                start = time.perf_counter()
+                for user_id in sample:
+                    user_info = service.get_user_message(user_id)
+                    stats = service.stats_engine.compute(user_info, service.get_user_buff_info(user_id))
+                    service._update_user_power_in_db(user_id, stats.power)
+                elapsed = time.perf_counter() - start
+            result["per_user_users_per_second"] = len(sample) / elapsed if elapsed > 0 else 0.0
+        finally:
+            service.close()
+    return result
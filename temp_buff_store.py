@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from astrbot.api import logger
+
+
+class TempBuffStore:
+    """
+    玩家临时Buff存储（如丹药提供的“下次突破失败惩罚减半”）
+
+    - (user_id, buff_key) -> (值, 过期时间戳或 None)，查询和消耗均为 O(1)
+    - 带过期时间的Buff同时进入最小堆，expire 时从堆顶主动回收，不依赖玩家再次访问
+    - 容量有上限，超出时先回收过期Buff，仍超出则淘汰最早设置的Buff
+    - 本身不做持久化，由服务层根据返回的变化写入 user_temp_buff 表
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self.lock = threading.RLock()
+        self._buffs: OrderedDict[tuple[str, str], tuple] = OrderedDict()
+        self._heap: list[tuple[float, int, tuple[str, str]]] = []
+        self._seq = itertools.count()
+        self._expired_times: deque[float] = deque()  # 最近一分钟内的过期时间点
+        self.expired_total = 0
+
+    def load(self, entries):
+        """由 (user_id, buff_key, 值, 过期时间戳) 重建，已过期的条目会被忽略"""
+        now = time.time()
+        with self.lock:
+            self._buffs.clear()
+            self._heap.clear()
+            for user_id, buff_key, value, expires_at in entries:
+                if expires_at is None or expires_at > now:
+                    self._put((user_id, buff_key), value, expires_at)
+            heapq.heapify(self._heap)
+            return len(self._buffs)
+
+    def _put(self, key, value, expires_at):
+        self._buffs[key] = (value, expires_at)
+        self._buffs.move_to_end(key)
+        if expires_at is not None:
+            heapq.heappush(self._heap, (expires_at, next(self._seq), key))
+
+    def set(self, user_id: str, buff_key: str, value, duration_seconds: float | None = None) -> tuple[float | None, list]:
+        """
+        设置Buff，返回 (过期时间戳, 因容量不足被淘汰的 key 列表)
+        """
+        expires_at = time.time() + duration_seconds if duration_seconds is not None else None
+        with self.lock:
+            self._put((user_id, buff_key), value, expires_at)
+            evicted = []
+            if len(self._buffs) > self.capacity:
+                evicted.extend(self.expire())
+                while len(self._buffs) > self.capacity:
+                    key, _ = self._buffs.popitem(last=False)
+                    evicted.append(key)
+                if evicted:
+                    logger.warning(f"临时Buff数量超出上限 {self.capacity}，已回收 {len(evicted)} 个。")
+            return expires_at, evicted
+
+    def get(self, user_id: str, buff_key: str):
+        """获取未过期的Buff值，不存在或已过期返回 None（过期条目留给 expire 统一回收）"""
+        entry = self._buffs.get((user_id, buff_key))
+        if entry is None or (entry[1] is not None and entry[1] <= time.time()):
+            return None
+        return entry[0]
+
+    def consume(self, user_id: str, buff_key: str):
+        """取出并移除Buff，返回其值；不存在或已过期返回 None"""
+        with self.lock:
+            entry = self._buffs.pop((user_id, buff_key), None)
+        if entry is None or (entry[1] is not None and entry[1] <= time.time()):
+            return None
+        return entry[0]
+
+    def expire(self) -> list[tuple[str, str]]:
+        """从堆顶回收所有已过期的Buff，返回被回收的 key 列表"""
+        now = time.time()
+        expired = []
+        with self.lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, _, key = heapq.heappop(self._heap)
+                entry = self._buffs.get(key)
+                # 堆中可能残留已被消耗或重新设置的旧记录
+                if entry is not None and entry[1] == expires_at:
+                    del self._buffs[key]
+                    expired.append(key)
+            if expired:
+                self.expired_total += len(expired)
+                self._expired_times.extend([now] * len(expired))
+            # 堆中残留过多旧记录时重建
+            if len(self._heap) > 2 * len(self._buffs) + 64:
+                self._heap = [(entry[1], next(self._seq), key) for key, entry in self._buffs.items() if entry[1] is not None]
+                heapq.heapify(self._heap)
+        return expired
+
+    def get_stats(self) -> dict:
+        now = time.time()
+        with self.lock:
+            while self._expired_times and now - self._expired_times[0] > 60:
+                self._expired_times.popleft()
+            return {
+                "live": len(self._buffs),
+                "expired_per_minute": len(self._expired_times),
+                "expired_total": self.expired_total,
+            }
@@ -1,6 +1,7 @@
 import math
 import re
 from io import BytesIO
+from collections.abc import Mapping
 from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont
 from wcwidth import wcwidth
@@ -175,7 +176,7 @@ def format_item_details(item_data: dict) -> str | None:
     :param item_data: 从 Items().get_data_by_item_id() 获取到的物品信息字典。
     :return: 格式化后的字符串，如果item_data无效则返回None。
     """
-    if not item_data or not isinstance(item_data, dict):
+    if not item_data or not isinstance(item_data, Mapping):
         return "未能找到该物品的详细信息。"
 
     name = item_data.get('name', '未知物品')